@@ -5,13 +5,21 @@ Gestion des modèles Gemini avec Smart Routing
 
 import re
 import json
+import random
+import time
 from dataclasses import dataclass
-from typing import Optional, List, Dict
-from datetime import datetime
+from typing import Awaitable, Callable, Optional, List, Dict
 
 import google.generativeai as genai
 
 from config import ModelConfig
+from conversation_history import ConversationHistoryManager
+from cost_ledger import CostLedger, TokenUsage, compute_cost
+from response_cache import ResponseCache
+from ai_scheduler import OVERLOAD_MESSAGE, AIScheduler, AIQueueTimeoutError
+from model_router import ModelRouter, RouteAttempt
+from complexity import ComplexityClassifier, select_tier
+from deadline import DEADLINE_MESSAGE, DeadlineExceeded, bounded_timeout, current_deadline, with_deadline
 
 
 @dataclass
@@ -24,6 +32,8 @@ class AIResponse:
     cost_usd: float
     success: bool
     error: Optional[str] = None
+    tokens_cached: int = 0
+    from_cache: bool = False
 
 
 class AIManager:
@@ -50,8 +60,29 @@ STYLE:
 - Utile et informative
 - Pas trop formelle"""
 
-    def __init__(self, api_key: str, db):
+    # Échanges (question + réponse) gardés par utilisateur
+    MAX_HISTORY = 10
+
+    def __init__(
+        self,
+        api_key: str,
+        db,
+        history: Optional[ConversationHistoryManager] = None,
+        cost_ledger: Optional[CostLedger] = None,
+        response_cache: Optional[ResponseCache] = None,
+        scheduler: Optional[AIScheduler] = None,
+        router: Optional[ModelRouter] = None
+    ):
         self.db = db
+        self.cost_ledger = cost_ledger
+        self.response_cache = response_cache  # Opt-in (RESPONSE_CACHE_ENABLED)
+        self.scheduler = scheduler            # File pondérée par plan devant Gemini
+        # Santé des modèles, requêtes couvertes et repli PRO -> FLASH -> FLASH_LITE
+        self.router = router or ModelRouter(ModelConfig.FALLBACK_CHAIN)
+        
+        # Smart routing: classifieur en une passe, tirage avec un générateur dédié
+        self.classifier = ComplexityClassifier()
+        self._rng = random.Random()
         genai.configure(api_key=api_key)
         
         # Initialiser les modèles
@@ -70,52 +101,103 @@ STYLE:
             )
         }
         
-        # Historique des conversations (en mémoire, limité)
-        self.conversation_history: Dict[int, List[Dict]] = {}
-        self.MAX_HISTORY = 10
+        # Historique des conversations: partagé avec SecurityIntegration si fourni
+        self.history = history or ConversationHistoryManager(db, max_history=self.MAX_HISTORY * 2)
     
     async def process_message(
         self,
         user_id: int,
         content: str,
         flash_ratio: float = 0.0,
-        pro_ratio: float = 0.0
+        pro_ratio: float = 0.0,
+        plan: Optional[str] = None,
+        on_text: Optional[Callable[[str], Awaitable[None]]] = None,
+        priority: Optional[str] = None
     ) -> AIResponse:
-        """Traite un message avec Smart Routing"""
+        """
+        Traite un message avec Smart Routing
+        
+        Avec `on_text`, la réponse est streamée: le callback reçoit le texte
+        complet reçu jusqu'ici à chaque fragment (voir DiscordStreamRenderer).
+        Avec un ordonnanceur, l'appel attend son tour selon `priority`
+        (support_priority du plan). Le routeur peut répondre avec un autre
+        modèle de la chaîne de repli (`model_used`).
+        """
         
         # Sélectionner le modèle
         model_name = self._select_model(content, flash_ratio, pro_ratio)
-        model = self.models[model_name]
         
         # Préparer le contexte
-        context = self._get_context(user_id)
+        context = await self._get_context(user_id)
+        
+        # Question récurrente sans (ou avec peu de) contexte: réponse en cache
+        cacheable = self.response_cache is not None and self.response_cache.is_cacheable(content, len(context))
+        if cacheable:
+            cached = await self.response_cache.get(model_name, content)
+            if cached:
+                await self._update_history(user_id, content, cached.content)
+                if on_text:
+                    await on_text(cached.content)
+                return AIResponse(
+                    content=cached.content,
+                    model_used=model_name,
+                    tokens_input=0,
+                    tokens_output=0,
+                    cost_usd=0.0,
+                    success=True,
+                    from_cache=True
+                )
         
         try:
-            # Générer la réponse
-            chat = model.start_chat(history=context)
-            response = await chat.send_message_async(content)
+            # Essais routés: couverture et repli gérés par le routeur
+            stream_owner: List[RouteAttempt] = []
+            
+            async def attempt_call(attempt: RouteAttempt):
+                return await self._call_model(attempt, context, content, on_text, stream_owner)
             
-            # Extraire la réponse
-            response_text = response.text
+            # Place dans l'ordonnanceur prise hors du circuit et de la santé du modèle
+            admit = None
+            if self.scheduler:
+                estimated = self._estimate_tokens(content, context)
+                
+                def admit(attempt: RouteAttempt):
+                    return self.scheduler.slot(priority, attempt.model, estimated, bounded_timeout())
             
-            # Estimer les tokens (approximation)
-            tokens_in = len(content) // 4
-            tokens_out = len(response_text) // 4
+            (response_text, usage, latency), attempt = await self.router.run(model_name, attempt_call, admit)
+            model_used = attempt.model
             
-            # Calculer le coût
-            costs = ModelConfig.COSTS[model_name]
-            cost_usd = (tokens_in / 1000000 * costs['input']) + (tokens_out / 1000000 * costs['output'])
+            # Coût réel (historique et system prompt inclus)
+            cost_usd = compute_cost(ModelConfig.COSTS[model_used], usage)
+            if self.cost_ledger:
+                self.cost_ledger.record(user_id, plan, model_used, usage, cost_usd)
+            
+            # Une réponse de repli ne remplace pas celle du modèle demandé
+            if cacheable and model_used == model_name:
+                await self.response_cache.set(model_name, content, response_text, latency, cost_usd)
             
             # Mettre à jour l'historique
-            self._update_history(user_id, content, response_text)
+            await self._update_history(user_id, content, response_text)
             
             return AIResponse(
                 content=response_text,
-                model_used=model_name,
-                tokens_input=tokens_in,
-                tokens_output=tokens_out,
+                model_used=model_used,
+                tokens_input=usage.prompt_tokens,
+                tokens_output=usage.completion_tokens,
                 cost_usd=cost_usd,
-                success=True
+                success=True,
+                tokens_cached=usage.cached_tokens
+            )
+        
+        except (AIQueueTimeoutError, DeadlineExceeded) as e:
+            # Délestage ou échéance dépassée: message convivial, ce n'est pas une panne du modèle
+            return AIResponse(
+                content="",
+                model_used=model_name,
+                tokens_input=0,
+                tokens_output=0,
+                cost_usd=0.0,
+                success=False,
+                error=OVERLOAD_MESSAGE if isinstance(e, AIQueueTimeoutError) else DEADLINE_MESSAGE
             )
             
         except Exception as e:
@@ -129,101 +211,107 @@ STYLE:
                 error=str(e)
             )
     
-    def _select_model(self, content: str, flash_ratio: float, pro_ratio: float) -> str:
-        """Sélectionne le meilleur modèle selon la complexité"""
+    async def _call_model(
+        self,
+        attempt: RouteAttempt,
+        context: List[Dict],
+        content: str,
+        on_text,
+        stream_owner: List[RouteAttempt]
+    ) -> tuple:
+        """
+        Un essai sur attempt.model (place en file déjà obtenue: attempt.slot)
         
-        # Complexité du message
-        complexity = self._analyze_complexity(content)
+        En streaming, le premier essai qui produit du texte s'approprie
+        l'affichage; s'il échoue, le suivant reprend (texte complet).
+        L'appel est borné par l'échéance du message.
+        Retourne (texte, usage, durée).
+        """
+        emit = None
+        if on_text:
+            async def emit(text: str):
+                attempt.mark_progress()
+                if not stream_owner:
+                    stream_owner.append(attempt)
+                if stream_owner[0] is attempt:
+                    await on_text(text)
         
-        # Random pour distribution
-        import random
-        rand = random.random()
+        model = self.models[attempt.model]
+        try:
+            started = time.perf_counter()
+            response, response_text = await with_deadline(self._generate(model, context, content, emit))
+            usage = TokenUsage.from_response(response, content, response_text)
+            if attempt.slot is not None:
+                attempt.slot.actual_tokens = usage.total_tokens
+        except BaseException:
+            if stream_owner and stream_owner[0] is attempt:
+                stream_owner.clear()
+            raise
         
-        # Pro pour messages très complexes
-        if complexity > 0.8 and pro_ratio > 0:
-            if rand < pro_ratio:
-                return ModelConfig.PRO
+        return response_text, usage, time.perf_counter() - started
+    
+    async def _generate(self, model, context: List[Dict], content: str, on_text) -> tuple:
+        """Appel Gemini (streamé si on_text); retourne (réponse, texte complet)"""
+        chat = model.start_chat(history=context)
         
-        # Flash pour messages moyennement complexes
-        if complexity > 0.4 and flash_ratio > 0:
-            if rand < flash_ratio:
-                return ModelConfig.FLASH
+        # Timeout HTTP aligné sur l'échéance du message
+        options = {}
+        deadline = current_deadline()
+        if deadline is not None:
+            options['request_options'] = {'timeout': deadline.remaining()}
         
-        # Par défaut: Flash-Lite (le moins cher)
-        return ModelConfig.FLASH_LITE
+        if on_text:
+            response = await chat.send_message_async(content, stream=True, **options)
+            partial = ""
+            async for chunk in response:
+                text = self._chunk_text(chunk)
+                if text:
+                    partial += text
+                    await on_text(partial)
+        else:
+            response = await chat.send_message_async(content, **options)
+        
+        # Texte agrégé en fin de stream
+        return response, response.text
+    
+    @staticmethod
+    def _estimate_tokens(content: str, context: List[Dict]) -> int:
+        """Estimation avant appel (budget du modèle): entrée ~4 car./token + sortie typique"""
+        chars = len(content) + sum(len(part) for msg in context for part in msg['parts'])
+        return chars // 4 + 500
+    
+    @staticmethod
+    def _chunk_text(chunk) -> str:
+        """Texte d'un fragment de stream (vide si le fragment n'en porte pas)"""
+        try:
+            return chunk.text
+        except ValueError:
+            return ""
+    
+    def _select_model(self, content: str, flash_ratio: float, pro_ratio: float) -> str:
+        """Sélectionne le meilleur modèle selon la complexité"""
+        score = self.classifier.classify(content).score
+        return ModelConfig.TIERS[select_tier(score, flash_ratio, pro_ratio, self._rng.random())]
     
     def _analyze_complexity(self, content: str) -> float:
         """Analyse la complexité d'un message (0-1)"""
-        score = 0.0
-        
-        # Longueur
-        if len(content) > 500:
-            score += 0.2
-        if len(content) > 1000:
-            score += 0.1
-        
-        # Code
-        if '```' in content or '`' in content:
-            score += 0.2
-        
-        # Questions complexes
-        complex_indicators = [
-            'explique', 'détaille', 'analyse', 'compare', 'différence',
-            'pourquoi', 'comment', 'optimise', 'améliore', 'résous',
-            'code', 'programme', 'script', 'fonction', 'algorithme'
-        ]
-        for indicator in complex_indicators:
-            if indicator in content.lower():
-                score += 0.1
-                break
-        
-        # Langues multiples
-        if any(ord(c) > 127 for c in content):
-            score += 0.1
-        
-        # Mathématiques
-        if any(c in content for c in '+=*/^$%#'):
-            score += 0.1
-        
-        return min(score, 1.0)
+        return self.classifier.classify(content).score
     
-    def _get_context(self, user_id: int) -> List[Dict]:
-        """Récupère le contexte de conversation"""
-        history = self.conversation_history.get(user_id, [])
+    async def _get_context(self, user_id: int) -> List[Dict]:
+        """Récupère le contexte de conversation (fenêtre tenue à jour par l'historique)"""
+        context = await self.history.get_conversation_context(user_id)
         
         # Convertir au format Gemini
-        context = []
-        for msg in history[-self.MAX_HISTORY:]:
-            context.append({
-                'role': 'user',
-                'parts': [msg['user']]
-            })
-            context.append({
-                'role': 'model',
-                'parts': [msg['assistant']]
-            })
-        
-        return context
+        return [{'role': msg['role'], 'parts': [msg['content']]} for msg in context]
     
-    def _update_history(self, user_id: int, user_msg: str, assistant_msg: str):
+    async def _update_history(self, user_id: int, user_msg: str, assistant_msg: str):
         """Met à jour l'historique"""
-        if user_id not in self.conversation_history:
-            self.conversation_history[user_id] = []
-        
-        self.conversation_history[user_id].append({
-            'user': user_msg,
-            'assistant': assistant_msg,
-            'timestamp': datetime.now().isoformat()
-        })
-        
-        # Limiter la taille
-        if len(self.conversation_history[user_id]) > self.MAX_HISTORY:
-            self.conversation_history[user_id] = self.conversation_history[user_id][-self.MAX_HISTORY:]
+        await self.history.add_message(user_id, 'user', user_msg)
+        await self.history.add_message(user_id, 'model', assistant_msg)
     
-    def clear_history(self, user_id: int):
+    async def clear_history(self, user_id: int):
         """Efface l'historique d'un utilisateur"""
-        if user_id in self.conversation_history:
-            del self.conversation_history[user_id]
+        await self.history.clear_history(user_id)
     
     async def generate_image(self, prompt: str) -> AIResponse:
         """Génère une image (si disponible)"""
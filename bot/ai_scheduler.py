@@ -0,0 +1,288 @@
+"""
+ORDONNANCEUR IA - Shellia AI Bot
+File d'attente pondérée par plan devant les appels Gemini
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional
+
+
+# Poids par niveau de support (config.PLANS[plan].support_priority):
+# à charge égale, un utilisateur 'vip' est servi 8 fois plus souvent qu'un 'community'
+DEFAULT_PRIORITY_WEIGHTS = {
+    'community': 1,
+    'normal': 2,
+    'priority': 4,
+    'vip': 8,
+}
+
+# Message affiché quand une requête est abandonnée en file
+OVERLOAD_MESSAGE = "⏳ Beaucoup de demandes en ce moment, réessaie dans quelques instants !"
+
+
+class AIQueueTimeoutError(Exception):
+    """Requête abandonnée: file pleine ou délai d'attente dépassé"""
+
+
+@dataclass
+class AISchedulerConfig:
+    """Configuration de l'ordonnanceur"""
+    max_in_flight: int = 8                 # Appels Gemini simultanés (par instance)
+    max_queue_depth: int = 500             # Au-delà: refus immédiat
+    queue_timeout: float = 20.0            # Attente maximale en file (s)
+    priority_weights: Dict[str, int] = field(default_factory=lambda: dict(DEFAULT_PRIORITY_WEIGHTS))
+    wait_samples: int = 1000               # Échantillons gardés pour les percentiles
+
+
+class TokenBucket:
+    """Budget de tokens par minute d'un modèle (seau à jetons)"""
+
+    def __init__(self, tokens_per_minute: int, now: float):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_consume(self, amount: float, now: float) -> bool:
+        """Consomme `amount` si disponible (un seau plein accepte toute requête)"""
+        self._refill(now)
+        if self.tokens >= amount or self.tokens >= self.capacity:
+            self.tokens -= amount
+            return True
+        return False
+
+    def time_until(self, amount: float) -> float:
+        """Secondes avant que `amount` tokens soient disponibles"""
+        missing = min(amount, self.capacity) - self.tokens
+        return max(missing / self.rate, 0.0) if self.rate else float('inf')
+
+    def adjust(self, delta: float):
+        """Corrige l'estimation une fois l'usage réel connu (peut passer en négatif)"""
+        self.tokens -= delta
+
+
+class _Ticket:
+    __slots__ = ('priority', 'model', 'tokens', 'enqueued_at', 'future', 'cancelled')
+
+    def __init__(self, priority: str, model: Optional[str], tokens: int, enqueued_at: float, future):
+        self.priority = priority
+        self.model = model
+        self.tokens = tokens
+        self.enqueued_at = enqueued_at
+        self.future = future
+        self.cancelled = False
+
+
+class Grant:
+    """Place obtenue; `actual_tokens` permet d'ajuster le budget du modèle"""
+
+    def __init__(self, ticket: _Ticket, waited: float):
+        self.model = ticket.model
+        self.estimated_tokens = ticket.tokens
+        self.waited = waited
+        self.actual_tokens: Optional[int] = None
+
+
+class AIScheduler:
+    """
+    Ordonnanceur équitable pondéré (WFQ) des appels IA
+
+    - Au plus `max_in_flight` appels en cours
+    - File unique triée par temps de fin virtuel: chaque niveau de support
+      avance de 1/poids par requête servie, d'où un partage pondéré sans
+      famine des plans gratuits
+    - Budget de tokens par modèle: une requête dont le modèle est à court
+      attend sans bloquer celles des autres modèles
+    - Délai d'attente maximal: au-delà la requête est abandonnée
+      (AIQueueTimeoutError, message OVERLOAD_MESSAGE)
+    """
+
+    def __init__(
+        self,
+        config: Optional[AISchedulerConfig] = None,
+        model_budgets: Optional[Dict[str, int]] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.config = config or AISchedulerConfig()
+        self.clock = clock
+
+        now = clock()
+        self.buckets: Dict[str, TokenBucket] = {
+            model: TokenBucket(tpm, now) for model, tpm in (model_budgets or {}).items()
+        }
+
+        self._heap: List = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_tag: Dict[str, float] = defaultdict(float)
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+        self.in_flight = 0
+        self.depth: Dict[str, int] = defaultdict(int)
+
+        # Statistiques
+        self.dispatched: Dict[str, int] = defaultdict(int)
+        self.shed: Dict[str, int] = defaultdict(int)
+        self._waits: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=self.config.wait_samples))
+
+    # ============================================================================
+    # API
+    # ============================================================================
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        priority: Optional[str] = None,
+        model: Optional[str] = None,
+        estimated_tokens: int = 1000,
+        timeout: Optional[float] = None
+    ):
+        """
+        Attend une place puis la rend à la sortie du bloc
+
+        `timeout` réduit l'attente maximale (échéance de la requête).
+
+        Raises:
+            AIQueueTimeoutError: file pleine ou délai dépassé
+        """
+        grant = await self.acquire(priority, model, estimated_tokens, timeout)
+        try:
+            yield grant
+        finally:
+            self.release(grant)
+
+    async def acquire(
+        self,
+        priority: Optional[str] = None,
+        model: Optional[str] = None,
+        estimated_tokens: int = 1000,
+        timeout: Optional[float] = None
+    ) -> Grant:
+        priority = priority if priority in self.config.priority_weights else 'community'
+
+        if sum(self.depth.values()) >= self.config.max_queue_depth:
+            self.shed[priority] += 1
+            raise AIQueueTimeoutError(OVERLOAD_MESSAGE)
+
+        now = self.clock()
+        ticket = _Ticket(priority, model, estimated_tokens, now, asyncio.get_running_loop().create_future())
+
+        weight = self.config.priority_weights[priority]
+        tag = max(self._virtual_time, self._last_tag[priority]) + 1.0 / weight
+        self._last_tag[priority] = tag
+        heapq.heappush(self._heap, (tag, next(self._seq), ticket))
+        self.depth[priority] += 1
+
+        self._dispatch()
+
+        wait = self.config.queue_timeout if timeout is None else min(timeout, self.config.queue_timeout)
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout=wait)
+        except asyncio.TimeoutError:
+            if not ticket.future.done():
+                ticket.cancelled = True
+                self.depth[priority] -= 1
+                self.shed[priority] += 1
+                raise AIQueueTimeoutError(OVERLOAD_MESSAGE)
+        except asyncio.CancelledError:
+            if ticket.future.done():
+                # Place attribuée mais plus attendue: la rendre
+                self.in_flight -= 1
+                self._dispatch()
+            else:
+                ticket.cancelled = True
+                self.depth[priority] -= 1
+            raise
+
+        return Grant(ticket, ticket.future.result())
+
+    def release(self, grant: Grant):
+        """Rend la place; ajuste le budget du modèle si l'usage réel est connu"""
+        self.in_flight -= 1
+        bucket = self.buckets.get(grant.model)
+        if bucket and grant.actual_tokens is not None:
+            bucket.adjust(grant.actual_tokens - grant.estimated_tokens)
+        self._dispatch()
+
+    # ============================================================================
+    # DISTRIBUTION
+    # ============================================================================
+
+    def _dispatch(self):
+        """Attribue les places libres, dans l'ordre des temps de fin virtuels"""
+        now = self.clock()
+        deferred = []
+        exhausted = set()  # Modèles à court de budget pendant ce passage
+
+        while self._heap and self.in_flight < self.config.max_in_flight:
+            entry = heapq.heappop(self._heap)
+            ticket = entry[2]
+            if ticket.cancelled:
+                continue
+
+            bucket = self.buckets.get(ticket.model)
+            if bucket and (ticket.model in exhausted or not bucket.try_consume(ticket.tokens, now)):
+                exhausted.add(ticket.model)
+                deferred.append(entry)
+                continue
+
+            self._virtual_time = entry[0]
+            self.in_flight += 1
+            self.depth[ticket.priority] -= 1
+            self.dispatched[ticket.priority] += 1
+            waited = now - ticket.enqueued_at
+            self._waits[ticket.priority].append(waited)
+            ticket.future.set_result(waited)
+
+        for entry in deferred:
+            heapq.heappush(self._heap, entry)
+
+        # Réveil quand le budget d'un modèle bloqué sera reconstitué
+        if deferred and self.in_flight < self.config.max_in_flight and self._wakeup is None:
+            delay = min(self.buckets[e[2].model].time_until(e[2].tokens) for e in deferred)
+            self._wakeup = asyncio.get_running_loop().call_later(max(delay, 0.01), self._on_wakeup)
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._dispatch()
+
+    # ============================================================================
+    # MÉTRIQUES
+    # ============================================================================
+
+    @staticmethod
+    def _percentile(samples: List[float], pct: float) -> float:
+        if not samples:
+            return 0.0
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(pct * len(ordered)))]
+
+    def get_stats(self) -> Dict:
+        """Profondeur de file, attente (p50/p95) et délestage par niveau"""
+        priorities = {}
+        for priority in self.config.priority_weights:
+            waits = list(self._waits[priority])
+            priorities[priority] = {
+                'queued': self.depth[priority],
+                'dispatched': self.dispatched[priority],
+                'shed': self.shed[priority],
+                'wait_p50': self._percentile(waits, 0.50),
+                'wait_p95': self._percentile(waits, 0.95),
+            }
+        return {
+            'in_flight': self.in_flight,
+            'max_in_flight': self.config.max_in_flight,
+            'queued': sum(self.depth.values()),
+            'priorities': priorities,
+            'model_budgets': {model: round(b.tokens) for model, b in self.buckets.items()},
+        }
@@ -0,0 +1,660 @@
+"""
+CLIENT SUPABASE ASYNCHRONE - Shellia AI Bot
+Variante non bloquante de SupabaseDB avec pool HTTP keep-alive partagé
+"""
+
+import asyncio
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import httpx
+from supabase import AsyncClient, AsyncClientOptions, acreate_client
+
+from config import EnvConfig
+from cost_ledger import CostLedger
+from deadline import with_deadline
+from supabase_client import admission_rules, finalize_admission
+from user_cache import UserCache, user_cache as shared_user_cache
+from write_behind import WriteBehindBuffer, WriteBehindConfig
+
+
+class AsyncSupabaseDB:
+    """
+    Client Supabase asynchrone pour le bot
+
+    Même surface que SupabaseDB, mais chaque méthode est awaitable.
+    Toutes les requêtes PostgREST passent par un seul httpx.AsyncClient
+    (connexions keep-alive réutilisées) et un sémaphore borne le nombre
+    de requêtes simultanées.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 20,
+        max_connections: int = 50,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        request_timeout: float = 10.0,
+        write_behind_config: Optional[WriteBehindConfig] = None,
+        user_cache: Optional[UserCache] = None
+    ):
+        self.client: Optional[AsyncClient] = None
+        self.user_cache = user_cache or shared_user_cache
+        self.max_concurrency = max_concurrency
+
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self._timeout = httpx.Timeout(request_timeout)
+        self._http: Optional[httpx.AsyncClient] = None
+        # Transport HTTP du pool (None: réseau; banc de charge: PostgREST simulé)
+        self.transport: Optional[httpx.AsyncBaseTransport] = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._connect_lock = asyncio.Lock()
+
+        # Règles envoyées à admit_message (constantes, calculées une fois)
+        self._admission_rules = admission_rules()
+
+        # Logs append-only (security_logs, télémétrie) écrits par lots
+        self.write_buffer = WriteBehindBuffer(self.insert_rows, write_behind_config)
+
+        # Coûts IA agrégés (utilisateur, plan, modèle, jour), écrits par lots
+        self.cost_ledger = CostLedger(self.record_costs)
+
+        # Statistiques
+        self.in_flight = 0
+        self.total_requests = 0
+
+    # ============================================================================
+    # CYCLE DE VIE
+    # ============================================================================
+
+    async def connect(self):
+        """Ouvre le pool HTTP et crée le client (idempotent)"""
+        async with self._connect_lock:
+            if self.client is not None:
+                return
+
+            self._http = httpx.AsyncClient(limits=self._limits, timeout=self._timeout, transport=self.transport)
+            self.client = await acreate_client(
+                EnvConfig.SUPABASE_URL,
+                EnvConfig.SUPABASE_KEY,
+                options=AsyncClientOptions(httpx_client=self._http)
+            )
+            self.write_buffer.start()
+            self.cost_ledger.start()
+
+    async def close(self):
+        """Écrit les logs et coûts en attente puis ferme le pool HTTP"""
+        if self.client is not None:
+            await self.write_buffer.stop()
+            await self.cost_ledger.stop()
+        if self._http is not None:
+            await self._http.aclose()
+        self._http = None
+        self.client = None
+
+    def _table(self, name: str):
+        if self.client is None:
+            raise RuntimeError("AsyncSupabaseDB.connect() doit être appelé avant usage")
+        return self.client.table(name)
+
+    def _rpc(self, name: str, params: Dict):
+        if self.client is None:
+            raise RuntimeError("AsyncSupabaseDB.connect() doit être appelé avant usage")
+        return self.client.rpc(name, params)
+
+    async def _execute(self, query):
+        """
+        Exécute une requête en respectant la limite de concurrence
+
+        L'attente du pool et la requête sont bornées par l'échéance du
+        message en cours, s'il y en a une (DeadlineExceeded).
+        """
+        return await with_deadline(self._execute_pooled(query))
+
+    async def _execute_pooled(self, query):
+        async with self._semaphore:
+            self.in_flight += 1
+            self.total_requests += 1
+            try:
+                return await query.execute()
+            finally:
+                self.in_flight -= 1
+
+    def get_stats(self) -> Dict:
+        """Statistiques du client"""
+        return {
+            'connected': self.client is not None,
+            'max_concurrency': self.max_concurrency,
+            'in_flight': self.in_flight,
+            'total_requests': self.total_requests,
+            'write_buffer': self.write_buffer.get_stats(),
+            'cost_ledger': self.cost_ledger.get_stats(),
+            'user_cache': self.user_cache.get_stats()
+        }
+
+    # ============================================================================
+    # UTILISATEURS
+    # ============================================================================
+
+    async def get_or_create_user(self, user_id: int, username: str, **kwargs) -> Dict:
+        """Récupère ou crée un utilisateur"""
+        user = await self.get_user(user_id)
+        if user:
+            return user
+
+        user_data = {
+            'user_id': user_id,
+            'username': username,
+            'discriminator': kwargs.get('discriminator'),
+            'avatar_url': kwargs.get('avatar_url'),
+            'plan': 'free',
+            'joined_at': datetime.now().isoformat(),
+            'last_active_at': datetime.now().isoformat()
+        }
+
+        await self._execute(self._table('users').insert(user_data))
+        self.user_cache.set(user_id, user_data)
+
+        await self._execute(self._table('user_streaks').insert({
+            'user_id': user_id,
+            'current_streak': 0,
+            'longest_streak': 0,
+            'total_days_active': 0
+        }))
+
+        return user_data
+
+    async def get_user(self, user_id: int) -> Optional[Dict]:
+        """Récupère un utilisateur (via le cache)"""
+        cached = self.user_cache.get(user_id)
+        if cached is not None:
+            return cached
+
+        result = await self._execute(self._table('users').select('*').eq('user_id', user_id))
+        if not result.data:
+            return None
+
+        self.user_cache.set(user_id, result.data[0])
+        return result.data[0]
+
+    def invalidate_user(self, user_id: int):
+        """Invalide le profil en cache (à appeler après toute écriture sur users)"""
+        self.user_cache.invalidate(user_id)
+
+    async def update_user(self, user_id: int, **kwargs) -> bool:
+        """Met à jour un utilisateur"""
+        await self._execute(self._table('users').update(kwargs).eq('user_id', user_id))
+        self.invalidate_user(user_id)
+        return True
+
+    async def set_user_plan(self, user_id: int, plan: str, duration_days: int = 30) -> bool:
+        """Change le plan d'un utilisateur"""
+        now = datetime.now()
+        expires = now + timedelta(days=duration_days)
+
+        await self._execute(self._table('users').update({
+            'plan': plan,
+            'plan_started_at': now.isoformat(),
+            'plan_expires_at': expires.isoformat()
+        }).eq('user_id', user_id))
+        self.invalidate_user(user_id)
+
+        await self.award_badge(user_id, f"{plan}_member")
+
+        return True
+
+    # ============================================================================
+    # QUOTAS
+    # ============================================================================
+
+    async def get_daily_quota(self, user_id: int, date: str = None) -> Dict:
+        """Récupère le quota journalier"""
+        if date is None:
+            date = datetime.now().strftime('%Y-%m-%d')
+
+        result = await self._execute(
+            self._table('daily_quotas').select('*').eq('user_id', user_id).eq('date', date)
+        )
+
+        if result.data:
+            return result.data[0]
+
+        from config import PLANS
+        user = await self.get_user(user_id)
+        plan_limit = PLANS.get(user['plan'], PLANS['free']).daily_quota if user else 10
+
+        quota_data = {
+            'user_id': user_id,
+            'date': date,
+            'messages_used': 0,
+            'messages_limit': plan_limit,
+            'tokens_used': 0,
+            'cost_usd': 0.0,
+            'streak_bonus': 0
+        }
+
+        await self._execute(self._table('daily_quotas').insert(quota_data))
+        return quota_data
+
+    async def increment_quota_usage(self, user_id: int, tokens: int = 0, cost: float = 0.0):
+        """Incrémente l'utilisation (les deux RPC partent en parallèle)"""
+        date = datetime.now().strftime('%Y-%m-%d')
+
+        await asyncio.gather(
+            self._execute(self._rpc('increment_quota', {
+                'p_user_id': user_id,
+                'p_date': date,
+                'p_tokens': tokens,
+                'p_cost': cost
+            })),
+            self._execute(self._rpc('increment_user_stats', {
+                'p_user_id': user_id,
+                'p_tokens': tokens,
+                'p_cost': cost
+            }))
+        )
+        self.invalidate_user(user_id)
+
+    async def add_streak_bonus(self, user_id: int, bonus: int):
+        """Ajoute un bonus de streak"""
+        date = datetime.now().strftime('%Y-%m-%d')
+
+        await self._execute(self._rpc('add_streak_bonus', {
+            'p_user_id': user_id,
+            'p_date': date,
+            'p_bonus': bonus
+        }))
+
+    # ============================================================================
+    # ADMISSION (HOT PATH IA)
+    # ============================================================================
+
+    async def admit_message(self, user_id: int, username: str, bypass_quota: bool = False) -> Dict:
+        """
+        Admission d'un message en un seul aller-retour
+
+        Returns:
+            {'admitted': bool, 'user': Dict, 'quota': Dict, 'streak': Dict}
+        """
+        result = await self._execute(self._rpc('admit_message', {
+            'p_user_id': user_id,
+            'p_username': username,
+            'p_date': datetime.now().strftime('%Y-%m-%d'),
+            'p_bypass_quota': bypass_quota,
+            **self._admission_rules
+        }))
+
+        admission = finalize_admission(result.data)
+        self.user_cache.set(user_id, admission['user'])
+        return admission
+
+    async def commit_usage(self, user_id: int, tokens: int = 0, cost: float = 0.0) -> Dict:
+        """Enregistre l'usage d'un message et retourne le quota du jour à jour"""
+        result = await self._execute(self._rpc('commit_usage', {
+            'p_user_id': user_id,
+            'p_date': datetime.now().strftime('%Y-%m-%d'),
+            'p_tokens': tokens,
+            'p_cost': cost
+        }))
+        self.invalidate_user(user_id)
+
+        return result.data
+
+    # ============================================================================
+    # STREAKS
+    # ============================================================================
+
+    async def update_streak(self, user_id: int) -> Dict:
+        """Met à jour le streak"""
+        today = datetime.now().strftime('%Y-%m-%d')
+        yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+
+        result = await self._execute(self._table('user_streaks').select('*').eq('user_id', user_id))
+
+        if not result.data:
+            await self._execute(self._table('user_streaks').insert({
+                'user_id': user_id,
+                'current_streak': 1,
+                'longest_streak': 1,
+                'last_active_date': today,
+                'total_days_active': 1
+            }))
+            return {'current_streak': 1, 'longest_streak': 1, 'is_new_milestone': False}
+
+        streak = result.data[0]
+        last_date = streak.get('last_active_date')
+        current = streak['current_streak']
+        longest = streak['longest_streak']
+
+        if last_date == today:
+            return {'current_streak': current, 'longest_streak': longest, 'is_new_milestone': False}
+
+        elif last_date == yesterday:
+            current += 1
+            if current > longest:
+                longest = current
+
+            from config import StreakConfig
+            bonus = StreakConfig.BONUS.get(min(current, 7), 50)
+
+            await asyncio.gather(
+                self._execute(self._table('user_streaks').update({
+                    'current_streak': current,
+                    'longest_streak': longest,
+                    'last_active_date': today,
+                    'total_days_active': streak['total_days_active'] + 1
+                }).eq('user_id', user_id)),
+                self._execute(self._table('streak_history').insert({
+                    'user_id': user_id,
+                    'date': today,
+                    'streak_count': current,
+                    'bonus_earned': bonus
+                }))
+            )
+
+            is_milestone = current in StreakConfig.BADGES
+        else:
+            current = 1
+            await self._execute(self._table('user_streaks').update({
+                'current_streak': 1,
+                'last_active_date': today,
+                'total_days_active': streak['total_days_active'] + 1
+            }).eq('user_id', user_id))
+            is_milestone = False
+
+        return {
+            'current_streak': current,
+            'longest_streak': longest,
+            'is_new_milestone': is_milestone
+        }
+
+    async def get_streak_info(self, user_id: int) -> Dict:
+        """Récupère les infos de streak"""
+        result = await self._execute(self._table('user_streaks').select('*').eq('user_id', user_id))
+
+        if not result.data:
+            return {'current_streak': 0, 'longest_streak': 0, 'total_days': 0, 'bonus_messages': 0}
+
+        streak = result.data[0]
+        current = streak['current_streak']
+
+        from config import StreakConfig
+        bonus = StreakConfig.BONUS.get(min(current, 7), 50) if current > 0 else 0
+
+        badge = None
+        for days, info in sorted(StreakConfig.BADGES.items(), reverse=True):
+            if current >= days:
+                badge = info
+                break
+
+        return {
+            'current_streak': current,
+            'longest_streak': streak['longest_streak'],
+            'total_days': streak['total_days_active'],
+            'bonus_messages': bonus,
+            'badge': badge
+        }
+
+    # ============================================================================
+    # BADGES
+    # ============================================================================
+
+    async def award_badge(self, user_id: int, badge_id: str) -> bool:
+        """Attribue un badge"""
+        try:
+            await self._execute(self._table('user_badges').insert({
+                'user_id': user_id,
+                'badge_id': badge_id,
+                'earned_at': datetime.now().isoformat()
+            }))
+            return True
+        except Exception:
+            return False
+
+    async def get_user_badges(self, user_id: int) -> List[Dict]:
+        """Récupère les badges"""
+        result = await self._execute(self._table('user_badges').select('*').eq('user_id', user_id))
+
+        from config import BADGES
+        badges = []
+        for row in result.data:
+            badge_info = BADGES.get(row['badge_id'], {})
+            badges.append({
+                'id': row['badge_id'],
+                'earned_at': row['earned_at'],
+                **badge_info
+            })
+        return badges
+
+    # ============================================================================
+    # PARRAINAGE
+    # ============================================================================
+
+    async def get_or_create_referral_code(self, user_id: int) -> str:
+        """Récupère ou crée un code de parrainage"""
+        result = await self._execute(
+            self._table('referral_codes').select('code').eq('user_id', user_id)
+        )
+
+        if result.data:
+            return result.data[0]['code']
+
+        code = f"SHELL-{hashlib.md5(str(user_id).encode()).hexdigest()[:6].upper()}"
+
+        await self._execute(self._table('referral_codes').insert({
+            'user_id': user_id,
+            'code': code,
+            'created_at': datetime.now().isoformat()
+        }))
+
+        return code
+
+    async def apply_referral_code(self, code: str, referred_id: int) -> tuple:
+        """Applique un code de parrainage"""
+        result = await self._execute(
+            self._table('referral_codes').select('user_id').eq('code', code.upper())
+        )
+
+        if not result.data:
+            return False, "Code invalide"
+
+        referrer_id = result.data[0]['user_id']
+
+        if referrer_id == referred_id:
+            return False, "Vous ne pouvez pas vous parrainer"
+
+        existing = await self._execute(
+            self._table('referrals').select('*').eq('referred_id', referred_id)
+        )
+        if existing.data:
+            return False, "Vous avez déjà utilisé un code"
+
+        await self._execute(self._table('referrals').insert({
+            'referrer_id': referrer_id,
+            'referred_id': referred_id,
+            'code_used': code,
+            'status': 'pending',
+            'created_at': datetime.now().isoformat()
+        }))
+
+        expires = (datetime.now() + timedelta(days=3)).isoformat()
+        await self._execute(self._table('referral_rewards').insert({
+            'user_id': referred_id,
+            'reward_type': 'pro_days',
+            'reward_value': 3,
+            'expires_at': expires
+        }))
+
+        return True, "Code appliqué ! 3 jours Pro gratuits"
+
+    async def get_referral_stats(self, user_id: int) -> Dict:
+        """Stats de parrainage (requêtes lancées en parallèle)"""
+        code_result, total, completed, rewards = await asyncio.gather(
+            self._execute(self._table('referral_codes').select('*').eq('user_id', user_id)),
+            self._execute(
+                self._table('referrals').select('*', count='exact').eq('referrer_id', user_id)
+            ),
+            self._execute(
+                self._table('referrals').select('*', count='exact')
+                .eq('referrer_id', user_id).eq('status', 'completed')
+            ),
+            self._execute(
+                self._table('referral_rewards').select('*')
+                .eq('user_id', user_id).eq('used', False)
+                .gt('expires_at', datetime.now().isoformat())
+            )
+        )
+
+        code = code_result.data[0] if code_result.data else None
+        total_days = sum(r['reward_value'] for r in rewards.data) if rewards.data else 0
+
+        return {
+            'code': code['code'] if code else None,
+            'total_referrals': total.count if hasattr(total, 'count') else len(total.data),
+            'completed_referrals': completed.count if hasattr(completed, 'count') else len(completed.data),
+            'active_rewards_days': total_days
+        }
+
+    # ============================================================================
+    # LEADERBOARD
+    # ============================================================================
+
+    async def get_leaderboard(self, period: str = 'week', limit: int = 10) -> List[Dict]:
+        """Récupère le leaderboard"""
+        if period == 'all':
+            result = await self._execute(
+                self._table('users').select('user_id, username, total_messages')
+                .order('total_messages', desc=True).limit(limit)
+            )
+
+            return [
+                {'rank': i+1, 'user_id': r['user_id'], 'username': r['username'], 'messages': r['total_messages']}
+                for i, r in enumerate(result.data)
+            ]
+
+        result = await self._execute(self._rpc('get_leaderboard', {
+            'period': period,
+            'limit_count': limit
+        }))
+
+        return result.data if result.data else []
+
+    # ============================================================================
+    # STATS SERVEUR
+    # ============================================================================
+
+    async def get_server_stats(self) -> Dict:
+        """Stats du serveur (requêtes lancées en parallèle)"""
+        today = datetime.now().strftime('%Y-%m-%d')
+
+        users, plans, daily = await asyncio.gather(
+            self._execute(self._table('users').select('*', count='exact')),
+            self._execute(self._table('users').select('plan')),
+            self._execute(
+                self._table('daily_quotas').select('messages_used, cost_usd').eq('date', today)
+            )
+        )
+
+        plan_dist = {}
+        for p in plans.data:
+            plan_dist[p['plan']] = plan_dist.get(p['plan'], 0) + 1
+
+        messages_today = sum(d['messages_used'] for d in daily.data) if daily.data else 0
+        cost_today = sum(d['cost_usd'] for d in daily.data) if daily.data else 0
+
+        return {
+            'total_users': users.count if hasattr(users, 'count') else len(users.data),
+            'plan_distribution': plan_dist,
+            'messages_today': messages_today,
+            'cost_today_usd': cost_today
+        }
+
+    # ============================================================================
+    # COÛTS IA
+    # ============================================================================
+
+    async def record_costs(self, rows: List[Dict]):
+        """Ajoute des agrégats au registre des coûts (un seul RPC, upsert additif)"""
+        await self._execute(self._rpc('record_cost_ledger', {'p_rows': rows}))
+
+    async def get_cost_report(self, days: int = 7, limit: int = 10) -> Dict:
+        """
+        Coûts réels des `days` derniers jours (dashboard admin)
+
+        Returns:
+            {'by_model': [...], 'by_plan': [...], 'top_users': [...], 'totals': {...}}
+        """
+        result = await self._execute(self._rpc('get_cost_report', {
+            'p_days': days,
+            'p_limit': limit
+        }))
+        return result.data if result.data else {}
+
+    # ============================================================================
+    # SÉCURITÉ
+    # ============================================================================
+
+    async def log_security_event(self, user_id: int, event_type: str, event_data: dict = None):
+        """Log un événement de sécurité (écriture différée, insérée par lots)"""
+        await self.write_buffer.add('security_logs', {
+            'user_id': user_id,
+            'event_type': event_type,
+            'event_data': json.dumps(event_data) if event_data else None,
+            'timestamp': datetime.now().isoformat()
+        })
+
+    async def insert_rows(self, table: str, rows: List[Dict]):
+        """Insertion groupée (un seul INSERT multi-lignes)"""
+        await self._execute(self._table(table).insert(rows))
+
+    async def add_violation(self, user_id: int, violation_type: str, description: str, action: str):
+        """Ajoute une violation"""
+        await self._execute(self._table('user_violations').insert({
+            'user_id': user_id,
+            'violation_type': violation_type,
+            'description': description,
+            'action_taken': action,
+            'timestamp': datetime.now().isoformat()
+        }))
+
+        await self._execute(self._rpc('increment_warnings', {'p_user_id': user_id}))
+
+    async def ban_user(self, user_id: int, reason: str, duration_days: int = None):
+        """Bannit un utilisateur"""
+        expires = (datetime.now() + timedelta(days=duration_days)).isoformat() if duration_days else None
+
+        await self._execute(self._table('users').update({
+            'is_banned': True,
+            'ban_reason': reason,
+            'ban_expires_at': expires
+        }).eq('user_id', user_id))
+        self.invalidate_user(user_id)
+
+    async def is_user_banned(self, user_id: int) -> tuple:
+        """Vérifie si banni"""
+        user = await self.get_user(user_id)
+
+        if not user:
+            return False, None
+
+        if not user.get('is_banned'):
+            return False, None
+
+        if user.get('ban_expires_at'):
+            expires = datetime.fromisoformat(user['ban_expires_at'].replace('Z', '+00:00'))
+            if datetime.now() > expires:
+                await self._execute(self._table('users').update({
+                    'is_banned': False,
+                    'ban_reason': None,
+                    'ban_expires_at': None
+                }).eq('user_id', user_id))
+                self.invalidate_user(user_id)
+                return False, None
+
+        return True, user.get('ban_reason')
@@ -5,15 +5,20 @@ Déclenche des giveaways automatiquement quand des paliers de membres sont attei
 
 import discord
 from discord.ext import commands, tasks
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Callable
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Callable, Set, Tuple
 import asyncio
-import random
+import bisect
 import json
 from dataclasses import dataclass, asdict
 from enum import Enum
 import logging
 
+from deadline_scheduler import DeadlineScheduler
+from dm_queue import DMQueue
+from giveaway_draw import DrawRecord, DrawResult, DrawWeights, ReservoirDraw, new_seed
+from giveaway_entries import EntryJournal, EntrySet, GiveawayEntry
+
 logger = logging.getLogger(__name__)
 
 
@@ -44,21 +49,6 @@ class MilestoneReward:
         return cls(**data)
 
 
-@dataclass
-class GiveawayEntry:
-    """Participation à un giveaway"""
-    user_id: int
-    joined_at: datetime
-    message_id: Optional[int] = None
-    
-    def to_dict(self) -> dict:
-        return {
-            'user_id': self.user_id,
-            'joined_at': self.joined_at.isoformat(),
-            'message_id': self.message_id
-        }
-
-
 @dataclass
 class ActiveGiveaway:
     """Giveaway en cours"""
@@ -70,10 +60,15 @@ class ActiveGiveaway:
     host_id: int
     started_at: datetime
     ends_at: datetime
-    entries: List[GiveawayEntry]
+    entries: EntrySet
     status: GiveawayStatus
     winners: List[int]
     
+    def __post_init__(self):
+        # Accepte une liste de GiveawayEntry (anciens appelants, JSONB legacy)
+        if not isinstance(self.entries, EntrySet):
+            self.entries = EntrySet(self.entries)
+    
     @property
     def entry_count(self) -> int:
         return len(self.entries)
@@ -92,17 +87,32 @@ class ActiveGiveaway:
             'host_id': self.host_id,
             'started_at': self.started_at.isoformat(),
             'ends_at': self.ends_at.isoformat(),
-            'entries': [e.to_dict() for e in self.entries],
+            'entries': self.entries.to_list(),
             'status': self.status.value,
             'winners': self.winners
         }
 
 
+def _seconds_until(moment: datetime) -> float:
+    """Secondes restantes avant `moment` (naïf = UTC, ou aware venant de la DB)"""
+    now = datetime.now(timezone.utc) if moment.tzinfo else datetime.utcnow()
+    return (moment - now).total_seconds()
+
+
 class AutoGiveawayManager:
     """
     Gestionnaire de giveaways automatiques aux paliers
     """
     
+    # Délai minimal entre deux éditions du compteur de participants d'un message
+    EDIT_DEBOUNCE_SECONDS = 10
+    # Passe de réconciliation des paliers (la détection suit on_member_join)
+    MILESTONE_RECONCILE_SECONDS = 3600
+    # Participations lues par page (pagination par user_id) lors d'un tirage depuis la base
+    DRAW_PAGE_SIZE = 5000
+    # Essais de fin d'un giveaway (un par minute) avant abandon
+    MAX_END_ATTEMPTS = 5
+    
     # Paliers par défaut
     DEFAULT_MILESTONES = {
         50: MilestoneReward(
@@ -170,11 +180,33 @@ class AutoGiveawayManager:
         self.db = db
         self.milestones: Dict[int, MilestoneReward] = self.DEFAULT_MILESTONES.copy()
         self.active_giveaways: Dict[str, ActiveGiveaway] = {}
-        self.completed_milestones: set = set()
+        # (channel_id, message_id) -> giveaway_id: routage des réactions en O(1)
+        self.message_index: Dict[Tuple[int, int], str] = {}
+        # Paliers célébrés: un bitset par serveur (bit attribué à chaque palier, stable)
+        self.completed_milestones: Dict[int, int] = {}
+        self._milestone_bits: Dict[int, int] = {}
+        self._thresholds: List[int] = []       # Paliers triés (bisect)
+        self._reached_masks: List[int] = [0]   # _reached_masks[i]: bits des i premiers paliers
+        self._member_counts: Dict[int, int] = {}
+        self._rebuild_thresholds()
         self.check_milestones_task = None
         self.update_giveaway_messages_task = None
         self.announcement_channel_id: Optional[int] = None
         self.log_channel_id: Optional[int] = None
+        # Participations écrites par lots dans giveaway_entries
+        self.entry_journal: Optional[EntryJournal] = EntryJournal(db) if db else None
+        # DMs de confirmation envoyés en arrière-plan, cadencés
+        self.dm_queue = DMQueue(bot)
+        # Échéances: ('end', id) à ends_at, ('refresh', id) après un changement de participants
+        self.scheduler = DeadlineScheduler(self._on_deadline)
+        self._rendered_counts: Dict[str, Optional[int]] = {}  # Compteur affiché sur chaque message
+        # Pondération du tirage (uniforme par défaut: plan, série, rôles configurables)
+        self.draw_weights = DrawWeights()
+        # Fins en cours: participations figées et étapes déjà faites (une reprise fait le reste)
+        self._ending: Dict[str, Set[str]] = {}
+        # Échecs de fin consécutifs par giveaway (voir MAX_END_ATTEMPTS)
+        self._end_attempts: Dict[str, int] = {}
+        self._end_locks: Dict[str, asyncio.Lock] = {}
         
     async def setup(self, announcement_channel_id: Optional[int] = None):
         """Initialise le gestionnaire"""
@@ -185,43 +217,142 @@ class AutoGiveawayManager:
             await self._load_from_db()
         
         # Démarrer les tâches de fond
-        self.check_milestones_task = self.bot.loop.create_task(
+        self.check_milestones_task = asyncio.create_task(
             self._check_milestones_loop()
         )
-        self.update_giveaway_messages_task = self.bot.loop.create_task(
-            self._update_giveaway_messages_loop()
-        )
+        # Fins et éditions des messages: planificateur d'échéances (pas de polling)
+        self.update_giveaway_messages_task = self.scheduler.start()
+        if self.entry_journal:
+            self.entry_journal.start()
+        self.dm_queue.start()
         
         logger.info("✅ AutoGiveawayManager initialisé")
         
+    async def close(self):
+        """Arrête les tâches de fond et écrit les participations en attente"""
+        if self.check_milestones_task:
+            self.check_milestones_task.cancel()
+        await self.scheduler.stop()
+        await self.dm_queue.stop()
+        if self.entry_journal:
+            await self.entry_journal.stop()
+        
     async def _load_from_db(self):
         """Charge l'état depuis la base de données"""
         try:
-            # Charger les paliers complétés
+            # Charger les paliers complétés (tous les serveurs, une fois)
             result = await self.db.fetch(
-                "SELECT milestone FROM completed_milestones WHERE guild_id = %s",
-                (self.get_default_guild_id(),)
+                "SELECT guild_id, milestone FROM completed_milestones"
             )
-            self.completed_milestones = {row['milestone'] for row in result}
+            for row in result:
+                self._mark_milestone_completed(row['guild_id'], row['milestone'])
             
-            # Charger les giveaways actifs
+            # Charger les giveaways actifs (y compris ceux échus pendant l'arrêt:
+            # leur échéance est réarmée dans le passé, ils se terminent aussitôt)
             result = await self.db.fetch(
-                "SELECT * FROM active_giveaways WHERE status = 'active' AND ends_at > NOW()"
+                "SELECT * FROM active_giveaways WHERE status = 'active'"
             )
             for row in result:
-                giveaway = self._row_to_giveaway(row)
-                self.active_giveaways[giveaway.id] = giveaway
+                self._register_giveaway(self._row_to_giveaway(row))
+            
+            # Charger leurs participants (une seule requête)
+            if self.active_giveaways:
+                rows = await self.db.fetch(
+                    "SELECT giveaway_id, user_id, joined_at FROM giveaway_entries WHERE giveaway_id = ANY(%s)",
+                    (list(self.active_giveaways),)
+                )
+                for row in rows:
+                    giveaway = self.active_giveaways.get(row['giveaway_id'])
+                    if giveaway:
+                        giveaway.entries.add(row['user_id'], row['joined_at'])
                 
         except Exception as e:
             logger.error(f"Erreur chargement DB: {e}")
             
+    def _register_giveaway(self, giveaway: ActiveGiveaway, rendered_count: Optional[int] = None):
+        """Ajoute un giveaway aux actifs, à l'index des messages, et arme sa fin"""
+        self.active_giveaways[giveaway.id] = giveaway
+        if giveaway.message_id:
+            self.message_index[(giveaway.channel_id, giveaway.message_id)] = giveaway.id
+        self._rendered_counts[giveaway.id] = rendered_count
+        self.scheduler.schedule_in(('end', giveaway.id), _seconds_until(giveaway.ends_at))
+            
+    def _unregister_giveaway(self, giveaway_id: str) -> Optional[ActiveGiveaway]:
+        """Retire un giveaway des actifs, de l'index et du planificateur"""
+        giveaway = self.active_giveaways.pop(giveaway_id, None)
+        if giveaway and giveaway.message_id:
+            self.message_index.pop((giveaway.channel_id, giveaway.message_id), None)
+        self._rendered_counts.pop(giveaway_id, None)
+        self._ending.pop(giveaway_id, None)
+        self._end_locks.pop(giveaway_id, None)
+        self._end_attempts.pop(giveaway_id, None)
+        self.scheduler.cancel(('end', giveaway_id))
+        self.scheduler.cancel(('refresh', giveaway_id))
+        return giveaway
+        
+    def giveaway_for_message(self, channel_id: int, message_id: int) -> Optional[ActiveGiveaway]:
+        """Giveaway actif dont le message est (channel_id, message_id)"""
+        giveaway_id = self.message_index.get((channel_id, message_id))
+        return self.active_giveaways.get(giveaway_id) if giveaway_id else None
+        
     def get_default_guild_id(self) -> int:
         """Récupère l'ID du serveur par défaut"""
         # À configurer selon votre serveur
         return 0
         
+    # ============ DÉTECTION DES PALIERS ============
+    
+    def _rebuild_thresholds(self):
+        """Recalcule le tableau trié des paliers et les masques cumulés"""
+        self._thresholds = sorted(self.milestones)
+        self._reached_masks = [0]
+        for milestone in self._thresholds:
+            self._reached_masks.append(self._reached_masks[-1] | (1 << self._milestone_bit(milestone)))
+            
+    def _milestone_bit(self, milestone: int) -> int:
+        """Position du palier dans les bitsets (jamais réattribuée)"""
+        bit = self._milestone_bits.get(milestone)
+        if bit is None:
+            bit = self._milestone_bits[milestone] = len(self._milestone_bits)
+        return bit
+        
+    def _mark_milestone_completed(self, guild_id: int, milestone: int):
+        mask = self.completed_milestones.get(guild_id, 0)
+        self.completed_milestones[guild_id] = mask | (1 << self._milestone_bit(milestone))
+        
+    def is_milestone_completed(self, guild_id: int, milestone: int) -> bool:
+        bit = self._milestone_bits.get(milestone)
+        return bit is not None and bool(self.completed_milestones.get(guild_id, 0) >> bit & 1)
+        
+    def pending_milestones(self, guild_id: int, member_count: int) -> List[int]:
+        """Paliers atteints (<= member_count) pas encore célébrés, croissants"""
+        reached = self._reached_masks[bisect.bisect_right(self._thresholds, member_count)]
+        pending = reached & ~self.completed_milestones.get(guild_id, 0)
+        if not pending:
+            return []
+        return [m for m in self._thresholds if pending >> self._milestone_bits[m] & 1]
+        
+    def upcoming_milestones(self, member_count: int, limit: int = 3) -> List[int]:
+        """Prochains paliers au-dessus de member_count"""
+        start = bisect.bisect_right(self._thresholds, member_count)
+        return self._thresholds[start:start + limit]
+        
+    async def on_member_count_changed(self, guild: discord.Guild):
+        """
+        À appeler sur on_member_join / on_member_remove
+        
+        Une baisse (ou un compte inchangé) ne peut pas atteindre de palier:
+        seule une hausse déclenche la vérification (bisect + masque, O(log n)).
+        """
+        member_count = guild.member_count or 0
+        previous = self._member_counts.get(guild.id)
+        self._member_counts[guild.id] = member_count
+        if previous is not None and member_count <= previous:
+            return
+        await self._check_guild_milestone(guild)
+        
     async def _check_milestones_loop(self):
-        """Boucle de vérification des paliers"""
+        """Réconciliation périodique (membres arrivés pendant un arrêt, événements manqués)"""
         await self.bot.wait_until_ready()
         
         while not self.bot.is_closed():
@@ -230,30 +361,26 @@ class AutoGiveawayManager:
             except Exception as e:
                 logger.error(f"Erreur vérification paliers: {e}")
                 
-            await asyncio.sleep(300)  # Vérifier toutes les 5 minutes
+            await asyncio.sleep(self.MILESTONE_RECONCILE_SECONDS)
             
     async def _check_all_guilds(self):
         """Vérifie les paliers pour tous les serveurs"""
         for guild in self.bot.guilds:
+            self._member_counts[guild.id] = guild.member_count or 0
             await self._check_guild_milestone(guild)
             
     async def _check_guild_milestone(self, guild: discord.Guild):
         """Vérifie si un palier a été atteint pour un serveur"""
-        member_count = guild.member_count
-        
-        # Chercher le prochain palier non atteint
-        for milestone in sorted(self.milestones.keys()):
-            if milestone > member_count:
-                continue
-                
-            # Vérifier si ce palier a déjà été célébré
-            milestone_key = f"{guild.id}:{milestone}"
-            if milestone_key in self.completed_milestones:
-                continue
-                
-            # 🎉 Palier atteint ! Démarrer un giveaway
-            await self._trigger_milestone_giveaway(guild, milestone)
-            self.completed_milestones.add(milestone_key)
+        for milestone in self.pending_milestones(guild.id, guild.member_count or 0):
+            # Marqué avant l'envoi: deux arrivées simultanées ne le déclenchent qu'une fois
+            self._mark_milestone_completed(guild.id, milestone)
+            try:
+                # 🎉 Palier atteint ! Démarrer un giveaway
+                await self._trigger_milestone_giveaway(guild, milestone)
+            except Exception:
+                # La réconciliation retentera
+                self.completed_milestones[guild.id] &= ~(1 << self._milestone_bits[milestone])
+                raise
             
             # Sauvegarder dans la DB
             if self.db:
@@ -333,8 +460,8 @@ class AutoGiveawayManager:
         # Ajouter la réaction 🎉
         await message.add_reaction("🎉")
         
-        # Stocker
-        self.active_giveaways[giveaway_id] = giveaway
+        # Stocker (indexer le message pour les réactions, armer la fin)
+        self._register_giveaway(giveaway, rendered_count=0)
         
         # Sauvegarder dans la DB
         if self.db:
@@ -348,6 +475,15 @@ class AutoGiveawayManager:
         giveaway: ActiveGiveaway
     ) -> discord.Message:
         """Envoie le message du giveaway"""
+        message = await channel.send(embed=self._build_giveaway_embed(channel, giveaway))
+        return message
+        
+    def _build_giveaway_embed(
+        self, 
+        channel: discord.TextChannel, 
+        giveaway: ActiveGiveaway
+    ) -> discord.Embed:
+        """Embed d'un giveaway en cours (envoi initial et mises à jour du compteur)"""
         reward = giveaway.reward
         
         # Construire la description des récompenses
@@ -378,9 +514,7 @@ class AutoGiveawayManager:
         )
         
         embed.set_footer(text=f"ID: {giveaway.id} • Organisé par Shellia AI")
-        
-        message = await channel.send(embed=embed)
-        return message
+        return embed
         
     async def _announce_milestone(
         self, 
@@ -415,28 +549,27 @@ class AutoGiveawayManager:
         if not giveaway:
             return False
             
-        if giveaway.status != GiveawayStatus.ACTIVE:
+        if giveaway.status != GiveawayStatus.ACTIVE or giveaway_id in self._ending:
             return False
             
         if datetime.utcnow() > giveaway.ends_at:
             return False
             
-        # Vérifier si déjà participé
-        if any(e.user_id == user_id for e in giveaway.entries):
-            return False
-            
         entry = GiveawayEntry(
             user_id=user_id,
             joined_at=datetime.utcnow(),
             message_id=message_id
         )
         
-        giveaway.entries.append(entry)
+        # Refusé si déjà participé (index O(1))
+        if not giveaway.entries.add(entry.user_id, entry.joined_at):
+            return False
         
         # Mettre à jour la DB
         if self.db:
             await self._save_entry(giveaway_id, entry)
-            
+        
+        self._schedule_refresh(giveaway_id)
         return True
         
     async def remove_entry(self, giveaway_id: str, user_id: int) -> bool:
@@ -445,43 +578,69 @@ class AutoGiveawayManager:
         if not giveaway:
             return False
             
-        giveaway.entries = [e for e in giveaway.entries if e.user_id != user_id]
+        # Participations figées dès la fin (tirage en cours)
+        if giveaway.status != GiveawayStatus.ACTIVE or giveaway_id in self._ending:
+            return False
+            
+        if not giveaway.entries.discard(user_id):
+            return True
         
         if self.db:
             await self._remove_entry_db(giveaway_id, user_id)
-            
+        
+        self._schedule_refresh(giveaway_id)
         return True
         
     async def end_giveaway(self, giveaway_id: str, manual: bool = False) -> Optional[ActiveGiveaway]:
-        """Termine un giveaway et tire les gagnants"""
+        """
+        Termine un giveaway et tire les gagnants
+        
+        Reprenable: chaque étape faite est notée, et le tirage est relu dans
+        giveaway_draws s'il existe. Après un échec (nouvel essai planifié par
+        _on_deadline) ou un redémarrage, seules les étapes restantes sont
+        exécutées, avec les mêmes gagnants.
+        """
         giveaway = self.active_giveaways.get(giveaway_id)
-        if not giveaway:
-            return None
-            
-        if giveaway.status == GiveawayStatus.ENDED:
+        if not giveaway or giveaway.status != GiveawayStatus.ACTIVE:
             return giveaway
             
-        # Tirer les gagnants
-        winners = await self._draw_winners(giveaway)
-        giveaway.winners = [w.id for w in winners]
-        giveaway.status = GiveawayStatus.ENDED
-        
-        # Mettre à jour le message
-        await self._update_giveaway_ended(giveaway, winners)
-        
-        # Annoncer les gagnants
-        await self._announce_winners(giveaway, winners)
-        
-        # Attribuer les récompenses
-        await self._distribute_rewards(giveaway, winners)
-        
-        # Mettre à jour la DB
-        if self.db:
-            await self._update_giveaway_status(giveaway_id, GiveawayStatus.ENDED)
+        async with self._end_locks.setdefault(giveaway_id, asyncio.Lock()):
+            if giveaway_id not in self.active_giveaways:
+                return giveaway  # Terminé par un appel concurrent
+                
+            # Clore les participations avant le tirage
+            done = self._ending.setdefault(giveaway_id, set())
             
-        # Nettoyer
-        if giveaway_id in self.active_giveaways:
-            del self.active_giveaways[giveaway_id]
+            if 'draw' not in done:
+                winners = await self._draw_winners(giveaway)
+                giveaway.winners = [w.id for w in winners]
+                done.add('draw')
+            else:
+                winners = self._resolve_members(giveaway.channel_id, giveaway.winners)
+                
+            # Mettre à jour le message
+            if 'message' not in done:
+                await self._update_giveaway_ended(giveaway, winners)
+                done.add('message')
+                
+            # Annoncer les gagnants
+            if 'announce' not in done:
+                await self._announce_winners(giveaway, winners)
+                done.add('announce')
+                
+            # Attribuer les récompenses
+            if 'rewards' not in done:
+                await self._distribute_rewards(giveaway, winners)
+                done.add('rewards')
+                
+            # Mettre à jour la DB (participations écrites avant l'archivage)
+            if self.db:
+                await self.entry_journal.flush()
+                await self._update_giveaway_status(giveaway_id, GiveawayStatus.ENDED)
+                
+            # Nettoyer
+            giveaway.status = GiveawayStatus.ENDED
+            self._unregister_giveaway(giveaway_id)
             
         logger.info(f"Giveaway {giveaway_id} terminé avec {len(winners)} gagnants")
         
@@ -491,35 +650,138 @@ class AutoGiveawayManager:
         self, 
         giveaway: ActiveGiveaway
     ) -> List[discord.Member]:
-        """Tire au sort les gagnants"""
+        """Tire au sort les gagnants (tirage journalisé, rejouable)"""
+        # Déjà tiré (fin reprise après un redémarrage): mêmes gagnants
+        draws = await self._load_draws(giveaway.id)
+        if draws:
+            return self._resolve_members(giveaway.channel_id, draws[0].winners)
+            
         if not giveaway.entries:
             return []
             
-        guild = self.bot.get_guild(giveaway.channel_id)
+        # Le serveur est celui du canal du giveaway
+        channel = self.bot.get_channel(giveaway.channel_id)
+        guild = getattr(channel, 'guild', None)
         if not guild:
             return []
             
-        # Récupérer les membres valides
-        valid_entries = []
-        for entry in giveaway.entries:
-            member = guild.get_member(entry.user_id)
-            if member and not member.bot:
-                valid_entries.append(entry)
-                
-        if not valid_entries:
+        seed = new_seed()
+        result = await self._run_draw(
+            giveaway.id, guild, giveaway.entries, giveaway.reward.winners_count,
+            seed, self.draw_weights, frozenset()
+        )
+        await self._record_draw(DrawRecord(
+            giveaway_id=giveaway.id,
+            round=0,
+            seed=seed,
+            weights=self.draw_weights,
+            winners=result.winners,
+            entries_scanned=result.entries_scanned,
+            eligibility_checks=result.eligibility_checks
+        ))
+        
+        return [result.members[user_id] for user_id in result.winners]
+        
+    def _resolve_members(self, channel_id: int, user_ids: List[int]) -> List[discord.Member]:
+        """Membres encore présents parmi `user_ids` (serveur du canal du giveaway)"""
+        guild = getattr(self.bot.get_channel(channel_id), 'guild', None)
+        if not guild:
             return []
-            
-        # Tirer au sort
-        winners_count = min(giveaway.reward.winners_count, len(valid_entries))
-        winner_entries = random.sample(valid_entries, winners_count)
+        return [member for member in map(guild.get_member, user_ids) if member]
         
-        winners = []
-        for entry in winner_entries:
-            member = guild.get_member(entry.user_id)
-            if member:
-                winners.append(member)
+    async def _run_draw(
+        self,
+        giveaway_id: str,
+        guild: discord.Guild,
+        entries: Optional[EntrySet],
+        count: int,
+        seed: str,
+        weights: DrawWeights,
+        exclude
+    ) -> DrawResult:
+        """
+        Tirage en flux (voir giveaway_draw.ReservoirDraw) hors de la boucle d'événements
+        
+        Depuis l'index en mémoire: un seul passage. Depuis giveaway_entries
+        (reroll, poids par plan / série): page par page, sans jamais charger
+        toutes les participations.
+        """
+        def eligible(user_id: int) -> Optional[discord.Member]:
+            member = guild.get_member(user_id)
+            return member if member and not member.bot else None
+            
+        draw = ReservoirDraw(count, seed, eligible, weights, exclude)
+        if entries is None or (weights.needs_profile and self.db):
+            try:
+                async for page in self._entry_pages(giveaway_id, weights.needs_profile):
+                    await asyncio.to_thread(draw.feed, page)
+                return draw.result()
+            except Exception as e:
+                if entries is None:
+                    raise
+                # Tirage initial: l'index en mémoire suffit (sans plan ni série)
+                logger.warning(f"Participations {giveaway_id} illisibles, tirage depuis la mémoire: {e}")
+                draw = ReservoirDraw(count, seed, eligible, weights, exclude)
                 
-        return winners
+        # Un passage sur des centaines de milliers de participations prend des secondes
+        await asyncio.to_thread(draw.feed, entries.user_ids())
+        return draw.result()
+        
+    async def _entry_pages(self, giveaway_id: str, with_profile: bool):
+        """
+        Participations de giveaway_entries par pages de DRAW_PAGE_SIZE
+        
+        Pagination par clé (user_id > dernier vu, index de la clé primaire):
+        chaque page coûte le même prix, quelle que soit sa position. Avec
+        `with_profile`, chaque participation vient avec le plan et la série.
+        """
+        await self.entry_journal.flush()
+        if with_profile:
+            sql = """
+                SELECT e.user_id, u.plan, s.current_streak
+                FROM giveaway_entries e
+                LEFT JOIN users u ON u.user_id = e.user_id
+                LEFT JOIN user_streaks s ON s.user_id = e.user_id
+                WHERE e.giveaway_id = %s AND e.user_id > %s
+                ORDER BY e.user_id
+                LIMIT %s
+            """
+        else:
+            sql = """
+                SELECT e.user_id
+                FROM giveaway_entries e
+                WHERE e.giveaway_id = %s AND e.user_id > %s
+                ORDER BY e.user_id
+                LIMIT %s
+            """
+            
+        last_user_id = 0
+        while True:
+            rows = await self.db.fetch(sql, (giveaway_id, last_user_id, self.DRAW_PAGE_SIZE))
+            if not rows:
+                return
+            if with_profile:
+                yield [(r['user_id'], r['plan'], r['current_streak']) for r in rows]
+            else:
+                yield [r['user_id'] for r in rows]
+            if len(rows) < self.DRAW_PAGE_SIZE:
+                return
+            last_user_id = rows[-1]['user_id']
+            
+    async def _load_draws(self, giveaway_id: str) -> List[DrawRecord]:
+        """Tirages journalisés d'un giveaway (tour 0: tirage initial, puis rerolls)"""
+        if not self.db:
+            return []
+        # Journal facultatif: illisible, le tirage repart de zéro
+        try:
+            rows = await self.db.fetch(
+                "SELECT * FROM giveaway_draws WHERE giveaway_id = %s ORDER BY round",
+                (giveaway_id,)
+            )
+            return [DrawRecord.from_row(row) for row in rows]
+        except Exception as e:
+            logger.warning(f"Journal des tirages {giveaway_id} illisible: {e}")
+            return []
         
     async def _update_giveaway_ended(
         self, 
@@ -531,10 +793,8 @@ class AutoGiveawayManager:
         if not channel:
             return
             
-        try:
-            message = await channel.fetch_message(giveaway.message_id)
-        except:
-            return
+        # Message partiel: pas de fetch_message avant l'édition
+        message = channel.get_partial_message(giveaway.message_id)
             
         winner_mentions = ", ".join([w.mention for w in winners]) if winners else "Aucun"
         
@@ -552,8 +812,11 @@ class AutoGiveawayManager:
         
         embed.set_footer(text=f"ID: {giveaway.id} • Terminé")
         
-        await message.edit(embed=embed)
-        await message.clear_reactions()
+        try:
+            await message.edit(embed=embed)
+            await message.clear_reactions()
+        except discord.HTTPException:
+            return  # Message supprimé ou permissions manquantes
         
     async def _announce_winners(
         self, 
@@ -629,13 +892,14 @@ class AutoGiveawayManager:
         reward: MilestoneReward
     ):
         """Envoie un MP au gagnant"""
+        role_line = "🏷️ Un nouveau rôle t'a été attribué" if reward.role_reward else ''
         try:
             embed = discord.Embed(
                 title="🎉 Félicitations ! Tu as gagné !",
                 description=(
                     f"Tu as remporté le giveaway du palier **{giveaway.milestone} membres** !\n\n"
                     f"{'💰 Tu as reçu ' + str(reward.currency_reward) + ' coins' if reward.currency_reward else ''}\n"
-                    f"{'🏷️ Un nouveau rôle t\'a été attribué' if reward.role_reward else ''}\n"
+                    f"{role_line}\n"
                     f"{'✨ ' + reward.custom_reward if reward.custom_reward else ''}\n\n"
                     f"Merci de faire partie de cette incroyable communauté ! 💜"
                 ),
@@ -646,44 +910,75 @@ class AutoGiveawayManager:
         except:
             pass  # DM fermés
             
-    async def _update_giveaway_messages_loop(self):
-        """Met à jour les messages des giveaways actifs"""
-        await self.bot.wait_until_ready()
-        
-        while not self.bot.is_closed():
+    async def _on_deadline(self, key):
+        """Échéance du planificateur: fin d'un giveaway ou édition différée"""
+        kind, giveaway_id = key
+        if kind == 'end':
             try:
-                await self._update_active_giveaways()
-            except Exception as e:
-                logger.error(f"Erreur mise à jour giveaways: {e}")
-                
-            await asyncio.sleep(60)  # Mettre à jour chaque minute
-            
-    async def _update_active_giveaways(self):
-        """Met à jour tous les giveaways actifs"""
-        now = datetime.utcnow()
-        
-        for giveaway_id, giveaway in list(self.active_giveaways.items()):
-            # Vérifier si terminé
-            if now >= giveaway.ends_at:
                 await self.end_giveaway(giveaway_id)
-                continue
-                
-            # Mettre à jour le message (compteur participants)
-            await self._refresh_giveaway_message(giveaway)
+                self._end_attempts.pop(giveaway_id, None)
+            except Exception:
+                # Réessayer dans une minute si le giveaway est toujours actif
+                attempts = self._end_attempts.get(giveaway_id, 0) + 1
+                self._end_attempts[giveaway_id] = attempts
+                if giveaway_id in self.active_giveaways:
+                    if attempts < self.MAX_END_ATTEMPTS:
+                        self.scheduler.schedule_in(key, 60)
+                    else:
+                        self._abandon_end(giveaway_id, attempts)
+                raise
+        elif kind == 'refresh':
+            giveaway = self.active_giveaways.get(giveaway_id)
+            if giveaway:
+                await self._refresh_giveaway_message(giveaway)
+            
+    def _abandon_end(self, giveaway_id: str, attempts: int):
+        """
+        Cesse de réessayer la fin d'un giveaway
+        
+        Gagnants déjà annoncés et récompensés: seul l'archivage en base a
+        échoué, le giveaway est terminé en mémoire. Sinon il reste figé
+        (participations closes) jusqu'à une fin manuelle.
+        """
+        done = self._ending.get(giveaway_id, set())
+        if {'draw', 'message', 'announce', 'rewards'} <= done:
+            logger.error(f"Giveaway {giveaway_id}: archivage abandonné après {attempts} essais")
+            self.active_giveaways[giveaway_id].status = GiveawayStatus.ENDED
+            self._unregister_giveaway(giveaway_id)
+        else:
+            logger.error(f"Giveaway {giveaway_id}: fin abandonnée après {attempts} essais")
+            
+    def _schedule_refresh(self, giveaway_id: str):
+        """
+        Planifie l'édition du compteur de participants
+        
+        Une seule édition en attente par giveaway: les réactions suivantes
+        s'y regroupent, d'où au plus une édition par EDIT_DEBOUNCE_SECONDS.
+        """
+        key = ('refresh', giveaway_id)
+        if key not in self.scheduler:
+            self.scheduler.schedule_in(key, self.EDIT_DEBOUNCE_SECONDS)
             
     async def _refresh_giveaway_message(self, giveaway: ActiveGiveaway):
-        """Rafraîchit le message d'un giveaway"""
-        channel = self.bot.get_channel(giveaway.channel_id)
-        if not channel:
+        """Met à jour le compteur du message, seulement s'il a changé"""
+        count = giveaway.entry_count
+        if self._rendered_counts.get(giveaway.id) == count:
             return
             
-        try:
-            message = await channel.fetch_message(giveaway.message_id)
-        except:
+        channel = self.bot.get_channel(giveaway.channel_id)
+        if not channel or not giveaway.message_id:
             return
             
-        # Mettre à jour seulement si le nombre de participants a changé
-        # (pour éviter le rate limiting)
+        # Message partiel: une seule requête (edit), pas de fetch_message
+        try:
+            await channel.get_partial_message(giveaway.message_id).edit(
+                embed=self._build_giveaway_embed(channel, giveaway)
+            )
+            self._rendered_counts[giveaway.id] = count
+        except discord.NotFound:
+            pass  # Message supprimé
+        except discord.HTTPException as e:
+            logger.warning(f"Édition du giveaway {giveaway.id} impossible: {e}")
         
     # ============ COMMANDES DE GESTION ============
     
@@ -697,6 +992,7 @@ class AutoGiveawayManager:
             return False
             
         self.milestones[member_count] = reward
+        self._rebuild_thresholds()
         
         if self.db:
             await self._save_milestone_config(member_count, reward)
@@ -712,6 +1008,7 @@ class AutoGiveawayManager:
             return False  # Ne pas supprimer les paliers par défaut
             
         del self.milestones[member_count]
+        self._rebuild_thresholds()
         
         if self.db:
             await self._remove_milestone_config(member_count)
@@ -751,7 +1048,7 @@ class AutoGiveawayManager:
         channel = self.bot.get_channel(giveaway.channel_id)
         if channel:
             try:
-                message = await channel.fetch_message(giveaway.message_id)
+                message = channel.get_partial_message(giveaway.message_id)
                 embed = discord.Embed(
                     title="❌ GIVEWAY ANNULÉ",
                     description="Ce giveaway a été annulé par un administrateur.",
@@ -763,7 +1060,7 @@ class AutoGiveawayManager:
                 pass
                 
         # Nettoyer
-        del self.active_giveaways[giveaway_id]
+        self._unregister_giveaway(giveaway_id)
         
         if self.db:
             await self._update_giveaway_status(giveaway_id, GiveawayStatus.CANCELLED)
@@ -785,33 +1082,40 @@ class AutoGiveawayManager:
             return []
             
         row = result[0]
-        entries_data = row['entries']
-        
-        # Reconstituer les entrées
-        entries = [GiveawayEntry(**e) for e in entries_data]
         
-        # Exclure les gagnants précédents
-        previous_winners = set(row['winners'])
-        available_entries = [e for e in entries if e.user_id not in previous_winners]
-        
-        if not available_entries:
-            return []
+        # Rejouer le tirage initial (même graine, mêmes poids) en sautant
+        # tous les gagnants déjà désignés: le reroll désigne les suivants
+        draws = await self._load_draws(giveaway_id)
+        excluded = set(row.get('winners') or [])
+        for draw in draws:
+            excluded.update(draw.winners)
+        if draws:
+            seed, weights, round_number = draws[0].seed, draws[0].weights, draws[-1].round + 1
+        else:
+            # Giveaway tiré avant le journal des tirages
+            seed, weights, round_number = new_seed(), self.draw_weights, 1
             
-        # Tirer au sort
-        guild = self.bot.get_guild(row['guild_id'])
+        channel = self.bot.get_channel(row['channel_id'])
+        guild = getattr(channel, 'guild', None) or self.bot.get_guild(row['guild_id'])
         if not guild:
             return []
             
-        winners_count = min(winners_count, len(available_entries))
-        new_winners_entries = random.sample(available_entries, winners_count)
-        
-        new_winners = []
-        for entry in new_winners_entries:
-            member = guild.get_member(entry.user_id)
-            if member:
-                new_winners.append(member)
-                
-        return new_winners
+        result = await self._run_draw(giveaway_id, guild, None, winners_count, seed, weights, excluded)
+        if not result.winners:
+            return []
+            
+        await self._record_draw(DrawRecord(
+            giveaway_id=giveaway_id,
+            round=round_number,
+            seed=seed,
+            weights=weights,
+            winners=result.winners,
+            excluded=sorted(excluded),
+            entries_scanned=result.entries_scanned,
+            eligibility_checks=result.eligibility_checks
+        ))
+        
+        return [result.members[user_id] for user_id in result.winners]
         
     # ============ MÉTHODES DB ============
     
@@ -835,7 +1139,7 @@ class AutoGiveawayManager:
              started_at, ends_at, status)
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             ON CONFLICT (id) DO UPDATE SET
-                entries = EXCLUDED.entries,
+                message_id = EXCLUDED.message_id,
                 status = EXCLUDED.status
             """,
             (
@@ -853,29 +1157,49 @@ class AutoGiveawayManager:
         )
         
     async def _save_entry(self, giveaway_id: str, entry: GiveawayEntry):
-        """Sauvegarde une entrée"""
-        await self.db.execute(
-            """
-            UPDATE active_giveaways 
-            SET entries = entries || %s::jsonb
-            WHERE id = %s
-            """,
-            (json.dumps([entry.to_dict()]), giveaway_id)
-        )
+        """Sauvegarde une entrée (écriture groupée, voir EntryJournal)"""
+        self.entry_journal.record_add(giveaway_id, entry.user_id, entry.joined_at)
         
     async def _remove_entry_db(self, giveaway_id: str, user_id: int):
-        """Supprime une entrée de la DB"""
+        """Supprime une entrée de la DB (écriture groupée)"""
+        self.entry_journal.record_remove(giveaway_id, user_id)
+        
+    async def _record_draw(self, record: DrawRecord):
+        """Journalise un tirage (graine, poids, gagnants): rejouable et vérifiable"""
+        logger.info(
+            f"Tirage {record.giveaway_id}#{record.round}: graine {record.seed}, "
+            f"{len(record.winners)} gagnants, {record.entries_scanned} participations"
+        )
+        if not self.db:
+            return
+            
+        # Journal facultatif: un échec n'empêche pas d'annoncer les gagnants
+        try:
+            await self._insert_draw(record)
+        except Exception as e:
+            logger.warning(f"Tirage {record.giveaway_id}#{record.round} non journalisé: {e}")
+            
+    async def _insert_draw(self, record: DrawRecord):
+        """Insère un tirage dans giveaway_draws"""
         await self.db.execute(
             """
-            UPDATE active_giveaways 
-            SET entries = (
-                SELECT jsonb_agg(e)
-                FROM jsonb_array_elements(entries) AS e
-                WHERE (e->>'user_id')::bigint != %s
-            )
-            WHERE id = %s
+            INSERT INTO giveaway_draws
+            (giveaway_id, round, seed, algorithm, weights, winners, excluded,
+             entries_scanned, eligibility_checks, drawn_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             """,
-            (user_id, giveaway_id)
+            (
+                record.giveaway_id,
+                record.round,
+                record.seed,
+                record.algorithm,
+                json.dumps(record.weights.to_dict()),
+                record.winners,
+                record.excluded,
+                record.entries_scanned,
+                record.eligibility_checks,
+                record.drawn_at
+            )
         )
         
     async def _update_giveaway_status(
@@ -922,7 +1246,10 @@ class AutoGiveawayManager:
     def _row_to_giveaway(self, row: dict) -> ActiveGiveaway:
         """Convertit une ligne DB en objet ActiveGiveaway"""
         reward_data = json.loads(row['reward'])
-        entries_data = json.loads(row.get('entries', '[]'))
+        # Colonne JSONB legacy: vide depuis giveaway_entries, lue pour les anciennes lignes
+        entries_data = row.get('entries') or []
+        if isinstance(entries_data, str):
+            entries_data = json.loads(entries_data)
         
         return ActiveGiveaway(
             id=row['id'],
@@ -933,7 +1260,7 @@ class AutoGiveawayManager:
             host_id=row['host_id'],
             started_at=row['started_at'],
             ends_at=row['ends_at'],
-            entries=[GiveawayEntry(**e) for e in entries_data],
+            entries=EntrySet(GiveawayEntry.from_dict(e) for e in entries_data),
             status=GiveawayStatus(row['status']),
             winners=row.get('winners', [])
         )
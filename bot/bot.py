@@ -11,10 +11,13 @@ import discord
 from discord.ext import commands, tasks
 from discord import app_commands
 
-from config import EnvConfig, SecurityConfig, PLANS, ChannelConfig, StreakConfig
+from config import EnvConfig, SecurityConfig, PLANS, ChannelConfig, ModelConfig
 from supabase_client import SupabaseDB
+from async_supabase_client import AsyncSupabaseDB
 from security import SecurityManager
 from ai_engine import AIManager
+from ai_scheduler import AIScheduler
+from discord_streaming import DiscordStreamRenderer
 
 
 class ShelliaBot(commands.Bot):
@@ -33,8 +36,14 @@ class ShelliaBot(commands.Bot):
         )
         
         self.db = SupabaseDB()
+        self.async_db = AsyncSupabaseDB()
         self.security = SecurityManager(self.db)
-        self.ai = AIManager(EnvConfig.GEMINI_API_KEY, self.db)
+        self.ai = AIManager(
+            EnvConfig.GEMINI_API_KEY,
+            self.db,
+            cost_ledger=self.async_db.cost_ledger,
+            scheduler=AIScheduler(model_budgets=ModelConfig.TOKENS_PER_MINUTE)
+        )
         
         self.created_roles = {}
     
@@ -42,6 +51,9 @@ class ShelliaBot(commands.Bot):
         """Setup initial"""
         print(f'✅ Bot connecté: {self.user}')
         
+        # Pool HTTP asynchrone vers Supabase
+        await self.async_db.connect()
+        
         # Sync commandes
         try:
             synced = await self.tree.sync()
@@ -52,6 +64,11 @@ class ShelliaBot(commands.Bot):
         # Démarrer tâches
         self.daily_reset.start()
     
+    async def close(self):
+        """Arrêt propre: ferme le pool HTTP Supabase"""
+        await self.async_db.close()
+        await super().close()
+    
     async def on_ready(self):
         """Bot prêt"""
         await self.change_presence(
@@ -181,7 +198,7 @@ class ShelliaBot(commands.Bot):
     async def on_member_join(self, member: discord.Member):
         """Nouveau membre"""
         # Créer en base
-        self.db.get_or_create_user(
+        await self.async_db.get_or_create_user(
             member.id,
             member.name,
             discriminator=str(member.discriminator) if hasattr(member, 'discriminator') else None,
@@ -249,25 +266,24 @@ class ShelliaBot(commands.Bot):
             await message.reply(error, delete_after=10)
             return
         
-        # Récupérer utilisateur
-        user_data = self.db.get_or_create_user(user_id, str(message.author))
+        # Admission: utilisateur, quota et streak en un seul aller-retour
+        admission = await self.async_db.admit_message(user_id, str(message.author), bypass_quota=is_admin)
+        user_data = admission['user']
         user_plan = user_data['plan']
         plan_config = PLANS.get(user_plan, PLANS['free'])
         
-        # Vérifier quota
-        quota = self.db.get_daily_quota(user_id)
+        quota = admission['quota']
         quota_limit = quota['messages_limit'] + quota.get('streak_bonus', 0)
         
-        if quota['messages_used'] >= quota_limit and not is_admin:
+        if not admission['admitted']:
             embed = self._quota_exhausted_embed(user_plan, plan_config)
             await message.reply(embed=embed)
             return
         
-        # Mettre à jour streak
-        streak_info = self.db.update_streak(user_id)
+        # Palier de streak atteint
+        streak_info = admission['streak']
         if streak_info['is_new_milestone']:
-            bonus = StreakConfig.BONUS.get(streak_info['current_streak'], 0)
-            self.db.add_streak_bonus(user_id, bonus)
+            bonus = streak_info['bonus']
             
             embed = discord.Embed(
                 title=f"{streak_info.get('badge', {}).get('emoji', '🔥')} Streak {streak_info['current_streak']} jours !",
@@ -276,46 +292,45 @@ class ShelliaBot(commands.Bot):
             )
             await message.reply(embed=embed, delete_after=30)
         
-        # Générer réponse
-        async with message.channel.typing():
-            response = await self.ai.process_message(
-                user_id=user_id,
-                content=content,
-                flash_ratio=plan_config.flash_ratio,
-                pro_ratio=plan_config.pro_ratio
-            )
+        # Générer réponse (streamée dans un message édité progressivement)
+        renderer = DiscordStreamRenderer(message)
+        await renderer.start()
+        response = await self.ai.process_message(
+            user_id=user_id,
+            content=content,
+            flash_ratio=plan_config.flash_ratio,
+            pro_ratio=plan_config.pro_ratio,
+            plan=user_plan,
+            on_text=renderer.update,
+            priority=plan_config.support_priority
+        )
         
         # Logger
-        self.db.log_security_event(user_id, 'message_processed', {
+        await self.async_db.log_security_event(user_id, 'message_processed', {
             'model': response.model_used,
             'cost': response.cost_usd,
             'success': response.success
         })
         
-        # Mettre à jour quota
+        # Mettre à jour quota (retourne le quota à jour, pas de relecture)
         if response.success:
-            self.db.increment_quota_usage(
+            quota = await self.async_db.commit_usage(
                 user_id=user_id,
                 tokens=response.tokens_input + response.tokens_output,
                 cost=response.cost_usd
             )
         
-        # Envoyer réponse
+        # Finaliser la réponse
         if response.success:
-            if len(response.content) > 2000:
-                for i in range(0, len(response.content), 1900):
-                    await message.channel.send(response.content[i:i+1900])
-            else:
-                await message.reply(response.content)
+            await renderer.finish(response.content)
         else:
-            await message.reply(f"❌ {response.error or 'Erreur'}")
+            await renderer.fail(f"❌ {response.error or 'Erreur'}")
         
         # Notification 80%
         if not is_admin:
-            new_quota = self.db.get_daily_quota(user_id)
-            usage = new_quota['messages_used'] / quota_limit
+            usage = quota['messages_used'] / quota_limit
             if 0.8 <= usage < 1.0:
-                remaining = quota_limit - new_quota['messages_used']
+                remaining = quota_limit - quota['messages_used']
                 embed = self._quota_80_embed(user_plan, remaining)
                 await message.reply(embed=embed, delete_after=60)
     
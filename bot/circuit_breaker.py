@@ -5,13 +5,20 @@ Protection contre les cascades de défaillance pour les appels API
 
 import time
 import asyncio
+from collections import deque
 from enum import Enum
-from typing import Optional, Callable, Any, Dict
+from typing import Optional, Callable, Any, Deque, Dict, Tuple
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from functools import wraps
 import random
 
+try:
+    from deadline import DeadlineExceeded, current_deadline
+    DEADLINE_AVAILABLE = True
+except ImportError:
+    DEADLINE_AVAILABLE = False
+
 
 class CircuitState(Enum):
     """États du circuit breaker"""
@@ -20,10 +27,17 @@ class CircuitState(Enum):
     HALF_OPEN = "half_open" # Test de récupération
 
 
+class CircuitMode(Enum):
+    """Critère d'ouverture du circuit"""
+    CONSECUTIVE = "consecutive"         # N échecs consécutifs
+    SLIDING_WINDOW = "sliding_window"   # Taux d'échecs / d'appels lents sur une fenêtre glissante
+
+
 @dataclass
 class CircuitBreakerConfig:
     """Configuration du circuit breaker"""
-    failure_threshold: int = 5           # Nombre d'échecs avant ouverture
+    mode: CircuitMode = CircuitMode.CONSECUTIVE
+    failure_threshold: int = 5           # Nombre d'échecs avant ouverture (CONSECUTIVE)
     success_threshold: int = 3           # Nombre de succès pour fermeture
     timeout_seconds: float = 60.0        # Temps avant tentative half-open
     half_open_max_calls: int = 3         # Max appels en half-open
@@ -36,6 +50,115 @@ class CircuitBreakerConfig:
     
     # Timeout des appels
     call_timeout: float = 30.0
+    
+    # Fenêtre glissante (SLIDING_WINDOW)
+    window_seconds: float = 60.0         # Durée de la fenêtre
+    bucket_seconds: float = 5.0          # Granularité (un compteur par tranche)
+    minimum_calls: int = 10              # Appels avant de juger les taux
+    failure_rate_threshold: float = 0.5  # Ouverture au-delà de ce taux d'échecs
+    slow_call_seconds: float = 10.0      # Appel réussi mais lent au-delà
+    slow_call_rate_threshold: float = 0.8
+    
+    # Historique des changements d'état gardé
+    max_state_changes: int = 50
+
+
+class SlidingWindow:
+    """
+    Compteurs par tranches de temps (anneau de taille fixe)
+    
+    Mémoire constante quel que soit le débit: une tranche expirée est
+    remise à zéro quand son emplacement est réutilisé.
+    """
+    
+    def __init__(self, window_seconds: float, bucket_seconds: float):
+        self.bucket_seconds = bucket_seconds
+        self.size = max(1, int(round(window_seconds / bucket_seconds)))
+        self._epochs = [-1] * self.size
+        self._calls = [0] * self.size
+        self._failures = [0] * self.size
+        self._slow = [0] * self.size
+    
+    def record(self, now: float, failed: bool, slow: bool):
+        epoch = int(now // self.bucket_seconds)
+        i = epoch % self.size
+        if self._epochs[i] != epoch:
+            self._epochs[i] = epoch
+            self._calls[i] = self._failures[i] = self._slow[i] = 0
+        self._calls[i] += 1
+        self._failures[i] += failed
+        self._slow[i] += slow
+    
+    def totals(self, now: float) -> Tuple[int, int, int]:
+        """(appels, échecs, appels lents) sur la fenêtre"""
+        oldest = int(now // self.bucket_seconds) - self.size + 1
+        calls = failures = slow = 0
+        for i in range(self.size):
+            if self._epochs[i] >= oldest:
+                calls += self._calls[i]
+                failures += self._failures[i]
+                slow += self._slow[i]
+        return calls, failures, slow
+    
+    def reset(self):
+        self._epochs = [-1] * self.size
+
+
+class RetryBudget:
+    """
+    Budget de retries partagé (tous circuits confondus)
+    
+    Les retries sont limités à `ratio` des appels de la fenêtre, plus un
+    plancher de `min_per_second`: pendant une panne, ils ne peuvent pas
+    multiplier la charge envoyée au service qui souffre.
+    """
+    
+    def __init__(
+        self,
+        ratio: float = 0.1,
+        min_per_second: float = 1.0,
+        window_seconds: float = 10.0,
+        bucket_seconds: float = 1.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.ratio = ratio
+        self.min_retries = min_per_second * window_seconds
+        self.clock = clock
+        self._requests = SlidingWindow(window_seconds, bucket_seconds)
+        self._retries = SlidingWindow(window_seconds, bucket_seconds)
+        
+        # Statistiques
+        self.granted = 0
+        self.denied = 0
+    
+    def record_request(self):
+        """Un appel logique (première tentative)"""
+        self._requests.record(self.clock(), False, False)
+    
+    def try_spend(self) -> bool:
+        """Autorise (et compte) un retry si le budget le permet"""
+        now = self.clock()
+        requests = self._requests.totals(now)[0]
+        retries = self._retries.totals(now)[0]
+        if retries >= self.ratio * requests + self.min_retries:
+            self.denied += 1
+            return False
+        self._retries.record(now, False, False)
+        self.granted += 1
+        return True
+    
+    def get_stats(self) -> Dict:
+        now = self.clock()
+        return {
+            'requests': self._requests.totals(now)[0],
+            'retries': self._retries.totals(now)[0],
+            'granted': self.granted,
+            'denied': self.denied,
+        }
+
+
+# Budget par défaut de tous les circuits
+GLOBAL_RETRY_BUDGET = RetryBudget()
 
 
 @dataclass
@@ -49,35 +172,60 @@ class CircuitStats:
     consecutive_failures: int = 0
     last_failure_time: Optional[datetime] = None
     last_success_time: Optional[datetime] = None
-    state_changes: list = field(default_factory=list)
+    retried_attempts: int = 0            # Tentatives supplémentaires (retries)
+    retries_denied: int = 0              # Retries refusés (budget ou échéance)
+    slow_calls: int = 0
+    state_changes: Deque = field(default_factory=deque)
 
 
 class CircuitBreaker:
     """
     Circuit breaker pour protéger les appels API
     Pattern: https://martinfowler.com/bliki/CircuitBreaker.html
+    
+    Un appel et ses retries comptent pour un seul appel logique: un succès
+    si une tentative réussit, sinon un échec. En mode SLIDING_WINDOW, le
+    circuit s'ouvre sur le taux d'échecs ou d'appels lents de la fenêtre,
+    dès `minimum_calls` appels.
     """
     
     def __init__(
         self,
         name: str,
         config: Optional[CircuitBreakerConfig] = None,
-        on_state_change: Optional[Callable] = None
+        on_state_change: Optional[Callable] = None,
+        retry_budget: Optional[RetryBudget] = None
     ):
         self.name = name
         self.config = config or CircuitBreakerConfig()
         self.on_state_change = on_state_change
+        self.retry_budget = retry_budget or GLOBAL_RETRY_BUDGET
         
         self.state = CircuitState.CLOSED
-        self.stats = CircuitStats()
+        self.stats = self._new_stats()
+        self.window = SlidingWindow(self.config.window_seconds, self.config.bucket_seconds)
         self._half_open_calls = 0
         self._state_changed_at: Optional[datetime] = None
         self._lock = asyncio.Lock()
     
+    def _new_stats(self) -> CircuitStats:
+        return CircuitStats(state_changes=deque(maxlen=self.config.max_state_changes))
+    
     @property
     def current_state(self) -> str:
         return self.state.value
     
+    def allows_request(self) -> bool:
+        """Un appel serait-il accepté maintenant ? (sans changer d'état)"""
+        if self.state == CircuitState.CLOSED:
+            return True
+        if self.state == CircuitState.OPEN:
+            if not self._state_changed_at:
+                return False
+            elapsed = (datetime.now() - self._state_changed_at).total_seconds()
+            return elapsed >= self.config.timeout_seconds
+        return self._half_open_calls < self.config.half_open_max_calls
+    
     async def call(self, func: Callable, *args, **kwargs) -> Any:
         """
         Exécute une fonction protégée par le circuit breaker
@@ -90,11 +238,29 @@ class CircuitBreaker:
                     f"Circuit '{self.name}' is OPEN - too many failures"
                 )
             
+            # Créneau de test en half-open (rattaché à cette période half-open)
+            probe_period = None
             if self.state == CircuitState.HALF_OPEN:
                 self._half_open_calls += 1
+                probe_period = self._state_changed_at
         
         # Exécuter avec retry
-        return await self._execute_with_retry(func, *args, **kwargs)
+        try:
+            return await self._execute_with_retry(func, *args, **kwargs)
+        finally:
+            # Toujours rendre le créneau: une sortie sans verdict (échéance,
+            # tentative annulée par le hedging) bloquerait sinon le circuit
+            if probe_period is not None:
+                await self._release_half_open_slot(probe_period)
+    
+    async def _release_half_open_slot(self, probe_period: Optional[datetime]):
+        async with self._lock:
+            if (
+                self.state == CircuitState.HALF_OPEN
+                and self._state_changed_at == probe_period
+                and self._half_open_calls > 0
+            ):
+                self._half_open_calls -= 1
     
     async def _can_execute(self) -> bool:
         """Vérifie si l'appel peut être exécuté selon l'état"""
@@ -120,35 +286,65 @@ class CircuitBreaker:
         return False
     
     async def _execute_with_retry(self, func: Callable, *args, **kwargs) -> Any:
-        """Exécute avec retry exponentiel"""
+        """
+        Exécute avec retry exponentiel (un seul appel logique)
+        
+        Chaque tentative est bornée par l'échéance de la requête en cours;
+        un retry n'est tenté que si le temps restant couvre le backoff et
+        que le budget global de retries le permet.
+        """
         last_error = None
+        started = time.monotonic()
+        deadline = current_deadline() if DEADLINE_AVAILABLE else None
+        if deadline is not None:
+            deadline.check()
+        self.retry_budget.record_request()
+        
+        # En half-open, une seule tentative: ne pas insister sur un service qui récupère
+        max_retries = 0 if self.state == CircuitState.HALF_OPEN else self.config.max_retries
         
-        for attempt in range(self.config.max_retries + 1):
+        for attempt in range(max_retries + 1):
+            timeout = self.config.call_timeout
+            if deadline is not None:
+                timeout = deadline.timeout(timeout)
+            
             try:
                 # Timeout sur l'appel
                 result = await asyncio.wait_for(
                     self._execute_async(func, *args, **kwargs),
-                    timeout=self.config.call_timeout
+                    timeout=timeout
                 )
                 
                 # Succès
-                await self._on_success()
+                await self._on_success(time.monotonic() - started)
                 return result
                 
-            except asyncio.TimeoutError:
-                last_error = TimeoutError(f"Call timed out after {self.config.call_timeout}s")
-                await self._on_failure()
+            except asyncio.TimeoutError as e:
+                if DEADLINE_AVAILABLE and isinstance(e, DeadlineExceeded):
+                    # Échéance atteinte dans l'appel lui-même: pas un échec du service
+                    raise
+                if deadline is not None and deadline.expired and timeout < self.config.call_timeout:
+                    # Coupé par l'échéance de la requête: pas un échec du service
+                    raise DeadlineExceeded() from None
+                last_error = TimeoutError(f"Call timed out after {timeout:.1f}s")
                 
             except Exception as e:
                 last_error = e
-                await self._on_failure()
             
             # Calculer le délai avant retry
-            if attempt < self.config.max_retries:
+            if attempt < max_retries:
                 delay = self._calculate_backoff(attempt)
+                if deadline is not None and deadline.remaining() <= delay:
+                    self.stats.retries_denied += 1
+                    break
+                if not self.retry_budget.try_spend():
+                    self.stats.retries_denied += 1
+                    break
+                self.stats.retried_attempts += 1
                 await asyncio.sleep(delay)
         
         # Tous les retries ont échoué
+        await self._on_failure()
         raise last_error
     
     async def _execute_async(self, func: Callable, *args, **kwargs) -> Any:
@@ -168,21 +364,28 @@ class CircuitBreaker:
         jitter = delay * 0.25 * (2 * random.random() - 1)
         return delay + jitter
     
-    async def _on_success(self):
-        """Appelé lors d'un succès"""
+    async def _on_success(self, duration: float = 0.0):
+        """Appelé lors d'un succès (appel logique)"""
         async with self._lock:
+            slow = duration >= self.config.slow_call_seconds
             self.stats.total_calls += 1
             self.stats.successful_calls += 1
+            self.stats.slow_calls += slow
             self.stats.consecutive_successes += 1
             self.stats.consecutive_failures = 0
             self.stats.last_success_time = datetime.now()
             
+            if self.config.mode == CircuitMode.SLIDING_WINDOW:
+                self.window.record(time.monotonic(), False, slow)
+            
             if self.state == CircuitState.HALF_OPEN:
                 if self.stats.consecutive_successes >= self.config.success_threshold:
                     await self._transition_to(CircuitState.CLOSED)
+            elif self.state == CircuitState.CLOSED and slow and self._window_tripped():
+                await self._transition_to(CircuitState.OPEN)
     
     async def _on_failure(self):
-        """Appelé lors d'un échec"""
+        """Appelé lors d'un échec (appel logique, retries épuisés)"""
         async with self._lock:
             self.stats.total_calls += 1
             self.stats.failed_calls += 1
@@ -190,13 +393,32 @@ class CircuitBreaker:
             self.stats.consecutive_successes = 0
             self.stats.last_failure_time = datetime.now()
             
+            if self.config.mode == CircuitMode.SLIDING_WINDOW:
+                self.window.record(time.monotonic(), True, False)
+            
             if self.state == CircuitState.HALF_OPEN:
                 # Retour en OPEN immédiatement
                 await self._transition_to(CircuitState.OPEN)
             elif self.state == CircuitState.CLOSED:
-                if self.stats.consecutive_failures >= self.config.failure_threshold:
+                if self.config.mode == CircuitMode.SLIDING_WINDOW:
+                    tripped = self._window_tripped()
+                else:
+                    tripped = self.stats.consecutive_failures >= self.config.failure_threshold
+                if tripped:
                     await self._transition_to(CircuitState.OPEN)
     
+    def _window_tripped(self) -> bool:
+        """Taux d'échecs ou d'appels lents au-delà des seuils (SLIDING_WINDOW)"""
+        if self.config.mode != CircuitMode.SLIDING_WINDOW:
+            return False
+        calls, failures, slow = self.window.totals(time.monotonic())
+        if calls < self.config.minimum_calls:
+            return False
+        return (
+            failures / calls >= self.config.failure_rate_threshold
+            or slow / calls >= self.config.slow_call_rate_threshold
+        )
+    
     async def _transition_to(self, new_state: CircuitState):
         """Transition vers un nouvel état"""
         if self.state == new_state:
@@ -211,6 +433,7 @@ class CircuitBreaker:
             self.stats.consecutive_failures = 0
             self.stats.consecutive_successes = 0
             self._half_open_calls = 0
+            self.window.reset()  # Repartir d'une fenêtre propre
         elif new_state == CircuitState.HALF_OPEN:
             self._half_open_calls = 0
             self.stats.consecutive_successes = 0
@@ -240,23 +463,38 @@ class CircuitBreaker:
         if self.stats.total_calls > 0:
             success_rate = (self.stats.successful_calls / self.stats.total_calls) * 100
         
-        return {
+        stats = {
             'name': self.name,
+            'mode': self.config.mode.value,
             'state': self.state.value,
             'total_calls': self.stats.total_calls,
             'successful': self.stats.successful_calls,
             'failed': self.stats.failed_calls,
             'rejected': self.stats.rejected_calls,
             'success_rate': f"{success_rate:.1f}%",
+            'slow_calls': self.stats.slow_calls,
+            'retried_attempts': self.stats.retried_attempts,
+            'retries_denied': self.stats.retries_denied,
             'consecutive_failures': self.stats.consecutive_failures,
             'state_changed_at': self._state_changed_at.isoformat() if self._state_changed_at else None,
-            'state_changes': self.stats.state_changes[-10:]  # 10 derniers changements
+            'state_changes': list(self.stats.state_changes)[-10:]  # 10 derniers changements
         }
+        
+        if self.config.mode == CircuitMode.SLIDING_WINDOW:
+            calls, failures, slow = self.window.totals(time.monotonic())
+            stats['window'] = {
+                'calls': calls,
+                'failure_rate': failures / calls if calls else 0.0,
+                'slow_call_rate': slow / calls if calls else 0.0,
+            }
+        
+        return stats
     
     def reset(self):
         """Reset le circuit breaker"""
         self.state = CircuitState.CLOSED
-        self.stats = CircuitStats()
+        self.stats = self._new_stats()
+        self.window.reset()
         self._half_open_calls = 0
         self._state_changed_at = None
 
@@ -283,6 +521,21 @@ class CircuitBreakerRegistry:
             cls._breakers[name] = CircuitBreaker(name, config, **kwargs)
         return cls._breakers[name]
     
+    @classmethod
+    def for_endpoint(
+        cls,
+        service: str,
+        endpoint: str,
+        config: Optional[CircuitBreakerConfig] = None,
+        **kwargs
+    ) -> CircuitBreaker:
+        """
+        Circuit propre à un modèle / endpoint ("gemini:gemini-2.5-pro")
+        
+        Une panne d'un modèle n'ouvre pas le circuit des autres.
+        """
+        return cls.get_or_create(f"{service}:{endpoint}", config, **kwargs)
+    
     @classmethod
     def get(cls, name: str) -> Optional[CircuitBreaker]:
         """Récupère un circuit breaker existant"""
@@ -0,0 +1,203 @@
+"""
+CLASSIFIEUR DE COMPLEXITÉ - Shellia AI Bot
+Score de complexité d'un message (automates précompilés) pour le smart routing, évaluation hors ligne
+"""
+
+import random
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+
+# Mots qui signalent une demande élaborée (recherche par sous-chaîne, sans casse)
+COMPLEX_INDICATORS = (
+    'explique', 'détaille', 'analyse', 'compare', 'différence',
+    'pourquoi', 'comment', 'optimise', 'améliore', 'résous',
+    'code', 'programme', 'script', 'fonction', 'algorithme'
+)
+
+
+def _trie_pattern(words) -> str:
+    """
+    Alternation factorisée par préfixes ('co(?:de|m(?:ment|pare))')
+
+    Le moteur de re de CPython essaie chaque branche d'une alternation
+    plate à chaque position; factorisée, une position qui ne commence
+    aucun mot est écartée sur son premier caractère.
+    """
+    groups: Dict[str, list] = {}
+    terminal = False
+    for word in words:
+        if not word:
+            terminal = True
+            continue
+        groups.setdefault(word[0], []).append(word[1:])
+
+    branches = [re.escape(ch) + _trie_pattern(rest) for ch, rest in sorted(groups.items())]
+    if not branches:
+        return ''
+    if len(branches) == 1 and not terminal:
+        return branches[0]
+    return '(?:' + '|'.join(branches) + ')' + ('?' if terminal else '')
+
+
+# Automates précompilés (le texte est mis en minuscules une seule fois)
+_INDICATORS_RE = re.compile(_trie_pattern(COMPLEX_INDICATORS))
+_MATH_RE = re.compile(r"[+=*/^$%#]")
+
+
+@dataclass
+class ComplexityFeatures:
+    """Signaux extraits d'un message et score (0-1)"""
+    length: int
+    code: bool
+    indicator: bool
+    non_ascii: bool
+    math: bool
+    score: float
+
+    @property
+    def vector(self) -> Tuple[float, ...]:
+        """Vecteur de features (longueur normalisée sur 1000 caractères)"""
+        return (
+            min(self.length / 1000, 1.0),
+            float(self.code),
+            float(self.indicator),
+            float(self.non_ascii),
+            float(self.math),
+        )
+
+
+class ComplexityClassifier:
+    """
+    Classifieur de complexité pour le choix du modèle
+
+    Chaque signal est calculé une fois, en C: une mise en minuscules (au
+    lieu d'une par indicateur), un automate précompilé pour les
+    indicateurs, isascii() et une classe de caractères pour le reste.
+    Mêmes pondérations que l'ancien AIManager._analyze_complexity.
+    """
+
+    def classify(self, content: str) -> ComplexityFeatures:
+        length = len(content)
+        code = '`' in content
+        indicator = _INDICATORS_RE.search(content.lower()) is not None
+        non_ascii = not content.isascii()
+        math = _MATH_RE.search(content) is not None
+
+        score = 0.0
+        if length > 500:
+            score += 0.2
+        if length > 1000:
+            score += 0.1
+        if code:
+            score += 0.2
+        if indicator:
+            score += 0.1
+        if non_ascii:
+            score += 0.1
+        if math:
+            score += 0.1
+
+        return ComplexityFeatures(
+            length=length,
+            code=code,
+            indicator=indicator,
+            non_ascii=non_ascii,
+            math=math,
+            score=min(score, 1.0)
+        )
+
+
+def select_tier(score: float, flash_ratio: float, pro_ratio: float, rand: float) -> str:
+    """
+    Niveau de modèle: 'pro', 'flash' ou 'lite'
+
+    `rand` (uniforme dans [0, 1)) répartit le trafic selon les ratios du plan.
+    """
+    # Pro pour messages très complexes
+    if score > 0.8 and pro_ratio > 0 and rand < pro_ratio:
+        return 'pro'
+
+    # Flash pour messages moyennement complexes
+    if score > 0.4 and flash_ratio > 0 and rand < flash_ratio:
+        return 'flash'
+
+    # Par défaut: Flash-Lite (le moins cher)
+    return 'lite'
+
+
+# ============================================================================
+# ÉVALUATION HORS LIGNE
+# ============================================================================
+
+def evaluate_routing(
+    messages: Iterable[Tuple[str, str]],
+    plans: Dict,
+    tier_models: Dict[str, str],
+    costs: Dict[str, Dict[str, float]],
+    output_tokens: int = 300,
+    seed: int = 0,
+    classifier: Optional[ComplexityClassifier] = None
+) -> Dict:
+    """
+    Rejoue des messages (contenu, plan) dans le routage
+
+    Args:
+        plans: config.PLANS (flash_ratio / pro_ratio par plan)
+        tier_models: niveau -> nom du modèle (ModelConfig.TIERS)
+        costs: prix par million de tokens (ModelConfig.COSTS)
+        output_tokens: longueur de réponse supposée pour l'estimation de coût
+
+    Returns:
+        Répartition par modèle, coût estimé, distribution des scores et
+        débit du classifieur (messages/s, classification seule)
+    """
+    classifier = classifier or ComplexityClassifier()
+    rng = random.Random(seed)
+    messages = list(messages)
+
+    # Débit: classification seule, mesurée à part
+    started = time.perf_counter()
+    features = [classifier.classify(content) for content, _ in messages]
+    elapsed = time.perf_counter() - started
+
+    mix: Counter = Counter()
+    cost_by_model: Dict[str, float] = Counter()
+    feature_hits: Counter = Counter()
+
+    for (content, plan_name), f in zip(messages, features):
+        plan = plans.get(plan_name) or plans.get('free')
+        tier = select_tier(f.score, plan.flash_ratio, plan.pro_ratio, rng.random())
+        model = tier_models[tier]
+        mix[model] += 1
+
+        price = costs[model]
+        cost_by_model[model] += (len(content) / 4 * price['input'] + output_tokens * price['output']) / 1_000_000
+
+        for name in ('code', 'indicator', 'non_ascii', 'math'):
+            feature_hits[name] += getattr(f, name)
+
+    total = len(messages)
+    scores = sorted(f.score for f in features)
+    total_cost = sum(cost_by_model.values())
+
+    return {
+        'messages': total,
+        'mix': {
+            model: {'count': count, 'share': count / total, 'cost_usd': cost_by_model[model]}
+            for model, count in mix.most_common()
+        },
+        'estimated_cost_usd': total_cost,
+        'cost_per_1k_messages': total_cost / total * 1000 if total else 0.0,
+        'score': {
+            'mean': sum(scores) / total if total else 0.0,
+            'p50': scores[total // 2] if total else 0.0,
+            'above_0.4': sum(s > 0.4 for s in scores) / total if total else 0.0,
+            'above_0.8': sum(s > 0.8 for s in scores) / total if total else 0.0,
+        },
+        'feature_rates': {name: hits / total for name, hits in feature_hits.items()} if total else {},
+        'classifier_per_second': total / elapsed if elapsed > 0 else float('inf'),
+    }
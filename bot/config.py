@@ -22,6 +22,9 @@ class EnvConfig:
     
     # Gemini
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+    IMAGE_STORE_DIR = os.getenv('IMAGE_STORE_DIR', 'data/images')
+    IMAGE_STORE_MAX_MB = int(os.getenv('IMAGE_STORE_MAX_MB', 500))
     
     # Stripe (optionnel)
     STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
@@ -41,6 +44,9 @@ class SecurityConfig:
     SPAM_THRESHOLD = 5
     AUTO_BAN_WARNINGS = 3
     
+    # Échéance d'un message IA, de l'admission à la réponse (secondes)
+    AI_REQUEST_DEADLINE = 45
+    
     # Rôles Discord à créer
     ROLES = {
         'ADMIN': {
@@ -117,6 +123,9 @@ class Plan:
     streak_multiplier: float
     referral_multiplier: float
     discord_role: str = None
+    # Rate limiting (moteur GCRA, voir rate_limit_engine.py)
+    messages_per_minute: int = 10
+    messages_per_hour: int = 100
 
 
 PLANS = {
@@ -128,7 +137,8 @@ PLANS = {
         history_days=1, can_export=False, can_upload=False, max_file_size=0,
         can_generate_images=False, image_quota=0,
         support_priority='community', streak_multiplier=1.0, referral_multiplier=1.0,
-        discord_role='USER'
+        discord_role='USER',
+        messages_per_minute=10, messages_per_hour=100
     ),
     'basic': Plan(
         name='Basic', price_monthly=4.99, price_yearly=47.90,
@@ -138,7 +148,8 @@ PLANS = {
         history_days=7, can_export=False, can_upload=True, max_file_size=5,
         can_generate_images=False, image_quota=0,
         support_priority='normal', streak_multiplier=1.0, referral_multiplier=1.0,
-        discord_role='PREMIUM'
+        discord_role='PREMIUM',
+        messages_per_minute=15, messages_per_hour=200
     ),
     'pro': Plan(
         name='Pro', price_monthly=9.99, price_yearly=95.90,
@@ -148,7 +159,8 @@ PLANS = {
         history_days=30, can_export=True, can_upload=True, max_file_size=25,
         can_generate_images=True, image_quota=10,
         support_priority='priority', streak_multiplier=1.5, referral_multiplier=1.5,
-        discord_role='PREMIUM'
+        discord_role='PREMIUM',
+        messages_per_minute=20, messages_per_hour=300
     ),
     'ultra': Plan(
         name='Ultra', price_monthly=29.99, price_yearly=287.90,
@@ -158,7 +170,8 @@ PLANS = {
         history_days=365, can_export=True, can_upload=True, max_file_size=100,
         can_generate_images=True, image_quota=50,
         support_priority='vip', streak_multiplier=2.0, referral_multiplier=2.0,
-        discord_role='PREMIUM'
+        discord_role='PREMIUM',
+        messages_per_minute=30, messages_per_hour=600
     ),
     'founder': Plan(
         name='Founder', price_monthly=3.49, price_yearly=33.90,
@@ -168,7 +181,8 @@ PLANS = {
         history_days=14, can_export=False, can_upload=True, max_file_size=10,
         can_generate_images=False, image_quota=0,
         support_priority='priority', streak_multiplier=1.25, referral_multiplier=1.25,
-        discord_role='FOUNDER'
+        discord_role='FOUNDER',
+        messages_per_minute=15, messages_per_hour=200
     )
 }
 
@@ -270,10 +284,31 @@ class ModelConfig:
     FLASH = "gemini-2.5-flash"
     PRO = "gemini-2.5-pro"
     
+    # USD par million de tokens ('cached': entrée servie par le cache de contexte)
     COSTS = {
-        FLASH_LITE: {'input': 0.10, 'output': 0.40},
-        FLASH: {'input': 0.30, 'output': 2.50},
-        PRO: {'input': 0.60, 'output': 10.00}
+        FLASH_LITE: {'input': 0.10, 'output': 0.40, 'cached': 0.025},
+        FLASH: {'input': 0.30, 'output': 2.50, 'cached': 0.075},
+        PRO: {'input': 0.60, 'output': 10.00, 'cached': 0.15}
+    }
+    
+    # Niveau de complexité (complexity.select_tier) -> modèle
+    TIERS = {
+        'lite': FLASH_LITE,
+        'flash': FLASH,
+        'pro': PRO
+    }
+    
+    # Repli quand un modèle est lent ou indisponible (routage)
+    FALLBACK_CHAIN = {
+        PRO: FLASH,
+        FLASH: FLASH_LITE
+    }
+    
+    # Budget de tokens par minute et par modèle (ordonnanceur, sous les quotas fournisseur)
+    TOKENS_PER_MINUTE = {
+        FLASH_LITE: 3_000_000,
+        FLASH: 800_000,
+        PRO: 800_000
     }
 
 
@@ -3,14 +3,26 @@ HISTORIQUE DE CONVERSATION PERSISTANT - Shellia AI Bot
 Stockage persistant de l'historique des conversations
 """
 
+import base64
 import json
+import sys
+import time
 import zlib
-from typing import List, Dict, Optional, Tuple
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Deque, List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
 from dataclasses import dataclass, asdict
 import asyncio
 
 
+# Objet Message + datetime + slot du deque, hors contenu
+MESSAGE_OVERHEAD_BYTES = 200
+
+# Estimation: ~4 caractères par token
+CHARS_PER_TOKEN = 4
+
+
 @dataclass
 class Message:
     """Un message de la conversation"""
@@ -35,22 +47,178 @@ class Message:
             timestamp=datetime.fromisoformat(data['timestamp']),
             metadata=data.get('metadata', {})
         )
+    
+    @property
+    def tokens(self) -> int:
+        """Nombre de tokens estimé"""
+        return -(-len(self.content) // CHARS_PER_TOKEN)
+    
+    def approx_size(self) -> int:
+        """Taille mémoire approximative (octets) pour le budget du cache"""
+        return sys.getsizeof(self.content) + MESSAGE_OVERHEAD_BYTES
+
+
+class CachedConversation:
+    """
+    Conversation d'un utilisateur en cache
+    
+    `ring` garde les `max_history` derniers messages. La fenêtre de contexte
+    est le plus long suffixe de l'anneau tenant dans `context_budget` tokens:
+    elle est maintenue à chaque ajout (coût amorti O(1)), le contexte Gemini
+    n'est donc jamais recalculé.
+    """
+    
+    __slots__ = ('ring', 'context_budget', 'window_len', 'window_tokens', 'bytes', 'last_used')
+    
+    def __init__(self, max_history: int, context_budget: int):
+        self.ring: Deque[Message] = deque(maxlen=max_history)
+        self.context_budget = context_budget
+        self.window_len = 0
+        self.window_tokens = 0
+        self.bytes = 0
+        self.last_used = time.monotonic()
+    
+    def append(self, message: Message) -> int:
+        """Ajoute un message; retourne la variation de taille mémoire"""
+        delta = message.approx_size()
+        if len(self.ring) == self.ring.maxlen:
+            oldest = self.ring[0]
+            delta -= oldest.approx_size()
+            if self.window_len == len(self.ring):
+                self.window_len -= 1
+                self.window_tokens -= oldest.tokens
+        
+        self.ring.append(message)
+        self.window_len += 1
+        self.window_tokens += message.tokens
+        
+        # Le début de la fenêtre ne fait qu'avancer
+        while self.window_len and self.window_tokens > self.context_budget:
+            self.window_tokens -= self.ring[len(self.ring) - self.window_len].tokens
+            self.window_len -= 1
+        
+        self.bytes += delta
+        return delta
+    
+    def messages(self) -> List[Message]:
+        return list(self.ring)
+    
+    def context(self) -> List[Message]:
+        """Messages de la fenêtre de contexte, du plus ancien au plus récent"""
+        return list(islice(self.ring, len(self.ring) - self.window_len, None))
 
 
 class ConversationHistoryManager:
     """
     Gestionnaire d'historique de conversation persistant
     Utilise Supabase avec compression optionnelle
+    
+    Source unique de l'historique (AIManager, SecurityIntegration):
+    - Base: un anneau de `max_history` messages par utilisateur (colonne seq),
+      ajout + élagage en un seul appel (append_conversation_message)
+    - Cache: LRU des conversations actives, borné en nombre d'utilisateurs,
+      en mémoire (`cache_memory_budget` octets) et en inactivité
+      (`idle_seconds`). Rien n'est préchargé au démarrage: une conversation
+      est lue en base au premier message de l'utilisateur.
     """
     
-    def __init__(self, db, max_history: int = 50, compression_threshold: int = 10):
+    def __init__(
+        self,
+        db,
+        max_history: int = 50,
+        compression_threshold: int = 10,
+        max_cached_users: int = 5000,
+        cache_memory_budget: int = 32 * 1024 * 1024,
+        context_token_budget: int = 4000,
+        idle_seconds: float = 1800.0
+    ):
         self.db = db
         self.max_history = max_history
         self.compression_threshold = compression_threshold
+        self.max_cached_users = max_cached_users
+        self.cache_memory_budget = cache_memory_budget
+        self.context_token_budget = context_token_budget
+        self.idle_seconds = idle_seconds
         
-        # Cache en mémoire pour les conversations actives
-        self._cache: Dict[int, List[Message]] = {}
+        # Cache LRU des conversations actives: user_id -> CachedConversation
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_total_bytes = 0
         self._cache_lock = asyncio.Lock()
+        
+        # Statistiques du cache
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+        self.idle_evictions = 0
+    
+    # ============ CACHE LRU ============
+    
+    def _cache_put(self, user_id: int, messages: List[Message]):
+        """Remplace la conversation en cache (appelé sous _cache_lock)"""
+        self._cache_drop(user_id)
+        conversation = CachedConversation(self.max_history, self.context_token_budget)
+        for message in messages[-self.max_history:]:
+            conversation.append(message)
+        self._cache[user_id] = conversation
+        self._cache_total_bytes += conversation.bytes
+        self._cache_evict()
+    
+    def _cache_append(self, user_id: int, message: Message):
+        """Ajout O(1) dans l'anneau (appelé sous _cache_lock)"""
+        conversation = self._cache_touch(user_id)
+        self._cache_total_bytes += conversation.append(message)
+        self._cache_evict()
+    
+    def _cache_touch(self, user_id: int) -> CachedConversation:
+        """Marque une conversation comme récemment utilisée (appelé sous _cache_lock)"""
+        conversation = self._cache[user_id]
+        conversation.last_used = time.monotonic()
+        self._cache.move_to_end(user_id)
+        return conversation
+    
+    def _cache_drop(self, user_id: int):
+        """Retire un utilisateur du cache (appelé sous _cache_lock)"""
+        conversation = self._cache.pop(user_id, None)
+        if conversation is not None:
+            self._cache_total_bytes -= conversation.bytes
+    
+    def _cache_evict(self):
+        """Évince les conversations inactives, puis les moins récentes au-delà des limites"""
+        idle_before = time.monotonic() - self.idle_seconds
+        while self._cache:
+            user_id, conversation = next(iter(self._cache.items()))
+            if conversation.last_used < idle_before:
+                self.idle_evictions += 1
+            elif (
+                len(self._cache) > self.max_cached_users
+                or self._cache_total_bytes > self.cache_memory_budget
+            ):
+                self.cache_evictions += 1
+            else:
+                break
+            self._cache_drop(user_id)
+    
+    async def evict_idle(self):
+        """Libère les conversations inactives (appel périodique)"""
+        async with self._cache_lock:
+            self._cache_evict()
+    
+    def get_cache_stats(self) -> Dict:
+        """Statistiques du cache en mémoire"""
+        total = self.cache_hits + self.cache_misses
+        return {
+            'users': len(self._cache),
+            'max_users': self.max_cached_users,
+            'bytes': self._cache_total_bytes,
+            'memory_budget': self.cache_memory_budget,
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'hit_rate': self.cache_hits / total if total else 0.0,
+            'evictions': self.cache_evictions,
+            'idle_evictions': self.idle_evictions,
+        }
+    
+    # ============ API ============
     
     async def add_message(
         self,
@@ -68,19 +236,40 @@ class ConversationHistoryManager:
             metadata=metadata
         )
         
-        # Ajouter au cache
+        # Conversation absente du cache: la charger avant d'ajouter, sinon le
+        # cache ne contiendrait que les messages de cette session
+        await self._get_cached(user_id)
+        
         async with self._cache_lock:
-            if user_id not in self._cache:
-                self._cache[user_id] = []
-            self._cache[user_id].append(message)
-            
-            # Limiter la taille du cache
-            if len(self._cache[user_id]) > self.max_history:
-                self._cache[user_id] = self._cache[user_id][-self.max_history:]
+            if user_id in self._cache:
+                self._cache_append(user_id, message)
         
         # Persister en base
         await self._persist_message(user_id, message)
     
+    async def _get_cached(self, user_id: int) -> CachedConversation:
+        """Conversation en cache, chargée depuis la base si absente"""
+        async with self._cache_lock:
+            if user_id in self._cache:
+                self.cache_hits += 1
+                return self._cache_touch(user_id)
+            self.cache_misses += 1
+        
+        # Charger depuis la base (l'anneau complet, pour servir tout `limit`)
+        history = await self._load_history(user_id, self.max_history, None)
+        
+        async with self._cache_lock:
+            if user_id not in self._cache:
+                self._cache_put(user_id, history)
+            return self._cache[user_id] if user_id in self._cache else self._detached(history)
+    
+    def _detached(self, messages: List[Message]) -> CachedConversation:
+        """Conversation hors cache (évincée aussitôt: budget trop petit)"""
+        conversation = CachedConversation(self.max_history, self.context_token_budget)
+        for message in messages[-self.max_history:]:
+            conversation.append(message)
+        return conversation
+    
     async def get_history(
         self,
         user_id: int,
@@ -95,105 +284,76 @@ class ConversationHistoryManager:
             limit: Nombre maximum de messages
             since: Date de début (None = tout)
         """
-        # Vérifier le cache d'abord
-        async with self._cache_lock:
-            if user_id in self._cache:
-                cache = self._cache[user_id]
-                if since:
-                    cache = [m for m in cache if m.timestamp >= since]
-                return cache[-limit:]
-        
-        # Charger depuis la base
-        history = await self._load_history(user_id, limit, since)
-        
-        # Mettre en cache
-        async with self._cache_lock:
-            self._cache[user_id] = history
-        
-        return history
+        conversation = await self._get_cached(user_id)
+        messages = conversation.messages()
+        if since:
+            messages = [m for m in messages if m.timestamp >= since]
+        return messages[-limit:]
     
     async def get_conversation_context(
         self,
         user_id: int,
-        max_tokens: int = 4000
+        max_tokens: Optional[int] = None
     ) -> List[Dict]:
         """
         Récupère le contexte formaté pour Gemini
         
+        Avec le budget par défaut (context_token_budget), la fenêtre est déjà
+        maintenue par le cache; un autre budget parcourt l'anneau une fois.
+        
         Returns:
             Liste de dicts {'role': str, 'content': str}
         """
-        history = await self.get_history(user_id, limit=self.max_history)
+        conversation = await self._get_cached(user_id)
         
-        context = []
-        total_chars = 0
-        
-        for msg in reversed(history):
-            msg_dict = {
-                'role': msg.role,
-                'content': msg.content
-            }
-            msg_chars = len(msg.content)
-            
-            # Estimation: ~4 chars/token
-            if total_chars + msg_chars > max_tokens * 4:
-                break
-            
-            context.insert(0, msg_dict)
-            total_chars += msg_chars
+        if max_tokens is None or max_tokens == self.context_token_budget:
+            messages = conversation.context()
+        else:
+            messages = []
+            total_tokens = 0
+            for msg in reversed(conversation.ring):
+                if total_tokens + msg.tokens > max_tokens:
+                    break
+                messages.append(msg)
+                total_tokens += msg.tokens
+            messages.reverse()
         
-        return context
+        return [{'role': msg.role, 'content': msg.content} for msg in messages]
     
     async def clear_history(self, user_id: int):
         """Efface l'historique d'un utilisateur"""
         async with self._cache_lock:
-            if user_id in self._cache:
-                del self._cache[user_id]
+            self._cache_drop(user_id)
         
         # Supprimer de la base
         try:
-            self.db.client.table('conversation_history')\
-                .delete()\
-                .eq('user_id', user_id)\
-                .execute()
+            await asyncio.to_thread(
+                lambda: self.db.client.table('conversation_history')
+                    .delete()
+                    .eq('user_id', user_id)
+                    .execute()
+            )
         except Exception as e:
             print(f"Erreur suppression historique: {e}")
     
     async def _persist_message(self, user_id: int, message: Message):
-        """Persiste un message en base"""
+        """
+        Persiste un message en base
+        
+        Un seul appel: la procédure numérote le message (seq) et supprime
+        en une requête ce qui sort de l'anneau de max_history messages.
+        """
         try:
-            # Insérer le nouveau message
-            self.db.client.table('conversation_history').insert({
-                'user_id': user_id,
-                'role': message.role,
-                'content': message.content,
-                'timestamp': message.timestamp.isoformat(),
-                'metadata': json.dumps(message.metadata) if message.metadata else None
-            }).execute()
-            
-            # Supprimer les vieux messages si dépassement
-            count_result = self.db.client.table('conversation_history')\
-                .select('id', count='exact')\
-                .eq('user_id', user_id)\
-                .execute()
-            
-            total = count_result.count
-            if total > self.max_history:
-                # Supprimer les plus anciens
-                to_delete = total - self.max_history
-                old_messages = self.db.client.table('conversation_history')\
-                    .select('id')\
-                    .eq('user_id', user_id)\
-                    .order('timestamp', desc=False)\
-                    .limit(to_delete)\
-                    .execute()
-                
-                for msg in old_messages.data:
-                    self.db.client.table('conversation_history')\
-                        .delete()\
-                        .eq('id', msg['id'])\
-                        .execute()
-            
+            await asyncio.to_thread(
+                lambda: self.db.client.rpc('append_conversation_message', {
+                    'p_user_id': user_id,
+                    'p_role': message.role,
+                    'p_content': message.content,
+                    'p_timestamp': message.timestamp.isoformat(),
+                    'p_metadata': message.metadata,
+                    'p_max_history': self.max_history
+                }).execute()
+            )
         except Exception as e:
             print(f"Erreur persistance message: {e}")
     
@@ -203,26 +363,28 @@ class ConversationHistoryManager:
         limit: int,
         since: Optional[datetime]
     ) -> List[Message]:
-        """Charge l'historique depuis la base"""
+        """Charge les `limit` derniers messages depuis la base (ordre chronologique)"""
         try:
             query = self.db.client.table('conversation_history')\
                 .select('role, content, timestamp, metadata')\
-                .eq('user_id', user_id)\
-                .order('timestamp', desc=False)\
-                .limit(limit)
+                .eq('user_id', user_id)
             
             if since:
                 query = query.gte('timestamp', since.isoformat())
             
-            result = query.execute()
+            # Client synchrone: l'aller-retour ne doit pas bloquer la boucle (défaut de cache)
+            result = await asyncio.to_thread(query.order('seq', desc=True).limit(limit).execute)
             
             messages = []
-            for row in result.data:
+            for row in reversed(result.data):
+                metadata = row['metadata']
+                if isinstance(metadata, str):
+                    metadata = json.loads(metadata)
                 msg = Message(
                     role=row['role'],
                     content=row['content'],
                     timestamp=datetime.fromisoformat(row['timestamp']),
-                    metadata=json.loads(row['metadata']) if row['metadata'] else None
+                    metadata=metadata or None
                 )
                 messages.append(msg)
             
@@ -282,7 +444,6 @@ class ConversationHistoryManager:
     
     def _decompress_history(self, compressed: str) -> List[Message]:
         """Décompresse l'historique"""
-        import base64
         data = zlib.decompress(base64.b64decode(compressed))
         messages_data = json.loads(data.decode('utf-8'))
         return [Message.from_dict(m) for m in messages_data]
@@ -369,6 +530,10 @@ CREATE TABLE IF NOT EXISTS conversation_history (
     timestamp TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     metadata JSONB,
     
+    -- Position dans l'anneau de l'utilisateur (croissante, attribuée par
+    -- append_conversation_message)
+    seq BIGINT,
+    
     -- Compression: null si non compressé, sinon format de compression
     compression VARCHAR(10) DEFAULT NULL
 );
@@ -376,6 +541,35 @@ CREATE TABLE IF NOT EXISTS conversation_history (
 CREATE INDEX idx_conversation_user ON conversation_history(user_id);
 CREATE INDEX idx_conversation_timestamp ON conversation_history(timestamp);
 CREATE INDEX idx_conversation_user_time ON conversation_history(user_id, timestamp DESC);
+CREATE UNIQUE INDEX idx_conversation_user_seq ON conversation_history(user_id, seq);
+
+-- Ajout + élagage de l'anneau en un appel
+CREATE OR REPLACE FUNCTION append_conversation_message(
+    p_user_id BIGINT,
+    p_role VARCHAR,
+    p_content TEXT,
+    p_timestamp TIMESTAMP WITH TIME ZONE,
+    p_metadata JSONB,
+    p_max_history INTEGER
+) RETURNS BIGINT AS $$
+DECLARE
+    new_seq BIGINT;
+BEGIN
+    -- Sérialise les ajouts d'un même utilisateur
+    PERFORM pg_advisory_xact_lock(p_user_id);
+    
+    SELECT COALESCE(MAX(seq), 0) + 1 INTO new_seq
+    FROM conversation_history WHERE user_id = p_user_id;
+    
+    INSERT INTO conversation_history (user_id, role, content, timestamp, metadata, seq)
+    VALUES (p_user_id, p_role, p_content, p_timestamp, p_metadata, new_seq);
+    
+    DELETE FROM conversation_history
+    WHERE user_id = p_user_id AND seq <= new_seq - p_max_history;
+    
+    RETURN new_seq;
+END;
+$$ LANGUAGE plpgsql;
 
 -- Table d'archive
 CREATE TABLE IF NOT EXISTS conversation_archive (
@@ -0,0 +1,207 @@
+"""
+REGISTRE DES COÛTS IA - Shellia AI Bot
+Tokens réels (usage_metadata Gemini) agrégés par utilisateur, plan, modèle et jour
+"""
+
+import asyncio
+from dataclasses import dataclass
+from datetime import date
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+@dataclass
+class TokenUsage:
+    """Tokens facturés pour un appel"""
+    prompt_tokens: int = 0       # Entrée complète: system prompt + historique + message
+    completion_tokens: int = 0   # Sortie, tokens de réflexion inclus
+    cached_tokens: int = 0       # Part de l'entrée servie par le cache de contexte
+    estimated: bool = False      # True si usage_metadata était absent
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @classmethod
+    def from_response(cls, response, fallback_prompt: str = "", fallback_completion: str = "") -> 'TokenUsage':
+        """
+        Lit response.usage_metadata (Gemini)
+
+        Sans métadonnées (réponse bloquée, vieux SDK), retombe sur
+        l'estimation ~4 caractères/token, marquée `estimated`.
+        """
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is None or not getattr(usage, 'prompt_token_count', 0):
+            return cls(
+                prompt_tokens=len(fallback_prompt) // 4,
+                completion_tokens=len(fallback_completion) // 4,
+                estimated=True
+            )
+
+        return cls(
+            prompt_tokens=usage.prompt_token_count or 0,
+            completion_tokens=(getattr(usage, 'candidates_token_count', 0) or 0)
+            + (getattr(usage, 'thoughts_token_count', 0) or 0),
+            cached_tokens=getattr(usage, 'cached_content_token_count', 0) or 0
+        )
+
+
+def compute_cost(costs: Dict[str, float], usage: TokenUsage) -> float:
+    """
+    Coût USD d'un appel
+
+    `costs`: prix par million de tokens (ModelConfig.COSTS[modèle]);
+    les tokens en cache sont facturés au tarif 'cached' s'il existe.
+    """
+    cached_price = costs.get('cached', costs['input'])
+    uncached = usage.prompt_tokens - usage.cached_tokens
+    return (
+        uncached * costs['input']
+        + usage.cached_tokens * cached_price
+        + usage.completion_tokens * costs['output']
+    ) / 1_000_000
+
+
+@dataclass
+class LedgerEntry:
+    """Agrégat d'une clé (utilisateur, plan, modèle, jour)"""
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    cost_usd: float = 0.0
+
+    def merge(self, other: 'LedgerEntry'):
+        self.calls += other.calls
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cached_tokens += other.cached_tokens
+        self.cost_usd += other.cost_usd
+
+
+LedgerKey = Tuple[int, str, str, str]  # (user_id, plan, model, jour ISO)
+
+
+class CostLedger:
+    """
+    Registre des coûts en mémoire, écrit par lots
+
+    record() ne fait qu'additionner dans un dict: aucun I/O par message.
+    flush() envoie tous les agrégats en un appel `writer(rows)`, qui les
+    ajoute côté base (record_cost_ledger); en cas d'échec ils sont réintégrés.
+    """
+
+    def __init__(
+        self,
+        writer: Optional[Callable[[List[Dict]], Awaitable[None]]] = None,
+        flush_interval: float = 30.0
+    ):
+        self.writer = writer
+        self.flush_interval = flush_interval
+
+        self._entries: Dict[LedgerKey, LedgerEntry] = {}
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+        # Statistiques
+        self.recorded = 0
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+
+    # ============================================================================
+    # CYCLE DE VIE
+    # ============================================================================
+
+    def start(self):
+        """Démarre le flush périodique (idempotent)"""
+        if self.writer and (self._task is None or self._task.done()):
+            self._closed = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Arrête le flush périodique et écrit ce qui reste"""
+        self._closed = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    # ============================================================================
+    # ENREGISTREMENT
+    # ============================================================================
+
+    def record(self, user_id: int, plan: Optional[str], model: str, usage: TokenUsage, cost_usd: float):
+        """Ajoute un appel à l'agrégat du jour"""
+        key = (user_id, plan or 'unknown', model, date.today().isoformat())
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = LedgerEntry()
+        entry.calls += 1
+        entry.prompt_tokens += usage.prompt_tokens
+        entry.completion_tokens += usage.completion_tokens
+        entry.cached_tokens += usage.cached_tokens
+        entry.cost_usd += cost_usd
+        self.recorded += 1
+
+    async def flush(self) -> int:
+        """Écrit les agrégats en attente en un appel; retourne le nombre de lignes"""
+        if not self.writer:
+            return 0
+
+        async with self._flush_lock:
+            if not self._entries:
+                return 0
+            entries, self._entries = self._entries, {}
+
+            rows = [
+                {
+                    'user_id': user_id,
+                    'plan': plan,
+                    'model': model,
+                    'day': day,
+                    'calls': entry.calls,
+                    'prompt_tokens': entry.prompt_tokens,
+                    'completion_tokens': entry.completion_tokens,
+                    'cached_tokens': entry.cached_tokens,
+                    'cost_usd': round(entry.cost_usd, 8),
+                }
+                for (user_id, plan, model, day), entry in entries.items()
+            ]
+
+            try:
+                await self.writer(rows)
+                self.flushed_rows += len(rows)
+                return len(rows)
+            except Exception as e:
+                # Réintégrer: les appels suivants se sont peut-être ajoutés entre-temps
+                self.failed_flushes += 1
+                for key, entry in entries.items():
+                    self._entries.setdefault(key, LedgerEntry()).merge(entry)
+                print(f"⚠️  Cost ledger: échec écriture ({len(rows)} lignes): {e}")
+                return 0
+
+    def pending_totals(self) -> Dict:
+        """Totaux non encore écrits (complément des requêtes sur cost_ledger)"""
+        calls = sum(e.calls for e in self._entries.values())
+        cost = sum(e.cost_usd for e in self._entries.values())
+        return {'keys': len(self._entries), 'calls': calls, 'cost_usd': cost}
+
+    def get_stats(self) -> Dict:
+        """Retourne les statistiques du registre"""
+        return {
+            'recorded': self.recorded,
+            'pending': self.pending_totals(),
+            'flushed_rows': self.flushed_rows,
+            'failed_flushes': self.failed_flushes,
+        }
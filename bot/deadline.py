@@ -0,0 +1,113 @@
+"""
+ÉCHÉANCES DE REQUÊTE - Shellia AI Bot
+Délai global d'un message, propagé à toute la chaîne (rate limit, base, circuit, Gemini)
+"""
+
+import asyncio
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Optional
+
+
+# Message affiché quand l'échéance d'un message est dépassée
+DEADLINE_MESSAGE = "⌛ La réponse a pris trop de temps, réessaie dans un instant."
+
+
+class DeadlineExceeded(TimeoutError):
+    """Échéance de la requête dépassée"""
+
+    def __init__(self, message: str = DEADLINE_MESSAGE):
+        super().__init__(message)
+
+
+class Deadline:
+    """
+    Instant limite d'une requête
+
+    Créée une fois par message (handle_ai_message) puis installée dans le
+    contexte (deadline_scope): chaque étape borne son propre timeout par le
+    temps restant au lieu d'empiler les siens. Les tâches créées dans la
+    portée héritent de l'échéance (contextvars).
+    """
+    __slots__ = ('expires_at', 'clock')
+
+    def __init__(self, seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.expires_at = clock() + seconds
+
+    def remaining(self) -> float:
+        return max(self.expires_at - self.clock(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.clock() >= self.expires_at
+
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """Temps restant, borné par `cap`"""
+        remaining = self.remaining()
+        return remaining if cap is None else min(cap, remaining)
+
+    def check(self):
+        """Lève DeadlineExceeded si l'échéance est passée"""
+        if self.expired:
+            raise DeadlineExceeded()
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar('shellia_deadline', default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Échéance de la requête en cours (None hors requête)"""
+    return _current.get()
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]):
+    """Installe `deadline` pour le bloc (None: travail non borné, ex. comptabilisation)"""
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def bounded_timeout(cap: Optional[float] = None) -> Optional[float]:
+    """
+    Timeout effectif d'une étape: `cap` borné par l'échéance courante
+
+    Raises:
+        DeadlineExceeded: l'échéance est déjà passée (inutile de lancer l'appel)
+    """
+    deadline = _current.get()
+    if deadline is None:
+        return cap
+    deadline.check()
+    return deadline.timeout(cap)
+
+
+async def with_deadline(awaitable: Awaitable, cap: Optional[float] = None):
+    """
+    Attend `awaitable` au plus `cap` secondes et jusqu'à l'échéance courante
+
+    Raises:
+        DeadlineExceeded: échéance atteinte
+        asyncio.TimeoutError: `cap` atteint avant l'échéance
+    """
+    try:
+        timeout = bounded_timeout(cap)
+    except DeadlineExceeded:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise
+
+    if timeout is None:
+        return await awaitable
+
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        deadline = _current.get()
+        if deadline is not None and deadline.expired:
+            raise DeadlineExceeded() from None
+        raise
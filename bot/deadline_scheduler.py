@@ -0,0 +1,137 @@
+"""
+⏰ Planificateur d'échéances
+Tas de minuteries (fin de giveaway, édition différée): une tâche dort jusqu'à la prochaine échéance
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    """
+    Exécute `callback(clé)` à l'échéance de chaque clé
+
+    Un tas (échéance, séquence, clé) et une seule tâche qui dort jusqu'à la
+    plus proche: pas de réveil périodique, pas de parcours de tous les
+    giveaways, et une échéance tenue à la milliseconde au lieu de la minute.
+    Replanifier ou annuler une clé est O(log n): l'ancienne entrée reste
+    dans le tas et est ignorée à sa sortie (suppression paresseuse).
+
+    Les callbacks tournent chacun dans sa propre tâche: une fin de giveaway
+    lente (annonces, récompenses) ne retarde pas les échéances suivantes.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[Hashable], Awaitable[None]],
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.callback = callback
+        self.clock = clock
+
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._deadlines: Dict[Hashable, Tuple[float, int]] = {}
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._running: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+        self.stats = {'scheduled': 0, 'cancelled': 0, 'fired': 0, 'errors': 0}
+
+    # ============================================================================
+    # CYCLE DE VIE
+    # ============================================================================
+
+    def start(self) -> asyncio.Task:
+        """Démarre la tâche de fond (idempotent) et la retourne"""
+        if self._task is None or self._task.done():
+            self._closed = False
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self):
+        """Arrête la tâche de fond; les échéances en attente sont conservées"""
+        self._closed = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    # ============================================================================
+    # ÉCHÉANCES
+    # ============================================================================
+
+    def schedule_in(self, key: Hashable, delay: float):
+        """(Re)planifie `key` dans `delay` secondes (négatif: tout de suite)"""
+        when = self.clock() + max(delay, 0.0)
+        entry = (when, next(self._sequence))
+        self._deadlines[key] = entry
+        heapq.heappush(self._heap, (entry[0], entry[1], key))
+        self.stats['scheduled'] += 1
+        # Réveiller la tâche seulement si l'échéance la plus proche a changé
+        if self._heap[0][2] == key:
+            self._wakeup.set()
+
+    def cancel(self, key: Hashable) -> bool:
+        if self._deadlines.pop(key, None) is None:
+            return False
+        self.stats['cancelled'] += 1
+        return True
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._deadlines
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def time_until(self, key: Hashable) -> Optional[float]:
+        entry = self._deadlines.get(key)
+        return max(entry[0] - self.clock(), 0.0) if entry else None
+
+    def _next_delay(self) -> Optional[float]:
+        """Délai avant la prochaine échéance valide (purge les entrées périmées)"""
+        while self._heap:
+            when, seq, key = self._heap[0]
+            if self._deadlines.get(key) == (when, seq):
+                return max(when - self.clock(), 0.0)
+            heapq.heappop(self._heap)
+        return None
+
+    # ============================================================================
+    # BOUCLE
+    # ============================================================================
+
+    async def _run(self):
+        while not self._closed:
+            delay = self._next_delay()
+            if delay is None or delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, key = heapq.heappop(self._heap)
+            del self._deadlines[key]
+            self.stats['fired'] += 1
+            task = asyncio.create_task(self._fire(key))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _fire(self, key: Hashable):
+        try:
+            await self.callback(key)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Erreur échéance {key}: {e}")
+
+    def get_stats(self) -> Dict:
+        return {'pending': len(self._deadlines), 'running': len(self._running), **self.stats}
@@ -0,0 +1,163 @@
+"""
+RENDU PROGRESSIF DISCORD - Shellia AI Bot
+Affiche une réponse IA en streaming en éditant un message, sans dépasser les limites Discord
+"""
+
+import time
+from typing import Callable, List, Optional
+
+# Taille maximale d'un message Discord
+DISCORD_MESSAGE_LIMIT = 2000
+
+CODE_FENCE = "```"
+
+
+def _last_safe_break(window: str) -> int:
+    """Index du dernier '\\n' de `window` situé hors d'un bloc de code (-1 sinon)"""
+    in_code = False
+    best = -1
+    pos = 0
+    for line in window.split('\n')[:-1]:
+        if line.strip().startswith(CODE_FENCE):
+            in_code = not in_code
+        pos += len(line) + 1
+        if not in_code:
+            best = pos - 1
+    return best
+
+
+def _open_fence(text: str) -> Optional[str]:
+    """Langage du bloc de code resté ouvert à la fin de `text` (None si aucun)"""
+    lang = None
+    for line in text.split('\n'):
+        stripped = line.strip()
+        if stripped.startswith(CODE_FENCE):
+            lang = None if lang is not None else stripped[len(CODE_FENCE):].strip()
+    return lang
+
+
+def split_message(text: str, limit: int = DISCORD_MESSAGE_LIMIT) -> List[str]:
+    """
+    Découpe un texte en messages Discord
+
+    Coupe de préférence à une fin de ligne hors bloc de code. Un bloc plus
+    long qu'un message est fermé puis rouvert (même langage) dans le suivant.
+    Le découpage d'un préfixe ne change pas quand du texte est ajouté: les
+    messages déjà complets ne sont jamais réédités pendant le streaming.
+    """
+    chunks = []
+    while len(text) > limit:
+        cut = _last_safe_break(text[:limit])
+        if cut > 0:
+            chunks.append(text[:cut])
+            text = text[cut + 1:]
+            continue
+
+        # Bloc de code (ou ligne) trop long: couper dedans, fermer puis rouvrir
+        room = limit - len(CODE_FENCE) - 1
+        newline = text.rfind('\n', 0, room)
+        cut = newline if newline > 0 else room
+        head = text[:cut]
+        text = text[cut + 1:] if newline > 0 else text[cut:]
+
+        lang = _open_fence(head)
+        if lang is not None:
+            head += '\n' + CODE_FENCE
+            text = f"{CODE_FENCE}{lang}\n{text}"
+        chunks.append(head)
+
+    chunks.append(text)
+    return chunks
+
+
+class DiscordStreamRenderer:
+    """
+    Rendu progressif d'une réponse dans Discord
+
+    Un placeholder est envoyé en réponse au message de l'utilisateur puis
+    édité au plus toutes les `min_edit_interval` secondes (limite Discord:
+    ~5 éditions / 5 s par salon). Au-delà de 2000 caractères, la suite part
+    dans de nouveaux messages (split_message). `update()` reçoit le texte
+    complet reçu jusqu'ici: un nouvel essai après un échec repart de zéro
+    sans dupliquer.
+    """
+
+    def __init__(
+        self,
+        reply_to,
+        placeholder: str = "💭 ...",
+        min_edit_interval: float = 1.2,
+        limit: int = DISCORD_MESSAGE_LIMIT,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.reply_to = reply_to
+        self.placeholder = placeholder
+        self.min_edit_interval = min_edit_interval
+        self.limit = limit
+        self.clock = clock
+
+        self.text = ""
+        self.messages = []       # Messages Discord envoyés, dans l'ordre
+        self._rendered: List[str] = []
+        self._last_render = 0.0
+
+        # Statistiques
+        self.edits = 0
+        self.first_text_at: Optional[float] = None
+
+    async def start(self):
+        """Envoie le placeholder"""
+        self.messages = [await self.reply_to.reply(self.placeholder)]
+        self._rendered = [self.placeholder]
+        self._last_render = self.clock()
+
+    async def update(self, text: str):
+        """Texte partiel reçu: rendu si l'intervalle minimal est écoulé"""
+        self.text = text
+        if text and self.first_text_at is None:
+            self.first_text_at = self.clock()
+            await self._render()
+        elif self.clock() - self._last_render >= self.min_edit_interval:
+            await self._render()
+
+    async def finish(self, text: Optional[str] = None):
+        """Rendu final (toujours effectué)"""
+        if text is not None:
+            self.text = text
+        await self._render()
+
+    async def fail(self, error: str, delete_after: Optional[float] = None):
+        """Remplace le placeholder par un message d'erreur"""
+        if not self.messages:
+            await self.reply_to.reply(error, delete_after=delete_after)
+            return
+        await self.messages[0].edit(content=error, delete_after=delete_after)
+        for extra in self.messages[1:]:
+            await extra.delete()
+        self.messages = self.messages[:1]
+        self._rendered = [error]
+
+    async def _render(self):
+        if not self.text:
+            return
+        if not self.messages:
+            await self.start()
+
+        chunks = split_message(self.text, self.limit)
+        for i, chunk in enumerate(chunks):
+            if i < len(self.messages):
+                if self._rendered[i] != chunk:
+                    await self.messages[i].edit(content=chunk)
+                    self._rendered[i] = chunk
+                    self.edits += 1
+            else:
+                self.messages.append(await self.messages[-1].channel.send(chunk))
+                self._rendered.append(chunk)
+
+        # Texte raccourci (nouvel essai): retirer les messages en trop
+        for extra in self.messages[len(chunks):]:
+            await extra.delete()
+        del self.messages[len(chunks):]
+        del self._rendered[len(chunks):]
+
+        self._last_render = self.clock()
@@ -0,0 +1,180 @@
+"""
+📬 File d'envoi de messages privés
+Envoi en arrière-plan, cadencé (seau à jetons), pour ne pas bloquer les événements Discord
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Hashable, Optional
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DMQueueConfig:
+    """Configuration de la file"""
+    rate_per_second: float = 1.0   # Débit moyen (chaque DM ouvre un canal: route limitée par Discord)
+    burst: int = 5                 # Envois immédiats possibles après une période calme
+    max_pending: int = 1000        # Au-delà, les nouveaux DMs sont abandonnés (non critiques)
+    max_attempts: int = 3          # Tentatives par DM sur 429 / erreur serveur
+
+
+@dataclass
+class _PendingDM:
+    user_id: int
+    embed: discord.Embed
+    attempts: int = 0
+
+
+class DMQueue:
+    """
+    File de DMs best-effort (confirmations de participation...)
+
+    Les handlers d'événements mettent en file et rendent la main tout de
+    suite: une vague de réactions au lancement d'un giveaway ne bloque
+    plus le dispatcher sur des centaines d'ouvertures de DM. Un seul
+    worker envoie au rythme `rate_per_second` (rafales jusqu'à `burst`),
+    recule sur un 429 (retry_after) et abandonne les DMs fermés.
+
+    Chaque DM a une clé (ex. (giveaway_id, user_id)): une clé déjà en
+    file n'est pas dupliquée, et `discard(clé)` annule un DM pas encore
+    parti (réaction retirée entre-temps).
+    """
+
+    def __init__(self, bot, config: Optional[DMQueueConfig] = None):
+        self.bot = bot
+        self.config = config or DMQueueConfig()
+
+        self._pending: "OrderedDict[Hashable, _PendingDM]" = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self._tokens = float(self.config.burst)
+        self._refilled_at = time.monotonic()
+
+        self.stats = {
+            'enqueued': 0, 'sent': 0, 'deduplicated': 0, 'cancelled': 0,
+            'dropped': 0, 'dms_closed': 0, 'rate_limited': 0, 'failed': 0,
+        }
+
+    # ============================================================================
+    # CYCLE DE VIE
+    # ============================================================================
+
+    def start(self):
+        """Démarre le worker (idempotent)"""
+        if self._task is None or self._task.done():
+            self._closed = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Arrête le worker; les DMs encore en file sont abandonnés"""
+        self._closed = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    # ============================================================================
+    # FILE
+    # ============================================================================
+
+    def enqueue(self, user_id: int, embed: discord.Embed, key: Optional[Hashable] = None) -> bool:
+        """
+        Met un DM en file (ne bloque jamais)
+
+        Returns:
+            False si la clé est déjà en file ou si la file est pleine
+        """
+        key = key if key is not None else user_id
+        if key in self._pending:
+            self.stats['deduplicated'] += 1
+            return False
+        if len(self._pending) >= self.config.max_pending:
+            self.stats['dropped'] += 1
+            return False
+
+        self._pending[key] = _PendingDM(user_id=user_id, embed=embed)
+        self.stats['enqueued'] += 1
+        self._wakeup.set()
+        return True
+
+    def discard(self, key: Hashable) -> bool:
+        """Annule un DM pas encore envoyé"""
+        if self._pending.pop(key, None) is None:
+            return False
+        self.stats['cancelled'] += 1
+        return True
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    # ============================================================================
+    # ENVOI
+    # ============================================================================
+
+    def _take_token(self) -> float:
+        """Consomme un jeton; sinon retourne l'attente nécessaire (secondes)"""
+        now = time.monotonic()
+        rate = self.config.rate_per_second
+        self._tokens = min(self.config.burst, self._tokens + (now - self._refilled_at) * rate)
+        self._refilled_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / rate
+
+    async def _run(self):
+        while not self._closed:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            wait = self._take_token()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            key, dm = self._pending.popitem(last=False)
+            retry_after = await self._deliver(dm)
+            if retry_after is not None:
+                dm.attempts += 1
+                if dm.attempts < self.config.max_attempts and key not in self._pending:
+                    self._pending[key] = dm
+                    self._pending.move_to_end(key, last=False)
+                else:
+                    self.stats['failed'] += 1
+                await asyncio.sleep(retry_after)
+
+    async def _deliver(self, dm: _PendingDM) -> Optional[float]:
+        """Envoie un DM; retourne un délai de recul si l'envoi est à retenter"""
+        try:
+            user = self.bot.get_user(dm.user_id) or await self.bot.fetch_user(dm.user_id)
+            await user.send(embed=dm.embed)
+            self.stats['sent'] += 1
+            return None
+        except discord.Forbidden:
+            self.stats['dms_closed'] += 1  # DM fermés: inutile de réessayer
+        except discord.NotFound:
+            self.stats['failed'] += 1
+        except discord.HTTPException as e:
+            if e.status == 429:
+                self.stats['rate_limited'] += 1
+                return float(getattr(e, 'retry_after', None) or 1.0)
+            if e.status >= 500:
+                return 1.0
+            self.stats['failed'] += 1
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.error(f"Erreur envoi DM à {dm.user_id}: {e}")
+        return None
+
+    def get_stats(self) -> Dict:
+        return {'pending': self.pending, **self.stats}
@@ -55,15 +55,12 @@ class GiveawayCommands(commands.Cog):
         
         # Prochains paliers
         upcoming = []
-        for milestone in sorted(self.giveaway_manager.milestones.keys()):
-            if milestone > member_count:
-                remaining = milestone - member_count
-                reward = self.giveaway_manager.milestones[milestone]
-                upcoming.append(
-                    f"**{milestone}** membres (+{remaining}) - {reward.description[:50]}..."
-                )
-                if len(upcoming) >= 3:
-                    break
+        for milestone in self.giveaway_manager.upcoming_milestones(member_count, limit=3):
+            remaining = milestone - member_count
+            reward = self.giveaway_manager.milestones[milestone]
+            upcoming.append(
+                f"**{milestone}** membres (+{remaining}) - {reward.description[:50]}..."
+            )
                     
         if upcoming:
             embed.add_field(
@@ -418,6 +415,18 @@ class GiveawayCommands(commands.Cog):
             
     # ============ EVENT LISTENERS ============
     
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        """Détection des paliers à l'arrivée d'un membre"""
+        if self.giveaway_manager:
+            await self.giveaway_manager.on_member_count_changed(member.guild)
+            
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        """Suivi du nombre de membres (une baisse ne déclenche rien)"""
+        if self.giveaway_manager:
+            await self.giveaway_manager.on_member_count_changed(member.guild)
+            
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
         """Gère les participations aux giveaways"""
@@ -432,36 +441,33 @@ class GiveawayCommands(commands.Cog):
         if str(payload.emoji) != "🎉":
             return
             
-        # Chercher le giveaway correspondant
-        for giveaway_id, giveaway in self.giveaway_manager.active_giveaways.items():
-            if giveaway.message_id == payload.message_id and giveaway.channel_id == payload.channel_id:
-                # Ajouter la participation
-                success = await self.giveaway_manager.add_entry(
-                    giveaway_id=giveaway_id,
-                    user_id=payload.user_id,
-                    message_id=payload.message_id
-                )
-                
-                if success:
-                    # Optionnel: Envoyer un DM de confirmation
-                    try:
-                        user = self.bot.get_user(payload.user_id)
-                        if user:
-                            embed = discord.Embed(
-                                title="🎉 Participation enregistrée !",
-                                description=(
-                                    f"Tu participes au giveaway du palier **{giveaway.milestone} membres** !\n\n"
-                                    f"🎯 Récompenses: {self._format_reward(giveaway.reward)}\n"
-                                    f"⏰ Fin: <t:{int(giveaway.ends_at.timestamp())}:R>\n\n"
-                                    f"Bonne chance ! 🍀"
-                                ),
-                                color=discord.Color.green()
-                            )
-                            await user.send(embed=embed)
-                    except:
-                        pass  # DM fermés
-                        
-                break
+        # Giveaway du message (index, O(1))
+        giveaway = self.giveaway_manager.giveaway_for_message(payload.channel_id, payload.message_id)
+        if not giveaway:
+            return
+            
+        # Ajouter la participation
+        success = await self.giveaway_manager.add_entry(
+            giveaway_id=giveaway.id,
+            user_id=payload.user_id,
+            message_id=payload.message_id
+        )
+        
+        if success:
+            # DM de confirmation en arrière-plan (ne bloque pas le dispatcher)
+            embed = discord.Embed(
+                title="🎉 Participation enregistrée !",
+                description=(
+                    f"Tu participes au giveaway du palier **{giveaway.milestone} membres** !\n\n"
+                    f"🎯 Récompenses: {self._format_reward(giveaway.reward)}\n"
+                    f"⏰ Fin: <t:{int(giveaway.ends_at.timestamp())}:R>\n\n"
+                    f"Bonne chance ! 🍀"
+                ),
+                color=discord.Color.green()
+            )
+            self.giveaway_manager.dm_queue.enqueue(
+                payload.user_id, embed, key=(giveaway.id, payload.user_id)
+            )
                 
     @commands.Cog.listener()
     async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
@@ -472,10 +478,13 @@ class GiveawayCommands(commands.Cog):
         if str(payload.emoji) != "🎉":
             return
             
-        for giveaway_id, giveaway in self.giveaway_manager.active_giveaways.items():
-            if giveaway.message_id == payload.message_id:
-                await self.giveaway_manager.remove_entry(giveaway_id, payload.user_id)
-                break
+        giveaway = self.giveaway_manager.giveaway_for_message(payload.channel_id, payload.message_id)
+        if not giveaway:
+            return
+            
+        await self.giveaway_manager.remove_entry(giveaway.id, payload.user_id)
+        # Confirmation pas encore partie: inutile de l'envoyer
+        self.giveaway_manager.dm_queue.discard((giveaway.id, payload.user_id))
                 
     # ============ HELPERS ============
     
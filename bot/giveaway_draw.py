@@ -0,0 +1,231 @@
+"""
+🎲 Tirage au sort des giveaways
+Échantillonnage pondéré en flux (réservoir), vérifications paresseuses, tirage rejouable depuis sa graine
+"""
+
+import hashlib
+import heapq
+import json
+import math
+import secrets
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+# Version de l'algorithme, inscrite dans le journal: un rejeu doit utiliser la même
+DRAW_ALGORITHM = "a-res/blake2b-v1"
+
+# Une participation: user_id seul, ou (user_id, plan, série) pour les poids par profil
+DrawCandidate = Union[int, Tuple[int, Optional[str], Optional[int]]]
+
+
+def new_seed() -> str:
+    return secrets.token_hex(16)
+
+
+def draw_uniform(seed: str, user_id: int) -> float:
+    """
+    Tirage uniforme dans ]0, 1[ propre à (graine, participant)
+
+    Dérivé d'un hash et non d'un générateur séquentiel: le résultat ne
+    dépend pas de l'ordre de parcours des participations (mémoire, base,
+    après un redémarrage), ce qui rend le tirage rejouable.
+    """
+    digest = hashlib.blake2b(f"{seed}:{user_id}".encode(), digest_size=8).digest()
+    return (int.from_bytes(digest, 'big') + 1) / (2 ** 64 + 2)
+
+
+@dataclass
+class DrawWeights:
+    """Pondération des participations (vide: tirage uniforme)"""
+    plans: Dict[str, float] = field(default_factory=dict)   # plan -> multiplicateur (absent: 1)
+    streak_bonus: float = 0.0                               # +x par jour de série
+    streak_cap: int = 30                                    # Jours de série pris en compte au plus
+    roles: Dict[int, float] = field(default_factory=dict)   # role_id -> multiplicateur (cumulables)
+
+    @property
+    def uniform(self) -> bool:
+        return not (self.plans or self.streak_bonus or self.roles)
+
+    @property
+    def needs_profile(self) -> bool:
+        """Plan / série requis (chargés avec les participations)"""
+        return bool(self.plans or self.streak_bonus)
+
+    @property
+    def max_weight(self) -> float:
+        """Borne haute des poids (tri des candidats sans calculer leur poids)"""
+        bound = max([1.0, *self.plans.values()])
+        bound *= 1 + self.streak_bonus * self.streak_cap
+        for multiplier in self.roles.values():
+            bound *= max(multiplier, 1.0)
+        return bound
+
+    def weight(self, plan: Optional[str], streak: Optional[int], member=None) -> float:
+        weight = self.plans.get(plan or 'free', 1.0)
+        weight *= 1 + self.streak_bonus * min(streak or 0, self.streak_cap)
+        if self.roles and member is not None:
+            for role in getattr(member, 'roles', ()):
+                weight *= self.roles.get(role.id, 1.0)
+        return weight
+
+    def to_dict(self) -> dict:
+        return {
+            'plans': dict(self.plans),
+            'streak_bonus': self.streak_bonus,
+            'streak_cap': self.streak_cap,
+            'roles': {str(role_id): m for role_id, m in self.roles.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> 'DrawWeights':
+        data = data or {}
+        return cls(
+            plans=dict(data.get('plans') or {}),
+            streak_bonus=data.get('streak_bonus', 0.0),
+            streak_cap=data.get('streak_cap', 30),
+            roles={int(role_id): m for role_id, m in (data.get('roles') or {}).items()},
+        )
+
+
+@dataclass
+class DrawRecord:
+    """Entrée du journal des tirages (table giveaway_draws)"""
+    giveaway_id: str
+    round: int                  # 0: tirage initial, 1+: rerolls
+    seed: str
+    weights: DrawWeights
+    winners: List[int]
+    excluded: List[int] = field(default_factory=list)
+    entries_scanned: int = 0
+    eligibility_checks: int = 0
+    algorithm: str = DRAW_ALGORITHM
+    drawn_at: datetime = field(default_factory=datetime.utcnow)
+
+    @classmethod
+    def from_row(cls, row: dict) -> 'DrawRecord':
+        weights = row.get('weights')
+        if isinstance(weights, str):
+            weights = json.loads(weights)
+        return cls(
+            giveaway_id=row['giveaway_id'],
+            round=row['round'],
+            seed=row['seed'],
+            weights=DrawWeights.from_dict(weights),
+            winners=list(row.get('winners') or []),
+            excluded=list(row.get('excluded') or []),
+            entries_scanned=row.get('entries_scanned') or 0,
+            eligibility_checks=row.get('eligibility_checks') or 0,
+            algorithm=row.get('algorithm') or DRAW_ALGORITHM,
+            drawn_at=row.get('drawn_at') or datetime.utcnow(),
+        )
+
+
+@dataclass
+class DrawResult:
+    """Résultat d'un tirage"""
+    winners: List[int]                 # Meilleure clé en premier
+    members: Dict[int, Any]            # user_id -> valeur retournée par `eligible`
+    entries_scanned: int = 0
+    eligibility_checks: int = 0
+
+
+class ReservoirDraw:
+    """
+    Tirage de `count` gagnants distincts en flux (Efraimidis-Spirakis A-Res)
+
+    Chaque participation reçoit la clé log(u)/poids, u = draw_uniform(graine,
+    user_id); les `count` plus grandes clés gagnent. Un tas min de taille
+    `count` suffit: rien n'est copié, et les participations peuvent être
+    fournies par lots successifs (pages d'une requête) via `feed`.
+
+    `eligible(user_id)` (membre présent, pas un bot...) est coûteux: il
+    n'est appelé que si la clé maximale possible (poids max) entre dans le
+    réservoir, soit ~count·ln(n/count) appels au lieu de n. Il retourne
+    l'objet à garder pour le gagnant (ex. discord.Member) ou None.
+
+    Même graine, mêmes participations, mêmes poids: mêmes gagnants, quel
+    que soit l'ordre ou le découpage en lots. `exclude` (gagnants
+    précédents) rejoue le classement en les sautant: un reroll désigne
+    les suivants.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        seed: str,
+        eligible: Callable[[int], Any] = lambda user_id: user_id,
+        weights: Optional[DrawWeights] = None,
+        exclude: Set[int] = frozenset()
+    ):
+        self.count = count
+        self.seed = seed
+        self.eligible = eligible
+        self.weights = weights or DrawWeights()
+        self.exclude = exclude
+        self._max_weight = self.weights.max_weight
+        self._reservoir: List[Tuple[float, int]] = []   # tas min (clé, user_id)
+        self._members: Dict[int, Any] = {}
+        self.entries_scanned = 0
+        self.eligibility_checks = 0
+
+    def feed(self, entries: Iterable[DrawCandidate]):
+        """Passe un lot de participations dans le réservoir"""
+        if self.count <= 0:
+            return
+        reservoir, members = self._reservoir, self._members
+
+        for candidate in entries:
+            if isinstance(candidate, int):
+                user_id, plan, streak = candidate, None, None
+            else:
+                user_id, plan, streak = candidate
+            self.entries_scanned += 1
+            if user_id in self.exclude:
+                continue
+
+            log_u = math.log(draw_uniform(self.seed, user_id))
+            full = len(reservoir) >= self.count
+            if full and log_u / self._max_weight <= reservoir[0][0]:
+                continue  # Même avec le poids max, n'entrerait pas
+
+            self.eligibility_checks += 1
+            member = self.eligible(user_id)
+            if member is None:
+                continue
+            weight = self.weights.weight(plan, streak, member)
+            if weight <= 0:
+                continue
+
+            key = log_u / weight
+            if not full:
+                heapq.heappush(reservoir, (key, user_id))
+            elif key > reservoir[0][0]:
+                _, evicted = heapq.heapreplace(reservoir, (key, user_id))
+                members.pop(evicted, None)
+            else:
+                continue
+            members[user_id] = member
+
+    def result(self) -> DrawResult:
+        winners = [user_id for _, user_id in sorted(self._reservoir, reverse=True)]
+        return DrawResult(
+            winners=winners,
+            members={user_id: self._members[user_id] for user_id in winners},
+            entries_scanned=self.entries_scanned,
+            eligibility_checks=self.eligibility_checks
+        )
+
+
+def draw_winners(
+    entries: Iterable[DrawCandidate],
+    count: int,
+    seed: str,
+    eligible: Callable[[int], Any] = lambda user_id: user_id,
+    weights: Optional[DrawWeights] = None,
+    exclude: Set[int] = frozenset()
+) -> DrawResult:
+    """Tirage en un seul passage sur `entries` (voir ReservoirDraw)"""
+    draw = ReservoirDraw(count, seed, eligible, weights, exclude)
+    draw.feed(entries)
+    return draw.result()
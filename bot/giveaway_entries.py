@@ -0,0 +1,336 @@
+"""
+🎟️ Participations aux giveaways
+Index des participants en mémoire (appartenance O(1)) et écriture groupée dans giveaway_entries
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def to_timestamp(moment: datetime) -> int:
+    """Secondes UTC depuis l'epoch (datetime naïf = UTC, comme datetime.utcnow())"""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return int((moment - _EPOCH).total_seconds())
+
+
+def from_timestamp(seconds: int) -> datetime:
+    """Inverse de to_timestamp (datetime naïf UTC)"""
+    return datetime.utcfromtimestamp(seconds)
+
+
+@dataclass
+class GiveawayEntry:
+    """Participation à un giveaway"""
+    user_id: int
+    joined_at: datetime
+    message_id: Optional[int] = None
+    
+    def to_dict(self) -> dict:
+        return {
+            'user_id': self.user_id,
+            'joined_at': self.joined_at.isoformat(),
+            'message_id': self.message_id
+        }
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> 'GiveawayEntry':
+        joined_at = data['joined_at']
+        if isinstance(joined_at, str):
+            joined_at = datetime.fromisoformat(joined_at)
+        return cls(user_id=int(data['user_id']), joined_at=joined_at, message_id=data.get('message_id'))
+
+
+class EntrySet:
+    """
+    Participants d'un giveaway
+
+    Un dict user_id -> seconde d'inscription: appartenance, ajout et
+    retrait en O(1), ordre d'inscription conservé, et deux entiers par
+    participant au lieu d'un GiveawayEntry (dataclass + datetime).
+    L'itération reconstruit les GiveawayEntry à la demande.
+    """
+    __slots__ = ('_joined',)
+
+    def __init__(self, entries: Iterable = ()):
+        self._joined: Dict[int, int] = {}
+        for entry in entries:
+            self.add(entry.user_id, entry.joined_at)
+
+    def add(self, user_id: int, joined_at: datetime) -> bool:
+        """Ajoute un participant (False s'il participe déjà)"""
+        if user_id in self._joined:
+            return False
+        self._joined[user_id] = to_timestamp(joined_at)
+        return True
+
+    def discard(self, user_id: int) -> bool:
+        """Retire un participant (False s'il ne participait pas)"""
+        return self._joined.pop(user_id, None) is not None
+
+    def joined_at(self, user_id: int) -> Optional[datetime]:
+        seconds = self._joined.get(user_id)
+        return from_timestamp(seconds) if seconds is not None else None
+
+    def user_ids(self) -> Iterator[int]:
+        """Identifiants dans l'ordre d'inscription, sans allocation par entrée"""
+        return iter(self._joined)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._joined
+
+    def __len__(self) -> int:
+        return len(self._joined)
+
+    def __iter__(self) -> Iterator[GiveawayEntry]:
+        for user_id, seconds in self._joined.items():
+            yield GiveawayEntry(user_id=user_id, joined_at=from_timestamp(seconds))
+
+    def to_list(self) -> List[dict]:
+        return [entry.to_dict() for entry in self]
+
+
+# ============================================================================
+# PERSISTANCE GROUPÉE
+# ============================================================================
+
+EntryKey = Tuple[str, int]  # (giveaway_id, user_id)
+
+
+@dataclass
+class EntryJournalConfig:
+    """Configuration de l'écriture groupée"""
+    max_batch_size: int = 500      # Lignes par requête (et seuil de flush anticipé)
+    flush_interval: float = 2.0    # Flush au plus tard toutes les N secondes
+    max_attempts: int = 5          # Échecs d'écriture d'un changement avant abandon
+    retry_base_delay: float = 2.0  # Attente après un flush en échec (doublée à chaque échec)
+    retry_max_delay: float = 60.0
+
+
+class EntryJournal:
+    """
+    Journal des inscriptions / désinscriptions vers la table giveaway_entries
+
+    Remplace la réécriture du tableau JSONB active_giveaways.entries à
+    chaque réaction (O(n) octets écrits par participant). Les changements
+    sont fusionnés par (giveaway, utilisateur) — une réaction ajoutée puis
+    retirée avant le flush ne coûte aucune écriture — puis envoyés en une
+    requête par lot (unnest de tableaux). Un lot en échec est remis en
+    file, sauf si un changement plus récent l'a remplacé entre-temps; après
+    un flush en échec, le suivant attend (backoff exponentiel) et un
+    changement qui échoue `max_attempts` fois est abandonné (dead_lettered).
+    """
+
+    UPSERT_SQL = """
+        INSERT INTO giveaway_entries (giveaway_id, user_id, joined_at)
+        SELECT * FROM unnest(%s::varchar[], %s::bigint[], %s::timestamptz[])
+        ON CONFLICT (giveaway_id, user_id) DO UPDATE SET joined_at = EXCLUDED.joined_at
+    """
+
+    DELETE_SQL = """
+        DELETE FROM giveaway_entries e
+        USING unnest(%s::varchar[], %s::bigint[]) AS d(giveaway_id, user_id)
+        WHERE e.giveaway_id = d.giveaway_id AND e.user_id = d.user_id
+    """
+
+    def __init__(self, db, config: Optional[EntryJournalConfig] = None):
+        self.db = db
+        self.config = config or EntryJournalConfig()
+
+        self._upserts: Dict[EntryKey, Tuple[datetime, bool]] = {}  # -> (inscription, ligne déjà en base)
+        self._deletes: Set[EntryKey] = set()
+        self._attempts: Dict[EntryKey, int] = {}  # Échecs d'écriture du changement en attente
+        self._failed_flushes = 0                  # Flushs consécutifs en échec (backoff)
+        self._flush_requested = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+        self.stats = {
+            'upserted': 0, 'deleted': 0, 'coalesced': 0,
+            'batches': 0, 'failed_batches': 0, 'dead_lettered': 0
+        }
+
+    # ============================================================================
+    # CYCLE DE VIE
+    # ============================================================================
+
+    def start(self):
+        """Démarre le flush périodique (idempotent)"""
+        if self._task is None or self._task.done():
+            self._closed = False
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Arrête la tâche de fond et écrit ce qui reste"""
+        self._closed = True
+        self._stopping.set()
+        self._flush_requested.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    @property
+    def retry_delay(self) -> float:
+        """Attente avant le prochain flush (0 si le dernier a réussi)"""
+        if not self._failed_flushes:
+            return 0.0
+        delay = self.config.retry_base_delay * 2 ** (self._failed_flushes - 1)
+        return min(delay, self.config.retry_max_delay)
+
+    async def _run(self):
+        while not self._closed:
+            delay = self.retry_delay
+            if delay:
+                # Base en échec: seul l'arrêt écourte l'attente (pas le seuil de taille)
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                try:
+                    await asyncio.wait_for(self._flush_requested.wait(), timeout=self.config.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Erreur flush participations: {e}")
+
+    # ============================================================================
+    # CHANGEMENTS
+    # ============================================================================
+
+    def record_add(self, giveaway_id: str, user_id: int, joined_at: datetime):
+        key = (giveaway_id, user_id)
+        # Retour après un retrait non encore écrit: la ligne existe peut-être
+        # en base, l'upsert la remplace (et un nouveau retrait devra la supprimer)
+        in_db = key in self._deletes
+        self._deletes.discard(key)
+        self._attempts.pop(key, None)
+        self._upserts[key] = (joined_at, in_db)
+        self._maybe_request_flush()
+
+    def record_remove(self, giveaway_id: str, user_id: int):
+        key = (giveaway_id, user_id)
+        pending = self._upserts.pop(key, None)
+        self._attempts.pop(key, None)
+        if pending is not None and not pending[1]:
+            # Inscription jamais écrite: les deux changements s'annulent
+            self.stats['coalesced'] += 1
+            return
+        self._deletes.add(key)
+        self._maybe_request_flush()
+
+    @property
+    def pending(self) -> int:
+        return len(self._upserts) + len(self._deletes)
+
+    def _maybe_request_flush(self):
+        if self.pending >= self.config.max_batch_size:
+            self._flush_requested.set()
+
+    # ============================================================================
+    # ÉCRITURE
+    # ============================================================================
+
+    async def flush(self):
+        """Écrit les changements en attente (suppressions d'abord, puis ajouts)"""
+        async with self._flush_lock:
+            if not self._upserts and not self._deletes:
+                return
+            upserts, self._upserts = self._upserts, {}
+            deletes, self._deletes = self._deletes, set()
+            failed = False
+
+            size = self.config.max_batch_size
+            delete_keys = list(deletes)
+            for start in range(0, len(delete_keys), size):
+                batch = delete_keys[start:start + size]
+                try:
+                    await self.db.execute(
+                        self.DELETE_SQL,
+                        ([g for g, _ in batch], [u for _, u in batch])
+                    )
+                    self.stats['deleted'] += len(batch)
+                    self.stats['batches'] += 1
+                    self._forget_attempts(batch)
+                except Exception as e:
+                    failed = True
+                    self.stats['failed_batches'] += 1
+                    logger.error(f"Erreur suppression participations ({len(batch)}): {e}")
+                    dropped = 0
+                    for key in batch:
+                        if key in self._upserts:
+                            continue
+                        if self._retry(key):
+                            self._deletes.add(key)
+                        else:
+                            dropped += 1
+                    self._log_dropped(dropped)
+
+            upsert_items = list(upserts.items())
+            for start in range(0, len(upsert_items), size):
+                batch = upsert_items[start:start + size]
+                try:
+                    await self.db.execute(
+                        self.UPSERT_SQL,
+                        (
+                            [g for (g, _), _ in batch],
+                            [u for (_, u), _ in batch],
+                            [joined_at for _, (joined_at, _) in batch]
+                        )
+                    )
+                    self.stats['upserted'] += len(batch)
+                    self.stats['batches'] += 1
+                    self._forget_attempts(key for key, _ in batch)
+                except Exception as e:
+                    failed = True
+                    self.stats['failed_batches'] += 1
+                    logger.error(f"Erreur écriture participations ({len(batch)}): {e}")
+                    dropped = 0
+                    for key, change in batch:
+                        if key in self._deletes or key in self._upserts:
+                            continue
+                        if self._retry(key):
+                            self._upserts[key] = change
+                        else:
+                            dropped += 1
+                    self._log_dropped(dropped)
+
+            self._failed_flushes = self._failed_flushes + 1 if failed else 0
+
+    def _retry(self, key: EntryKey) -> bool:
+        """Compte un échec d'écriture; False si le changement est abandonné"""
+        attempts = self._attempts.get(key, 0) + 1
+        if attempts < self.config.max_attempts:
+            self._attempts[key] = attempts
+            return True
+        self._attempts.pop(key, None)
+        self.stats['dead_lettered'] += 1
+        return False
+
+    def _log_dropped(self, dropped: int):
+        if dropped:
+            logger.error(
+                f"{dropped} changements de participation abandonnés après "
+                f"{self.config.max_attempts} échecs ({self.stats['dead_lettered']} au total)"
+            )
+
+    def _forget_attempts(self, keys: Iterable[EntryKey]):
+        for key in keys:
+            self._attempts.pop(key, None)
+
+    def get_stats(self) -> Dict:
+        return {'pending': self.pending, 'retry_delay': self.retry_delay, **self.stats}
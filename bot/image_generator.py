@@ -24,6 +24,8 @@ class ImageGenerationResult:
     generation_time: float = 0.0
     cost_usd: float = 0.0
     error: Optional[str] = None
+    description: Optional[str] = None  # Repli texte quand aucune image n'a pu être générée
+    cached: bool = False               # Servi depuis le cache, sans appel au modèle
 
 
 class ImageGenerator:
@@ -53,6 +55,13 @@ class ImageGenerator:
         self.api_key = api_key
         genai.configure(api_key=api_key)
         
+        # Pool de threads des appels bloquants (None: pool par défaut de la boucle);
+        # la file de jobs y met le sien, dimensionné sur ses workers
+        self.executor = None
+        
+        # Cache des images et descriptions (image_jobs.ImageStore, optionnel)
+        self.store = None
+        
         # Modèle principal pour la génération d'images
         try:
             self.image_model = genai.GenerativeModel('gemini-2.0-flash-exp-image-generation')
@@ -139,7 +148,7 @@ class ImageGenerator:
             )
             return response
         
-        response = await asyncio.to_thread(_generate)
+        response = await asyncio.get_running_loop().run_in_executor(self.executor, _generate)
         
         # Extraire l'image de la réponse
         for part in response.parts:
@@ -171,10 +180,35 @@ class ImageGenerator:
             error="Le modèle n'a pas généré d'image. Réessayez avec un prompt différent."
         )
     
+    def cache_key(self, prompt: str, style: str = "vivid", size: str = "1024x1024") -> str:
+        """
+        Clé de cache d'une image: prompt amélioré normalisé, style et taille
+        
+        Deux prompts qui ne diffèrent que par la casse, les espaces ou la
+        ponctuation donnent la même image en cache.
+        """
+        enhanced = self.store.normalize_prompt(self._enhance_prompt(prompt, style))
+        return self.store.request_key('image', 'gemini-2.0-flash-exp-image-generation', style, size, enhanced)
+    
     async def _generate_description_fallback(self, prompt: str) -> ImageGenerationResult:
         """
         Fallback: Génère une description détaillée au lieu d'une image
+        
+        La description ne dépend que du prompt (ni style ni taille): elle est
+        mise en cache sur le prompt normalisé.
         """
+        key = None
+        if self.store is not None:
+            key = self.store.request_key('description', 'gemini-1.5-flash', self.store.normalize_prompt(prompt))
+            description = await asyncio.to_thread(self.store.get_text, key)
+            if description is not None:
+                return ImageGenerationResult(
+                    success=True,
+                    model_used="gemini-1.5-flash-description",
+                    description=description,
+                    cached=True
+                )
+        
         fallback_prompt = f"""
         L'utilisateur a demandé une image de: "{prompt}"
         
@@ -190,7 +224,9 @@ class ImageGenerator:
             response = self.text_model.generate_content(fallback_prompt)
             return response.text
         
-        description = await asyncio.to_thread(_generate)
+        description = await asyncio.get_running_loop().run_in_executor(self.executor, _generate)
+        if key is not None and description:
+            await asyncio.to_thread(self.store.put_text, key, description)
         
         # Créer une "image" textuelle (on renvoie le texte qui sera affiché)
         return ImageGenerationResult(
@@ -198,7 +234,8 @@ class ImageGenerator:
             image_data=None,
             model_used="gemini-1.5-flash-description",
             cost_usd=0.0,
-            error=None  # Pas une erreur, juste un fallback
+            error=None,  # Pas une erreur, juste un fallback
+            description=description
         )
     
     def _enhance_prompt(self, prompt: str, style: str) -> str:
@@ -298,15 +335,8 @@ class ImageGenerator:
         Incrémente le compteur d'images générées pour un utilisateur
         """
         try:
-            result = db.client.table('users').select('images_generated_today').eq('user_id', user_id).execute()
-            
-            if result.data:
-                current = result.data[0].get('images_generated_today', 0)
-                db.client.table('users').update({
-                    'images_generated_today': current + 1
-                }).eq('user_id', user_id).execute()
-                return True
-            return False
+            # RPC atomique (pas de lecture puis écriture) qui invalide le profil en cache
+            return db.increment_images_generated(user_id) is not None
         except Exception as e:
             print(f"❌ Erreur incrémentation usage: {e}")
             return False
@@ -346,8 +376,9 @@ class ImageGenerator:
         if not result.success:
             return {'success': False, 'error': result.error}
         
-        # 4. Incrémenter usage
-        self.increment_usage(user_id, db)
+        # 4. Incrémenter usage (pas pour un résultat servi depuis le cache)
+        if not result.cached:
+            self.increment_usage(user_id, db)
         
         # 5. Logger
         try:
@@ -381,8 +412,8 @@ class ImageGenerator:
             return {
                 'success': True,
                 'text_fallback': True,
-                'description': "Service d'images temporairement indisponible",
-                'remaining': quota_info['remaining'] - 1
+                'description': result.description or "Service d'images temporairement indisponible",
+                'remaining': quota_info['remaining'] - (0 if result.cached else 1)
             }
 
 
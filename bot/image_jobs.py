@@ -0,0 +1,575 @@
+"""
+FILE DE GÉNÉRATION D'IMAGES - Shellia AI Bot
+Jobs d'images: pool de workers borné, limites par utilisateur et globales, stockage adressé par contenu
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+
+class ImageJobRejected(Exception):
+    """Job refusé: file pleine ou trop de jobs en cours pour l'utilisateur"""
+
+
+class JobStatus(Enum):
+    """États d'un job d'image"""
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+# ============================================================================
+# STOCKAGE
+# ============================================================================
+
+@dataclass
+class StoreEntry:
+    """Entrée de l'index en mémoire (le contenu reste sur disque)"""
+    kind: str                          # 'image' ou 'description'
+    size: int                          # Octets comptés dans la borne du cache
+    digest: Optional[str] = None       # Blob de l'image
+    mime_type: str = "image/png"
+
+
+class ImageStore:
+    """
+    Cache disque adressé par contenu, borné en taille (LRU)
+
+    blobs/<sha256 des octets>      : l'image, écrite une seule fois
+    requests/<clé de la demande>   : métadonnées (JSON) et texte des descriptions
+
+    Une demande identique (nouvel essai, renvoi) retrouve l'image sans
+    nouvelle génération; deux demandes qui produisent les mêmes octets
+    partagent le même blob. Les descriptions de repli sont gardées sous
+    leur propre clé. Seul l'index (clé -> digest, taille) est en mémoire;
+    au-delà de `max_bytes`, les demandes les moins récemment servies sont
+    oubliées et leurs blobs supprimés quand plus rien n'y renvoie.
+    Écritures atomiques (fichier temporaire + rename).
+    """
+
+    def __init__(self, root: str, max_bytes: int = 500 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._blobs = os.path.join(root, 'blobs')
+        self._requests = os.path.join(root, 'requests')
+        os.makedirs(self._blobs, exist_ok=True)
+        os.makedirs(self._requests, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._index: OrderedDict = OrderedDict()      # clé -> StoreEntry, du plus ancien au plus récent
+        self._refs: Counter = Counter()               # digest -> demandes qui y renvoient
+        self.total_bytes = 0
+
+        # Statistiques
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+        self.evictions = 0
+
+        self._load_index()
+
+    @staticmethod
+    def normalize_prompt(prompt: str) -> str:
+        """Prompt réduit à ses mots (casse, espaces et ponctuation ignorés)"""
+        return ' '.join(re.findall(r'\w+', prompt.lower()))
+
+    @staticmethod
+    def request_key(*parts: str) -> str:
+        """Clé d'une demande (type, modèle, style, taille, prompt normalisé...)"""
+        return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self._blobs, digest[:2], digest)
+
+    def _request_path(self, key: str) -> str:
+        return os.path.join(self._requests, key[:2], key)
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _load_index(self):
+        """Reconstruit l'index depuis le disque (ordre LRU: date de dernier accès)"""
+        found = []
+        for dirpath, _, filenames in os.walk(self._requests):
+            for name in filenames:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        meta = json.load(f)
+                    found.append((os.path.getmtime(path), name, meta))
+                except (OSError, ValueError):
+                    continue
+
+        for _, key, meta in sorted(found, key=lambda item: item[0]):
+            entry = StoreEntry(
+                kind=meta.get('kind', 'image'),
+                size=meta.get('size', 0),
+                digest=meta.get('digest'),
+                mime_type=meta.get('mime_type', 'image/png')
+            )
+            self._add(key, entry)
+        self._evict()
+
+    # ============================================================================
+    # INDEX
+    # ============================================================================
+
+    def _add(self, key: str, entry: StoreEntry):
+        previous = self._index.pop(key, None)
+        if previous is not None:
+            self._release(previous)
+        self._index[key] = entry
+        if not entry.digest:
+            self.total_bytes += entry.size
+            return
+        # Un blob partagé n'occupe le disque qu'une fois
+        if self._refs[entry.digest] == 0:
+            self.total_bytes += entry.size
+        self._refs[entry.digest] += 1
+
+    def _release(self, entry: StoreEntry) -> Optional[str]:
+        """Retire une entrée des compteurs; retourne le blob devenu orphelin"""
+        if not entry.digest:
+            self.total_bytes -= entry.size
+            return None
+        self._refs[entry.digest] -= 1
+        if self._refs[entry.digest] > 0:
+            return None
+        del self._refs[entry.digest]
+        self.total_bytes -= entry.size
+        return entry.digest
+
+    def _evict(self):
+        """Oublie les demandes les moins récentes tant que la borne est dépassée"""
+        while self.total_bytes > self.max_bytes and self._index:
+            key, entry = self._index.popitem(last=False)
+            orphan = self._release(entry)
+            self.evictions += 1
+            for path in (self._request_path(key), self._blob_path(orphan) if orphan else None):
+                if path:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+    def _touch(self, key: str):
+        """Marque la demande comme récente (en mémoire et sur disque pour le redémarrage)"""
+        self._index.move_to_end(key)
+        try:
+            os.utime(self._request_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _forget(self, key: str):
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self._release(entry)
+
+    # ============================================================================
+    # LECTURE / ÉCRITURE (bloquant: via asyncio.to_thread)
+    # ============================================================================
+
+    def put(self, key: str, data: bytes, mime_type: str) -> str:
+        """Enregistre l'image d'une demande; retourne son digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        meta = {'kind': 'image', 'digest': digest, 'mime_type': mime_type, 'size': len(data)}
+
+        # Sous le verrou: une éviction concurrente ne supprime pas un blob en cours de référencement
+        with self._lock:
+            blob = self._blob_path(digest)
+            if not os.path.exists(blob):
+                self._write_atomic(blob, data)
+            self._write_atomic(self._request_path(key), json.dumps(meta).encode('utf-8'))
+            self._add(key, StoreEntry(kind='image', size=len(data), digest=digest, mime_type=mime_type))
+            self._evict()
+        return digest
+
+    def put_text(self, key: str, text: str):
+        """Enregistre une description de repli"""
+        size = len(text.encode('utf-8'))
+        data = json.dumps({'kind': 'description', 'size': size, 'text': text}, ensure_ascii=False).encode('utf-8')
+
+        with self._lock:
+            self._write_atomic(self._request_path(key), data)
+            self._add(key, StoreEntry(kind='description', size=size))
+            self._evict()
+
+    def lookup(self, key: str) -> Optional[StoreEntry]:
+        """Image déjà produite pour cette demande, ou None"""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None and entry.digest and not os.path.exists(self._blob_path(entry.digest)):
+                self._forget(key)
+                entry = None
+            if entry is None or entry.kind != 'image':
+                self.misses['image'] += 1
+                return None
+            self.hits['image'] += 1
+            self._touch(key)
+            return entry
+
+    def get_text(self, key: str) -> Optional[str]:
+        """Description déjà produite pour cette demande, ou None"""
+        with self._lock:
+            entry = self._index.get(key)
+            text = None
+            if entry is not None and entry.kind == 'description':
+                try:
+                    with open(self._request_path(key), encoding='utf-8') as f:
+                        text = json.load(f).get('text')
+                except (OSError, ValueError):
+                    self._forget(key)
+            if text is None:
+                self.misses['description'] += 1
+                return None
+            self.hits['description'] += 1
+            self._touch(key)
+            return text
+
+    def read(self, digest: str) -> bytes:
+        with open(self._blob_path(digest), 'rb') as f:
+            return f.read()
+
+    def get_stats(self) -> Dict:
+        """Taux de succès par type, occupation et évictions"""
+        def rate(kind):
+            total = self.hits[kind] + self.misses[kind]
+            return {
+                'hits': self.hits[kind],
+                'misses': self.misses[kind],
+                'hit_rate': self.hits[kind] / total if total else 0.0,
+            }
+
+        return {
+            'images': rate('image'),
+            'descriptions': rate('description'),
+            'entries': len(self._index),
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions,
+        }
+
+
+# ============================================================================
+# JOBS
+# ============================================================================
+
+@dataclass
+class ImageJobConfig:
+    """Configuration de la file d'images"""
+    workers: int = 2                  # Générations simultanées (limite globale)
+    max_queue: int = 50               # Jobs en attente au-delà desquels on refuse
+    per_user_limit: int = 1           # Jobs actifs (en file ou en cours) par utilisateur
+    max_jobs_kept: int = 1000         # Jobs terminés gardés pour le suivi
+    model: str = 'gemini-2.0-flash-exp-image-generation'
+
+
+@dataclass
+class ImageJob:
+    """Un job d'image et son état"""
+    job_id: str
+    user_id: int
+    prompt: str
+    style: str
+    size: str
+    key: str
+    status: JobStatus = JobStatus.QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    digest: Optional[str] = None       # Image dans le store
+    mime_type: str = "image/png"
+    model_used: str = ""
+    cached: bool = False               # Servi depuis le store, sans génération
+    description: Optional[str] = None  # Description de repli (pas d'image)
+    error: Optional[str] = None
+    follows: Optional[str] = None      # Job qui produit l'image (demande identique déjà en cours)
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.DONE, JobStatus.FAILED)
+
+
+class ImageJobQueue:
+    """
+    File de jobs d'images
+
+    submit() retourne tout de suite un job (identifiant + statut à suivre).
+    `workers` tâches consomment la file; les appels bloquants du SDK
+    passent par un pool de threads de même taille (jamais plus de
+    `workers` générations en parallèle). Une demande déjà produite est
+    servie depuis le store; une demande identique déjà en cours donne un
+    job propre à l'appelant (limites, suivi et décompte à son nom) qui
+    attend le résultat de la génération existante.
+    """
+
+    def __init__(
+        self,
+        generate: Callable[[ImageJob], Awaitable],
+        store: ImageStore,
+        config: Optional[ImageJobConfig] = None,
+        key_fn: Optional[Callable[[str, str, str], str]] = None,
+        charge: Optional[Callable[[ImageJob], Awaitable]] = None
+    ):
+        """
+        Args:
+            generate: coroutine (job) -> ImageGenerationResult; appelée
+                uniquement quand l'image n'est pas déjà dans le store
+            key_fn: (prompt, style, taille) -> clé du store
+                (ImageGenerator.cache_key: prompt amélioré normalisé)
+            charge: coroutine (job) appelée pour chaque job qui reçoit une
+                image réellement générée (job d'origine et jobs rattachés)
+        """
+        self.generate = generate
+        self.store = store
+        self.config = config or ImageJobConfig()
+        self.key_fn = key_fn or self._default_key
+        self.charge = charge
+        self.executor = ThreadPoolExecutor(max_workers=self.config.workers, thread_name_prefix='image-job')
+
+        self._queue: Deque[ImageJob] = deque()
+        self._available = asyncio.Event()
+        self._jobs: OrderedDict = OrderedDict()       # job_id -> ImageJob
+        self._inflight: Dict[str, ImageJob] = {}      # clé de demande -> job qui génère
+        self._followers: Dict[str, List[ImageJob]] = {}   # job_id -> jobs rattachés
+        self._active_jobs: Set[str] = set()            # Jobs comptés dans la limite par utilisateur
+        self._active_by_user: Dict[int, int] = {}
+        self._workers = []
+        self._closed = False
+
+        # Statistiques
+        self.generated = 0
+        self.failed = 0
+        self.store_hits = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def _default_key(self, prompt: str, style: str, size: str) -> str:
+        return self.store.request_key('image', self.config.model, style, size, self.store.normalize_prompt(prompt))
+
+    # ============================================================================
+    # CYCLE DE VIE
+    # ============================================================================
+
+    def start(self):
+        """Démarre les workers (idempotent)"""
+        if self._workers:
+            return
+        self._closed = False
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.config.workers)]
+
+    async def stop(self):
+        """Arrête les workers après les jobs en cours; les jobs en file échouent"""
+        self._closed = True
+        self._available.set()
+        if self._workers:
+            await asyncio.gather(*self._workers)
+            self._workers = []
+        while self._queue:
+            self._finish(self._queue.popleft(), error="Service d'images arrêté")
+        self.executor.shutdown(wait=False)
+
+    # ============================================================================
+    # SOUMISSION / SUIVI
+    # ============================================================================
+
+    async def submit(self, user_id: int, prompt: str, style: str = "vivid", size: str = "1024x1024") -> ImageJob:
+        """
+        Crée un job (servi depuis le store, rattaché à une génération en cours, ou mis en file)
+
+        Raises:
+            ImageJobRejected: file pleine ou limite par utilisateur atteinte
+        """
+        key = self.key_fn(prompt, style, size)
+        job = ImageJob(
+            job_id=uuid.uuid4().hex[:10],
+            user_id=user_id,
+            prompt=prompt,
+            style=style,
+            size=size,
+            key=key
+        )
+
+        # Déjà produite: aucun appel au modèle
+        found = await asyncio.to_thread(self.store.lookup, key)
+        if found:
+            job.digest, job.mime_type = found.digest, found.mime_type
+            job.model_used = self.config.model
+            job.cached = True
+            self.store_hits += 1
+            self._remember(job)
+            self._finish(job)
+            return job
+
+        if self._active_by_user.get(user_id, 0) >= self.config.per_user_limit:
+            self.rejected += 1
+            raise ImageJobRejected("⏳ Tu as déjà une image en cours de génération, attends qu'elle soit prête !")
+        if len(self._queue) >= self.config.max_queue:
+            self.rejected += 1
+            raise ImageJobRejected("⏳ Beaucoup d'images en cours de génération, réessaie dans quelques minutes.")
+
+        self._remember(job)
+        self._active_jobs.add(job.job_id)
+        self._active_by_user[user_id] = self._active_by_user.get(user_id, 0) + 1
+
+        # Même demande en cours: ce job attend le résultat de la génération existante
+        leader = self._inflight.get(key)
+        if leader is not None:
+            job.follows = leader.job_id
+            job.status, job.started_at = leader.status, leader.started_at
+            self._followers.setdefault(leader.job_id, []).append(job)
+            self.coalesced += 1
+            return job
+
+        self._inflight[key] = job
+        self._queue.append(job)
+        self._available.set()
+        return job
+
+    def get(self, job_id: str) -> Optional[ImageJob]:
+        return self._jobs.get(job_id)
+
+    def position(self, job: ImageJob) -> int:
+        """Rang dans la file (0: en cours ou terminé)"""
+        if job.follows is not None:
+            leader = self._jobs.get(job.follows)
+            return self.position(leader) if leader else 0
+        if job.status != JobStatus.QUEUED:
+            return 0
+        for i, queued in enumerate(self._queue, start=1):
+            if queued is job:
+                return i
+        return 0
+
+    async def wait(self, job: ImageJob, timeout: Optional[float] = None) -> ImageJob:
+        """Attend la fin du job (au plus `timeout` secondes; le job continue au-delà)"""
+        try:
+            await asyncio.wait_for(job.done.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job
+
+    def read_image(self, job: ImageJob) -> Optional[bytes]:
+        """Octets de l'image d'un job terminé"""
+        return self.store.read(job.digest) if job.digest else None
+
+    # ============================================================================
+    # WORKERS
+    # ============================================================================
+
+    async def _worker(self):
+        while True:
+            while not self._queue and not self._closed:
+                self._available.clear()
+                await self._available.wait()
+            if self._closed:
+                return
+
+            job = self._queue.popleft()
+            job.status = JobStatus.RUNNING
+            job.started_at = time.time()
+            for follower in self._followers.get(job.job_id, ()):
+                follower.status, follower.started_at = job.status, job.started_at
+            try:
+                result = await self.generate(job)
+                if result.success and result.image_data:
+                    job.digest = await asyncio.to_thread(
+                        self.store.put, job.key, result.image_data, result.mime_type
+                    )
+                    job.mime_type = result.mime_type
+                    job.model_used = result.model_used
+                    job.cached = result.cached
+                    self.generated += 1
+                    delivered = [job, *self._finish(job)]
+                    if not job.cached:
+                        await self._charge(delivered)
+                elif result.success and result.description:
+                    # Repli texte (éventuellement déjà en cache côté générateur)
+                    job.description = result.description
+                    job.model_used = result.model_used
+                    job.cached = result.cached
+                    self._finish(job)
+                else:
+                    self._finish(job, error=result.error or "Le modèle n'a pas généré d'image.")
+            except Exception as e:
+                print(f"❌ Job image {job.job_id}: {e}")
+                self._finish(job, error="Erreur lors de la génération de l'image. Réessayez plus tard.")
+
+    def _finish(self, job: ImageJob, error: Optional[str] = None) -> List[ImageJob]:
+        """Termine un job et ceux qui lui sont rattachés (retournés)"""
+        job.finished_at = time.time()
+        job.status = JobStatus.FAILED if error else JobStatus.DONE
+        job.error = error
+        if error:
+            self.failed += 1
+
+        if self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+        if job.job_id in self._active_jobs:
+            self._active_jobs.discard(job.job_id)
+            remaining = self._active_by_user.get(job.user_id, 1) - 1
+            if remaining > 0:
+                self._active_by_user[job.user_id] = remaining
+            else:
+                self._active_by_user.pop(job.user_id, None)
+        job.done.set()
+
+        followers = self._followers.pop(job.job_id, [])
+        for follower in followers:
+            follower.digest, follower.mime_type = job.digest, job.mime_type
+            follower.model_used, follower.cached = job.model_used, job.cached
+            follower.description = job.description
+            self._finish(follower, error)
+        return followers
+
+    async def _charge(self, jobs: List[ImageJob]):
+        """Décompte l'image de chaque appelant servi par la génération"""
+        if self.charge is None:
+            return
+        for job in jobs:
+            try:
+                await self.charge(job)
+            except Exception as e:
+                print(f"⚠️ Erreur quota image (job {job.job_id}): {e}")
+
+    def _remember(self, job: ImageJob):
+        """Garde le job pour le suivi; oublie les plus anciens jobs terminés"""
+        self._jobs[job.job_id] = job
+        while len(self._jobs) > self.config.max_jobs_kept:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if not oldest.finished:
+                break
+            del self._jobs[oldest_id]
+
+    def get_stats(self) -> Dict:
+        """Retourne les statistiques de la file"""
+        return {
+            'queued': len(self._queue),
+            'running': sum(1 for job in self._inflight.values() if job.status == JobStatus.RUNNING),
+            'workers': self.config.workers,
+            'generated': self.generated,
+            'failed': self.failed,
+            'store_hits': self.store_hits,
+            'coalesced': self.coalesced,
+            'rejected': self.rejected,
+            'store': self.store.get_stats(),
+        }
@@ -0,0 +1,369 @@
+"""
+ROUTAGE DES MODÈLES - Shellia AI Bot
+Santé des modèles (latence, erreurs), requêtes couvertes et repli en chaîne
+"""
+
+import asyncio
+import time
+from collections import Counter, deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, AsyncContextManager, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+try:
+    from deadline import DeadlineExceeded
+    DEADLINE_AVAILABLE = True
+except ImportError:
+    DEADLINE_AVAILABLE = False
+
+
+# Message quand aucun modèle de la chaîne n'est disponible
+UNAVAILABLE_MESSAGE = "🔄 Le service IA est temporairement indisponible. Réessayez dans quelques minutes."
+
+
+class NoModelAvailableError(Exception):
+    """Tous les circuits de la chaîne de repli sont ouverts"""
+
+
+@dataclass
+class RoutingConfig:
+    """Configuration du routage"""
+    hedge_delay: Optional[float] = 4.0     # Sans premier token après ce délai: requête couverte (None: jamais)
+    unhealthy_error_rate: float = 0.5      # Au-delà: requête couverte sans attendre
+    min_samples: int = 10                  # Appels avant de juger la santé d'un modèle
+    window: int = 200                      # Derniers appels gardés par modèle
+    max_decisions: int = 1000              # Décisions gardées pour analyse
+
+
+def _is_deadline(error: BaseException) -> bool:
+    return DEADLINE_AVAILABLE and isinstance(error, DeadlineExceeded)
+
+
+def _percentile(samples, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(pct * len(ordered)))]
+
+
+class ModelHealth:
+    """Fenêtre glissante des derniers appels d'un modèle"""
+
+    def __init__(self, window: int):
+        self.latencies: Deque[float] = deque(maxlen=window)     # Durée totale (succès)
+        self.first_token: Deque[float] = deque(maxlen=window)   # Délai avant le premier texte
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+
+    def record(self, ok: bool, latency: float, first_token: Optional[float] = None):
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(latency)
+        if first_token is not None:
+            self.first_token.append(first_token)
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def snapshot(self) -> Dict:
+        return {
+            'calls': len(self.outcomes),
+            'error_rate': self.error_rate,
+            'p50': _percentile(self.latencies, 0.50),
+            'p95': _percentile(self.latencies, 0.95),
+            'first_token_p50': _percentile(self.first_token, 0.50),
+            'first_token_p95': _percentile(self.first_token, 0.95),
+        }
+
+
+@dataclass
+class RoutingDecision:
+    """Trace d'une requête routée"""
+    requested: str
+    chosen: Optional[str]         # Modèle qui a répondu (None: échec)
+    reason: str                   # primary / hedge / fallback / breaker_open / failed / shed / unavailable
+    attempts: List[str]           # Modèles lancés, dans l'ordre
+    skipped: List[str]            # Modèles écartés (circuit ouvert)
+    hedged: bool
+    latency: float
+    at: float = field(default_factory=time.time)
+
+
+class RouteAttempt:
+    """
+    Un essai sur un modèle
+
+    `dispatch()` marque l'envoi au modèle (après l'attente en file): les durées
+    et le délai de couverture partent de là. `mark_progress()` signale le
+    premier texte reçu.
+    """
+    __slots__ = ('model', 'kind', 'started_at', 'first_token_at', 'slot', 'dispatched', 'progressed')
+
+    def __init__(self, model: str, kind: str):
+        self.model = model
+        self.kind = kind              # primary / hedge / fallback
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.slot: Any = None         # Place obtenue par `admit` (ex. Grant de l'ordonnanceur)
+        self.dispatched = asyncio.Event()
+        self.progressed = asyncio.Event()
+
+    def dispatch(self, slot: Any = None):
+        self.slot = slot
+        self.started_at = time.perf_counter()
+        self.dispatched.set()
+
+    def mark_progress(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            self.progressed.set()
+
+
+class ModelRouter:
+    """
+    Routage des appels Gemini selon la santé des modèles
+
+    - p50/p95 (durée et premier token) et taux d'erreur glissants par modèle
+    - Modèle dont le circuit est ouvert: repli sur le suivant de la chaîne
+      (PRO -> FLASH -> FLASH_LITE), sans appel
+    - Sans premier token après `hedge_delay` (immédiatement si le modèle est
+      en mauvaise santé), une requête couverte part sur le modèle suivant:
+      la première réponse gagne, l'autre est annulée
+    - Échec: essai suivant de la chaîne
+    - `admit` (ex. place dans l'ordonnanceur) est attendu hors du circuit et
+      de la santé du modèle: un refus avant envoi (délestage) ou une échéance
+      dépassée n'est pas une panne, ni couvert ni replié
+    - Chaque décision est gardée (decisions()) pour analyse
+    """
+
+    def __init__(
+        self,
+        chain: Optional[Dict[str, str]] = None,
+        config: Optional[RoutingConfig] = None,
+        breakers: Optional[Dict[str, Any]] = None
+    ):
+        self.chain = chain or {}
+        self.config = config or RoutingConfig()
+        # Modèle -> CircuitBreaker; dict partagé, rempli éventuellement plus tard
+        self.breakers = breakers if breakers is not None else {}
+
+        self.health: Dict[str, ModelHealth] = {}
+        self._decisions: Deque[RoutingDecision] = deque(maxlen=self.config.max_decisions)
+
+        # Statistiques
+        self.reasons: Counter = Counter()
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    # ============================================================================
+    # SANTÉ
+    # ============================================================================
+
+    def _health(self, model: str) -> ModelHealth:
+        health = self.health.get(model)
+        if health is None:
+            health = self.health[model] = ModelHealth(self.config.window)
+        return health
+
+    def is_available(self, model: str) -> bool:
+        """Le circuit du modèle accepterait-il un appel ?"""
+        breaker = self.breakers.get(model)
+        return breaker is None or breaker.allows_request()
+
+    def is_unhealthy(self, model: str) -> bool:
+        health = self.health.get(model)
+        return (
+            health is not None
+            and len(health.outcomes) >= self.config.min_samples
+            and health.error_rate >= self.config.unhealthy_error_rate
+        )
+
+    def candidates(self, model: str) -> Tuple[List[str], List[str]]:
+        """(modèles utilisables, modèles écartés) en descendant la chaîne depuis `model`"""
+        available, skipped = [], []
+        seen = set()
+        while model and model not in seen:
+            seen.add(model)
+            (available if self.is_available(model) else skipped).append(model)
+            model = self.chain.get(model)
+        return available, skipped
+
+    def _hedge_timeout(self, attempt: RouteAttempt) -> Optional[float]:
+        if self.is_unhealthy(attempt.model):
+            return 0.0
+        if self.config.hedge_delay is None:
+            return None
+        return max(self.config.hedge_delay - (time.perf_counter() - attempt.started_at), 0.0)
+
+    # ============================================================================
+    # EXÉCUTION
+    # ============================================================================
+
+    async def run(
+        self,
+        model: str,
+        call: Callable[[RouteAttempt], Awaitable[Any]],
+        admit: Optional[Callable[[RouteAttempt], AsyncContextManager]] = None
+    ) -> Tuple[Any, RouteAttempt]:
+        """
+        Exécute `call(attempt)` sur `model` ou ses replis
+
+        Avec `admit`, chaque essai entre d'abord dans `admit(attempt)` (place
+        rendue à la fin de l'essai), puis est envoyé au modèle.
+
+        Returns:
+            (résultat, essai gagnant)
+
+        Raises:
+            NoModelAvailableError: tous les circuits sont ouverts
+            Exception: erreur du dernier essai si tous ont échoué
+        """
+        started = time.perf_counter()
+        pending, skipped = self.candidates(model)
+        pending = deque(pending)
+
+        if not pending:
+            self._record(model, None, 'unavailable', [], skipped, False, started)
+            raise NoModelAvailableError(UNAVAILABLE_MESSAGE)
+
+        tasks: Dict[asyncio.Task, RouteAttempt] = {}
+        attempts: List[str] = []
+        hedged = False
+        shed = False
+        last_error: Optional[BaseException] = None
+
+        def launch(kind: str) -> RouteAttempt:
+            attempt = RouteAttempt(pending.popleft(), kind)
+            attempts.append(attempt.model)
+            tasks[asyncio.create_task(self._attempt(attempt, call, admit))] = attempt
+            return attempt
+
+        launch('primary')
+        try:
+            while tasks:
+                waiters = set(tasks)
+                timeout = None
+                progress = None
+
+                # Un seul essai en cours, encore muet: couverture possible
+                if not hedged and pending and len(tasks) == 1:
+                    current = next(iter(tasks.values()))
+                    if not current.dispatched.is_set():
+                        # Encore en file: le délai de couverture part de l'envoi
+                        progress = asyncio.create_task(current.dispatched.wait())
+                        waiters.add(progress)
+                    elif not current.progressed.is_set():
+                        timeout = self._hedge_timeout(current)
+                        if timeout is not None:
+                            progress = asyncio.create_task(current.progressed.wait())
+                            waiters.add(progress)
+
+                try:
+                    done, _ = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    if progress is not None:
+                        progress.cancel()
+
+                finished = [task for task in done if task in tasks]
+                if not finished:
+                    if progress is None or not progress.done():
+                        launch('hedge')
+                        hedged = True
+                        self.hedges += 1
+                    continue
+
+                for task in finished:
+                    attempt = tasks.pop(task)
+                    if task.exception() is None:
+                        reason = 'breaker_open' if skipped and attempt.kind == 'primary' else attempt.kind
+                        if attempt.kind == 'hedge':
+                            self.hedge_wins += 1
+                        self._record(model, attempt.model, reason, attempts, skipped, hedged, started)
+                        return task.result(), attempt
+                    last_error = task.exception()
+                    if not attempt.dispatched.is_set() or _is_deadline(last_error):
+                        # Délestage ou échéance: un autre modèle n'y changerait rien
+                        shed = True
+                        pending.clear()
+
+                if not tasks and pending:
+                    launch('fallback')
+        finally:
+            # Perdant d'une course, ou appelant annulé
+            for task in tasks:
+                task.cancel()
+
+        self._record(model, None, 'shed' if shed else 'failed', attempts, skipped, hedged, started)
+        raise last_error
+
+    async def _attempt(
+        self,
+        attempt: RouteAttempt,
+        call: Callable[[RouteAttempt], Awaitable[Any]],
+        admit: Optional[Callable[[RouteAttempt], AsyncContextManager]]
+    ) -> Any:
+        if admit is None:
+            attempt.dispatch()
+            return await self._dispatch(attempt, call)
+
+        # L'attente d'une place ne compte ni pour le circuit ni pour la santé
+        async with admit(attempt) as slot:
+            attempt.dispatch(slot)
+            return await self._dispatch(attempt, call)
+
+    async def _dispatch(self, attempt: RouteAttempt, call: Callable[[RouteAttempt], Awaitable[Any]]) -> Any:
+        health = self._health(attempt.model)
+        breaker = self.breakers.get(attempt.model)
+        try:
+            if breaker is not None:
+                result = await breaker.call(call, attempt)
+            else:
+                result = await call(attempt)
+        except Exception as e:
+            # Temps de la requête épuisé: pas un verdict sur le modèle
+            if not _is_deadline(e):
+                health.record(False, time.perf_counter() - attempt.started_at)
+            raise
+
+        now = time.perf_counter()
+        first_token = attempt.first_token_at - attempt.started_at if attempt.first_token_at else None
+        health.record(True, now - attempt.started_at, first_token)
+        return result
+
+    # ============================================================================
+    # DÉCISIONS / STATISTIQUES
+    # ============================================================================
+
+    def _record(self, requested, chosen, reason, attempts, skipped, hedged, started):
+        self.reasons[reason] += 1
+        self._decisions.append(RoutingDecision(
+            requested=requested,
+            chosen=chosen,
+            reason=reason,
+            attempts=list(attempts),
+            skipped=list(skipped),
+            hedged=hedged,
+            latency=time.perf_counter() - started
+        ))
+
+    def decisions(self, limit: Optional[int] = None) -> List[Dict]:
+        """Dernières décisions (les plus récentes en dernier)"""
+        items = list(self._decisions)
+        if limit is not None:
+            items = items[-limit:]
+        return [asdict(d) for d in items]
+
+    def get_stats(self) -> Dict:
+        """Santé par modèle et répartition des décisions"""
+        models = {}
+        for model, health in self.health.items():
+            models[model] = health.snapshot()
+            breaker = self.breakers.get(model)
+            models[model]['breaker'] = breaker.current_state if breaker is not None else None
+        return {
+            'models': models,
+            'reasons': dict(self.reasons),
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+        }
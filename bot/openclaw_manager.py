@@ -16,6 +16,11 @@ import random
 import logging
 from collections import defaultdict
 
+try:
+    from user_cache import user_cache
+except ImportError:
+    user_cache = None
+
 logger = logging.getLogger(__name__)
 
 
@@ -728,6 +733,8 @@ class OpenClawManager:
                 "UPDATE users SET plan = %s, plan_expires_at = %s WHERE user_id = %s",
                 (self.config.winner_plan_type, plan_end, user_id)
             )
+            if user_cache:
+                user_cache.invalidate(user_id)
             
         # 3. Envoyer message de félicitations avec infos
         await self._send_winner_notification(user_id, giveaway_id, plan_end)
@@ -837,6 +844,8 @@ class OpenClawManager:
                 """,
                 (user_id, self.config.winner_plan_type)
             )
+            if user_cache:
+                user_cache.invalidate(user_id)
             
             # Notifier l'utilisateur
             try:
@@ -3,13 +3,22 @@ RATE LIMITER PERSISTANT - Shellia AI Bot
 Rate limiting distribué avec Redis ou fallback Supabase
 """
 
+import math
 import time
-from typing import Optional, Tuple
-from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+from datetime import datetime, timedelta, timezone
 from dataclasses import dataclass
 import json
 
 
+try:
+    from config import PLANS, SecurityConfig
+    from rate_limit_engine import RateLimitEngine, MemoryGCRABackend, RedisGCRABackend
+    RATE_LIMIT_ENGINE_AVAILABLE = True
+except ImportError:
+    RATE_LIMIT_ENGINE_AVAILABLE = False
+
+
 @dataclass
 class RateLimitStatus:
     """Status du rate limit pour un utilisateur"""
@@ -24,15 +33,15 @@ class RateLimitStatus:
 class PersistentRateLimiter:
     """
     Rate limiter persistant qui utilise Redis si disponible,
-    sinon fallback sur Supabase
+    sinon compteurs en mémoire avec checkpoints périodiques dans Supabase
     """
     
-    def __init__(self, db, redis_client=None):
+    def __init__(self, db, redis_client=None, engine=None):
         self.db = db
         self.redis = redis_client
         
         # Configuration
-        self.COOLDOWN_SECONDS = 3
+        self.COOLDOWN_SECONDS = SecurityConfig.COOLDOWN_SECONDS if RATE_LIMIT_ENGINE_AVAILABLE else 3
         self.MAX_PER_MINUTE = 10
         self.MAX_PER_HOUR = 100
         self.SPAM_THRESHOLD = 5
@@ -40,6 +49,23 @@ class PersistentRateLimiter:
         # Cache local pour réduire les requêtes DB
         self._local_cache: dict = {}
         self._cache_ttl = 5  # 5 secondes
+        
+        # last_active_at: écrit par lots hors du hot path (flush_last_active)
+        self._pending_last_active: Dict[int, str] = {}
+        
+        # Moteur GCRA (cooldown + minute + heure par plan):
+        # - Redis: un seul EVALSHA par message
+        # - sans Redis: état en mémoire, aucun aller-retour DB sur le hot path,
+        #   persisté par checkpoint_counters() / restore_counters()
+        if engine is None and RATE_LIMIT_ENGINE_AVAILABLE:
+            engine = RateLimitEngine(
+                RedisGCRABackend(self.redis) if self.redis else MemoryGCRABackend(),
+                plans=PLANS,
+                cooldown_seconds=self.COOLDOWN_SECONDS,
+                default_per_minute=self.MAX_PER_MINUTE,
+                default_per_hour=self.MAX_PER_HOUR
+            )
+        self.engine = engine
     
     def _get_cache_key(self, user_id: int, key_type: str) -> str:
         """Génère une clé de cache"""
@@ -168,14 +194,12 @@ class PersistentRateLimiter:
             if timestamp:
                 last_time = datetime.fromtimestamp(float(timestamp))
         else:
-            # Récupérer depuis la DB
+            # Profil en cache uniquement: pas d'aller-retour base sur le hot path
             try:
-                result = self.db.client.table('users')\
-                    .select('last_active_at')\
-                    .eq('user_id', user_id)\
-                    .execute()
-                if result.data and result.data[0]['last_active_at']:
-                    last_time = datetime.fromisoformat(result.data[0]['last_active_at'])
+                user_cache = getattr(self.db, 'user_cache', None)
+                user = user_cache.get(user_id) if user_cache is not None else None
+                if user and user.get('last_active_at'):
+                    last_time = datetime.fromisoformat(user['last_active_at'])
             except:
                 pass
         
@@ -193,18 +217,47 @@ class PersistentRateLimiter:
             key = f"shellia:lastmsg:{user_id}"
             self.redis.setex(key, 3600, now.timestamp())
         
-        # Mettre à jour aussi dans la DB
+        self._mark_active(user_id, now)
+    
+    def _mark_active(self, user_id: int, now: datetime):
+        """Note l'activité; la DB est mise à jour plus tard par flush_last_active()"""
+        self._pending_last_active[user_id] = now.isoformat()
+        
+        # Write-through: garder le profil en cache cohérent
+        user_cache = getattr(self.db, 'user_cache', None)
+        if user_cache is not None:
+            user_cache.patch(user_id, last_active_at=now.isoformat())
+    
+    def flush_last_active(self) -> int:
+        """
+        Écrit les last_active_at en attente en un seul appel RPC
+        
+        Returns:
+            Nombre d'utilisateurs mis à jour
+        """
+        if not self._pending_last_active:
+            return 0
+        
+        pending, self._pending_last_active = self._pending_last_active, {}
         try:
-            self.db.client.table('users')\
-                .update({'last_active_at': now.isoformat()})\
-                .eq('user_id', user_id)\
-                .execute()
-        except:
-            pass
+            self.db.client.rpc('touch_last_active', {
+                'p_user_ids': list(pending.keys()),
+                'p_timestamps': list(pending.values())
+            }).execute()
+            return len(pending)
+        except Exception as e:
+            print(f"Erreur flush last_active_at: {e}")
+            # Remettre en attente sans écraser une activité plus récente
+            for user_id, timestamp in pending.items():
+                self._pending_last_active.setdefault(user_id, timestamp)
+            return 0
     
-    def check_rate_limit(self, user_id: int, is_admin: bool = False) -> RateLimitStatus:
+    def check_rate_limit(self, user_id: int, is_admin: bool = False, plan: str = None) -> RateLimitStatus:
         """
         Vérifie le rate limit pour un utilisateur
+        
+        Args:
+            plan: plan de l'utilisateur (dernier plan connu du cache si absent)
         """
         if is_admin:
             return RateLimitStatus(
@@ -215,6 +268,9 @@ class PersistentRateLimiter:
                 cooldown_remaining=0
             )
         
+        if self.engine:
+            return self._check_rate_limit_engine(user_id, plan or self._get_user_plan(user_id))
+        
         # Vérifier cooldown
         last_time = self._get_last_message_time(user_id)
         if last_time:
@@ -265,6 +321,137 @@ class PersistentRateLimiter:
             cooldown_remaining=0
         )
     
+    # ============ CHECKPOINTS (mode sans Redis) ============
+    
+    def _checkpoint_backend(self):
+        """Backend mémoire du moteur, ou None si rien à persister"""
+        backend = getattr(self.engine, 'backend', None)
+        return backend if hasattr(backend, 'drain_dirty') else None
+    
+    def checkpoint_counters(self) -> int:
+        """
+        Écrit l'état des compteurs modifiés dans rate_limits, en un seul RPC
+        
+        Une ligne par (utilisateur, période): expires_at = TAT GCRA (restauré
+        tel quel), count = messages encore "consommés" dans la fenêtre.
+        
+        Returns:
+            Nombre de lignes écrites
+        """
+        backend = self._checkpoint_backend()
+        if not backend:
+            return 0
+        
+        now = time.time()
+        entries = backend.drain_dirty(now)
+        rows = []
+        for key, tat, interval in entries:
+            user_id, period = key.rsplit(':', 1)
+            if period not in ('minute', 'hour'):
+                continue  # le cooldown (quelques secondes) n'est pas persisté
+            rows.append({
+                'user_id': int(user_id),
+                'period': period,
+                'window_start': datetime.fromtimestamp(now, timezone.utc).isoformat(),
+                'expires_at': datetime.fromtimestamp(tat, timezone.utc).isoformat(),
+                'count': math.ceil((tat - now) / interval)
+            })
+        
+        if not rows:
+            return 0
+        
+        try:
+            self.db.client.rpc('checkpoint_rate_limits', {'p_rows': rows}).execute()
+            return len(rows)
+        except Exception as e:
+            print(f"Erreur checkpoint rate limits: {e}")
+            backend.mark_dirty(entries)
+            return 0
+    
+    def restore_counters(self) -> int:
+        """
+        Reconstruit l'état mémoire depuis le dernier checkpoint (au démarrage)
+        
+        Returns:
+            Nombre de compteurs restaurés
+        """
+        backend = self._checkpoint_backend()
+        if not backend:
+            return 0
+        
+        restored = 0
+        page_size = 1000
+        now = datetime.now(timezone.utc).isoformat()
+        try:
+            while True:
+                result = self.db.client.table('rate_limits')\
+                    .select('user_id, period, expires_at')\
+                    .gt('expires_at', now)\
+                    .range(restored, restored + page_size - 1)\
+                    .execute()
+                
+                for row in result.data:
+                    tat = datetime.fromisoformat(row['expires_at'].replace('Z', '+00:00')).timestamp()
+                    backend.load(f"{row['user_id']}:{row['period']}", tat)
+                restored += len(result.data)
+                
+                if len(result.data) < page_size:
+                    break
+        except Exception as e:
+            print(f"Erreur restauration rate limits: {e}")
+        
+        return restored
+    
+    def _get_user_plan(self, user_id: int) -> str:
+        """Dernier plan connu en mémoire, 'free' sinon (jamais d'appel base)"""
+        user_cache = getattr(self.db, 'user_cache', None)
+        plan = user_cache.known_plan(user_id) if user_cache is not None else None
+        return plan or 'free'
+    
+    def _check_rate_limit_engine(self, user_id: int, plan: str) -> RateLimitStatus:
+        """Cooldown + fenêtres glissantes minute/heure via le moteur GCRA"""
+        now = datetime.now()
+        decision = self.engine.check(user_id, plan)
+        remaining_minute = decision.remaining.get('minute', 0)
+        remaining_hour = decision.remaining.get('hour', 0)
+        
+        if decision.allowed:
+            self._mark_active(user_id, now)
+            return RateLimitStatus(
+                can_proceed=True,
+                remaining_minute=remaining_minute,
+                remaining_hour=remaining_hour,
+                reset_time=now + timedelta(hours=1),
+                cooldown_remaining=0
+            )
+        
+        reset_time = now + timedelta(seconds=decision.retry_after)
+        if decision.rule == 'cooldown':
+            return RateLimitStatus(
+                can_proceed=False,
+                remaining_minute=0,
+                remaining_hour=0,
+                reset_time=reset_time,
+                cooldown_remaining=decision.retry_after,
+                reason=f"Cooldown: attente {decision.retry_after:.1f}s"
+            )
+        
+        limits = self.engine.rules_for(plan)
+        limit = next(rule.limit for rule in limits if rule.name == decision.rule)
+        if decision.rule == 'hour':
+            reason = f"Limite horaire atteinte ({limit} msg/h)"
+        else:
+            reason = f"Trop rapide ({limit} msg/min max)"
+        
+        return RateLimitStatus(
+            can_proceed=False,
+            remaining_minute=remaining_minute,
+            remaining_hour=remaining_hour,
+            reset_time=reset_time,
+            cooldown_remaining=0,
+            reason=reason
+        )
+    
     def _increment_counters(self, user_id: int):
         """Incrémente les compteurs"""
         if self.redis:
@@ -333,6 +520,9 @@ class PersistentRateLimiter:
                 if keys:
                     self.redis.delete(*keys)
         
+        if self.engine:
+            self.engine.reset(user_id)
+        
         # Vider le cache local
         for key in list(self._local_cache.keys()):
             if str(user_id) in key:
@@ -375,4 +565,35 @@ $$ LANGUAGE plpgsql;
 
 -- Nettoyage automatique des entrées expirées
 DELETE FROM rate_limits WHERE expires_at < NOW() - INTERVAL '1 day';
+
+-- Checkpoint groupé des compteurs en mémoire (mode sans Redis)
+CREATE OR REPLACE FUNCTION checkpoint_rate_limits(p_rows JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    written INTEGER;
+BEGIN
+    DELETE FROM rate_limits r
+    USING jsonb_to_recordset(p_rows) AS t(user_id BIGINT, period VARCHAR)
+    WHERE r.user_id = t.user_id AND r.period = t.period;
+    
+    INSERT INTO rate_limits (user_id, period, window_start, expires_at, count)
+    SELECT user_id, period, window_start, expires_at, count
+    FROM jsonb_to_recordset(p_rows)
+        AS t(user_id BIGINT, period VARCHAR, window_start TIMESTAMPTZ, expires_at TIMESTAMPTZ, count INTEGER);
+    
+    GET DIAGNOSTICS written = ROW_COUNT;
+    RETURN written;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Mise à jour groupée de last_active_at (flush_last_active)
+CREATE OR REPLACE FUNCTION touch_last_active(
+    p_user_ids BIGINT[],
+    p_timestamps TIMESTAMP WITH TIME ZONE[]
+) RETURNS VOID AS $$
+    UPDATE users u SET last_active_at = t.ts
+    FROM unnest(p_user_ids, p_timestamps) AS t(user_id, ts)
+    WHERE u.user_id = t.user_id
+      AND (u.last_active_at IS NULL OR u.last_active_at < t.ts);
+$$ LANGUAGE sql;
 """
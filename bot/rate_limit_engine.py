@@ -0,0 +1,239 @@
+"""
+MOTEUR DE RATE LIMITING - Shellia AI Bot
+GCRA (Generic Cell Rate Algorithm) par plan, backends mémoire et Redis
+"""
+
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class RateLimitRule:
+    """Règle: au plus `limit` messages sur `period` secondes (fenêtre glissante)"""
+    name: str
+    limit: int
+    period: float
+
+    @property
+    def interval(self) -> float:
+        """Espacement moyen entre deux messages"""
+        return self.period / self.limit
+
+
+@dataclass
+class RateLimitDecision:
+    """Résultat d'une vérification"""
+    allowed: bool
+    rule: Optional[str] = None          # Règle qui a refusé
+    retry_after: float = 0.0            # Secondes avant le prochain message possible
+    remaining: Dict[str, int] = field(default_factory=dict)
+
+
+def gcra_update(
+    tats: List[float],
+    rules: List[RateLimitRule],
+    now: float
+) -> Tuple[bool, int, float, List[float], List[int]]:
+    """
+    Cœur GCRA, sans état (partagé par les backends)
+
+    Chaque règle ne stocke qu'un instant: le TAT (theoretical arrival time).
+    Un message est accepté si, pour toutes les règles, TAT + intervalle - période <= now.
+    Tout ou rien: si une règle refuse, aucun TAT n'est avancé.
+
+    Returns:
+        (accepté, index de la règle refusante ou -1, retry_after, nouveaux TAT, restants)
+    """
+    new_tats = []
+    remaining = []
+    for i, rule in enumerate(rules):
+        tat = max(tats[i], now)
+        new_tat = tat + rule.interval
+        allow_at = new_tat - rule.period
+        if now < allow_at:
+            return False, i, allow_at - now, tats, [0] * len(rules)
+        new_tats.append(new_tat)
+        remaining.append(int(math.floor((rule.period - (new_tat - now)) / rule.interval + 1e-9)))
+    return True, -1, 0.0, new_tats, remaining
+
+
+# ============================================================================
+# BACKENDS
+# ============================================================================
+
+class MemoryGCRABackend:
+    """
+    Backend en mémoire (une instance)
+
+    Un float par (utilisateur, règle). Les TAT passés sont équivalents à une
+    absence d'état: ils sont purgés périodiquement pour borner la mémoire.
+    Les clés modifiées depuis le dernier checkpoint sont suivies (drain_dirty)
+    pour permettre une persistance par lots sans Redis.
+    """
+
+    def __init__(self, sweep_every: int = 10000):
+        self.tats: Dict[str, float] = {}
+        self.sweep_every = sweep_every
+        self._checks = 0
+        self._dirty: Dict[str, float] = {}  # clé -> intervalle de la règle
+
+    def check(self, keys: List[str], rules: List[RateLimitRule], now: float) -> Tuple[bool, int, float, List[int]]:
+        self._checks += 1
+        if self._checks % self.sweep_every == 0:
+            self.sweep(now)
+
+        tats = [self.tats.get(key, 0.0) for key in keys]
+        allowed, index, retry_after, new_tats, remaining = gcra_update(tats, rules, now)
+        if allowed:
+            for key, tat, rule in zip(keys, new_tats, rules):
+                self.tats[key] = tat
+                self._dirty[key] = rule.interval
+        return allowed, index, retry_after, remaining
+
+    def sweep(self, now: float):
+        """Supprime les TAT expirés"""
+        for key in [k for k, tat in self.tats.items() if tat <= now]:
+            del self.tats[key]
+
+    def reset(self, keys: List[str]):
+        for key in keys:
+            self.tats.pop(key, None)
+            self._dirty.pop(key, None)
+
+    def drain_dirty(self, now: float) -> List[Tuple[str, float, float]]:
+        """Retourne (clé, TAT, intervalle) des clés modifiées encore actives"""
+        dirty, self._dirty = self._dirty, {}
+        return [
+            (key, self.tats[key], interval)
+            for key, interval in dirty.items()
+            if self.tats.get(key, 0.0) > now
+        ]
+
+    def mark_dirty(self, entries: List[Tuple[str, float, float]]):
+        """Remet des clés à checkpointer (après un échec d'écriture)"""
+        for key, _, interval in entries:
+            self._dirty.setdefault(key, interval)
+
+    def load(self, key: str, tat: float):
+        """Restaure un TAT (reprise depuis un checkpoint)"""
+        self.tats[key] = max(self.tats.get(key, 0.0), tat)
+
+
+# Même algorithme que gcra_update, exécuté atomiquement côté Redis.
+# KEYS: un TAT par règle; ARGV: now, puis (limit, period) par règle
+# Retour: {accepté, index refusant (1-based, 0 si accepté), retry_after, restants...}
+GCRA_LUA = """
+local now = tonumber(ARGV[1])
+local n = #KEYS
+local new_tats = {}
+local remaining = {}
+
+for i = 1, n do
+    local limit = tonumber(ARGV[2 * i])
+    local period = tonumber(ARGV[2 * i + 1])
+    local interval = period / limit
+    local tat = tonumber(redis.call('GET', KEYS[i]) or '0')
+    if tat < now then tat = now end
+    local new_tat = tat + interval
+    local allow_at = new_tat - period
+    if now < allow_at then
+        local zeros = {}
+        for j = 1, n do zeros[j] = 0 end
+        return {0, i, tostring(allow_at - now), unpack(zeros)}
+    end
+    new_tats[i] = new_tat
+    remaining[i] = math.floor((period - (new_tat - now)) / interval + 1e-9)
+end
+
+for i = 1, n do
+    local ttl = math.ceil((new_tats[i] - now) * 1000)
+    redis.call('SET', KEYS[i], string.format('%.6f', new_tats[i]), 'PX', ttl)
+end
+
+return {1, 0, '0', unpack(remaining)}
+"""
+
+
+class RedisGCRABackend:
+    """Backend Redis (multi-instances): un EVALSHA atomique par vérification"""
+
+    def __init__(self, redis_client, key_prefix: str = "shellia:gcra"):
+        self.redis = redis_client
+        self.key_prefix = key_prefix
+        self._script = redis_client.register_script(GCRA_LUA)
+
+    def check(self, keys: List[str], rules: List[RateLimitRule], now: float) -> Tuple[bool, int, float, List[int]]:
+        args = [now]
+        for rule in rules:
+            args.extend([rule.limit, rule.period])
+
+        reply = self._script(keys=[f"{self.key_prefix}:{key}" for key in keys], args=args)
+        allowed, index, retry_after = reply[0], reply[1], reply[2]
+        retry_after = float(retry_after.decode() if isinstance(retry_after, bytes) else retry_after)
+        return bool(allowed), int(index) - 1, retry_after, [int(r) for r in reply[3:]]
+
+    def reset(self, keys: List[str]):
+        self.redis.delete(*[f"{self.key_prefix}:{key}" for key in keys])
+
+
+# ============================================================================
+# MOTEUR
+# ============================================================================
+
+class RateLimitEngine:
+    """
+    Rate limiting O(1) par message, limites par plan
+
+    Chaque plan définit messages_per_minute / messages_per_hour (config.PLANS).
+    Un cooldown optionnel est une règle GCRA de plus (1 message / N secondes).
+    """
+
+    def __init__(
+        self,
+        backend,
+        plans: Optional[Dict] = None,
+        cooldown_seconds: float = 0,
+        default_per_minute: int = 10,
+        default_per_hour: int = 100,
+        clock: Callable[[], float] = time.time
+    ):
+        self.backend = backend
+        self.clock = clock
+        self._default_rules = self._build_rules(cooldown_seconds, default_per_minute, default_per_hour)
+        self._rules_by_plan: Dict[str, List[RateLimitRule]] = {
+            key: self._build_rules(cooldown_seconds, plan.messages_per_minute, plan.messages_per_hour)
+            for key, plan in (plans or {}).items()
+        }
+
+    @staticmethod
+    def _build_rules(cooldown_seconds: float, per_minute: int, per_hour: int) -> List[RateLimitRule]:
+        rules = []
+        if cooldown_seconds > 0:
+            rules.append(RateLimitRule('cooldown', 1, cooldown_seconds))
+        rules.append(RateLimitRule('minute', per_minute, 60))
+        rules.append(RateLimitRule('hour', per_hour, 3600))
+        return rules
+
+    def rules_for(self, plan: Optional[str]) -> List[RateLimitRule]:
+        """Règles d'un plan (plan inconnu: free, sinon valeurs par défaut)"""
+        return self._rules_by_plan.get(plan) or self._rules_by_plan.get('free') or self._default_rules
+
+    def check(self, user_id: int, plan: Optional[str] = None) -> RateLimitDecision:
+        """Vérifie et consomme un message pour l'utilisateur"""
+        rules = self.rules_for(plan)
+        keys = [f"{user_id}:{rule.name}" for rule in rules]
+
+        allowed, index, retry_after, remaining = self.backend.check(keys, rules, self.clock())
+
+        return RateLimitDecision(
+            allowed=allowed,
+            rule=rules[index].name if not allowed else None,
+            retry_after=retry_after,
+            remaining={rule.name: r for rule, r in zip(rules, remaining)}
+        )
+
+    def reset(self, user_id: int, plan: Optional[str] = None):
+        """Efface l'état d'un utilisateur"""
+        self.backend.reset([f"{user_id}:{rule.name}" for rule in self.rules_for(plan)])
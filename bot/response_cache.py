@@ -0,0 +1,232 @@
+"""
+CACHE DE RÉPONSES - Shellia AI Bot
+Réponses IA réutilisées pour les questions récurrentes (prompt normalisé + modèle)
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import sys
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    Forme canonique d'une question
+
+    "C'est quoi le plan PRO ?!" et "cest quoi le plan pro" donnent la même
+    clé: minuscules, accents retirés, ponctuation supprimée, espaces réduits.
+    """
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = _PUNCTUATION.sub('', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+@dataclass
+class ResponseCacheConfig:
+    """Configuration du cache de réponses"""
+    ttl_seconds: float = 3600.0
+    max_entries: int = 2000
+    max_bytes: int = 4 * 1024 * 1024       # Budget mémoire local (contenu des réponses)
+    max_prompt_chars: int = 300            # Questions plus longues: jamais en cache
+    max_context_messages: int = 2          # Tours avec plus d'historique: jamais en cache
+    max_response_chars: int = 4000
+    redis_prefix: str = "shellia:answer"
+
+
+@dataclass
+class CachedAnswer:
+    """Une réponse en cache et ce qu'elle a coûté à produire"""
+    content: str
+    model: str
+    prompt: str                 # Prompt normalisé (stats)
+    latency: float              # Durée de l'appel d'origine (s)
+    cost_usd: float
+    created_at: float = field(default_factory=time.time)
+    hits: int = 0
+
+    @property
+    def size(self) -> int:
+        return sys.getsizeof(self.content)
+
+
+class ResponseCache:
+    """
+    Cache TTL + LRU des réponses IA
+
+    Clé: hash(modèle + prompt normalisé). Seuls les tours sans contexte ou
+    à contexte court sont éligibles (la réponse ne dépend alors que de la
+    question). Le niveau local est borné en entrées et en octets; avec un
+    client Redis, les réponses sont partagées entre instances.
+    """
+
+    def __init__(self, config: Optional[ResponseCacheConfig] = None, redis_client=None):
+        self.config = config or ResponseCacheConfig()
+        self.redis = redis_client
+
+        self._entries: OrderedDict = OrderedDict()  # clé -> (CachedAnswer, expires_at)
+        self._bytes = 0
+
+        # Statistiques
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_latency = 0.0
+        self.saved_cost_usd = 0.0
+
+    # ============================================================================
+    # CLÉS
+    # ============================================================================
+
+    def is_cacheable(self, prompt: str, context_messages: int) -> bool:
+        """Le tour est-il éligible (question courte, peu ou pas d'historique) ?"""
+        return (
+            len(prompt) <= self.config.max_prompt_chars
+            and context_messages <= self.config.max_context_messages
+            and bool(normalize_prompt(prompt))
+        )
+
+    @staticmethod
+    def make_key(model: str, prompt: str) -> str:
+        normalized = normalize_prompt(prompt)
+        return hashlib.sha256(f"{model}\n{normalized}".encode('utf-8')).hexdigest()
+
+    # ============================================================================
+    # LECTURE / ÉCRITURE
+    # ============================================================================
+
+    async def get(self, model: str, prompt: str) -> Optional[CachedAnswer]:
+        """Réponse en cache pour ce modèle et ce prompt, ou None"""
+        key = self.make_key(model, prompt)
+        answer = self._get_local(key)
+
+        if answer is None and self.redis:
+            answer = await self._get_redis(key)
+            if answer is not None:
+                self._set_local(key, answer, answer.created_at + self.config.ttl_seconds)
+
+        if answer is None:
+            self.misses += 1
+            return None
+
+        answer.hits += 1
+        self.hits += 1
+        self.saved_latency += answer.latency
+        self.saved_cost_usd += answer.cost_usd
+        return answer
+
+    async def set(self, model: str, prompt: str, content: str, latency: float, cost_usd: float):
+        """Met une réponse en cache"""
+        if len(content) > self.config.max_response_chars:
+            return
+
+        key = self.make_key(model, prompt)
+        answer = CachedAnswer(
+            content=content,
+            model=model,
+            prompt=normalize_prompt(prompt),
+            latency=latency,
+            cost_usd=cost_usd
+        )
+        self._set_local(key, answer, time.time() + self.config.ttl_seconds)
+
+        if self.redis:
+            await self._set_redis(key, answer)
+
+    def _get_local(self, key: str) -> Optional[CachedAnswer]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        answer, expires_at = entry
+        if time.time() >= expires_at:
+            self._drop(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return answer
+
+    def _set_local(self, key: str, answer: CachedAnswer, expires_at: float):
+        self._drop(key)
+        self._entries[key] = (answer, expires_at)
+        self._bytes += answer.size
+
+        while self._entries and (
+            len(self._entries) > self.config.max_entries
+            or self._bytes > self.config.max_bytes
+        ):
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[0].size
+
+    async def _get_redis(self, key: str) -> Optional[CachedAnswer]:
+        try:
+            raw = await asyncio.to_thread(self.redis.get, f"{self.config.redis_prefix}:{key}")
+        except Exception as e:
+            print(f"⚠️  Cache réponses: lecture Redis impossible: {e}")
+            return None
+        if not raw:
+            return None
+        data = json.loads(raw)
+        data['hits'] = 0  # compteur propre à l'instance
+        return CachedAnswer(**data)
+
+    async def _set_redis(self, key: str, answer: CachedAnswer):
+        try:
+            await asyncio.to_thread(
+                self.redis.set,
+                f"{self.config.redis_prefix}:{key}",
+                json.dumps(asdict(answer)),
+                ex=int(self.config.ttl_seconds)
+            )
+        except Exception as e:
+            print(f"⚠️  Cache réponses: écriture Redis impossible: {e}")
+
+    def clear(self):
+        """Vide le cache local"""
+        self._entries.clear()
+        self._bytes = 0
+
+    # ============================================================================
+    # STATISTIQUES
+    # ============================================================================
+
+    def top_entries(self, limit: int = 10) -> List[Dict]:
+        """Questions les plus servies depuis le cache"""
+        answers = sorted((a for a, _ in self._entries.values()), key=lambda a: a.hits, reverse=True)
+        return [
+            {'prompt': a.prompt, 'model': a.model, 'hits': a.hits,
+             'saved_latency': a.hits * a.latency, 'saved_cost_usd': a.hits * a.cost_usd}
+            for a in answers[:limit]
+        ]
+
+    def get_stats(self) -> Dict:
+        """Retourne les statistiques du cache"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.config.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'evictions': self.evictions,
+            'saved_latency_seconds': self.saved_latency,
+            'saved_cost_usd': self.saved_cost_usd,
+            'redis': self.redis is not None,
+        }
@@ -5,11 +5,12 @@ Gestion des rate limits, anti-spam et validation
 
 import re
 import asyncio
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Dict, List, Tuple, Optional
 from collections import defaultdict
 
-from config import SecurityConfig
+from config import SecurityConfig, PLANS
+from rate_limit_engine import RateLimitEngine, MemoryGCRABackend
 
 
 class SecurityManager:
@@ -18,19 +19,25 @@ class SecurityManager:
     def __init__(self, db):
         self.db = db
         self.cooldowns: Dict[int, datetime] = {}
-        self.message_history: Dict[int, List[datetime]] = defaultdict(list)
+        self.rate_engine = RateLimitEngine(
+            MemoryGCRABackend(),
+            plans=PLANS,
+            default_per_minute=SecurityConfig.MAX_MESSAGES_PER_MINUTE,
+            default_per_hour=SecurityConfig.MAX_MESSAGES_PER_HOUR
+        )
         self.spam_tracking: Dict[int, List[str]] = defaultdict(list)
         self.warning_count: Dict[int, int] = defaultdict(int)
     
-    async def check_user(self, user_id: int, content: str, is_admin: bool = False) -> Tuple[bool, str]:
+    async def check_user(self, user_id: int, content: str, is_admin: bool = False,
+                         plan: str = None) -> Tuple[bool, str]:
         """Vérifie si l'utilisateur peut envoyer un message"""
         
         # Admins bypass tout
         if is_admin:
             return True, None
         
-        # Vérifier bannissement
-        is_banned, ban_reason = self.db.is_user_banned(user_id)
+        # Vérifier bannissement (client sync: hors de la boucle asyncio)
+        is_banned, ban_reason = await asyncio.to_thread(self.db.is_user_banned, user_id)
         if is_banned:
             return False, f"🚫 Vous êtes banni: {ban_reason or 'Violation des règles'}"
         
@@ -40,7 +47,7 @@ class SecurityManager:
             return False, error
         
         # Vérifier rate limit
-        can_proceed, error = self._check_rate_limit(user_id)
+        can_proceed, error = self._check_rate_limit(user_id, plan or self._get_user_plan(user_id))
         if not can_proceed:
             return False, error
         
@@ -70,28 +77,22 @@ class SecurityManager:
         self.cooldowns[user_id] = now
         return True, None
     
-    def _check_rate_limit(self, user_id: int) -> Tuple[bool, str]:
-        """Vérifie le rate limit (messages/min et messages/hour)"""
-        now = datetime.now()
-        history = self.message_history[user_id]
-        
-        # Nettoyer l'historique ancien
-        one_hour_ago = now - timedelta(hours=1)
-        history = [t for t in history if t > one_hour_ago]
-        self.message_history[user_id] = history
-        
-        # Vérifier limite horaire
-        if len(history) >= SecurityConfig.MAX_MESSAGES_PER_HOUR:
-            return False, f"⏱️ Limite horaire atteinte ({SecurityConfig.MAX_MESSAGES_PER_HOUR} msg/h)"
-        
-        # Vérifier limite minute
-        one_minute_ago = now - timedelta(minutes=1)
-        recent = [t for t in history if t > one_minute_ago]
-        if len(recent) >= SecurityConfig.MAX_MESSAGES_PER_MINUTE:
-            return False, f"⏱️ Trop rapide ! ({SecurityConfig.MAX_MESSAGES_PER_MINUTE} msg/min max)"
+    def _get_user_plan(self, user_id: int) -> str:
+        """Dernier plan connu en mémoire, 'free' sinon (jamais d'appel base)"""
+        user_cache = getattr(self.db, 'user_cache', None)
+        plan = user_cache.known_plan(user_id) if user_cache is not None else None
+        return plan or 'free'
+    
+    def _check_rate_limit(self, user_id: int, plan: str = 'free') -> Tuple[bool, str]:
+        """Vérifie le rate limit (messages/min et messages/hour, GCRA en O(1))"""
+        decision = self.rate_engine.check(user_id, plan)
+        if decision.allowed:
+            return True, None
         
-        history.append(now)
-        return True, None
+        plan_config = PLANS.get(plan, PLANS['free'])
+        if decision.rule == 'hour':
+            return False, f"⏱️ Limite horaire atteinte ({plan_config.messages_per_hour} msg/h)"
+        return False, f"⏱️ Trop rapide ! ({plan_config.messages_per_minute} msg/min max)"
     
     def _check_spam(self, user_id: int, content: str) -> Tuple[bool, str]:
         """Détecte et gère le spam"""
@@ -27,7 +27,7 @@ except ImportError:
     WEBHOOK_VALIDATOR_AVAILABLE = False
 
 try:
-    from circuit_breaker import CircuitBreakerRegistry, CircuitBreakerConfig, CircuitBreakerOpenError
+    from circuit_breaker import CircuitBreakerRegistry, CircuitBreakerConfig, CircuitBreakerOpenError, CircuitMode
     CIRCUIT_BREAKER_AVAILABLE = True
 except ImportError:
     CIRCUIT_BREAKER_AVAILABLE = False
@@ -38,21 +38,35 @@ try:
 except ImportError:
     CONVERSATION_HISTORY_AVAILABLE = False
 
+try:
+    from deadline import DeadlineExceeded, with_deadline
+    DEADLINE_AVAILABLE = True
+except ImportError:
+    DEADLINE_AVAILABLE = False
+
 
 class SecurityIntegration:
     """
     Intègre tous les modules de sécurité dans une interface unifiée
     """
     
-    def __init__(self, db):
+    def __init__(self, db, write_buffer=None, conversation_history=None):
         self.db = db
+        self.write_buffer = write_buffer  # WriteBehindBuffer partagé (logs par lots)
         self.config: Optional[ShelliaConfig] = None
         self.rate_limiter: Optional[PersistentRateLimiter] = None
         self.webhook_handler: Optional[StripeEventHandler] = None
-        self.conversation_history: Optional[ConversationHistoryManager] = None
+        # Historique partagé avec AIManager s'il est fourni
+        self.conversation_history: Optional[ConversationHistoryManager] = conversation_history
         self.gemini_breaker = None
+        # Un circuit par modèle Gemini (routeur de modèles); rempli à l'initialisation
+        self.model_breakers = {}
+        self.redis = None  # Client Redis partagé (rate limiter, cache de réponses)
         
         self._initialized = False
+        self._maintenance_task: Optional[asyncio.Task] = None
+        self.maintenance_interval = 30  # secondes
+        self.rate_limit_timeout = 1.0   # Vérification via Redis: au-delà, on laisse passer
     
     async def initialize(self, redis_client=None):
         """
@@ -62,6 +76,7 @@ class SecurityIntegration:
             return
         
         print("🔒 Initialisation des composants de sécurité...")
+        self.redis = redis_client
         
         # 1. Configuration sécurisée
         self._init_config()
@@ -78,6 +93,10 @@ class SecurityIntegration:
         # 5. Historique de conversation
         self._init_conversation_history()
         
+        # 6. Écritures différées du rate limiter (last_active_at, checkpoints)
+        if self.rate_limiter:
+            self._maintenance_task = asyncio.create_task(self._maintenance_loop())
+        
         self._initialized = True
         print("✅ Tous les composants de sécurité sont initialisés")
     
@@ -104,8 +123,11 @@ class SecurityIntegration:
         if RATE_LIMITER_AVAILABLE:
             try:
                 self.rate_limiter = PersistentRateLimiter(self.db, redis_client)
-                backend = "Redis" if redis_client else "Supabase"
-                print(f"✅ Rate limiter initialisé ({backend})")
+                if redis_client:
+                    print("✅ Rate limiter initialisé (Redis)")
+                else:
+                    restored = self.rate_limiter.restore_counters()
+                    print(f"✅ Rate limiter initialisé (mémoire, {restored} compteurs restaurés)")
             except Exception as e:
                 print(f"⚠️  Erreur rate limiter: {e}")
         else:
@@ -118,7 +140,7 @@ class SecurityIntegration:
                 secret = self.config.stripe_webhook_secret
                 if secret:
                     validator = StripeWebhookValidator(secret)
-                    self.webhook_handler = StripeEventHandler(self.db, validator)
+                    self.webhook_handler = StripeEventHandler(self.db, validator, write_buffer=self.write_buffer)
                     print("✅ Webhook handler initialisé")
                 else:
                     print("⚠️  STRIPE_WEBHOOK_SECRET non configuré")
@@ -131,18 +153,44 @@ class SecurityIntegration:
         """Initialise le circuit breaker pour Gemini"""
         if CIRCUIT_BREAKER_AVAILABLE:
             try:
+                from config import ModelConfig, SecurityConfig
+                
+                # Disjoncteur global autour de toute la réponse: ni retry (rejouerait
+                # tout le chat) ni timeout plus court que l'échéance du message.
+                # Le repli entre modèles est assuré par le routeur et les circuits par modèle
                 self.gemini_breaker = CircuitBreakerRegistry.get_or_create(
                     "gemini_api",
                     config=CircuitBreakerConfig(
                         failure_threshold=3,
                         success_threshold=2,
                         timeout_seconds=60,
-                        max_retries=2,
-                        base_delay=2.0,
-                        call_timeout=30.0
+                        max_retries=0,
+                        call_timeout=float(SecurityConfig.AI_REQUEST_DEADLINE)
                     ),
                     on_state_change=self._on_circuit_state_change
                 )
+                
+                # Un circuit par modèle, sur taux d'échecs / d'appels lents (fenêtre glissante).
+                # Sans retry: le routeur se replie sur le modèle suivant
+                for model in (ModelConfig.PRO, ModelConfig.FLASH, ModelConfig.FLASH_LITE):
+                    self.model_breakers[model] = CircuitBreakerRegistry.for_endpoint(
+                        "gemini",
+                        model,
+                        config=CircuitBreakerConfig(
+                            mode=CircuitMode.SLIDING_WINDOW,
+                            window_seconds=60,
+                            bucket_seconds=5,
+                            minimum_calls=10,
+                            failure_rate_threshold=0.5,
+                            slow_call_seconds=20.0,
+                            slow_call_rate_threshold=0.8,
+                            success_threshold=2,
+                            timeout_seconds=30,
+                            max_retries=0,
+                            call_timeout=30.0
+                        ),
+                        on_state_change=self._on_circuit_state_change
+                    )
                 print("✅ Circuit breaker Gemini initialisé")
             except Exception as e:
                 print(f"⚠️  Erreur circuit breaker: {e}")
@@ -151,7 +199,9 @@ class SecurityIntegration:
     
     def _init_conversation_history(self):
         """Initialise l'historique de conversation"""
-        if CONVERSATION_HISTORY_AVAILABLE:
+        if self.conversation_history:
+            print("✅ Gestionnaire d'historique initialisé (partagé)")
+        elif CONVERSATION_HISTORY_AVAILABLE:
             try:
                 self.conversation_history = ConversationHistoryManager(
                     self.db,
@@ -164,6 +214,28 @@ class SecurityIntegration:
         else:
             print("⚠️  Module conversation_history non disponible")
     
+    def _flush_rate_limiter(self):
+        """last_active_at en attente + checkpoint des compteurs (thread)"""
+        self.rate_limiter.flush_last_active()
+        self.rate_limiter.checkpoint_counters()
+    
+    async def _maintenance_loop(self):
+        """Écritures périodiques du rate limiter (hors hot path)"""
+        while True:
+            await asyncio.sleep(self.maintenance_interval)
+            try:
+                await asyncio.to_thread(self._flush_rate_limiter)
+            except Exception as e:
+                print(f"⚠️  Erreur maintenance rate limiter: {e}")
+    
+    async def close(self):
+        """Arrête les tâches de fond et écrit ce qui reste"""
+        if self._maintenance_task:
+            self._maintenance_task.cancel()
+            self._maintenance_task = None
+        if self.rate_limiter:
+            await asyncio.to_thread(self._flush_rate_limiter)
+    
     def _on_circuit_state_change(self, name, old_state, new_state):
         """Callback pour changement d'état du circuit"""
         print(f"🔄 Circuit '{name}': {old_state.value} -> {new_state.value}")
@@ -181,10 +253,13 @@ class SecurityIntegration:
     
     # ============ MÉTHODES PUBLIQUES ============
     
-    async def check_rate_limit(self, user_id: int, is_admin: bool = False) -> tuple:
+    async def check_rate_limit(self, user_id: int, is_admin: bool = False, plan: str = None) -> tuple:
         """
         Vérifie le rate limit pour un utilisateur
         
+        Args:
+            plan: plan déjà connu de l'appelant (sinon dernier plan en cache, ou 'free')
+        
         Returns:
             (can_proceed: bool, message: str)
         """
@@ -192,7 +267,20 @@ class SecurityIntegration:
             # Fallback: pas de rate limiting
             return True, None
         
-        status = self.rate_limiter.check_rate_limit(user_id, is_admin)
+        if self.redis is not None and DEADLINE_AVAILABLE:
+            # Appel réseau: borné par l'échéance du message et rate_limit_timeout
+            try:
+                status = await with_deadline(
+                    asyncio.to_thread(self.rate_limiter.check_rate_limit, user_id, is_admin, plan),
+                    cap=self.rate_limit_timeout
+                )
+            except DeadlineExceeded:
+                raise
+            except asyncio.TimeoutError:
+                print(f"⚠️  Rate limit: Redis trop lent pour {user_id}, message accepté")
+                return True, None
+        else:
+            status = self.rate_limiter.check_rate_limit(user_id, is_admin, plan)
         
         if not status.can_proceed:
             if status.cooldown_remaining > 0:
@@ -264,6 +352,11 @@ class SecurityIntegration:
         if self.gemini_breaker:
             stats['circuit_stats'] = self.gemini_breaker.get_stats()
         
+        if self.model_breakers:
+            stats['model_circuits'] = {
+                model: breaker.get_stats() for model, breaker in self.model_breakers.items()
+            }
+        
         return stats
 
 
@@ -194,9 +194,10 @@ class StripeEventHandler:
     Gestionnaire d'événements Stripe sécurisé
     """
     
-    def __init__(self, db, validator: StripeWebhookValidator):
+    def __init__(self, db, validator: StripeWebhookValidator, write_buffer=None):
         self.db = db
         self.validator = validator
+        self.write_buffer = write_buffer  # WriteBehindBuffer optionnel
         self.handlers = {
             'checkout.session.completed': self._handle_checkout_completed,
             'invoice.payment_succeeded': self._handle_payment_succeeded,
@@ -361,15 +362,21 @@ class StripeEventHandler:
             pass
     
     def _log_event_processed(self, event_id: str, event_type: str, result: str):
-        """Log un événement traité"""
+        """Log un événement traité (par lots si un write buffer est fourni)"""
+        row = {
+            'event_id': event_id,
+            'event_type': event_type,
+            'status': 'processed',
+            'result': result,
+            'processed_at': datetime.now().isoformat()
+        }
+        
+        # Buffer plein ou absent: écriture directe
+        if self.write_buffer and self.write_buffer.add_nowait('webhook_logs', row):
+            return
+        
         try:
-            self.db.client.table('webhook_logs').insert({
-                'event_id': event_id,
-                'event_type': event_type,
-                'status': 'processed',
-                'result': result,
-                'processed_at': datetime.now().isoformat()
-            }).execute()
+            self.db.client.table('webhook_logs').insert(row).execute()
         except:
             pass
     
@@ -7,14 +7,33 @@ from typing import Dict, List, Optional, Any
 from datetime import datetime, timedelta
 import json
 
-from config import EnvConfig
+from config import EnvConfig, PLANS, StreakConfig
+from user_cache import UserCache, user_cache as shared_user_cache
+
+
+def admission_rules() -> Dict:
+    """Règles métier envoyées à la procédure admit_message"""
+    return {
+        'p_plan_limits': {key: plan.daily_quota for key, plan in PLANS.items()},
+        'p_streak_bonuses': {str(days): bonus for days, bonus in StreakConfig.BONUS.items()},
+        'p_milestones': sorted(StreakConfig.BADGES.keys())
+    }
+
+
+def finalize_admission(admission: Dict) -> Dict:
+    """Ajoute le badge au streak si un palier vient d'être atteint"""
+    streak = admission['streak']
+    if streak['is_new_milestone'] and streak['current_streak'] in StreakConfig.BADGES:
+        streak['badge'] = StreakConfig.BADGES[streak['current_streak']]
+    return admission
 
 
 class SupabaseDB:
     """Client Supabase pour le bot"""
     
-    def __init__(self):
+    def __init__(self, user_cache: Optional[UserCache] = None):
         self.client: Client = create_client(EnvConfig.SUPABASE_URL, EnvConfig.SUPABASE_KEY)
+        self.user_cache = user_cache or shared_user_cache
     
     # ============================================================================
     # UTILISATEURS
@@ -23,10 +42,9 @@ class SupabaseDB:
     def get_or_create_user(self, user_id: int, username: str, **kwargs) -> Dict:
         """Récupère ou crée un utilisateur"""
         # Vérifier si existe
-        result = self.client.table('users').select('*').eq('user_id', user_id).execute()
-        
-        if result.data:
-            return result.data[0]
+        user = self.get_user(user_id)
+        if user:
+            return user
         
         # Créer
         user_data = {
@@ -40,6 +58,7 @@ class SupabaseDB:
         }
         
         self.client.table('users').insert(user_data).execute()
+        self.user_cache.set(user_id, user_data)
         
         # Créer streak
         self.client.table('user_streaks').insert({
@@ -52,13 +71,26 @@ class SupabaseDB:
         return user_data
     
     def get_user(self, user_id: int) -> Optional[Dict]:
-        """Récupère un utilisateur"""
+        """Récupère un utilisateur (via le cache)"""
+        cached = self.user_cache.get(user_id)
+        if cached is not None:
+            return cached
+        
         result = self.client.table('users').select('*').eq('user_id', user_id).execute()
-        return result.data[0] if result.data else None
+        if not result.data:
+            return None
+        
+        self.user_cache.set(user_id, result.data[0])
+        return result.data[0]
+    
+    def invalidate_user(self, user_id: int):
+        """Invalide le profil en cache (à appeler après toute écriture sur users)"""
+        self.user_cache.invalidate(user_id)
     
     def update_user(self, user_id: int, **kwargs) -> bool:
         """Met à jour un utilisateur"""
         self.client.table('users').update(kwargs).eq('user_id', user_id).execute()
+        self.invalidate_user(user_id)
         return True
     
     def set_user_plan(self, user_id: int, plan: str, duration_days: int = 30) -> bool:
@@ -71,6 +103,7 @@ class SupabaseDB:
             'plan_started_at': now.isoformat(),
             'plan_expires_at': expires.isoformat()
         }).eq('user_id', user_id).execute()
+        self.invalidate_user(user_id)
         
         # Attribuer badge
         badge_id = f"{plan}_member"
@@ -129,6 +162,13 @@ class SupabaseDB:
             'p_tokens': tokens,
             'p_cost': cost
         }).execute()
+        self.invalidate_user(user_id)
+    
+    def increment_images_generated(self, user_id: int) -> Optional[int]:
+        """Incrémente le compteur d'images du jour (atomique) et retourne le nouveau total"""
+        result = self.client.rpc('increment_images_generated', {'p_user_id': user_id}).execute()
+        self.invalidate_user(user_id)
+        return result.data
     
     def add_streak_bonus(self, user_id: int, bonus: int):
         """Ajoute un bonus de streak"""
@@ -140,6 +180,44 @@ class SupabaseDB:
             'p_bonus': bonus
         }).execute()
     
+    # ============================================================================
+    # ADMISSION (HOT PATH IA)
+    # ============================================================================
+    
+    def admit_message(self, user_id: int, username: str, bypass_quota: bool = False) -> Dict:
+        """
+        Admission d'un message en un seul aller-retour
+        
+        Upsert de l'utilisateur, quota du jour, avancement du streak et bonus
+        de palier sont faits par la procédure admit_message.
+        
+        Returns:
+            {'admitted': bool, 'user': Dict, 'quota': Dict, 'streak': Dict}
+        """
+        result = self.client.rpc('admit_message', {
+            'p_user_id': user_id,
+            'p_username': username,
+            'p_date': datetime.now().strftime('%Y-%m-%d'),
+            'p_bypass_quota': bypass_quota,
+            **admission_rules()
+        }).execute()
+        
+        admission = finalize_admission(result.data)
+        self.user_cache.set(user_id, admission['user'])
+        return admission
+    
+    def commit_usage(self, user_id: int, tokens: int = 0, cost: float = 0.0) -> Dict:
+        """Enregistre l'usage d'un message et retourne le quota du jour à jour"""
+        result = self.client.rpc('commit_usage', {
+            'p_user_id': user_id,
+            'p_date': datetime.now().strftime('%Y-%m-%d'),
+            'p_tokens': tokens,
+            'p_cost': cost
+        }).execute()
+        self.invalidate_user(user_id)
+        
+        return result.data
+    
     # ============================================================================
     # STREAKS
     # ============================================================================
@@ -425,6 +503,7 @@ class SupabaseDB:
         
         # Incrémenter warnings
         self.client.rpc('increment_warnings', {'p_user_id': user_id}).execute()
+        self.invalidate_user(user_id)
     
     def ban_user(self, user_id: int, reason: str, duration_days: int = None):
         """Bannit un utilisateur"""
@@ -435,17 +514,15 @@ class SupabaseDB:
             'ban_reason': reason,
             'ban_expires_at': expires
         }).eq('user_id', user_id).execute()
+        self.invalidate_user(user_id)
     
     def is_user_banned(self, user_id: int) -> tuple:
         """Vérifie si banni"""
-        result = self.client.table('users').select('is_banned, ban_reason, ban_expires_at')\
-            .eq('user_id', user_id).execute()
+        user = self.get_user(user_id)
         
-        if not result.data:
+        if not user:
             return False, None
         
-        user = result.data[0]
-        
         if not user.get('is_banned'):
             return False, None
         
@@ -459,6 +536,7 @@ class SupabaseDB:
                     'ban_reason': None,
                     'ban_expires_at': None
                 }).eq('user_id', user_id).execute()
+                self.invalidate_user(user_id)
                 return False, None
         
         return True, user.get('ban_reason')
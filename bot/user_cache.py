@@ -0,0 +1,116 @@
+"""
+CACHE UTILISATEURS - Shellia AI Bot
+Cache TTL + LRU des lignes `users` devant Supabase
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class UserCache:
+    """
+    Cache en mémoire des profils utilisateurs (ligne `users`)
+
+    - TTL: une entrée expire après `ttl_seconds` (filet de sécurité si une
+      écriture hors bot n'a pas invalidé)
+    - LRU: au plus `max_entries` utilisateurs, le moins récemment lu est évincé
+    - Invalidation explicite par les chemins d'écriture (plan, ban, update)
+    - Dernier plan connu: conservé après invalidation (compteurs modifiés),
+      il sert au rate limiting sans aller-retour base
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._entries: OrderedDict = OrderedDict()  # user_id -> (row, expires_at)
+        self._plans: Dict[int, str] = {}            # user_id -> dernier plan vu
+        self._lock = threading.Lock()  # SupabaseDB sync peut être appelé hors boucle
+
+        # Statistiques
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        """Retourne une copie de la ligne en cache, ou None"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            row, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[user_id]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return dict(row)
+
+    def set(self, user_id: int, row: Dict):
+        """Stocke (ou remplace) la ligne d'un utilisateur"""
+        with self._lock:
+            self._entries[user_id] = (dict(row), time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(user_id)
+            if row.get('plan'):
+                self._remember_plan(user_id, row['plan'])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def patch(self, user_id: int, **fields):
+        """Met à jour des champs d'une entrée existante (write-through)"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                entry[0].update(fields)
+            if fields.get('plan'):
+                self._remember_plan(user_id, fields['plan'])
+
+    def known_plan(self, user_id: int) -> Optional[str]:
+        """Dernier plan vu pour l'utilisateur (même après invalidation), ou None"""
+        with self._lock:
+            return self._plans.get(user_id)
+
+    def _remember_plan(self, user_id: int, plan: str):
+        # Appelé sous self._lock; borné comme le cache (plus ancien évincé)
+        self._plans.pop(user_id, None)
+        self._plans[user_id] = plan
+        if len(self._plans) > self.max_entries:
+            del self._plans[next(iter(self._plans))]
+
+    def invalidate(self, user_id: int):
+        """Supprime l'entrée d'un utilisateur"""
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        """Vide le cache"""
+        with self._lock:
+            self._entries.clear()
+            self._plans.clear()
+
+    def get_stats(self) -> Dict:
+        """Retourne les statistiques du cache"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+# Instance partagée par SupabaseDB et AsyncSupabaseDB: une invalidation
+# faite par l'un (ex: webhook Stripe) est vue par l'autre
+user_cache = UserCache()
@@ -232,16 +232,12 @@ class WeeklyAdminRecap:
         )
         images_generated = result[0]['count'] if result else 0
         
+        # Appels et coûts réels (usage_metadata Gemini, registre cost_ledger)
         result = await self.db.fetch(
-            "SELECT COALESCE(SUM(ai_requests), 0) as count FROM daily_stats WHERE date > %s",
+            "SELECT COALESCE(SUM(calls), 0) as count, COALESCE(SUM(cost_usd), 0) as cost FROM cost_ledger WHERE day > %s",
             (week_ago,)
         )
         ai_requests = result[0]['count'] if result else 0
-        
-        result = await self.db.fetch(
-            "SELECT COALESCE(SUM(api_cost), 0) as cost FROM daily_stats WHERE date > %s",
-            (week_ago,)
-        )
         api_cost = result[0]['cost'] if result else 0
         
         # Modération
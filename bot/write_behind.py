@@ -0,0 +1,171 @@
+"""
+WRITE-BEHIND BUFFER - Shellia AI Bot
+Regroupe les INSERT append-only (logs, télémétrie) en insertions groupées
+"""
+
+import asyncio
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+@dataclass
+class WriteBehindConfig:
+    """Configuration du buffer"""
+    max_batch_size: int = 200      # Flush dès qu'une table atteint ce nombre de lignes
+    flush_interval: float = 2.0    # Flush au plus tard toutes les N secondes
+    max_pending: int = 5000        # Lignes en attente (en vol incluses) avant backpressure
+
+
+@dataclass
+class WriteBehindStats:
+    """Statistiques du buffer"""
+    enqueued: int = 0
+    written: int = 0
+    batches: int = 0
+    failed_batches: int = 0
+    dropped: int = 0
+    backpressure_waits: int = 0
+
+
+class WriteBehindBuffer:
+    """
+    Buffer d'écriture différée partagé
+
+    Les lignes sont regroupées par table puis écrites par lots via `writer`
+    (coroutine `writer(table, rows)`). Un flush est déclenché quand une table
+    atteint `max_batch_size`, toutes les `flush_interval` secondes, et à l'arrêt.
+    Au-delà de `max_pending` lignes, `add()` attend qu'un flush libère de la place.
+    Après `stop()`, plus rien n'est mis en attente: `add()` écrit la ligne directement.
+    """
+
+    def __init__(
+        self,
+        writer: Callable[[str, List[Dict]], Awaitable[None]],
+        config: Optional[WriteBehindConfig] = None
+    ):
+        self.writer = writer
+        self.config = config or WriteBehindConfig()
+        self.stats = WriteBehindStats()
+
+        self._pending: Dict[str, List[Dict]] = defaultdict(list)
+        self._pending_count = 0   # Lignes non encore écrites (en vol incluses)
+        self._flush_requested = asyncio.Event()
+        self._space_available = asyncio.Event()
+        self._space_available.set()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    # ============================================================================
+    # CYCLE DE VIE
+    # ============================================================================
+
+    def start(self):
+        """Démarre la tâche de flush périodique (idempotent)"""
+        if self._task is None or self._task.done():
+            self._closed = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Arrête la tâche de fond et écrit tout ce qui reste"""
+        # Pas de cancel(): un lot en cours d'écriture serait perdu
+        self._closed = True
+        self._flush_requested.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        """Boucle de flush: par taille (événement) ou par intervalle"""
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.config.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+    # ============================================================================
+    # ÉCRITURE
+    # ============================================================================
+
+    async def add(self, table: str, row: Dict):
+        """Ajoute une ligne; attend si le buffer est plein (backpressure)"""
+        if self._closed:
+            # Buffer arrêté: aucun flush ne passera plus, on écrit tout de suite
+            self.stats.enqueued += 1
+            await self._write_batch(table, [row])
+            return
+        while self._pending_count >= self.config.max_pending:
+            self.stats.backpressure_waits += 1
+            self._space_available.clear()
+            self._flush_requested.set()
+            if self._task is None:
+                # Pas de tâche de fond: le producteur flush lui-même
+                await self.flush()
+            else:
+                await self._space_available.wait()
+        self._append(table, row)
+
+    def add_nowait(self, table: str, row: Dict) -> bool:
+        """
+        Ajoute une ligne sans attendre (appelants synchrones)
+
+        Returns:
+            False si le buffer est plein: l'appelant doit écrire lui-même
+        """
+        if self._closed or self._pending_count >= self.config.max_pending:
+            return False
+        self._append(table, row)
+        return True
+
+    def _append(self, table: str, row: Dict):
+        rows = self._pending[table]
+        rows.append(row)
+        self._pending_count += 1
+        self.stats.enqueued += 1
+        if len(rows) >= self.config.max_batch_size:
+            self._flush_requested.set()
+
+    async def flush(self):
+        """Écrit toutes les lignes en attente, par lots de max_batch_size"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, defaultdict(list)
+
+            size = self.config.max_batch_size
+            for table, rows in pending.items():
+                for start in range(0, len(rows), size):
+                    batch = rows[start:start + size]
+                    try:
+                        await self._write_batch(table, batch)
+                    finally:
+                        self._pending_count -= len(batch)
+                        self._space_available.set()
+
+    async def _write_batch(self, table: str, batch: List[Dict]):
+        """Écrit un lot; un échec est compté et journalisé, jamais propagé"""
+        try:
+            await self.writer(table, batch)
+            self.stats.written += len(batch)
+            self.stats.batches += 1
+        except Exception as e:
+            # Logs best-effort: on ne bloque pas le bot pour eux
+            self.stats.failed_batches += 1
+            self.stats.dropped += len(batch)
+            print(f"⚠️  Write-behind: échec insertion {table} ({len(batch)} lignes): {e}")
+
+    def get_stats(self) -> Dict:
+        """Retourne les statistiques du buffer"""
+        return {
+            'pending': self._pending_count,
+            'enqueued': self.stats.enqueued,
+            'written': self.stats.written,
+            'batches': self.stats.batches,
+            'failed_batches': self.stats.failed_batches,
+            'dropped': self.stats.dropped,
+            'backpressure_waits': self.stats.backpressure_waits,
+        }
@@ -155,9 +155,10 @@ class ButtonManager:
         }
     }
     
-    def __init__(self, bot: commands.Bot, db=None):
+    def __init__(self, bot: commands.Bot, db=None, write_buffer=None):
         self.bot = bot
         self.db = db
+        self.write_buffer = write_buffer  # WriteBehindBuffer partagé (analytics par lots)
         self.active_buttons: Dict[str, ButtonConfig] = {}
         self.views: Dict[int, discord.ui.View] = {}  # channel_id -> view
         
@@ -495,7 +496,13 @@ class ButtonManager:
         
     async def _log_button_click(self, button_id: str, user_id: int):
         """Log les interactions avec les boutons"""
-        if self.db:
+        if self.write_buffer:
+            await self.write_buffer.add('button_analytics', {
+                'button_id': button_id,
+                'user_id': user_id,
+                'clicked_at': datetime.utcnow().isoformat()
+            })
+        elif self.db:
             await self.db.execute(
                 """
                 INSERT INTO button_analytics (button_id, user_id, clicked_at)
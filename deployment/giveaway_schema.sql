@@ -51,6 +51,17 @@ CREATE INDEX idx_active_giveaways_guild ON active_giveaways(guild_id);
 CREATE INDEX idx_active_giveaways_status ON active_giveaways(status);
 CREATE INDEX idx_active_giveaways_ends ON active_giveaways(ends_at);
 
+-- Table: Participations (une ligne par participant, remplace active_giveaways.entries)
+-- Pas de clé étrangère: les lignes restent après l'archivage dans ended_giveaways
+CREATE TABLE giveaway_entries (
+    giveaway_id VARCHAR(8) NOT NULL,
+    user_id BIGINT NOT NULL,
+    joined_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (giveaway_id, user_id)
+);
+
+CREATE INDEX idx_giveaway_entries_user ON giveaway_entries(user_id);
+
 -- Table: Giveaways terminés (archive)
 CREATE TABLE ended_giveaways (
     id VARCHAR(8) PRIMARY KEY,
@@ -71,6 +82,21 @@ CREATE TABLE ended_giveaways (
 CREATE INDEX idx_ended_giveaways_guild ON ended_giveaways(guild_id);
 CREATE INDEX idx_ended_giveaways_ended ON ended_giveaways(ended_at);
 
+-- Table: Journal des tirages (graine + poids: un tirage se rejoue et se vérifie)
+CREATE TABLE giveaway_draws (
+    giveaway_id VARCHAR(8) NOT NULL,
+    round INTEGER NOT NULL, -- 0: tirage initial, 1+: rerolls
+    seed TEXT NOT NULL,
+    algorithm VARCHAR(40) NOT NULL,
+    weights JSONB DEFAULT '{}'::jsonb,
+    winners BIGINT[] DEFAULT '{}',
+    excluded BIGINT[] DEFAULT '{}',
+    entries_scanned INTEGER DEFAULT 0,
+    eligibility_checks INTEGER DEFAULT 0,
+    drawn_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (giveaway_id, round)
+);
+
 -- Table: Économie virtuelle (pour les récompenses)
 CREATE TABLE user_economy (
     user_id BIGINT PRIMARY KEY,
@@ -121,6 +147,8 @@ ALTER TABLE giveaway_milestones ENABLE ROW LEVEL SECURITY;
 ALTER TABLE completed_milestones ENABLE ROW LEVEL SECURITY;
 ALTER TABLE active_giveaways ENABLE ROW LEVEL SECURITY;
 ALTER TABLE ended_giveaways ENABLE ROW LEVEL SECURITY;
+ALTER TABLE giveaway_entries ENABLE ROW LEVEL SECURITY;
+ALTER TABLE giveaway_draws ENABLE ROW LEVEL SECURITY;
 ALTER TABLE user_economy ENABLE ROW LEVEL SECURITY;
 ALTER TABLE economy_transactions ENABLE ROW LEVEL SECURITY;
 ALTER TABLE giveaway_stats ENABLE ROW LEVEL SECURITY;
@@ -141,6 +169,22 @@ CREATE POLICY "Only bot can modify active giveaways"
     ON active_giveaways FOR ALL 
     USING (is_bot_user(auth.uid()));
 
+-- Policies: giveaway_entries
+CREATE POLICY "Giveaway entries are viewable by everyone" 
+    ON giveaway_entries FOR SELECT USING (true);
+
+CREATE POLICY "Only bot can modify giveaway entries" 
+    ON giveaway_entries FOR ALL 
+    USING (is_bot_user(auth.uid()));
+
+-- Policies: giveaway_draws
+CREATE POLICY "Giveaway draws are viewable by everyone" 
+    ON giveaway_draws FOR SELECT USING (true);
+
+CREATE POLICY "Only bot can modify giveaway draws" 
+    ON giveaway_draws FOR ALL 
+    USING (is_bot_user(auth.uid()));
+
 -- Policies: user_economy
 CREATE POLICY "Users can view own economy" 
     ON user_economy FOR SELECT 
@@ -185,7 +229,7 @@ DECLARE
     currency_amount INTEGER;
 BEGIN
     -- Calculer les stats
-    participant_count := jsonb_array_length(NEW.entries);
+    SELECT COUNT(*) INTO participant_count FROM giveaway_entries WHERE giveaway_id = NEW.id;
     winner_count := array_length(NEW.winners, 1);
     IF winner_count IS NULL THEN winner_count := 0; END IF;
     
@@ -216,9 +260,9 @@ BEGIN
         total_currency_given = giveaway_stats.total_currency_given + currency_amount,
         biggest_giveaway_id = CASE 
             WHEN participant_count > (
-                SELECT jsonb_array_length(entries) 
-                FROM ended_giveaways 
-                WHERE id = giveaway_stats.biggest_giveaway_id
+                SELECT COUNT(*) 
+                FROM giveaway_entries 
+                WHERE giveaway_id = giveaway_stats.biggest_giveaway_id
             ) THEN NEW.id
             ELSE giveaway_stats.biggest_giveaway_id
         END,
@@ -288,7 +332,7 @@ ORDER BY balance DESC;
 CREATE VIEW guild_giveaway_history AS
 SELECT 
     g.*,
-    jsonb_array_length(g.entries) as participant_count,
+    (SELECT COUNT(*) FROM giveaway_entries e WHERE e.giveaway_id = g.id) as participant_count,
     array_length(g.winners, 1) as winner_count
 FROM ended_giveaways g
 ORDER BY g.ended_at DESC;
@@ -311,8 +355,9 @@ BEGIN
         COALESCE(SUM(t.amount), 0)::INTEGER as total_earned,
         (
             SELECT COUNT(*)::INTEGER 
-            FROM ended_giveaways 
-            WHERE entries @> jsonb_build_array(jsonb_build_object('user_id', user_id))
+            FROM giveaway_entries e
+            JOIN ended_giveaways eg ON eg.id = e.giveaway_id
+            WHERE e.user_id = get_user_giveaway_stats.user_id
         ) as participation_count
     FROM ended_giveaways g
     LEFT JOIN economy_transactions t ON t.giveaway_id = g.id AND t.user_id = user_id
@@ -358,3 +403,19 @@ BEGIN
     FROM giveaway_stats;
 END;
 $$ LANGUAGE plpgsql;
+
+-- ===========================================
+-- 🚚 Migration: entries JSONB -> giveaway_entries
+-- ===========================================
+
+-- À exécuter une fois sur une base existante (idempotent)
+INSERT INTO giveaway_entries (giveaway_id, user_id, joined_at)
+SELECT g.id, (e->>'user_id')::BIGINT, (e->>'joined_at')::TIMESTAMPTZ
+FROM (
+    SELECT id, entries FROM active_giveaways
+    UNION ALL
+    SELECT id, entries FROM ended_giveaways
+) g, jsonb_array_elements(g.entries) AS e
+ON CONFLICT (giveaway_id, user_id) DO NOTHING;
+
+UPDATE active_giveaways SET entries = '[]'::jsonb WHERE entries <> '[]'::jsonb;
@@ -52,6 +52,38 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Checkpoint groupé des compteurs en mémoire (rate limiter sans Redis)
+-- Une ligne par (user_id, period); expires_at = état GCRA restauré au démarrage
+CREATE OR REPLACE FUNCTION checkpoint_rate_limits(p_rows JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    written INTEGER;
+BEGIN
+    DELETE FROM rate_limits r
+    USING jsonb_to_recordset(p_rows) AS t(user_id BIGINT, period VARCHAR)
+    WHERE r.user_id = t.user_id AND r.period = t.period;
+    
+    INSERT INTO rate_limits (user_id, period, window_start, expires_at, count)
+    SELECT user_id, period, window_start, expires_at, count
+    FROM jsonb_to_recordset(p_rows)
+        AS t(user_id BIGINT, period VARCHAR, window_start TIMESTAMPTZ, expires_at TIMESTAMPTZ, count INTEGER);
+    
+    GET DIAGNOSTICS written = ROW_COUNT;
+    RETURN written;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Mise à jour groupée de users.last_active_at (hors hot path)
+CREATE OR REPLACE FUNCTION touch_last_active(
+    p_user_ids BIGINT[],
+    p_timestamps TIMESTAMP WITH TIME ZONE[]
+) RETURNS VOID AS $$
+    UPDATE users u SET last_active_at = t.ts
+    FROM unnest(p_user_ids, p_timestamps) AS t(user_id, ts)
+    WHERE u.user_id = t.user_id
+      AND (u.last_active_at IS NULL OR u.last_active_at < t.ts);
+$$ LANGUAGE sql;
+
 -- ============================================================
 -- 2. HISTORIQUE DE CONVERSATION PERSISTANT
 -- ============================================================
@@ -63,6 +95,7 @@ CREATE TABLE IF NOT EXISTS conversation_history (
     content TEXT NOT NULL,
     timestamp TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     metadata JSONB,
+    seq BIGINT,
     compression VARCHAR(10) DEFAULT NULL
 );
 
@@ -70,6 +103,47 @@ CREATE INDEX idx_conversation_user ON conversation_history(user_id);
 CREATE INDEX idx_conversation_timestamp ON conversation_history(timestamp);
 CREATE INDEX idx_conversation_user_time ON conversation_history(user_id, timestamp DESC);
 
+-- Anneau par utilisateur: seq croissant, élagage par plage sur (user_id, seq)
+ALTER TABLE conversation_history ADD COLUMN IF NOT EXISTS seq BIGINT;
+
+UPDATE conversation_history c
+SET seq = numbered.rn
+FROM (
+    SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp, id) AS rn
+    FROM conversation_history
+) numbered
+WHERE c.id = numbered.id AND c.seq IS NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_conversation_user_seq ON conversation_history(user_id, seq);
+
+-- Ajout d'un message + élagage de l'anneau en un seul appel
+CREATE OR REPLACE FUNCTION append_conversation_message(
+    p_user_id BIGINT,
+    p_role VARCHAR,
+    p_content TEXT,
+    p_timestamp TIMESTAMP WITH TIME ZONE,
+    p_metadata JSONB,
+    p_max_history INTEGER
+) RETURNS BIGINT AS $$
+DECLARE
+    new_seq BIGINT;
+BEGIN
+    -- Sérialise les ajouts d'un même utilisateur
+    PERFORM pg_advisory_xact_lock(p_user_id);
+    
+    SELECT COALESCE(MAX(seq), 0) + 1 INTO new_seq
+    FROM conversation_history WHERE user_id = p_user_id;
+    
+    INSERT INTO conversation_history (user_id, role, content, timestamp, metadata, seq)
+    VALUES (p_user_id, p_role, p_content, p_timestamp, p_metadata, new_seq);
+    
+    DELETE FROM conversation_history
+    WHERE user_id = p_user_id AND seq <= new_seq - p_max_history;
+    
+    RETURN new_seq;
+END;
+$$ LANGUAGE plpgsql;
+
 -- Table d'archive pour vieilles conversations
 CREATE TABLE IF NOT EXISTS conversation_archive (
     id SERIAL PRIMARY KEY,
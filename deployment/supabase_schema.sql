@@ -257,6 +257,50 @@ CREATE TABLE IF NOT EXISTS payments (
 CREATE INDEX idx_payments_user ON payments(user_id);
 CREATE INDEX idx_payments_stripe ON payments(stripe_payment_id);
 
+-- ============================================
+-- 14. TABLES: button_analytics / embed_analytics
+-- (clics écrits par lots via le write-behind buffer)
+-- ============================================
+CREATE TABLE IF NOT EXISTS button_analytics (
+    id BIGSERIAL PRIMARY KEY,
+    button_id VARCHAR(100) NOT NULL,
+    user_id BIGINT NOT NULL,
+    clicked_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX idx_button_analytics_button ON button_analytics(button_id, clicked_at);
+
+CREATE TABLE IF NOT EXISTS embed_analytics (
+    id BIGSERIAL PRIMARY KEY,
+    embed_id VARCHAR(100) NOT NULL,
+    button_id VARCHAR(100),
+    user_id BIGINT NOT NULL,
+    clicked_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX idx_embed_analytics_embed ON embed_analytics(embed_id, clicked_at);
+
+-- ============================================
+-- 15. TABLE: cost_ledger
+-- (tokens réels Gemini agrégés, écrits par lots)
+-- ============================================
+CREATE TABLE IF NOT EXISTS cost_ledger (
+    user_id BIGINT NOT NULL,
+    plan VARCHAR(20) NOT NULL,
+    model VARCHAR(50) NOT NULL,
+    day DATE NOT NULL,
+    calls INTEGER DEFAULT 0,
+    prompt_tokens BIGINT DEFAULT 0,
+    completion_tokens BIGINT DEFAULT 0,
+    cached_tokens BIGINT DEFAULT 0,
+    cost_usd DECIMAL(12, 8) DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    
+    PRIMARY KEY (user_id, plan, model, day)
+);
+
+CREATE INDEX idx_cost_ledger_day ON cost_ledger(day);
+
 -- ============================================
 -- FONCTIONS RPC
 -- ============================================
@@ -312,6 +356,24 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Fonction: incrémenter le compteur d'images du jour
+-- (atomique: deux générations concurrentes comptent bien deux images)
+ALTER TABLE users ADD COLUMN IF NOT EXISTS images_generated_today INTEGER DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION increment_images_generated(
+    p_user_id BIGINT
+) RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    UPDATE users
+    SET images_generated_today = COALESCE(images_generated_today, 0) + 1
+    WHERE user_id = p_user_id
+    RETURNING images_generated_today INTO v_count;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
 -- Fonction: incrémenter warnings
 CREATE OR REPLACE FUNCTION increment_warnings(
     p_user_id BIGINT
@@ -323,6 +385,153 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Fonction: admission d'un message IA (un seul aller-retour)
+-- Upsert utilisateur + quota du jour + avancement du streak + bonus de palier
+CREATE OR REPLACE FUNCTION admit_message(
+    p_user_id BIGINT,
+    p_username TEXT,
+    p_date DATE,
+    p_plan_limits JSONB,        -- {"free": 10, "basic": 50, ...}
+    p_streak_bonuses JSONB,     -- StreakConfig.BONUS {"1": 0, "2": 5, ...}
+    p_milestones INTEGER[],     -- StreakConfig.BADGES (jours)
+    p_bypass_quota BOOLEAN DEFAULT FALSE
+) RETURNS JSONB AS $$
+DECLARE
+    v_user users%ROWTYPE;
+    v_quota daily_quotas%ROWTYPE;
+    v_streak user_streaks%ROWTYPE;
+    v_limit INTEGER;
+    v_admitted BOOLEAN;
+    v_current INTEGER := 0;
+    v_longest INTEGER := 0;
+    v_milestone BOOLEAN := FALSE;
+    v_bonus INTEGER := 0;
+BEGIN
+    -- 1. Utilisateur
+    INSERT INTO users (user_id, username, plan, joined_at, last_active_at)
+    VALUES (p_user_id, p_username, 'free', NOW(), NOW())
+    ON CONFLICT (user_id) DO NOTHING;
+
+    SELECT * INTO v_user FROM users WHERE user_id = p_user_id;
+
+    -- 2. Quota du jour
+    v_limit := COALESCE(
+        (p_plan_limits ->> v_user.plan)::INTEGER,
+        (p_plan_limits ->> 'free')::INTEGER,
+        10
+    );
+
+    INSERT INTO daily_quotas (user_id, date, messages_limit)
+    VALUES (p_user_id, p_date, v_limit)
+    ON CONFLICT (user_id, date) DO NOTHING;
+
+    SELECT * INTO v_quota FROM daily_quotas WHERE user_id = p_user_id AND date = p_date;
+
+    v_admitted := p_bypass_quota
+        OR v_quota.messages_used < v_quota.messages_limit + v_quota.streak_bonus;
+
+    -- 3. Streak (seulement si le message est admis)
+    IF v_admitted THEN
+        SELECT * INTO v_streak FROM user_streaks WHERE user_id = p_user_id FOR UPDATE;
+
+        IF NOT FOUND THEN
+            INSERT INTO user_streaks (user_id, current_streak, longest_streak, last_active_date, total_days_active)
+            VALUES (p_user_id, 1, 1, p_date, 1);
+            v_current := 1;
+            v_longest := 1;
+        ELSIF v_streak.last_active_date = p_date THEN
+            v_current := v_streak.current_streak;
+            v_longest := v_streak.longest_streak;
+        ELSIF v_streak.last_active_date = p_date - 1 THEN
+            v_current := v_streak.current_streak + 1;
+            v_longest := GREATEST(v_streak.longest_streak, v_current);
+
+            UPDATE user_streaks
+            SET current_streak = v_current,
+                longest_streak = v_longest,
+                last_active_date = p_date,
+                total_days_active = total_days_active + 1
+            WHERE user_id = p_user_id;
+
+            INSERT INTO streak_history (user_id, date, streak_count, bonus_earned)
+            VALUES (
+                p_user_id, p_date, v_current,
+                COALESCE((p_streak_bonuses ->> LEAST(v_current, 7)::TEXT)::INTEGER, 50)
+            );
+
+            v_milestone := v_current = ANY(p_milestones);
+        ELSE
+            v_current := 1;
+            v_longest := v_streak.longest_streak;
+
+            UPDATE user_streaks
+            SET current_streak = 1,
+                last_active_date = p_date,
+                total_days_active = total_days_active + 1
+            WHERE user_id = p_user_id;
+        END IF;
+
+        -- 4. Bonus de palier
+        IF v_milestone THEN
+            v_bonus := COALESCE((p_streak_bonuses ->> v_current::TEXT)::INTEGER, 0);
+
+            UPDATE daily_quotas
+            SET streak_bonus = streak_bonus + v_bonus,
+                updated_at = NOW()
+            WHERE user_id = p_user_id AND date = p_date
+            RETURNING * INTO v_quota;
+        END IF;
+    ELSE
+        SELECT current_streak, longest_streak INTO v_current, v_longest
+        FROM user_streaks WHERE user_id = p_user_id;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'admitted', v_admitted,
+        'user', to_jsonb(v_user),
+        'quota', to_jsonb(v_quota),
+        'streak', jsonb_build_object(
+            'current_streak', COALESCE(v_current, 0),
+            'longest_streak', COALESCE(v_longest, 0),
+            'is_new_milestone', v_milestone,
+            'bonus', v_bonus
+        )
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Fonction: enregistrer l'usage d'un message et retourner le quota à jour
+-- (remplace increment_quota + increment_user_stats + relecture du quota)
+CREATE OR REPLACE FUNCTION commit_usage(
+    p_user_id BIGINT,
+    p_date DATE,
+    p_tokens INTEGER,
+    p_cost DECIMAL
+) RETURNS JSONB AS $$
+DECLARE
+    v_quota daily_quotas%ROWTYPE;
+BEGIN
+    INSERT INTO daily_quotas (user_id, date, messages_used, tokens_used, cost_usd)
+    VALUES (p_user_id, p_date, 1, p_tokens, p_cost)
+    ON CONFLICT (user_id, date)
+    DO UPDATE SET
+        messages_used = daily_quotas.messages_used + 1,
+        tokens_used = daily_quotas.tokens_used + p_tokens,
+        cost_usd = daily_quotas.cost_usd + p_cost,
+        updated_at = NOW()
+    RETURNING * INTO v_quota;
+
+    UPDATE users
+    SET total_messages = total_messages + 1,
+        total_tokens = total_tokens + p_tokens,
+        total_cost_usd = total_cost_usd + p_cost,
+        last_active_at = NOW()
+    WHERE user_id = p_user_id;
+
+    RETURN to_jsonb(v_quota);
+END;
+$$ LANGUAGE plpgsql;
+
 -- Fonction: leaderboard
 CREATE OR REPLACE FUNCTION get_leaderboard(
     period TEXT,
@@ -361,6 +570,76 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Fonction: ajouter un lot d'agrégats au registre des coûts
+CREATE OR REPLACE FUNCTION record_cost_ledger(p_rows JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    written INTEGER;
+BEGIN
+    INSERT INTO cost_ledger (
+        user_id, plan, model, day, calls,
+        prompt_tokens, completion_tokens, cached_tokens, cost_usd
+    )
+    SELECT user_id, plan, model, day, calls,
+           prompt_tokens, completion_tokens, cached_tokens, cost_usd
+    FROM jsonb_to_recordset(p_rows) AS t(
+        user_id BIGINT, plan VARCHAR, model VARCHAR, day DATE, calls INTEGER,
+        prompt_tokens BIGINT, completion_tokens BIGINT, cached_tokens BIGINT, cost_usd DECIMAL
+    )
+    ON CONFLICT (user_id, plan, model, day) DO UPDATE SET
+        calls = cost_ledger.calls + EXCLUDED.calls,
+        prompt_tokens = cost_ledger.prompt_tokens + EXCLUDED.prompt_tokens,
+        completion_tokens = cost_ledger.completion_tokens + EXCLUDED.completion_tokens,
+        cached_tokens = cost_ledger.cached_tokens + EXCLUDED.cached_tokens,
+        cost_usd = cost_ledger.cost_usd + EXCLUDED.cost_usd,
+        updated_at = NOW();
+    
+    GET DIAGNOSTICS written = ROW_COUNT;
+    RETURN written;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Fonction: rapport de coûts (dashboard admin)
+CREATE OR REPLACE FUNCTION get_cost_report(
+    p_days INTEGER DEFAULT 7,
+    p_limit INTEGER DEFAULT 10
+) RETURNS JSONB AS $$
+    WITH recent AS (
+        SELECT * FROM cost_ledger WHERE day > CURRENT_DATE - p_days
+    )
+    SELECT jsonb_build_object(
+        'totals', (
+            SELECT jsonb_build_object(
+                'calls', COALESCE(SUM(calls), 0),
+                'prompt_tokens', COALESCE(SUM(prompt_tokens), 0),
+                'completion_tokens', COALESCE(SUM(completion_tokens), 0),
+                'cached_tokens', COALESCE(SUM(cached_tokens), 0),
+                'cost_usd', COALESCE(SUM(cost_usd), 0)
+            ) FROM recent
+        ),
+        'by_model', COALESCE((
+            SELECT jsonb_agg(m ORDER BY m.cost_usd DESC) FROM (
+                SELECT model, SUM(calls) AS calls, SUM(cached_tokens) AS cached_tokens,
+                       SUM(prompt_tokens + completion_tokens) AS tokens, SUM(cost_usd) AS cost_usd
+                FROM recent GROUP BY model
+            ) m
+        ), '[]'::jsonb),
+        'by_plan', COALESCE((
+            SELECT jsonb_agg(p ORDER BY p.cost_usd DESC) FROM (
+                SELECT plan, SUM(calls) AS calls, SUM(cost_usd) AS cost_usd
+                FROM recent GROUP BY plan
+            ) p
+        ), '[]'::jsonb),
+        'top_users', COALESCE((
+            SELECT jsonb_agg(u ORDER BY u.cost_usd DESC) FROM (
+                SELECT user_id, SUM(calls) AS calls, SUM(cost_usd) AS cost_usd
+                FROM recent GROUP BY user_id
+                ORDER BY SUM(cost_usd) DESC LIMIT p_limit
+            ) u
+        ), '[]'::jsonb)
+    );
+$$ LANGUAGE sql STABLE;
+
 -- ============================================
 -- POLITIQUES RLS (Row Level Security)
 -- ============================================
@@ -378,6 +657,9 @@ ALTER TABLE user_violations ENABLE ROW LEVEL SECURITY;
 ALTER TABLE security_logs ENABLE ROW LEVEL SECURITY;
 ALTER TABLE message_history ENABLE ROW LEVEL SECURITY;
 ALTER TABLE payments ENABLE ROW LEVEL SECURITY;
+ALTER TABLE button_analytics ENABLE ROW LEVEL SECURITY;
+ALTER TABLE embed_analytics ENABLE ROW LEVEL SECURITY;
+ALTER TABLE cost_ledger ENABLE ROW LEVEL SECURITY;
 
 -- Politique: service_role peut tout faire (pour le bot)
 CREATE POLICY service_all ON users FOR ALL TO service_role USING (true) WITH CHECK (true);
@@ -392,3 +674,6 @@ CREATE POLICY service_all ON user_violations FOR ALL TO service_role USING (true
 CREATE POLICY service_all ON security_logs FOR ALL TO service_role USING (true) WITH CHECK (true);
 CREATE POLICY service_all ON message_history FOR ALL TO service_role USING (true) WITH CHECK (true);
 CREATE POLICY service_all ON payments FOR ALL TO service_role USING (true) WITH CHECK (true);
+CREATE POLICY service_all ON button_analytics FOR ALL TO service_role USING (true) WITH CHECK (true);
+CREATE POLICY service_all ON embed_analytics FOR ALL TO service_role USING (true) WITH CHECK (true);
+CREATE POLICY service_all ON cost_ledger FOR ALL TO service_role USING (true) WITH CHECK (true);
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+ÉVALUATION DU ROUTAGE - Shellia AI Bot
+Rejoue des messages journalisés dans le classifieur de complexité (hors ligne, sans API)
+
+Usage:
+    python eval_routing.py messages.jsonl [--plan pro] [--output-tokens 300] [--seed 0]
+
+Entrée: un message par ligne, en JSON ({"content": ..., "plan": ..., "role": ...};
+export de conversation_history accepté, seuls les messages 'user' sont gardés)
+ou en texte brut.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot'))
+
+from config import PLANS, ModelConfig
+from complexity import evaluate_routing
+
+
+def load_messages(path: str, default_plan: str):
+    """(contenu, plan) pour chaque message utilisateur du fichier"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                yield line, default_plan
+                continue
+            if not isinstance(record, dict):
+                yield str(record), default_plan
+                continue
+            if record.get('role', 'user') != 'user' or not record.get('content'):
+                continue
+            yield record['content'], record.get('plan') or default_plan
+
+
+def print_report(report: dict):
+    print(f"\n{'='*60}")
+    print(f"  ROUTAGE - {report['messages']:,} messages")
+    print(f"{'='*60}")
+
+    for model, row in report['mix'].items():
+        print(f"  {model:<24} {row['count']:>8,}  {row['share']:>6.1%}  ${row['cost_usd']:.4f}")
+
+    print(f"\n  Coût estimé:        ${report['estimated_cost_usd']:.4f}")
+    print(f"  Coût / 1000 msgs:   ${report['cost_per_1k_messages']:.4f}")
+
+    score = report['score']
+    print(f"  Score moyen:        {score['mean']:.3f} (p50 {score['p50']:.2f})")
+    print(f"  Score > 0.4 / 0.8:  {score['above_0.4']:.1%} / {score['above_0.8']:.1%}")
+
+    for name, rate in report['feature_rates'].items():
+        print(f"  Signal {name:<12} {rate:.1%}")
+
+    print(f"\n  Débit classifieur:  {report['classifier_per_second']:,.0f} messages/s\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Évaluation hors ligne du smart routing")
+    parser.add_argument('path', help="Fichier de messages (JSONL ou texte)")
+    parser.add_argument('--plan', default='free', choices=sorted(PLANS), help="Plan des messages sans plan")
+    parser.add_argument('--output-tokens', type=int, default=300, help="Longueur de réponse supposée")
+    parser.add_argument('--seed', type=int, default=0, help="Graine du tirage (rejeu déterministe)")
+    parser.add_argument('--json', action='store_true', help="Rapport en JSON")
+    args = parser.parse_args()
+
+    report = evaluate_routing(
+        load_messages(args.path, args.plan),
+        PLANS,
+        ModelConfig.TIERS,
+        ModelConfig.COSTS,
+        output_tokens=args.output_tokens,
+        seed=args.seed
+    )
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,789 @@
+#!/usr/bin/env python3
+"""
+BANC DE CHARGE - Shellia AI Bot
+Messages Discord synthétiques à travers le vrai handler IA, entièrement hors ligne
+
+Usage:
+    python load_test.py [--bot maxis|shellia] [--users 50] [--messages 5] [--gemini-latency 0.8]
+
+Le handler réel (MaxisBot.handle_ai_message ou ShelliaBot.handle_ai_message)
+tourne avec:
+- un PostgREST simulé en mémoire (tables + procédures admit_message,
+  commit_usage, append_conversation_message, record_cost_ledger,
+  touch_last_active) derrière
+  les vrais clients supabase (sync et async), via un transport httpx
+- fakeredis (rate limiter GCRA, anti-spam)
+- un faux Gemini (latence log-normale, taux d'erreur, streaming)
+- de faux messages Discord (réponses et éditions comptées)
+
+Rapport: messages/s, latence p50/p95/p99, allers-retours base par message,
+lag de la boucle asyncio, issues des messages.
+"""
+
+import argparse
+import asyncio
+import importlib
+import importlib.util
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_DIR = os.path.join(ROOT_DIR, 'bot')
+for path in (BOT_DIR, ROOT_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import httpx
+
+from config import EnvConfig, PLANS, SecurityConfig
+
+
+# Jamais de service réel pendant un banc de charge: EnvConfig est forcé
+# sur ces valeurs le temps du banc (les bots sont créés après)
+FAKE_ENV = {
+    'SUPABASE_URL': 'https://loadtest.supabase.invalid',
+    'SUPABASE_KEY': 'loadtest-key',
+    'GEMINI_API_KEY': 'loadtest-key',
+    'IMAGE_STORE_DIR': os.path.join(tempfile.gettempdir(), 'shellia-loadtest-images'),
+}
+
+
+# Préfixe des réponses du faux Gemini (distingue une réponse d'un refus)
+ANSWER_MARKER = "[fake-gemini]"
+
+
+def _percentile(samples, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(pct * len(ordered)))]
+
+
+# ============================================================================
+# SUPABASE SIMULÉ (POSTGREST)
+# ============================================================================
+
+class FakeSupabase:
+    """
+    PostgREST en mémoire
+
+    Sert les requêtes des clients supabase-py (table: select/insert/upsert/
+    update/delete avec filtres eq, neq, gt, gte, lt, lte, in, is; rpc) et
+    compte chaque aller-retour. Les procédures reproduisent celles de
+    deployment/*.sql. `latency`: délai ajouté à chaque requête.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.tables: Dict[str, List[Dict]] = defaultdict(list)
+        self.round_trips: Counter = Counter()     # "GET users", "RPC admit_message"...
+        self.errors: Counter = Counter()
+        self._lock = threading.Lock()
+        self.rpcs = {
+            'admit_message': self._admit_message,
+            'commit_usage': self._commit_usage,
+            'append_conversation_message': self._append_conversation_message,
+            'record_cost_ledger': self._record_cost_ledger,
+            'touch_last_active': self._touch_last_active,
+        }
+
+    # ============================================================================
+    # CLIENTS
+    # ============================================================================
+
+    def sync_client(self):
+        """Client supabase synchrone branché sur le PostgREST simulé"""
+        from supabase import ClientOptions, create_client
+        http = httpx.Client(transport=httpx.MockTransport(self.handle))
+        return create_client(FAKE_ENV['SUPABASE_URL'], FAKE_ENV['SUPABASE_KEY'], options=ClientOptions(httpx_client=http))
+
+    def async_transport(self) -> httpx.MockTransport:
+        """Transport du pool httpx d'AsyncSupabaseDB"""
+        return httpx.MockTransport(self.handle_async)
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._dispatch(request)
+
+    async def handle_async(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._dispatch(request)
+
+    @property
+    def total_round_trips(self) -> int:
+        return sum(self.round_trips.values())
+
+    # ============================================================================
+    # REQUÊTES
+    # ============================================================================
+
+    def _dispatch(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path.split('/rest/v1/', 1)[-1]
+        params = parse_qsl(request.url.query.decode(), keep_blank_values=True)
+        body = json.loads(request.content) if request.content else None
+
+        with self._lock:
+            if path.startswith('rpc/'):
+                name = path[4:]
+                self.round_trips[f"RPC {name}"] += 1
+                handler = self.rpcs.get(name)
+                if handler is None:
+                    self.errors[f"RPC {name}"] += 1
+                    return httpx.Response(404, json={
+                        'code': 'PGRST202', 'message': f"Could not find the function public.{name}",
+                        'details': None, 'hint': None
+                    })
+                return httpx.Response(200, json=handler(**(body or {})))
+
+            self.round_trips[f"{request.method} {path}"] += 1
+            prefer = request.headers.get('prefer', '')
+            if request.method == 'GET':
+                return self._select(path, params, prefer)
+            if request.method == 'POST':
+                return self._insert(path, params, body, prefer)
+            if request.method == 'PATCH':
+                rows = self._filtered(path, params)
+                for row in rows:
+                    row.update(body or {})
+                return httpx.Response(200, json=rows)
+            if request.method == 'DELETE':
+                rows = self._filtered(path, params)
+                self.tables[path] = [row for row in self.tables[path] if row not in rows]
+                return httpx.Response(200, json=rows)
+        return httpx.Response(405, json={'message': 'method not allowed'})
+
+    @staticmethod
+    def _compare(value, op: str, operand: str) -> bool:
+        if op == 'is':
+            return value is None if operand == 'null' else str(value).lower() == operand
+        if value is None:
+            return False
+        if op == 'in':
+            return str(value) in operand.strip('()').split(',')
+        if op in ('eq', 'neq'):
+            equal = str(value).lower() == operand.lower() if isinstance(value, bool) else str(value) == operand
+            return equal if op == 'eq' else not equal
+        try:
+            left, right = float(value), float(operand)
+        except (TypeError, ValueError):
+            left, right = str(value), operand
+        return {'gt': left > right, 'gte': left >= right, 'lt': left < right, 'lte': left <= right}.get(op, False)
+
+    def _filtered(self, table: str, params) -> List[Dict]:
+        filters = [
+            (column, *expr.split('.', 1)) for column, expr in params
+            if column not in ('select', 'order', 'limit', 'offset', 'columns', 'on_conflict') and '.' in expr
+        ]
+        return [
+            row for row in self.tables[table]
+            if all(self._compare(row.get(column), op, operand) for column, op, operand in filters)
+        ]
+
+    def _select(self, table: str, params, prefer: str) -> httpx.Response:
+        rows = self._filtered(table, params)
+        options = dict(params)
+        total = len(rows)
+
+        for clause in reversed(options.get('order', '').split(',') if options.get('order') else []):
+            column, _, direction = clause.partition('.')
+            rows.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=direction.startswith('desc'))
+        offset = int(options.get('offset', 0))
+        if 'limit' in options:
+            rows = rows[offset:offset + int(options['limit'])]
+
+        columns = [c.strip() for c in options.get('select', '*').split(',')]
+        if '*' not in columns:
+            rows = [{c: row.get(c) for c in columns} for row in rows]
+
+        headers = {}
+        if 'count=' in prefer:
+            headers['content-range'] = f"0-{max(len(rows) - 1, 0)}/{total}"
+        return httpx.Response(200, json=rows, headers=headers)
+
+    def _insert(self, table: str, params, body, prefer: str) -> httpx.Response:
+        rows = body if isinstance(body, list) else [body]
+        conflict = dict(params).get('on_conflict')
+        written = []
+        for row in rows:
+            if 'merge-duplicates' in prefer and conflict:
+                keys = conflict.split(',')
+                existing = next((r for r in self.tables[table] if all(r.get(k) == row.get(k) for k in keys)), None)
+                if existing is not None:
+                    existing.update(row)
+                    written.append(existing)
+                    continue
+            row = dict(row)
+            row.setdefault('id', len(self.tables[table]) + 1)
+            self.tables[table].append(row)
+            written.append(row)
+        return httpx.Response(201, json=written)
+
+    # ============================================================================
+    # DONNÉES
+    # ============================================================================
+
+    def _find(self, table: str, **match) -> Optional[Dict]:
+        for row in self.tables[table]:
+            if all(row.get(k) == v for k, v in match.items()):
+                return row
+        return None
+
+    def seed_user(self, user_id: int, username: str, plan: str = 'free'):
+        now = datetime.now().isoformat()
+        self.tables['users'].append({
+            'user_id': user_id, 'username': username, 'plan': plan,
+            'joined_at': now, 'last_active_at': now, 'is_banned': False,
+            'total_messages': 0, 'total_tokens': 0, 'total_cost_usd': 0.0,
+            'images_generated_today': 0,
+        })
+
+    # ============================================================================
+    # PROCÉDURES (cf. deployment/supabase_schema.sql, security_schema.sql)
+    # ============================================================================
+
+    def _admit_message(self, p_user_id, p_username, p_date, p_plan_limits, p_streak_bonuses,
+                       p_milestones, p_bypass_quota=False):
+        user = self._find('users', user_id=p_user_id)
+        if user is None:
+            self.seed_user(p_user_id, p_username)
+            user = self.tables['users'][-1]
+
+        quota = self._find('daily_quotas', user_id=p_user_id, date=p_date)
+        if quota is None:
+            limit = p_plan_limits.get(user['plan'], p_plan_limits.get('free', 10))
+            quota = {'user_id': p_user_id, 'date': p_date, 'messages_limit': limit, 'messages_used': 0,
+                     'streak_bonus': 0, 'tokens_used': 0, 'cost_usd': 0.0}
+            self.tables['daily_quotas'].append(quota)
+
+        admitted = p_bypass_quota or quota['messages_used'] < quota['messages_limit'] + quota['streak_bonus']
+        current = longest = 0
+        milestone = False
+        bonus = 0
+
+        streak = self._find('user_streaks', user_id=p_user_id)
+        if admitted:
+            yesterday = (date.fromisoformat(p_date) - timedelta(days=1)).isoformat()
+            if streak is None:
+                streak = {'user_id': p_user_id, 'current_streak': 1, 'longest_streak': 1,
+                          'last_active_date': p_date, 'total_days_active': 1}
+                self.tables['user_streaks'].append(streak)
+            elif streak['last_active_date'] == yesterday:
+                streak['current_streak'] += 1
+                streak['longest_streak'] = max(streak['longest_streak'], streak['current_streak'])
+                streak['last_active_date'] = p_date
+                streak['total_days_active'] += 1
+                milestone = streak['current_streak'] in p_milestones
+            elif streak['last_active_date'] != p_date:
+                streak.update(current_streak=1, last_active_date=p_date,
+                              total_days_active=streak['total_days_active'] + 1)
+            current, longest = streak['current_streak'], streak['longest_streak']
+
+            if milestone:
+                bonus = int(p_streak_bonuses.get(str(current), 0))
+                quota['streak_bonus'] += bonus
+        elif streak is not None:
+            current, longest = streak['current_streak'], streak['longest_streak']
+
+        return {
+            'admitted': admitted,
+            'user': dict(user),
+            'quota': dict(quota),
+            'streak': {'current_streak': current, 'longest_streak': longest,
+                       'is_new_milestone': milestone, 'bonus': bonus},
+        }
+
+    def _commit_usage(self, p_user_id, p_date, p_tokens, p_cost):
+        quota = self._find('daily_quotas', user_id=p_user_id, date=p_date)
+        if quota is None:
+            quota = {'user_id': p_user_id, 'date': p_date, 'messages_limit': 10, 'messages_used': 0,
+                     'streak_bonus': 0, 'tokens_used': 0, 'cost_usd': 0.0}
+            self.tables['daily_quotas'].append(quota)
+        quota['messages_used'] += 1
+        quota['tokens_used'] += p_tokens
+        quota['cost_usd'] += p_cost
+
+        user = self._find('users', user_id=p_user_id)
+        if user is not None:
+            user['total_messages'] += 1
+            user['total_tokens'] += p_tokens
+            user['total_cost_usd'] += p_cost
+        return dict(quota)
+
+    def _touch_last_active(self, p_user_ids, p_timestamps):
+        for user_id, timestamp in zip(p_user_ids, p_timestamps):
+            user = self._find('users', user_id=user_id)
+            if user is not None and (user.get('last_active_at') or '') < timestamp:
+                user['last_active_at'] = timestamp
+        return None
+
+    def _append_conversation_message(self, p_user_id, p_role, p_content, p_timestamp, p_metadata, p_max_history):
+        rows = self.tables['conversation_history']
+        seq = max((r['seq'] for r in rows if r['user_id'] == p_user_id), default=0) + 1
+        rows.append({'user_id': p_user_id, 'role': p_role, 'content': p_content,
+                     'timestamp': p_timestamp, 'metadata': p_metadata, 'seq': seq})
+        self.tables['conversation_history'] = [
+            r for r in rows if r['user_id'] != p_user_id or r['seq'] > seq - p_max_history
+        ]
+        return seq
+
+    def _record_cost_ledger(self, p_rows):
+        self.tables['cost_ledger'].extend(p_rows)
+        return len(p_rows)
+
+
+# ============================================================================
+# GEMINI SIMULÉ
+# ============================================================================
+
+@dataclass
+class GeminiProfile:
+    """Comportement du faux Gemini"""
+    latency: float = 0.8           # Médiane de la durée totale d'une réponse (s)
+    sigma: float = 0.4             # Dispersion log-normale (0: latence fixe)
+    error_rate: float = 0.0        # Part des appels en erreur
+    chunks: int = 5                # Fragments streamés par réponse
+    output_tokens: int = 200
+
+
+class FakeGeminiResponse:
+    """Réponse (streamée ou non) au format du SDK google.generativeai"""
+
+    def __init__(self, text: str, chunks: List[str], delays: List[float], prompt_tokens: int, output_tokens: int):
+        self.text = text
+        self._chunks = chunks
+        self._delays = delays
+        self.usage_metadata = type('UsageMetadata', (), {
+            'prompt_token_count': prompt_tokens,
+            'candidates_token_count': output_tokens,
+            'cached_content_token_count': 0,
+        })()
+
+    async def __aiter__(self):
+        for chunk, delay in zip(self._chunks, self._delays):
+            await asyncio.sleep(delay)
+            yield type('Chunk', (), {'text': chunk})()
+
+
+class FakeGeminiChat:
+    def __init__(self, model: 'FakeGeminiModel', history):
+        self.model = model
+        self.history = history or []
+
+    async def send_message_async(self, content: str, stream: bool = False, **options):
+        return await self.model.respond(content, self.history, stream)
+
+
+class FakeGeminiModel:
+    """Remplace genai.GenerativeModel dans AIManager.models"""
+
+    def __init__(self, name: str, profile: GeminiProfile, rng: random.Random, stats: Counter):
+        self.name = name
+        self.profile = profile
+        self.rng = rng
+        self.stats = stats
+
+    def start_chat(self, history=None) -> FakeGeminiChat:
+        return FakeGeminiChat(self, history)
+
+    async def respond(self, content: str, history, stream: bool) -> FakeGeminiResponse:
+        profile = self.profile
+        self.stats['calls'] += 1
+        self.stats[f"calls:{self.name}"] += 1
+
+        total = profile.latency
+        if profile.sigma > 0 and profile.latency > 0:
+            total = self.rng.lognormvariate(math.log(profile.latency), profile.sigma)
+
+        if self.rng.random() < profile.error_rate:
+            await asyncio.sleep(total / 2)
+            self.stats['errors'] += 1
+            raise RuntimeError("503 Service Unavailable (faux Gemini)")
+
+        words = f"{ANSWER_MARKER} réponse de {self.name} à: {content[:60]}".split()
+        per_chunk = max(1, math.ceil(len(words) / profile.chunks))
+        chunks = [' '.join(words[i:i + per_chunk]) + ' ' for i in range(0, len(words), per_chunk)]
+        text = ''.join(chunks)
+        prompt_tokens = (len(content) + sum(len(p) for m in history for p in m['parts'])) // 4 + 1
+
+        if stream:
+            delays = [total / len(chunks)] * len(chunks)
+        else:
+            await asyncio.sleep(total)
+            delays = [0.0] * len(chunks)
+        return FakeGeminiResponse(text, chunks, delays, prompt_tokens, profile.output_tokens)
+
+
+# ============================================================================
+# DISCORD SIMULÉ
+# ============================================================================
+
+class FakePermissions:
+    administrator = False
+
+
+class FakeAuthor:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.name = f"loadtest{user_id}"
+        self.guild_permissions = FakePermissions()
+
+    def __str__(self):
+        return self.name
+
+
+class FakeChannel:
+    def __init__(self, stats: Counter):
+        self.stats = stats
+
+    async def send(self, content=None, **kwargs):
+        self.stats['sends'] += 1
+        return FakeSentMessage(self, content, kwargs.get('embed'))
+
+
+class FakeSentMessage:
+    """Message envoyé par le bot (placeholder, erreurs, embeds)"""
+
+    def __init__(self, channel: FakeChannel, content, embed=None):
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+        self.deleted = False
+
+    async def edit(self, content=None, **kwargs):
+        self.channel.stats['edits'] += 1
+        if content is not None:
+            self.content = content
+
+    async def delete(self):
+        self.channel.stats['deletes'] += 1
+        self.deleted = True
+
+
+class FakeMessage:
+    """Message d'un utilisateur simulé"""
+
+    def __init__(self, author: FakeAuthor, content: str, channel: FakeChannel):
+        self.author = author
+        self.content = content
+        self.channel = channel
+        self.replies: List[FakeSentMessage] = []
+
+    async def reply(self, content=None, **kwargs):
+        self.channel.stats['replies'] += 1
+        sent = FakeSentMessage(self.channel, content, kwargs.get('embed'))
+        self.replies.append(sent)
+        return sent
+
+    def outcome(self) -> str:
+        """Issue du message, lue dans ce que le bot a affiché"""
+        texts = [(r.content or (r.embed.title if r.embed else '') or '') for r in self.replies if not r.deleted]
+        if any(t.startswith(ANSWER_MARKER) for t in texts):
+            return 'answered'
+        text = next((t for t in texts if t and not t.startswith('💭')), '')
+        if 'Quota' in text:
+            return 'quota_exhausted'
+        for prefix, outcome in (
+            ('⏱️', 'rate_limited'), ('🚫', 'blocked'), ('⚠️', 'spam'), ('⌛', 'deadline'),
+            ('⏳', 'overloaded'), ('🔄', 'unavailable'), ('❌', 'ai_error'),
+        ):
+            if text.startswith(prefix):
+                return outcome
+        return 'no_reply'
+
+
+# ============================================================================
+# LAG DE LA BOUCLE
+# ============================================================================
+
+class LoopLagMonitor:
+    """Retard de réveil d'une tâche qui dort `interval` secondes (boucle bloquée = lag)"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._closed = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._closed = True
+        if self._task:
+            await self._task
+
+    async def _run(self):
+        while not self._closed:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(time.perf_counter() - started - self.interval, 0.0))
+
+
+# ============================================================================
+# BANC DE CHARGE
+# ============================================================================
+
+@dataclass
+class LoadTestConfig:
+    """Paramètres d'un banc de charge"""
+    bot: str = 'maxis'                 # maxis (MaxisBot) ou shellia (bot/bot.py)
+    users: int = 50
+    messages_per_user: int = 5
+    think_time: float = 0.0            # Pause entre deux messages d'un utilisateur (s)
+    ramp_up: float = 1.0               # Arrivée étalée des utilisateurs (s)
+    plans: List[str] = field(default_factory=lambda: ['pro'])
+    cooldown: float = 0.0              # Cooldown par utilisateur (prod: SecurityConfig.COOLDOWN_SECONDS)
+    db_latency: float = 0.005
+    gemini: GeminiProfile = field(default_factory=GeminiProfile)
+    seed: int = 0
+
+
+SAMPLE_MESSAGES = (
+    "Salut, tu peux m'aider avec mon serveur ?",
+    "Explique-moi la différence entre une liste et un tuple en Python",
+    "Comment optimiser cette fonction ? `def f(x): return [i*i for i in range(x)]`",
+    "Quelle heure est-il à Tokyo ?",
+    "Donne-moi une idée de nom pour mon bot Discord",
+    "Pourquoi mon script plante avec une KeyError ?",
+    "Résous 3x + 5 = 20",
+    "Merci beaucoup !",
+)
+
+
+def _load_bot_class(name: str):
+    """Classe du bot visé (modules importés comme le fait leur point d'entrée)"""
+    if name == 'maxis':
+        return importlib.import_module('maxis_bot').MaxisBot
+    if name == 'shellia':
+        # bot/bot.py: nom de module distinct (le dossier bot/ est aussi un package)
+        spec = importlib.util.spec_from_file_location('shellia_main_bot', os.path.join(BOT_DIR, 'bot.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module.ShelliaBot
+    raise ValueError(f"Bot inconnu: {name}")
+
+
+async def _build_bot(config: LoadTestConfig, supabase: FakeSupabase, redis_client, gemini_stats: Counter):
+    bot = _load_bot_class(config.bot)()
+
+    bot.db.client = supabase.sync_client()
+    bot.async_db.transport = supabase.async_transport()
+    await bot.async_db.connect()
+
+    # MaxisBot: SecurityIntegration (rate limiter GCRA sur fakeredis)
+    if not getattr(bot, 'security_initialized', True):
+        await bot.security.initialize(redis_client)
+        bot.security_initialized = True
+
+    rng = random.Random(config.seed)
+    bot.ai.models = {
+        name: FakeGeminiModel(name, config.gemini, rng, gemini_stats)
+        for name in bot.ai.models
+    }
+    return bot
+
+
+async def _shutdown_bot(bot):
+    if hasattr(bot.security, 'close') and getattr(bot, 'security_initialized', False):
+        await bot.security.close()
+    await bot.async_db.close()
+
+
+async def run_load_test(config: LoadTestConfig) -> Dict:
+    """
+    Lance le banc de charge et retourne le rapport
+
+    Chaque utilisateur simulé envoie `messages_per_user` messages l'un après
+    l'autre (le handler va jusqu'au rendu final), après `think_time`.
+    """
+    import fakeredis
+
+    # Cooldown du banc (les limites minute/heure des plans restent actives)
+    saved_cooldown = SecurityConfig.COOLDOWN_SECONDS
+    saved_env = {key: getattr(EnvConfig, key) for key in FAKE_ENV}
+    SecurityConfig.COOLDOWN_SECONDS = config.cooldown
+    for key in saved_env:
+        setattr(EnvConfig, key, FAKE_ENV[key])
+
+    supabase = FakeSupabase(latency=config.db_latency)
+    redis_client = fakeredis.FakeRedis(decode_responses=True)
+    gemini_stats: Counter = Counter()
+    discord_stats: Counter = Counter()
+    channel = FakeChannel(discord_stats)
+
+    rng = random.Random(config.seed)
+    user_ids = [900_000_000 + i for i in range(config.users)]
+    for i, user_id in enumerate(user_ids):
+        supabase.seed_user(user_id, f"loadtest{user_id}", config.plans[i % len(config.plans)])
+
+    bot = None
+    monitor = LoopLagMonitor()
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    outcomes: Counter = Counter()
+    failures: Counter = Counter()
+
+    async def simulate_user(index: int, user_id: int):
+        author = FakeAuthor(user_id)
+        await asyncio.sleep(config.ramp_up * index / max(config.users, 1))
+        for n in range(config.messages_per_user):
+            content = f"{rng.choice(SAMPLE_MESSAGES)} (#{n})"
+            message = FakeMessage(author, content, channel)
+            started = time.perf_counter()
+            try:
+                await bot.handle_ai_message(message)
+                outcome = message.outcome()
+            except Exception as e:
+                outcome = 'exception'
+                failures[f"{type(e).__name__}: {e}"[:120]] += 1
+            latencies[outcome].append(time.perf_counter() - started)
+            outcomes[outcome] += 1
+            if config.think_time:
+                await asyncio.sleep(config.think_time)
+
+    try:
+        bot = await _build_bot(config, supabase, redis_client, gemini_stats)
+        trips_before = supabase.total_round_trips
+
+        monitor.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(simulate_user(i, user_id) for i, user_id in enumerate(user_ids)))
+        elapsed = time.perf_counter() - started
+        await monitor.stop()
+
+        trips_in_run = supabase.total_round_trips - trips_before
+        await _shutdown_bot(bot)
+    finally:
+        SecurityConfig.COOLDOWN_SECONDS = saved_cooldown
+        for key, value in saved_env.items():
+            setattr(EnvConfig, key, value)
+
+    total = sum(outcomes.values())
+    answered = latencies.get('answered', [])
+    all_latencies = [v for values in latencies.values() for v in values]
+
+    return {
+        'bot': config.bot,
+        'config': asdict(config),
+        'messages': total,
+        'duration_s': elapsed,
+        'messages_per_sec': total / elapsed if elapsed else 0.0,
+        'answered_per_sec': len(answered) / elapsed if elapsed else 0.0,
+        'outcomes': dict(outcomes),
+        'latency': {
+            'p50': _percentile(answered, 0.50),
+            'p95': _percentile(answered, 0.95),
+            'p99': _percentile(answered, 0.99),
+            'max': max(answered, default=0.0),
+            'all_p99': _percentile(all_latencies, 0.99),
+        },
+        'db': {
+            'round_trips': trips_in_run,
+            'round_trips_per_message': trips_in_run / total if total else 0.0,
+            # Écritures différées vidées à l'arrêt incluses
+            'round_trips_with_flush': supabase.total_round_trips - trips_before,
+            'by_endpoint': dict(supabase.round_trips.most_common()),
+            'errors': dict(supabase.errors),
+        },
+        'loop_lag': {
+            'p50': _percentile(monitor.samples, 0.50),
+            'p99': _percentile(monitor.samples, 0.99),
+            'max': max(monitor.samples, default=0.0),
+        },
+        'gemini': dict(gemini_stats),
+        'discord': {key: value / total if total else 0.0 for key, value in discord_stats.items()},
+        'exceptions': dict(failures.most_common(5)),
+    }
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def print_report(report: Dict):
+    latency = report['latency']
+    db = report['db']
+    lag = report['loop_lag']
+
+    print(f"\n{'='*60}")
+    print(f"  BANC DE CHARGE - {report['bot']} - {report['messages']:,} messages en {report['duration_s']:.1f}s")
+    print(f"{'='*60}")
+    print(f"  Débit:               {report['messages_per_sec']:.1f} msgs/s ({report['answered_per_sec']:.1f} réponses/s)")
+    print(f"  Latence (réponses):  p50 {latency['p50'] * 1000:.0f} ms, p95 {latency['p95'] * 1000:.0f} ms, "
+          f"p99 {latency['p99'] * 1000:.0f} ms, max {latency['max'] * 1000:.0f} ms")
+    print(f"  Base:                {db['round_trips_per_message']:.2f} allers-retours/message "
+          f"({db['round_trips_with_flush']:,} avec écritures différées)")
+    for endpoint, count in list(db['by_endpoint'].items())[:8]:
+        print(f"    {endpoint:<40} {count:>8,}")
+    print(f"  Lag boucle:          p50 {lag['p50'] * 1000:.1f} ms, p99 {lag['p99'] * 1000:.1f} ms, max {lag['max'] * 1000:.1f} ms")
+    print(f"  Issues:              {', '.join(f'{k} {v}' for k, v in sorted(report['outcomes'].items()))}")
+    print(f"  Discord / message:   {', '.join(f'{k} {v:.2f}' for k, v in sorted(report['discord'].items()))}")
+    if report['exceptions']:
+        print("  ❌ Exceptions:")
+        for error, count in report['exceptions'].items():
+            print(f"    {count:>5}  {error}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc de charge hors ligne du handler IA")
+    parser.add_argument('--bot', default='maxis', choices=['maxis', 'shellia'])
+    parser.add_argument('--users', type=int, default=50, help="Utilisateurs simulés")
+    parser.add_argument('--messages', type=int, default=5, help="Messages par utilisateur")
+    parser.add_argument('--think-time', type=float, default=0.0, help="Pause entre deux messages (s)")
+    parser.add_argument('--ramp-up', type=float, default=1.0, help="Arrivée étalée des utilisateurs (s)")
+    parser.add_argument('--plans', default='pro', help="Plans attribués en tourniquet (ex. free,basic,pro)")
+    parser.add_argument('--cooldown', type=float, default=0.0,
+                        help=f"Cooldown par utilisateur (prod: {SecurityConfig.COOLDOWN_SECONDS}s)")
+    parser.add_argument('--db-latency', type=float, default=0.005, help="Latence par requête PostgREST (s)")
+    parser.add_argument('--gemini-latency', type=float, default=0.8, help="Médiane de latence Gemini (s)")
+    parser.add_argument('--gemini-sigma', type=float, default=0.4, help="Dispersion log-normale de la latence")
+    parser.add_argument('--gemini-error-rate', type=float, default=0.0, help="Part des appels Gemini en erreur")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="Rapport en JSON")
+    args = parser.parse_args()
+
+    plans = [p.strip() for p in args.plans.split(',') if p.strip()]
+    unknown = [p for p in plans if p not in PLANS]
+    if unknown:
+        parser.error(f"plans inconnus: {', '.join(unknown)}")
+
+    config = LoadTestConfig(
+        bot=args.bot,
+        users=args.users,
+        messages_per_user=args.messages,
+        think_time=args.think_time,
+        ramp_up=args.ramp_up,
+        plans=plans,
+        cooldown=args.cooldown,
+        db_latency=args.db_latency,
+        gemini=GeminiProfile(
+            latency=args.gemini_latency,
+            sigma=args.gemini_sigma,
+            error_rate=args.gemini_error_rate
+        ),
+        seed=args.seed
+    )
+    report = asyncio.run(run_load_test(config))
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
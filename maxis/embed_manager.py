@@ -184,10 +184,11 @@ class EmbedManager:
         }
     }
     
-    def __init__(self, bot: commands.Bot, db=None, stripe_manager=None):
+    def __init__(self, bot: commands.Bot, db=None, stripe_manager=None, write_buffer=None):
         self.bot = bot
         self.db = db
         self.stripe_manager = stripe_manager
+        self.write_buffer = write_buffer  # WriteBehindBuffer partagé (analytics par lots)
         self.embeds: Dict[str, EmbedConfig] = {}
         self.views: Dict[str, discord.ui.View] = {}
         
@@ -592,7 +593,14 @@ class EmbedManager:
             
     async def _log_embed_click(self, embed_id: str, button_id: Optional[str], user_id: int):
         """Log les clics sur les embeds"""
-        if self.db:
+        if self.write_buffer:
+            await self.write_buffer.add('embed_analytics', {
+                'embed_id': embed_id,
+                'button_id': button_id,
+                'user_id': user_id,
+                'clicked_at': datetime.utcnow().isoformat()
+            })
+        elif self.db:
             await self.db.execute(
                 """
                 INSERT INTO embed_analytics (embed_id, button_id, user_id, clicked_at)
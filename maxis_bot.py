@@ -6,7 +6,6 @@ Contrôlé par Shellia IA via API
 import os
 import asyncio
 import io
-import base64
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -14,8 +13,9 @@ import discord
 from discord.ext import commands, tasks
 from discord import app_commands
 
-from config import EnvConfig, SecurityConfig, PLANS, ChannelConfig, StreakConfig
+from config import EnvConfig, SecurityConfig, PLANS, ChannelConfig, ModelConfig
 from supabase_client import SupabaseDB
+from async_supabase_client import AsyncSupabaseDB
 
 # Nouveaux imports sécurité
 try:
@@ -29,6 +29,13 @@ except ImportError:
     SECURITY_ENABLED = False
 
 from ai_engine import AIManager
+from ai_scheduler import AIScheduler
+from model_router import ModelRouter
+from response_cache import ResponseCache
+from discord_streaming import DiscordStreamRenderer
+from deadline import DEADLINE_MESSAGE, Deadline, DeadlineExceeded, deadline_scope
+from image_generator import ImageGenerator
+from image_jobs import ImageJobQueue, ImageJobRejected, ImageStore, JobStatus
 
 # Import système de giveaways
 try:
@@ -76,20 +83,54 @@ class MaxisBot(commands.Bot):
         )
         
         self.db = SupabaseDB()
+        self.async_db = AsyncSupabaseDB()
+        
+        # Historique unique: alimenté par AIManager, persisté et archivé via la sécurité
+        self.conversation_history = ConversationHistoryManager(self.db) if SECURITY_ENABLED else None
         
         # Initialisation sécurité
         if SECURITY_ENABLED:
-            self.security = SecurityIntegration(self.db)
+            self.security = SecurityIntegration(
+                self.db,
+                write_buffer=self.async_db.write_buffer,
+                conversation_history=self.conversation_history
+            )
             self.security_initialized = False
         else:
             self.security = SecurityManager(self.db)
             self.security_initialized = True
         
-        self.ai = AIManager(EnvConfig.GEMINI_API_KEY, self.db)
+        # File pondérée par plan devant Gemini (concurrence et budgets par modèle)
+        self.ai_scheduler = AIScheduler(model_budgets=ModelConfig.TOKENS_PER_MINUTE)
+        
+        # Routage par santé des modèles; circuits par modèle créés à l'init sécurité
+        self.model_router = ModelRouter(
+            ModelConfig.FALLBACK_CHAIN,
+            breakers=self.security.model_breakers if SECURITY_ENABLED else None
+        )
+        
+        self.ai = AIManager(
+            EnvConfig.GEMINI_API_KEY,
+            self.db,
+            history=self.conversation_history,
+            cost_ledger=self.async_db.cost_ledger,
+            scheduler=self.ai_scheduler,
+            router=self.model_router
+        )
         self.created_roles = {}
         
-        # Cache pour la génération d'images
-        self.image_generating = set()
+        # Génération d'images: file de jobs (workers bornés) et cache sur disque
+        # (images et descriptions de repli, clé: prompt amélioré normalisé)
+        image_store = ImageStore(EnvConfig.IMAGE_STORE_DIR, max_bytes=EnvConfig.IMAGE_STORE_MAX_MB * 1024 * 1024)
+        self.image_generator = ImageGenerator(EnvConfig.GEMINI_API_KEY)
+        self.image_generator.store = image_store
+        self.image_jobs = ImageJobQueue(
+            self._generate_image_job,
+            image_store,
+            key_fn=self.image_generator.cache_key,
+            charge=self._charge_image_job
+        )
+        self.image_generator.executor = self.image_jobs.executor
         
         # Système de giveaways automatiques
         if GIVEAWAY_ENABLED:
@@ -125,6 +166,9 @@ class MaxisBot(commands.Bot):
         """Setup initial avec sécurité"""
         print(f'🤖 Maxis connecté: {self.user}')
         
+        # Pool HTTP asynchrone vers Supabase
+        await self.async_db.connect()
+        
         # Initialiser les composants de sécurité
         if SECURITY_ENABLED and not self.security_initialized:
             try:
@@ -145,6 +189,13 @@ class MaxisBot(commands.Bot):
             self.security_initialized = True
             print("✅ Sécurité initialisée")
         
+        # Cache de réponses (opt-in), partagé entre instances si Redis est là
+        if EnvConfig.RESPONSE_CACHE_ENABLED and self.ai.response_cache is None:
+            self.ai.response_cache = ResponseCache(redis_client=getattr(self.security, 'redis', None))
+            print("✅ Cache de réponses activé")
+        
+        self.image_jobs.start()
+        
         # Sync commandes
         try:
             synced = await self.tree.sync()
@@ -219,6 +270,16 @@ class MaxisBot(commands.Bot):
             except Exception as e:
                 print(f"⚠️ Erreur initialisation OpenClaw: {e}")
     
+    async def close(self):
+        """Arrêt propre: écrit les données en attente et ferme le pool HTTP Supabase"""
+        if SECURITY_ENABLED and self.security_initialized:
+            await self.security.close()
+        if self.giveaway_initialized:
+            await self.giveaway_manager.close()
+        await self.image_jobs.stop()
+        await self.async_db.close()
+        await super().close()
+    
     async def on_ready(self):
         """Bot prêt"""
         await self.change_presence(
@@ -349,7 +410,7 @@ class MaxisBot(commands.Bot):
     
     async def on_member_join(self, member: discord.Member):
         """Nouveau membre"""
-        self.db.get_or_create_user(
+        await self.async_db.get_or_create_user(
             member.id,
             member.name,
             discriminator=str(member.discriminator) if hasattr(member, 'discriminator') else None,
@@ -403,7 +464,20 @@ class MaxisBot(commands.Bot):
         await self.handle_ai_message(message)
     
     async def handle_ai_message(self, message: discord.Message):
-        """Traite un message IA avec sécurité renforcée"""
+        """
+        Traite un message IA avec sécurité renforcée
+        
+        Une échéance unique (SecurityConfig.AI_REQUEST_DEADLINE) couvre toute
+        la chaîne: rate limit, base, file IA, circuit et appel Gemini bornent
+        leurs timeouts par le temps restant.
+        """
+        with deadline_scope(Deadline(SecurityConfig.AI_REQUEST_DEADLINE)):
+            try:
+                await self._handle_ai_message(message)
+            except DeadlineExceeded:
+                await message.reply(DEADLINE_MESSAGE, delete_after=30)
+    
+    async def _handle_ai_message(self, message: discord.Message):
         user_id = message.author.id
         content = message.content
         
@@ -430,29 +504,24 @@ class MaxisBot(commands.Bot):
                 await message.reply(spam_msg, delete_after=10)
                 return
         
-        # === 3. RÉCUPÉRER INFOS UTILISATEUR ===
-        user_data = self.db.get_or_create_user(user_id, str(message.author))
+        # === 3. ADMISSION (utilisateur, quota, streak en un aller-retour) ===
+        admission = await self.async_db.admit_message(user_id, str(message.author), bypass_quota=is_admin)
+        user_data = admission['user']
         user_plan = user_data['plan']
         plan_config = PLANS.get(user_plan, PLANS['free'])
         
-        # Vérifier quota
-        quota = self.db.get_daily_quota(user_id)
+        quota = admission['quota']
         quota_limit = quota['messages_limit'] + quota.get('streak_bonus', 0)
         
-        if quota['messages_used'] >= quota_limit and not is_admin:
+        if not admission['admitted']:
             embed = self._quota_exhausted_embed(user_plan, plan_config)
             await message.reply(embed=embed)
             return
         
-        # === 4. SAUVEGARDER MESSAGE UTILISATEUR ===
-        if SECURITY_ENABLED and hasattr(self.security, 'add_to_history'):
-            await self.security.add_to_history(user_id, 'user', content)
-        
-        # === 5. METTRE À JOUR STREAK ===
-        streak_info = self.db.update_streak(user_id)
+        # === 5. PALIER DE STREAK ===
+        streak_info = admission['streak']
         if streak_info['is_new_milestone']:
-            bonus = StreakConfig.BONUS.get(streak_info['current_streak'], 0)
-            self.db.add_streak_bonus(user_id, bonus)
+            bonus = streak_info['bonus']
             
             embed = discord.Embed(
                 title=f"{streak_info.get('badge', {}).get('emoji', '🔥')} Streak {streak_info['current_streak']} jours !",
@@ -461,75 +530,81 @@ class MaxisBot(commands.Bot):
             )
             await message.reply(embed=embed, delete_after=30)
         
-        # === 6. GÉNÉRER RÉPONSE AVEC CIRCUIT BREAKER ===
-        async with message.channel.typing():
-            if SECURITY_ENABLED and self.security.gemini_breaker:
-                # Utiliser circuit breaker
-                try:
-                    response = await self.security.call_with_circuit_breaker(
-                        self._generate_ai_response_wrapper,
-                        user_id=user_id,
-                        content=content,
-                        flash_ratio=plan_config.flash_ratio,
-                        pro_ratio=plan_config.pro_ratio
-                    )
-                    
-                    if response is None:
-                        await message.reply(
-                            "🔄 Le service IA est temporairement indisponible. Réessayez dans quelques minutes.",
-                            delete_after=30
-                        )
-                        return
-                        
-                except CircuitBreakerOpenError:
-                    await message.reply(
+        # === 6. GÉNÉRER RÉPONSE (STREAMÉE) AVEC CIRCUIT BREAKER ===
+        renderer = DiscordStreamRenderer(message)
+        await renderer.start()
+        
+        if SECURITY_ENABLED and self.security.gemini_breaker:
+            # Utiliser circuit breaker
+            try:
+                response = await self.security.call_with_circuit_breaker(
+                    self._generate_ai_response_wrapper,
+                    user_id=user_id,
+                    content=content,
+                    flash_ratio=plan_config.flash_ratio,
+                    pro_ratio=plan_config.pro_ratio,
+                    plan=user_plan,
+                    on_text=renderer.update,
+                    priority=plan_config.support_priority
+                )
+                
+                if response is None:
+                    await renderer.fail(
                         "🔄 Le service IA est temporairement indisponible. Réessayez dans quelques minutes.",
                         delete_after=30
                     )
                     return
-            else:
-                # Fallback sans circuit breaker
-                response = await self.ai.process_message(
-                    user_id=user_id,
-                    content=content,
-                    flash_ratio=plan_config.flash_ratio,
-                    pro_ratio=plan_config.pro_ratio
+                    
+            except CircuitBreakerOpenError:
+                await renderer.fail(
+                    "🔄 Le service IA est temporairement indisponible. Réessayez dans quelques minutes.",
+                    delete_after=30
                 )
-        
-        # === 7. LOGGER ET METTRE À JOUR QUOTA ===
-        self.db.log_security_event(user_id, 'message_processed', {
-            'model': response.model_used,
-            'cost': response.cost_usd,
-            'success': response.success
-        })
-        
-        if response.success:
-            self.db.increment_quota_usage(
+                return
+            except DeadlineExceeded:
+                # Remplacer le placeholder (et le texte partiel) plutôt que répondre à côté
+                await renderer.fail(DEADLINE_MESSAGE, delete_after=30)
+                return
+        else:
+            # Fallback sans circuit breaker
+            response = await self.ai.process_message(
                 user_id=user_id,
-                tokens=response.tokens_input + response.tokens_output,
-                cost=response.cost_usd
+                content=content,
+                flash_ratio=plan_config.flash_ratio,
+                pro_ratio=plan_config.pro_ratio,
+                plan=user_plan,
+                on_text=renderer.update,
+                priority=plan_config.support_priority
             )
+        
+        # === 7. LOGGER ET METTRE À JOUR QUOTA ===
+        # La réponse est produite: la comptabilisation n'est plus soumise à l'échéance
+        with deadline_scope(None):
+            await self.async_db.log_security_event(user_id, 'message_processed', {
+                'model': response.model_used,
+                'cost': response.cost_usd,
+                'success': response.success
+            })
             
-            # Sauvegarder réponse dans historique
-            if SECURITY_ENABLED and hasattr(self.security, 'add_to_history'):
-                await self.security.add_to_history(user_id, 'model', response.content)
+            if response.success:
+                # Retourne le quota à jour (pas de relecture)
+                quota = await self.async_db.commit_usage(
+                    user_id=user_id,
+                    tokens=response.tokens_input + response.tokens_output,
+                    cost=response.cost_usd
+                )
         
-        # === 8. ENVOYER RÉPONSE ===
+        # === 8. FINALISER LA RÉPONSE ===
         if response.success:
-            if len(response.content) > 2000:
-                for i in range(0, len(response.content), 1900):
-                    await message.channel.send(response.content[i:i+1900])
-            else:
-                await message.reply(response.content)
+            await renderer.finish(response.content)
         else:
-            await message.reply(f"❌ {response.error or 'Erreur'}")
+            await renderer.fail(f"❌ {response.error or 'Erreur'}")
         
         # === 9. NOTIFICATION 80% ===
         if not is_admin:
-            new_quota = self.db.get_daily_quota(user_id)
-            usage = new_quota['messages_used'] / quota_limit
+            usage = quota['messages_used'] / quota_limit
             if 0.8 <= usage < 1.0:
-                remaining = quota_limit - new_quota['messages_used']
+                remaining = quota_limit - quota['messages_used']
                 embed = self._quota_80_embed(user_plan, remaining)
                 await message.reply(embed=embed, delete_after=60)
     
@@ -537,44 +612,19 @@ class MaxisBot(commands.Bot):
         """Wrapper pour appel AI avec circuit breaker"""
         return await self.ai.process_message(**kwargs)
     
-    async def generate_image(self, user_id: int, prompt: str) -> Optional[discord.File]:
-        """Génère une image avec Gemini et retourne un fichier Discord"""
-        if user_id in self.image_generating:
-            return None
-        
-        self.image_generating.add(user_id)
+    async def _generate_image_job(self, job):
+        """Génère l'image d'un job (worker de la file)"""
+        return await self.image_generator.generate(job.prompt, job.user_id, size=job.size, style=job.style)
+    
+    async def _charge_image_job(self, job):
+        """
+        Décompte le quota de l'auteur d'un job servi par une génération
         
-        try:
-            import google.generativeai as genai
-            
-            # Configurer le modèle d'image
-            model = genai.GenerativeModel('gemini-2.0-flash-exp-image-generation')
-            
-            response = await asyncio.to_thread(
-                model.generate_content,
-                f"Generate an image: {prompt}",
-                generation_config={"response_modalities": ["Text", "Image"]}
-            )
-            
-            # Extraire l'image
-            for part in response.parts:
-                if hasattr(part, 'inline_data') and part.inline_data:
-                    image_data = part.inline_data.data
-                    image_bytes = base64.b64decode(image_data)
-                    
-                    file = discord.File(
-                        io.BytesIO(image_bytes),
-                        filename=f"shellia_image_{int(datetime.now().timestamp())}.png"
-                    )
-                    return file
-            
-            return None
-            
-        except Exception as e:
-            print(f"❌ Erreur génération image: {e}")
-            return None
-        finally:
-            self.image_generating.discard(user_id)
+        Appelé par la file pour chaque appelant (y compris ceux rattachés à
+        une demande identique en cours); jamais pour le cache ni une
+        description de repli.
+        """
+        await asyncio.to_thread(self.db.increment_images_generated, job.user_id)
     
     def _quota_exhausted_embed(self, plan: str, plan_config) -> discord.Embed:
         """Embed quota épuisé"""
@@ -624,7 +674,7 @@ class MaxisBot(commands.Bot):
 # COMMANDES SLASH
 # ============================================================================
 
-bot = ShelliaBotSecure()
+bot = MaxisBot()
 
 @bot.tree.command(name="help", description="Affiche l'aide")
 async def slash_help(interaction: discord.Interaction):
@@ -865,33 +915,20 @@ async def slash_image(interaction: discord.Interaction, prompt: str):
         )
         return
     
+    try:
+        job = await bot.image_jobs.submit(user_id, prompt)
+    except ImageJobRejected as e:
+        await interaction.response.send_message(str(e), ephemeral=True)
+        return
+    
     await interaction.response.defer(thinking=True)
     
     try:
-        image_file = await bot.generate_image(user_id, prompt)
-        
-        if image_file:
-            # Incrémenter compteur
-            bot.db.client.table('users').update({
-                'images_generated_today': images_used + 1
-            }).eq('user_id', user_id).execute()
-            
-            embed = discord.Embed(
-                title="🎨 Image générée",
-                description=f"Prompt: *{prompt[:100]}...*" if len(prompt) > 100 else f"Prompt: *{prompt}*",
-                color=discord.Color.purple()
-            )
-            embed.set_image(url=f"attachment://{image_file.filename}")
-            
-            remaining = plan_config.image_quota - images_used - 1
-            embed.set_footer(text=f"{remaining} images restantes aujourd'hui")
-            
-            await interaction.followup.send(embed=embed, file=image_file)
-        else:
-            await interaction.followup.send(
-                "❌ Erreur lors de la génération de l'image. Réessayez plus tard.",
-                ephemeral=True
-            )
+        # Attente bornée: au-delà, l'utilisateur suit le job avec /image_status
+        await bot.image_jobs.wait(job, timeout=IMAGE_WAIT_SECONDS)
+        charged = job.digest is not None and not job.cached
+        remaining = plan_config.image_quota - images_used - (1 if charged else 0)
+        await _send_image_job(interaction, job, remaining)
     except Exception as e:
         print(f"❌ Erreur commande image: {e}")
         await interaction.followup.send(
@@ -900,6 +937,74 @@ async def slash_image(interaction: discord.Interaction, prompt: str):
         )
 
 
+@bot.tree.command(name="image_status", description="Suivre une génération d'image")
+@app_commands.describe(job_id="Identifiant donné par /image")
+async def slash_image_status(interaction: discord.Interaction, job_id: str):
+    """Statut d'un job d'image (et l'image si elle est prête)"""
+    job = bot.image_jobs.get(job_id.strip())
+    if job is None or job.user_id != interaction.user.id:
+        await interaction.response.send_message("❌ Job introuvable ou expiré.", ephemeral=True)
+        return
+    
+    if not job.finished:
+        await interaction.response.send_message(_image_job_pending_text(job), ephemeral=True)
+        return
+    
+    await interaction.response.defer(thinking=True)
+    await _send_image_job(interaction, job)
+
+
+# Attente maximale de /image avant de rendre la main (le job continue)
+IMAGE_WAIT_SECONDS = 120
+
+
+def _image_job_pending_text(job) -> str:
+    position = bot.image_jobs.position(job)
+    if job.status == JobStatus.QUEUED and position:
+        state = f"en file (position {position})"
+    else:
+        state = "en cours de génération"
+    return f"⏳ Image {state}. Suivez-la avec `/image_status {job.job_id}`."
+
+
+async def _send_image_job(interaction: discord.Interaction, job, remaining: Optional[int] = None):
+    """Envoie le résultat d'un job (image, échec ou attente) en réponse différée"""
+    if not job.finished:
+        await interaction.followup.send(_image_job_pending_text(job), ephemeral=True)
+        return
+    
+    if job.status == JobStatus.FAILED:
+        await interaction.followup.send(f"❌ {job.error}", ephemeral=True)
+        return
+    
+    if job.digest is None:
+        # Repli: description de l'image (service d'images indisponible)
+        embed = discord.Embed(
+            title="🖌️ Image indisponible, voici sa description",
+            description=(job.description or "")[:4000],
+            color=discord.Color.purple()
+        )
+        embed.set_footer(text="Non décompté de votre quota d'images")
+        await interaction.followup.send(embed=embed)
+        return
+    
+    image_bytes = await asyncio.to_thread(bot.image_jobs.read_image, job)
+    extension = job.mime_type.split('/')[-1]
+    image_file = discord.File(io.BytesIO(image_bytes), filename=f"shellia_image_{job.job_id}.{extension}")
+    
+    prompt = job.prompt
+    embed = discord.Embed(
+        title="🎨 Image générée",
+        description=f"Prompt: *{prompt[:100]}...*" if len(prompt) > 100 else f"Prompt: *{prompt}*",
+        color=discord.Color.purple()
+    )
+    embed.set_image(url=f"attachment://{image_file.filename}")
+    if remaining is not None:
+        embed.set_footer(text=f"{remaining} images restantes aujourd'hui")
+    
+    await interaction.followup.send(embed=embed, file=image_file)
+
+
 # ============================================================================
 # COMMANDES ADMIN
 # ============================================================================
@@ -958,9 +1063,58 @@ async def slash_serverstats(interaction: discord.Interaction):
     embed.add_field(name="Messages aujourd'hui", value=f"{stats['messages_today']:,}", inline=True)
     embed.add_field(name="Coût API", value=f"${stats['cost_today_usd']:.4f}", inline=True)
     
+    queue = bot.ai_scheduler.get_stats()
+    queue_text = "\n".join(
+        f"{name}: {p['queued']} en file, p95 {p['wait_p95']:.1f}s, {p['shed']} abandons"
+        for name, p in queue['priorities'].items()
+    )
+    embed.add_field(name=f"File IA ({queue['in_flight']}/{queue['max_in_flight']} en cours)", value=queue_text, inline=False)
+    
+    routing = bot.model_router.get_stats()
+    if routing['models']:
+        routing_text = "\n".join(
+            f"{model}: p50 {h['p50']:.1f}s, p95 {h['p95']:.1f}s, {h['error_rate']:.0%} erreurs"
+            + (f", circuit {h['breaker']}" if h['breaker'] else "")
+            for model, h in routing['models'].items()
+        )
+        routing_text += f"\nCouvertures: {routing['hedges']} ({routing['hedge_wins']} gagnées)"
+        embed.add_field(name="Routage IA", value=routing_text, inline=False)
+    
+    images = bot.image_jobs.get_stats()
+    embed.add_field(
+        name=f"Images ({images['running']}/{images['workers']} en cours, {images['queued']} en file)",
+        value=f"{images['generated']} générées, {images['store_hits']} depuis le store, "
+              f"{images['coalesced']} regroupées, {images['rejected']} refusées, {images['failed']} échecs\n"
+              f"Cache: {images['store']['images']['hit_rate']:.0%} images, "
+              f"{images['store']['descriptions']['hit_rate']:.0%} descriptions, "
+              f"{images['store']['bytes'] / 1024 / 1024:.0f}/{images['store']['max_bytes'] / 1024 / 1024:.0f} Mo",
+        inline=False
+    )
+    
+    journal = bot.giveaway_manager.entry_journal if bot.giveaway_manager else None
+    if journal:
+        entries = journal.get_stats()
+        if entries['failed_batches'] or entries['dead_lettered']:
+            embed.add_field(
+                name="Participations giveaways",
+                value=f"{entries['pending']} en attente, {entries['failed_batches']} lots en échec, "
+                      f"{entries['dead_lettered']} abandonnées"
+                      + (f", prochain essai dans {entries['retry_delay']:.0f}s" if entries['retry_delay'] else ""),
+                inline=False
+            )
+    
     plan_text = "\n".join([f"{p.upper()}: {c}" for p, c in stats['plan_distribution'].items()])
     embed.add_field(name="Plans", value=plan_text, inline=False)
     
+    # Coûts réels par modèle (registre, 7 jours)
+    report = await bot.async_db.get_cost_report(days=7)
+    if report.get('by_model'):
+        model_text = "\n".join(
+            f"{row['model']}: ${row['cost_usd']:.4f} ({row['calls']:,} appels, {row['cached_tokens']:,} tokens en cache)"
+            for row in report['by_model']
+        )
+        embed.add_field(name="Coûts IA (7j)", value=model_text, inline=False)
+    
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
 
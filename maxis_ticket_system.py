@@ -12,6 +12,11 @@ from enum import Enum
 import aiohttp
 import json
 
+try:
+    from user_cache import user_cache
+except ImportError:
+    user_cache = None
+
 
 class TicketStatus(Enum):
     OPEN = "open"
@@ -111,7 +116,12 @@ class MaxisTicketSystem:
         return ticket_data
         
     async def _get_user_plan(self, user_id: int) -> str:
-        """Récupère le plan de l'utilisateur"""
+        """Récupère le plan de l'utilisateur (cache utilisateurs d'abord)"""
+        if user_cache:
+            cached = user_cache.get(user_id)
+            if cached and cached.get('plan'):
+                return cached['plan']
+        
         try:
             result = await self.db.fetch(
                 "SELECT plan FROM users WHERE user_id = %s",
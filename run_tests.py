@@ -2,6 +2,8 @@
 """
 SCRIPT DE TEST - Shellia AI Bot
 Lance tous les tests (unitaires et d'intégration)
+
+Prérequis: pip install -r requirements-dev.txt (pytest, fakeredis)
 """
 
 import sys
@@ -60,8 +62,17 @@ def main():
         "Tests d'intégration"
     )
     
-    # 4. Test de connexion aux services (si variables d'env configurées)
-    print_header("4. TESTS DE CONNEXION")
+    # 4. Banc de charge hors ligne (faux Supabase, fakeredis, faux Gemini)
+    print_header("4. BANC DE CHARGE (HORS LIGNE)")
+    
+    results['load_test'] = run_command(
+        [sys.executable, 'load_test.py', '--bot', 'shellia', '--users', '20', '--messages', '3',
+         '--gemini-latency', '0.2'],
+        "Banc de charge"
+    )
+    
+    # 5. Test de connexion aux services (si variables d'env configurées)
+    print_header("5. TESTS DE CONNEXION")
     
     if all(key in sys.environ for key in ['SUPABASE_URL', 'GEMINI_API_KEY']):
         print("✅ Variables d'environnement présentes")
@@ -8,17 +8,28 @@ from datetime import datetime, timedelta
 from unittest.mock import Mock, AsyncMock, patch
 import discord
 
-# Imports à tester
+# Imports à tester (les modules de bot/ s'importent entre eux sans préfixe;
+# bot/ est retiré du path ensuite pour ne pas masquer le paquet `bot`)
+import os
 import sys
-sys.path.insert(0, 'bot')
-
-from auto_giveaway import (
-    AutoGiveawayManager, 
-    MilestoneReward, 
-    GiveawayEntry,
-    ActiveGiveaway,
-    GiveawayStatus
-)
+BOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot')
+sys.path.insert(0, BOT_DIR)
+try:
+    from auto_giveaway import (
+        AutoGiveawayManager, 
+        MilestoneReward, 
+        GiveawayEntry,
+        ActiveGiveaway,
+        GiveawayStatus
+    )
+    from giveaway_entries import EntryJournal, EntryJournalConfig, EntrySet
+    from giveaway_commands import GiveawayCommands
+    from dm_queue import DMQueue, DMQueueConfig
+    from deadline_scheduler import DeadlineScheduler
+    from giveaway_draw import DrawWeights, draw_winners
+    from supabase_client import SupabaseDB
+finally:
+    sys.path.remove(BOT_DIR)
 
 
 # ============================================================================
@@ -31,7 +42,6 @@ def mock_bot():
     bot = Mock()
     bot.user = Mock()
     bot.user.id = 123456789
-    bot.loop = asyncio.get_event_loop()
     bot.is_closed = Mock(return_value=False)
     bot.wait_until_ready = AsyncMock()
     return bot
@@ -144,6 +154,146 @@ class TestGiveawayEntry:
         assert 'joined_at' in data
 
 
+# ============================================================================
+# TESTS INDEX ET JOURNAL DES PARTICIPATIONS
+# ============================================================================
+
+class TestEntrySet:
+    """Tests de l'index des participants"""
+    
+    def test_membership_and_order(self):
+        """Ajout idempotent, retrait, ordre d'inscription conservé"""
+        now = datetime.utcnow().replace(microsecond=0)
+        entries = EntrySet()
+        
+        assert entries.add(3, now) is True
+        assert entries.add(1, now) is True
+        assert entries.add(3, now) is False
+        assert 3 in entries and 2 not in entries
+        assert list(entries.user_ids()) == [3, 1]
+        assert entries.joined_at(1) == now
+        
+        assert entries.discard(3) is True
+        assert entries.discard(3) is False
+        assert len(entries) == 1
+        assert [e.user_id for e in entries] == [1]
+    
+    def test_from_legacy_entries(self):
+        """Construit depuis une liste (JSONB legacy), timestamps aware ou naïfs"""
+        from datetime import timezone
+        aware = datetime(2026, 1, 1, 12, 0, tzinfo=timezone.utc)
+        entries = EntrySet([
+            GiveawayEntry.from_dict({'user_id': '7', 'joined_at': '2026-01-01T12:00:00'}),
+            GiveawayEntry(user_id=8, joined_at=aware),
+        ])
+        
+        assert [e.joined_at for e in entries] == [datetime(2026, 1, 1, 12, 0)] * 2
+        assert entries.to_list()[0]['user_id'] == 7
+
+
+class TestEntryJournal:
+    """Tests de l'écriture groupée dans giveaway_entries"""
+    
+    @pytest.mark.asyncio
+    async def test_batched_writes(self, mock_db):
+        """Une requête par lot, suppressions et ajouts séparés"""
+        journal = EntryJournal(mock_db, EntryJournalConfig(max_batch_size=2))
+        now = datetime.utcnow()
+        for user_id in range(3):
+            journal.record_add("g1", user_id, now)
+        journal.record_remove("g2", 99)
+        
+        await journal.flush()
+        
+        calls = mock_db.execute.await_args_list
+        assert len(calls) == 3  # 1 DELETE + 2 lots d'INSERT
+        assert "DELETE" in calls[0].args[0]
+        assert calls[0].args[1] == (["g2"], [99])
+        assert calls[1].args[1][:2] == (["g1", "g1"], [0, 1])
+        assert calls[2].args[1][:2] == (["g1"], [2])
+        assert journal.pending == 0
+    
+    @pytest.mark.asyncio
+    async def test_add_then_remove_coalesces(self, mock_db):
+        """Réaction ajoutée puis retirée avant le flush: aucune écriture"""
+        journal = EntryJournal(mock_db)
+        journal.record_add("g1", 1, datetime.utcnow())
+        journal.record_remove("g1", 1)
+        
+        await journal.flush()
+        
+        mock_db.execute.assert_not_awaited()
+        assert journal.get_stats()['coalesced'] == 1
+    
+    @pytest.mark.asyncio
+    async def test_readd_after_persisted_remove(self, mock_db):
+        """Retrait d'une ligne écrite, retour, puis nouveau retrait: DELETE conservé"""
+        journal = EntryJournal(mock_db)
+        journal.record_remove("g1", 1)
+        journal.record_add("g1", 1, datetime.utcnow())
+        journal.record_remove("g1", 1)
+        
+        await journal.flush()
+        
+        assert mock_db.execute.await_count == 1
+        assert "DELETE" in mock_db.execute.await_args.args[0]
+    
+    @pytest.mark.asyncio
+    async def test_failed_batch_is_requeued(self, mock_db):
+        """Un lot en échec reste en attente pour le flush suivant"""
+        journal = EntryJournal(mock_db)
+        journal.record_add("g1", 1, datetime.utcnow())
+        mock_db.execute.side_effect = [Exception("timeout"), None]
+        
+        await journal.flush()
+        assert journal.pending == 1
+        
+        await journal.flush()
+        assert journal.pending == 0
+        assert journal.get_stats()['upserted'] == 1
+    
+    @pytest.mark.asyncio
+    async def test_failing_db_backs_off_and_dead_letters(self, mock_db):
+        """Base en panne: attente croissante, puis abandon compté après max_attempts"""
+        journal = EntryJournal(mock_db, EntryJournalConfig(
+            max_attempts=3, retry_base_delay=2.0, retry_max_delay=5.0
+        ))
+        mock_db.execute.side_effect = Exception("db down")
+        journal.record_add("g1", 1, datetime.utcnow())
+        journal.record_remove("g2", 2)
+        
+        delays = []
+        for _ in range(3):
+            await journal.flush()
+            delays.append(journal.retry_delay)
+        
+        assert delays == [2.0, 4.0, 5.0]
+        assert journal.pending == 0
+        assert journal.get_stats()['dead_lettered'] == 2
+        assert journal.get_stats()['failed_batches'] == 6
+        
+        # Base rétablie: plus d'attente
+        mock_db.execute.side_effect = None
+        journal.record_add("g1", 3, datetime.utcnow())
+        await journal.flush()
+        assert journal.retry_delay == 0
+        assert journal.get_stats()['upserted'] == 1
+    
+    @pytest.mark.asyncio
+    async def test_background_flush_waits_out_backoff(self, mock_db):
+        """La tâche de fond n'insiste pas toutes les flush_interval sur une base en échec"""
+        journal = EntryJournal(mock_db, EntryJournalConfig(flush_interval=0.01, retry_base_delay=10.0))
+        mock_db.execute.side_effect = Exception("db down")
+        journal.record_add("g1", 1, datetime.utcnow())
+        
+        journal.start()
+        await asyncio.sleep(0.1)
+        assert mock_db.execute.await_count == 1
+        
+        await journal.stop()  # L'arrêt écourte l'attente et tente un dernier flush
+        assert mock_db.execute.await_count == 3
+
+
 # ============================================================================
 # TESTS ACTIVE GIVEAWAY
 # ============================================================================
@@ -375,6 +525,700 @@ class TestAutoGiveawayManager:
             
             assert success is True
             assert giveaway.entry_count == 0
+    
+    @pytest.mark.asyncio
+    async def test_entries_go_through_journal(self, giveaway_manager, mock_db, sample_reward):
+        """Inscriptions écrites par lot au flush, pas une requête par réaction"""
+        giveaway = ActiveGiveaway(
+            id="batched",
+            milestone=50,
+            reward=sample_reward,
+            channel_id=1,
+            message_id=1,
+            host_id=1,
+            started_at=datetime.utcnow(),
+            ends_at=datetime.utcnow() + timedelta(hours=24),
+            entries=[],
+            status=GiveawayStatus.ACTIVE,
+            winners=[]
+        )
+        giveaway_manager.active_giveaways["batched"] = giveaway
+        
+        for user_id in range(50):
+            await giveaway_manager.add_entry("batched", user_id)
+        await giveaway_manager.remove_entry("batched", 0)
+        mock_db.execute.assert_not_awaited()
+        
+        await giveaway_manager.entry_journal.flush()
+        
+        assert mock_db.execute.await_count == 1
+        assert len(mock_db.execute.await_args.args[1][1]) == 49
+    
+    @pytest.mark.asyncio
+    async def test_load_entries_from_table(self, giveaway_manager, mock_db):
+        """Au démarrage, les participants viennent de giveaway_entries"""
+        now = datetime.utcnow()
+        giveaway_row = {
+            'id': 'loaded', 'milestone': 50, 'reward': '{"member_count": 50}',
+            'channel_id': 1, 'message_id': 1, 'host_id': 1,
+            'started_at': now, 'ends_at': now + timedelta(hours=1),
+            'entries': [], 'status': 'active', 'winners': []
+        }
+        entry_rows = [{'giveaway_id': 'loaded', 'user_id': u, 'joined_at': now} for u in (5, 6)]
+        mock_db.fetch = AsyncMock(side_effect=[[], [giveaway_row], entry_rows])
+        
+        await giveaway_manager._load_from_db()
+        
+        giveaway = giveaway_manager.active_giveaways['loaded']
+        assert giveaway.entry_count == 2
+        assert 6 in giveaway.entries
+
+
+# ============================================================================
+# TESTS DÉTECTION DES PALIERS
+# ============================================================================
+
+def _guild(guild_id, member_count):
+    guild = Mock()
+    guild.id = guild_id
+    guild.member_count = member_count
+    return guild
+
+
+class TestMilestoneDetection:
+    """Paliers détectés sur les arrivées (bisect + bitset par serveur)"""
+    
+    @pytest.mark.asyncio
+    async def test_join_crossing_threshold_triggers_once(self, giveaway_manager):
+        """Le palier est célébré à l'arrivée qui le franchit, une seule fois"""
+        guild = _guild(1, 48)
+        with patch.object(giveaway_manager, '_trigger_milestone_giveaway', new_callable=AsyncMock) as trigger:
+            await giveaway_manager.on_member_count_changed(guild)
+            guild.member_count = 49
+            await giveaway_manager.on_member_count_changed(guild)
+            trigger.assert_not_awaited()
+            
+            guild.member_count = 50
+            await giveaway_manager.on_member_count_changed(guild)
+            guild.member_count = 49   # Départ
+            await giveaway_manager.on_member_count_changed(guild)
+            guild.member_count = 50   # Retour au palier
+            await giveaway_manager.on_member_count_changed(guild)
+        
+        trigger.assert_awaited_once_with(guild, 50)
+        assert giveaway_manager.is_milestone_completed(1, 50)
+        assert not giveaway_manager.is_milestone_completed(2, 50)
+        giveaway_manager.db.execute.assert_awaited_once()
+    
+    @pytest.mark.asyncio
+    async def test_loaded_bitset_and_custom_milestones(self, giveaway_manager, mock_db):
+        """Bitsets chargés une fois depuis la DB; palier ajouté ensuite pris en compte"""
+        mock_db.fetch = AsyncMock(side_effect=[
+            [{'guild_id': 1, 'milestone': 50}, {'guild_id': 1, 'milestone': 100}],
+            []
+        ])
+        await giveaway_manager._load_from_db()
+        
+        assert giveaway_manager.pending_milestones(1, 120) == []
+        assert giveaway_manager.pending_milestones(2, 120) == [50, 100]
+        
+        with patch.object(giveaway_manager, '_save_milestone_config', new_callable=AsyncMock):
+            await giveaway_manager.add_custom_milestone(75, MilestoneReward(member_count=75))
+        
+        assert giveaway_manager.pending_milestones(1, 120) == [75]
+        assert giveaway_manager.upcoming_milestones(120, limit=2) == [250, 500]
+    
+    @pytest.mark.asyncio
+    async def test_failed_trigger_is_retried_by_reconciliation(self, giveaway_manager):
+        """Échec de lancement: le palier reste à célébrer pour la passe suivante"""
+        guild = _guild(1, 50)
+        giveaway_manager.bot.guilds = [guild]
+        trigger = AsyncMock(side_effect=[RuntimeError("no channel"), None])
+        with patch.object(giveaway_manager, '_trigger_milestone_giveaway', trigger):
+            with pytest.raises(RuntimeError):
+                await giveaway_manager.on_member_count_changed(guild)
+            assert not giveaway_manager.is_milestone_completed(1, 50)
+            
+            await giveaway_manager._check_all_guilds()
+        
+        assert trigger.await_count == 2
+        assert giveaway_manager.is_milestone_completed(1, 50)
+
+
+# ============================================================================
+# TESTS ROUTAGE DES RÉACTIONS
+# ============================================================================
+
+def _reaction(channel_id, message_id, user_id, emoji="🎉"):
+    payload = Mock()
+    payload.channel_id = channel_id
+    payload.message_id = message_id
+    payload.user_id = user_id
+    payload.emoji = emoji
+    return payload
+
+
+class TestReactionRouting:
+    """Tests de l'index (channel_id, message_id) -> giveaway"""
+    
+    @staticmethod
+    async def _create(giveaway_manager, sample_reward):
+        """Giveaway créé par create_giveaway (message 555 dans le canal 42)"""
+        message = Mock(id=555)
+        message.add_reaction = AsyncMock()
+        channel = Mock(id=42)
+        with patch.object(giveaway_manager, '_send_giveaway_message', AsyncMock(return_value=message)):
+            return await giveaway_manager.create_giveaway(
+                guild=Mock(), channel=channel, milestone=50, reward=sample_reward, host_id=1
+            )
+    
+    @pytest.mark.asyncio
+    async def test_index_maintained_on_create_and_cancel(self, giveaway_manager, sample_reward):
+        """Indexé à la création, retiré à l'annulation"""
+        created = await self._create(giveaway_manager, sample_reward)
+        assert giveaway_manager.giveaway_for_message(42, 555) is created
+        assert giveaway_manager.giveaway_for_message(43, 555) is None
+        
+        giveaway_manager.bot.get_channel = Mock(return_value=None)
+        await giveaway_manager.cancel_giveaway(created.id)
+        
+        assert giveaway_manager.giveaway_for_message(42, 555) is None
+        assert giveaway_manager.message_index == {}
+    
+    @pytest.mark.asyncio
+    async def test_index_cleared_on_end(self, giveaway_manager, sample_reward):
+        """Retiré de l'index à la fin du giveaway"""
+        created = await self._create(giveaway_manager, sample_reward)
+        with patch.object(giveaway_manager, '_update_giveaway_ended', new_callable=AsyncMock), \
+             patch.object(giveaway_manager, '_announce_winners', new_callable=AsyncMock), \
+             patch.object(giveaway_manager, '_update_giveaway_status', new_callable=AsyncMock):
+            await giveaway_manager.end_giveaway(created.id)
+        
+        assert giveaway_manager.message_index == {}
+    
+    @pytest.mark.asyncio
+    async def test_reactions_route_and_queue_dm(self, giveaway_manager, sample_reward):
+        """Réaction: participation + DM en file; retrait: DM annulé"""
+        created = await self._create(giveaway_manager, sample_reward)
+        cog = GiveawayCommands(giveaway_manager.bot)
+        cog.setup_manager(giveaway_manager)
+        
+        await cog.on_raw_reaction_add(_reaction(42, 555, 777))
+        await cog.on_raw_reaction_add(_reaction(42, 999, 778))   # Autre message
+        await cog.on_raw_reaction_add(_reaction(42, 555, 779, emoji="👍"))
+        
+        assert list(created.entries.user_ids()) == [777]
+        assert giveaway_manager.dm_queue.pending == 1
+        
+        await cog.on_raw_reaction_remove(_reaction(42, 555, 777))
+        
+        assert created.entry_count == 0
+        assert giveaway_manager.dm_queue.pending == 0
+
+
+class TestDMQueue:
+    """Tests de la file de DMs"""
+    
+    @staticmethod
+    def _bot(user):
+        bot = Mock()
+        bot.get_user = Mock(return_value=user)
+        return bot
+    
+    @pytest.mark.asyncio
+    async def test_paced_delivery(self):
+        """Rafale jusqu'à `burst`, puis au rythme configuré"""
+        user = Mock()
+        user.send = AsyncMock()
+        queue = DMQueue(self._bot(user), DMQueueConfig(rate_per_second=50, burst=2))
+        for i in range(5):
+            assert queue.enqueue(i, discord.Embed()) is True
+        assert queue.enqueue(0, discord.Embed()) is False  # Déjà en file
+        
+        start = asyncio.get_running_loop().time()
+        queue.start()
+        while queue.pending or user.send.await_count < 5:
+            await asyncio.sleep(0.005)
+        elapsed = asyncio.get_running_loop().time() - start
+        await queue.stop()
+        
+        assert user.send.await_count == 5
+        assert elapsed >= 3 / 50 * 0.8   # 3 envois au-delà de la rafale
+        assert queue.get_stats()['deduplicated'] == 1
+    
+    @pytest.mark.asyncio
+    async def test_rate_limit_retry_and_closed_dms(self):
+        """429: recul puis nouvel essai; DMs fermés: abandon sans retry"""
+        response = Mock(status=429, reason="Too Many Requests")
+        rate_limited = discord.HTTPException(response, "rate limited")
+        rate_limited.retry_after = 0.01
+        forbidden = discord.Forbidden(Mock(status=403, reason="Forbidden"), "closed")
+        
+        user = Mock()
+        user.send = AsyncMock(side_effect=[rate_limited, None, forbidden])
+        queue = DMQueue(self._bot(user), DMQueueConfig(rate_per_second=1000, burst=10))
+        queue.enqueue(1, discord.Embed())
+        queue.enqueue(2, discord.Embed())
+        
+        queue.start()
+        while user.send.await_count < 3:
+            await asyncio.sleep(0.005)
+        await queue.stop()
+        
+        stats = queue.get_stats()
+        assert stats['rate_limited'] == 1
+        assert stats['sent'] == 1
+        assert stats['dms_closed'] == 1
+    
+    def test_bounded(self):
+        """File pleine: les nouveaux DMs sont abandonnés"""
+        queue = DMQueue(Mock(), DMQueueConfig(max_pending=1))
+        assert queue.enqueue(1, discord.Embed()) is True
+        assert queue.enqueue(2, discord.Embed()) is False
+        assert queue.discard(1) is True
+        assert queue.get_stats()['dropped'] == 1
+
+
+# ============================================================================
+# TESTS ÉCHÉANCES
+# ============================================================================
+
+class TestDeadlineScheduler:
+    """Tests du planificateur d'échéances"""
+    
+    @pytest.mark.asyncio
+    async def test_fires_in_order_and_honors_cancel(self):
+        """Ordre des échéances, annulation et replanification"""
+        fired = []
+        
+        async def callback(key):
+            fired.append(key)
+        
+        scheduler = DeadlineScheduler(callback)
+        scheduler.start()
+        scheduler.schedule_in('b', 0.04)
+        scheduler.schedule_in('a', 0.02)
+        scheduler.schedule_in('c', 0.03)
+        scheduler.cancel('c')
+        scheduler.schedule_in('d', 10)
+        scheduler.schedule_in('d', 0.01)   # Replanifiée plus tôt: réveil anticipé
+        
+        await asyncio.sleep(0.1)
+        await scheduler.stop()
+        
+        assert fired == ['d', 'a', 'b']
+        assert len(scheduler) == 0
+    
+    @pytest.mark.asyncio
+    async def test_failing_callback_does_not_stop_loop(self):
+        """Une échéance en erreur n'empêche pas les suivantes"""
+        fired = []
+        
+        async def callback(key):
+            if key == 'boom':
+                raise RuntimeError("boom")
+            fired.append(key)
+        
+        scheduler = DeadlineScheduler(callback)
+        scheduler.start()
+        scheduler.schedule_in('boom', 0)
+        scheduler.schedule_in('ok', 0.01)
+        
+        await asyncio.sleep(0.05)
+        await scheduler.stop()
+        
+        assert fired == ['ok']
+        assert scheduler.get_stats()['errors'] == 1
+
+
+def _giveaway(giveaway_id, reward, ends_in: timedelta, message_id=1):
+    return ActiveGiveaway(
+        id=giveaway_id,
+        milestone=50,
+        reward=reward,
+        channel_id=1,
+        message_id=message_id,
+        host_id=1,
+        started_at=datetime.utcnow(),
+        ends_at=datetime.utcnow() + ends_in,
+        entries=[],
+        status=GiveawayStatus.ACTIVE,
+        winners=[]
+    )
+
+
+class TestGiveawayScheduling:
+    """Fin à l'échéance, réarmement au redémarrage, éditions regroupées"""
+    
+    @pytest.mark.asyncio
+    async def test_ends_at_deadline(self, giveaway_manager, sample_reward):
+        """Le giveaway se termine à ends_at, sans attendre un tour de polling"""
+        giveaway_manager._register_giveaway(_giveaway("soon", sample_reward, timedelta(milliseconds=30)))
+        
+        with patch.object(giveaway_manager, 'end_giveaway', new_callable=AsyncMock) as end:
+            giveaway_manager.scheduler.start()
+            await asyncio.sleep(0.01)
+            end.assert_not_awaited()
+            await asyncio.sleep(0.05)
+            await giveaway_manager.scheduler.stop()
+        
+        end.assert_awaited_once_with("soon")
+    
+    @pytest.mark.asyncio
+    async def test_rearmed_from_db_on_restart(self, giveaway_manager, mock_db):
+        """Au redémarrage: échéances réarmées, celles dépassées tout de suite"""
+        now = datetime.utcnow()
+        rows = [
+            {
+                'id': giveaway_id, 'milestone': 50, 'reward': '{"member_count": 50}',
+                'channel_id': 1, 'message_id': n, 'host_id': 1,
+                'started_at': now - timedelta(hours=2), 'ends_at': now + ends_in,
+                'entries': [], 'status': 'active', 'winners': []
+            }
+            for n, (giveaway_id, ends_in) in enumerate([("overdue", timedelta(hours=-1)), ("later", timedelta(hours=1))])
+        ]
+        mock_db.fetch = AsyncMock(side_effect=[[], rows, []])
+        
+        await giveaway_manager._load_from_db()
+        
+        assert "active_giveaways WHERE status = 'active'" in mock_db.fetch.await_args_list[1].args[0]
+        assert giveaway_manager.scheduler.time_until(('end', 'overdue')) == 0
+        assert 3500 < giveaway_manager.scheduler.time_until(('end', 'later')) <= 3600
+    
+    @pytest.mark.asyncio
+    async def test_cancel_disarms_deadline(self, giveaway_manager, sample_reward):
+        """Annulé: plus d'échéance ni d'édition en attente"""
+        giveaway_manager.bot.get_channel = Mock(return_value=None)
+        giveaway_manager._register_giveaway(_giveaway("gone", sample_reward, timedelta(hours=1)))
+        with patch.object(giveaway_manager, '_save_entry', new_callable=AsyncMock):
+            await giveaway_manager.add_entry("gone", 1)
+        
+        await giveaway_manager.cancel_giveaway("gone")
+        
+        assert len(giveaway_manager.scheduler) == 0
+    
+    @pytest.mark.asyncio
+    async def test_debounced_edits(self, giveaway_manager, sample_reward):
+        """Une édition par fenêtre, et seulement si le compteur a changé"""
+        partial = Mock()
+        partial.edit = AsyncMock()
+        channel = Mock()
+        channel.get_partial_message = Mock(return_value=partial)
+        giveaway_manager.bot.get_channel = Mock(return_value=channel)
+        giveaway_manager.EDIT_DEBOUNCE_SECONDS = 0.02
+        giveaway = _giveaway("busy", sample_reward, timedelta(hours=1))
+        giveaway_manager._register_giveaway(giveaway, rendered_count=0)
+        giveaway_manager.scheduler.start()
+        
+        with patch.object(giveaway_manager, '_save_entry', new_callable=AsyncMock), \
+             patch.object(giveaway_manager, '_remove_entry_db', new_callable=AsyncMock):
+            for user_id in range(20):
+                await giveaway_manager.add_entry("busy", user_id)
+            for _ in range(100):
+                if partial.edit.await_count:
+                    break
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)  # Une fenêtre de plus: pas de seconde édition
+            assert partial.edit.await_count == 1
+            channel.fetch_message.assert_not_called()
+            
+            # Entrée puis sortie: compteur inchangé, pas d'édition
+            await giveaway_manager.add_entry("busy", 99)
+            await giveaway_manager.remove_entry("busy", 99)
+            await asyncio.sleep(0.05)
+        
+        await giveaway_manager.scheduler.stop()
+        assert partial.edit.await_count == 1
+
+
+# ============================================================================
+# TESTS TIRAGE
+# ============================================================================
+
+class TestGiveawayDraw:
+    """Tests du tirage pondéré rejouable"""
+    
+    def test_same_seed_same_winners_in_any_order(self):
+        """Le résultat dépend de la graine, pas de l'ordre des participations"""
+        users = list(range(1, 501))
+        first = draw_winners(users, 3, "seed")
+        again = draw_winners(reversed(users), 3, "seed")
+        
+        assert first.winners == again.winners
+        assert len(set(first.winners)) == 3
+        assert draw_winners(users, 3, "other").winners != first.winners
+    
+    def test_eligibility_checked_lazily(self):
+        """Seuls les candidats qui entreraient dans le réservoir sont vérifiés"""
+        checked = []
+        
+        def eligible(user_id):
+            checked.append(user_id)
+            return user_id
+        
+        result = draw_winners(iter(range(100000)), 3, "seed", eligible)
+        
+        assert result.entries_scanned == 100000
+        assert result.eligibility_checks == len(checked) < 500
+    
+    def test_ineligible_members_skipped(self):
+        """Un participant inéligible (parti, bot) ne gagne pas"""
+        banned = set(draw_winners(range(100), 2, "seed").winners)
+        result = draw_winners(range(100), 2, "seed", lambda u: None if u in banned else u)
+        
+        assert len(result.winners) == 2
+        assert not banned & set(result.winners)
+    
+    def test_weights_bias_the_draw(self):
+        """Un plan à fort multiplicateur gagne bien plus souvent"""
+        weights = DrawWeights(plans={'premium': 20.0})
+        entries = [(1, 'premium', 0)] + [(u, 'free', 0) for u in range(2, 12)]
+        wins = sum(
+            draw_winners(entries, 1, f"seed-{i}", weights=weights).winners == [1]
+            for i in range(300)
+        )
+        
+        # Espérance: 20 / 30 des tirages, contre 1 / 11 sans poids
+        assert wins > 150
+    
+    def test_exclude_yields_next_ranked(self):
+        """Rejouer en excluant les gagnants désigne les suivants du classement"""
+        full = draw_winners(range(1000), 5, "seed")
+        reroll = draw_winners(range(1000), 2, "seed", exclude=set(full.winners[:3]))
+        
+        assert reroll.winners == full.winners[3:]
+    
+    def test_weights_roundtrip(self):
+        weights = DrawWeights(plans={'pro': 2.0}, streak_bonus=0.1, roles={42: 1.5})
+        assert DrawWeights.from_dict(weights.to_dict()) == weights
+    
+    @pytest.mark.asyncio
+    async def test_manager_draws_from_channel_guild(self, giveaway_manager, mock_bot, mock_db, sample_reward):
+        """Les gagnants sont des membres du serveur du canal, le tirage est journalisé"""
+        giveaway = ActiveGiveaway(
+            id="draw",
+            milestone=50,
+            reward=sample_reward,
+            channel_id=77,
+            message_id=1,
+            host_id=1,
+            started_at=datetime.utcnow(),
+            ends_at=datetime.utcnow() + timedelta(hours=1),
+            entries=[],
+            status=GiveawayStatus.ENDED,
+            winners=[]
+        )
+        for user_id in range(1, 21):
+            giveaway.entries.add(user_id, datetime.utcnow())
+        
+        guild = Mock()
+        guild.get_member = lambda user_id: Mock(id=user_id, bot=False)
+        mock_bot.get_channel = Mock(return_value=Mock(guild=guild))
+        
+        winners = await giveaway_manager._draw_winners(giveaway)
+        
+        mock_bot.get_channel.assert_called_with(77)
+        assert [w.id for w in winners] == draw_winners(range(1, 21), 2, mock_db.execute.call_args[0][1][2]).winners
+        sql, params = mock_db.execute.call_args[0]
+        assert "INSERT INTO giveaway_draws" in sql
+        assert params[0] == "draw" and params[1] == 0
+    
+    @pytest.mark.asyncio
+    async def test_reroll_replays_logged_seed(self, giveaway_manager, mock_bot, mock_db):
+        """Le reroll reprend la graine du tirage initial et saute les gagnants déjà désignés"""
+        ranking = draw_winners(range(1, 51), 4, "logged").winners
+        draw_row = {
+            'giveaway_id': 'old', 'round': 0, 'seed': 'logged', 'weights': {},
+            'winners': ranking[:2], 'excluded': [],
+        }
+        
+        async def fetch(sql, params=()):
+            if 'ended_giveaways' in sql:
+                return [{'id': 'old', 'guild_id': 5, 'channel_id': 77, 'winners': ranking[:2]}]
+            if 'giveaway_draws' in sql:
+                return [draw_row]
+            return [{'user_id': user_id} for user_id in range(1, 51)]
+        
+        mock_db.fetch = AsyncMock(side_effect=fetch)
+        guild = Mock()
+        guild.get_member = lambda user_id: Mock(id=user_id, bot=False)
+        mock_bot.get_channel = Mock(return_value=Mock(guild=guild))
+        
+        winners = await giveaway_manager.reroll_giveaway('old', winners_count=2)
+        
+        assert [w.id for w in winners] == ranking[2:]
+        params = mock_db.execute.call_args[0][1]
+        assert params[1] == 1 and params[2] == 'logged'
+    
+    @pytest.mark.asyncio
+    async def test_entries_frozen_after_end(self, giveaway_manager, sample_reward):
+        """Un retrait pendant le tirage ne modifie pas les participations"""
+        giveaway = ActiveGiveaway(
+            id="frozen",
+            milestone=50,
+            reward=sample_reward,
+            channel_id=1,
+            message_id=1,
+            host_id=1,
+            started_at=datetime.utcnow(),
+            ends_at=datetime.utcnow() + timedelta(hours=1),
+            entries=[],
+            status=GiveawayStatus.ACTIVE,
+            winners=[]
+        )
+        giveaway_manager.active_giveaways["frozen"] = giveaway
+        await giveaway_manager.add_entry("frozen", 1)
+        giveaway.status = GiveawayStatus.ENDED
+        
+        assert await giveaway_manager.remove_entry("frozen", 1) is False
+        assert 1 in giveaway.entries
+    
+    @staticmethod
+    def _ending_giveaway(giveaway_id, reward, user_ids):
+        giveaway = ActiveGiveaway(
+            id=giveaway_id,
+            milestone=50,
+            reward=reward,
+            channel_id=77,
+            message_id=1,
+            host_id=1,
+            started_at=datetime.utcnow(),
+            ends_at=datetime.utcnow() + timedelta(hours=1),
+            entries=[],
+            status=GiveawayStatus.ACTIVE,
+            winners=[]
+        )
+        for user_id in user_ids:
+            giveaway.entries.add(user_id, datetime.utcnow())
+        return giveaway
+    
+    @pytest.mark.asyncio
+    async def test_failed_end_resumes_without_redrawing(self, giveaway_manager, mock_bot, mock_db, sample_reward):
+        """Après un échec, la reprise garde le tirage et ne refait que les étapes restantes"""
+        giveaway = self._ending_giveaway("retry", sample_reward, range(1, 21))
+        giveaway_manager.active_giveaways["retry"] = giveaway
+        guild = Mock()
+        guild.get_member = lambda user_id: Mock(id=user_id, bot=False)
+        mock_bot.get_channel = Mock(return_value=Mock(guild=guild))
+        
+        announce = AsyncMock(side_effect=[RuntimeError("discord down"), None])
+        with patch.object(giveaway_manager, '_update_giveaway_ended', new_callable=AsyncMock) as edit, \
+                patch.object(giveaway_manager, '_announce_winners', announce), \
+                patch.object(giveaway_manager, '_distribute_rewards', new_callable=AsyncMock), \
+                patch.object(giveaway_manager, '_update_giveaway_status', new_callable=AsyncMock) as archive:
+            with pytest.raises(RuntimeError):
+                await giveaway_manager.end_giveaway("retry")
+            
+            # Toujours actif, participations figées
+            assert "retry" in giveaway_manager.active_giveaways
+            assert await giveaway_manager.add_entry("retry", 999) is False
+            first_winners = list(giveaway.winners)
+            
+            result = await giveaway_manager.end_giveaway("retry")
+        
+        assert result.status == GiveawayStatus.ENDED
+        assert "retry" not in giveaway_manager.active_giveaways
+        assert giveaway.winners == first_winners
+        assert edit.await_count == 1
+        assert announce.await_count == 2
+        archive.assert_awaited_once_with("retry", GiveawayStatus.ENDED)
+        draws = [c for c in mock_db.execute.call_args_list if "giveaway_draws" in c[0][0]]
+        assert len(draws) == 1
+    
+    @pytest.mark.asyncio
+    async def test_end_after_restart_reuses_logged_draw(self, giveaway_manager, mock_bot, mock_db, sample_reward):
+        """Un tirage déjà journalisé (fin interrompue par un redémarrage) n'est pas refait"""
+        giveaway = self._ending_giveaway("restart", sample_reward, range(1, 21))
+        guild = Mock()
+        guild.get_member = lambda user_id: Mock(id=user_id, bot=False)
+        mock_bot.get_channel = Mock(return_value=Mock(guild=guild))
+        mock_db.fetch = AsyncMock(return_value=[{
+            'giveaway_id': 'restart', 'round': 0, 'seed': 'logged', 'weights': {}, 'winners': [7, 3],
+        }])
+        
+        winners = await giveaway_manager._draw_winners(giveaway)
+        
+        assert [w.id for w in winners] == [7, 3]
+        assert not mock_db.execute.called
+    
+    @pytest.mark.asyncio
+    async def test_db_draw_streams_keyset_pages(self, giveaway_manager, mock_bot, mock_db):
+        """Le tirage depuis giveaway_entries lit des pages bornées, pas toute la table"""
+        users = list(range(1, 24))
+        queries = []
+        
+        async def fetch(sql, params=()):
+            if 'giveaway_draws' in sql:
+                return []
+            queries.append(params)
+            _, after, limit = params
+            return [
+                {'user_id': u, 'plan': 'premium' if u % 5 == 0 else 'free', 'current_streak': u % 7}
+                for u in users if u > after
+            ][:limit]
+        
+        mock_db.fetch = AsyncMock(side_effect=fetch)
+        giveaway_manager.DRAW_PAGE_SIZE = 5
+        giveaway_manager.draw_weights = DrawWeights(plans={'premium': 3.0}, streak_bonus=0.1)
+        guild = Mock()
+        guild.get_member = lambda user_id: Mock(id=user_id, bot=False)
+        
+        result = await giveaway_manager._run_draw(
+            "paged", guild, None, 3, "seed", giveaway_manager.draw_weights, frozenset()
+        )
+        
+        expected = draw_winners(
+            [(u, 'premium' if u % 5 == 0 else 'free', u % 7) for u in users], 3, "seed",
+            weights=giveaway_manager.draw_weights
+        )
+        assert result.winners == expected.winners
+        assert result.entries_scanned == len(users)
+        assert [after for _, after, _ in queries] == [0, 5, 10, 15, 20]
+
+    @pytest.mark.asyncio
+    async def test_end_with_supabase_db_draws_from_memory(self, mock_bot, sample_reward):
+        """Client Supabase (sans fetch/execute): tirage depuis la mémoire, gagnants annoncés"""
+        manager = AutoGiveawayManager(mock_bot, Mock(spec=SupabaseDB))
+        manager.draw_weights = DrawWeights(plans={'premium': 3.0})
+        giveaway = self._ending_giveaway("supabase", sample_reward, range(1, 21))
+        manager.active_giveaways["supabase"] = giveaway
+        guild = Mock()
+        guild.get_member = lambda user_id: Mock(id=user_id, bot=False)
+        mock_bot.get_channel = Mock(return_value=Mock(guild=guild))
+        
+        with patch.object(manager, '_update_giveaway_ended', new_callable=AsyncMock), \
+                patch.object(manager, '_announce_winners', new_callable=AsyncMock) as announce, \
+                patch.object(manager, '_distribute_rewards', new_callable=AsyncMock):
+            with pytest.raises(AttributeError):
+                await manager._on_deadline(('end', "supabase"))
+        
+        assert len(giveaway.winners) == 2
+        announced = [w.id for w in announce.await_args[0][1]]
+        assert announced == giveaway.winners
+    
+    @pytest.mark.asyncio
+    async def test_end_retries_are_capped(self, mock_bot, sample_reward):
+        """L'archivage qui échoue toujours n'est pas réessayé indéfiniment"""
+        manager = AutoGiveawayManager(mock_bot, Mock(spec=SupabaseDB))
+        giveaway = self._ending_giveaway("capped", sample_reward, range(1, 21))
+        manager.active_giveaways["capped"] = giveaway
+        guild = Mock()
+        guild.get_member = lambda user_id: Mock(id=user_id, bot=False)
+        mock_bot.get_channel = Mock(return_value=Mock(guild=guild))
+        
+        with patch.object(manager, '_update_giveaway_ended', new_callable=AsyncMock), \
+                patch.object(manager, '_announce_winners', new_callable=AsyncMock) as announce, \
+                patch.object(manager, '_distribute_rewards', new_callable=AsyncMock), \
+                patch.object(manager.scheduler, 'schedule_in') as schedule_in:
+            for _ in range(manager.MAX_END_ATTEMPTS):
+                with pytest.raises(AttributeError):
+                    await manager._on_deadline(('end', "capped"))
+        
+        assert schedule_in.call_count == manager.MAX_END_ATTEMPTS - 1
+        assert announce.await_count == 1
+        # Gagnants annoncés: terminé en mémoire malgré l'archivage manquant
+        assert giveaway.status == GiveawayStatus.ENDED
+        assert "capped" not in manager.active_giveaways
 
 
 # ============================================================================
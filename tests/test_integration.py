@@ -6,7 +6,12 @@ Tests complets des flux critiques
 import pytest
 import asyncio
 import os
+import sys
 import json
+import importlib
+import importlib.util
+import threading
+import time
 from datetime import datetime, timedelta
 from unittest.mock import Mock, patch, AsyncMock
 
@@ -16,6 +21,17 @@ os.environ.setdefault('SUPABASE_SERVICE_KEY', 'test_key')
 os.environ.setdefault('GEMINI_API_KEY', 'test_gemini_key')
 os.environ.setdefault('DISCORD_TOKEN', 'test_discord_token')
 
+BOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot')
+
+
+def import_bot_module(name):
+    """Importe un module de bot/ (ces modules s'importent entre eux sans préfixe)"""
+    sys.path.insert(0, BOT_DIR)
+    try:
+        return importlib.import_module(name)
+    finally:
+        sys.path.remove(BOT_DIR)
+
 
 class TestIntegration:
     """Tests d'intégration complets"""
@@ -171,6 +187,357 @@ class TestSecurityIntegration(TestIntegration):
                 break
         
         assert is_spam, "Le spam devrait être détecté"
+    
+    @pytest.mark.asyncio
+    async def test_security_manager_hot_path_leaves_event_loop(self):
+        """Test que SecurityManager ne bloque pas la boucle: ban hors boucle, plan en mémoire"""
+        try:
+            SecurityManager = import_bot_module('security').SecurityManager
+        except ImportError:
+            pytest.skip("security non disponible")
+        
+        UserCache = import_bot_module('user_cache').UserCache
+        loop_thread = threading.get_ident()
+        ban_threads = []
+        
+        class MockDB:
+            user_cache = UserCache()
+            
+            def is_user_banned(self, user_id):
+                ban_threads.append(threading.get_ident())
+                return False, None
+            
+            def get_user(self, user_id):
+                raise AssertionError("Aucune lecture du plan en base attendue")
+        
+        db = MockDB()
+        db.user_cache.set(1, {'user_id': 1, 'plan': 'pro'})
+        db.user_cache.invalidate(1)  # usage enregistré: profil invalidé, plan connu
+        manager = SecurityManager(db)
+        
+        assert manager._get_user_plan(1) == 'pro'
+        assert manager._get_user_plan(2) == 'free'
+        assert await manager.check_user(1, "bonjour") == (True, None)
+        assert ban_threads and loop_thread not in ban_threads
+    
+    def test_global_gemini_breaker_never_replays_a_reply(self, mock_db):
+        """Test que le disjoncteur global ne rejoue pas le chat et ne coupe pas avant l'échéance"""
+        try:
+            module = import_bot_module('security_integration')
+            registry = import_bot_module('circuit_breaker').CircuitBreakerRegistry
+        except ImportError:
+            pytest.skip("security_integration non disponible")
+        
+        SecurityConfig = import_bot_module('config').SecurityConfig
+        security = module.SecurityIntegration(mock_db)
+        with patch.dict(registry._breakers, clear=True):
+            security._init_circuit_breaker()
+            config = security.gemini_breaker.config
+        
+        assert config.max_retries == 0
+        assert config.call_timeout >= SecurityConfig.AI_REQUEST_DEADLINE
+
+
+class TestAsyncSupabaseDB:
+    """Tests du client Supabase asynchrone"""
+    
+    class FakeQuery:
+        """Requête PostgREST factice (chaînable, execute awaitable)"""
+        
+        def __init__(self, data=None, delay=0.0, tracker=None):
+            self.data = data or []
+            self.delay = delay
+            self.tracker = tracker
+        
+        def __getattr__(self, name):
+            return lambda *args, **kwargs: self
+        
+        async def execute(self):
+            if self.tracker is not None:
+                self.tracker['current'] += 1
+                self.tracker['peak'] = max(self.tracker['peak'], self.tracker['current'])
+            await asyncio.sleep(self.delay)
+            if self.tracker is not None:
+                self.tracker['current'] -= 1
+            return Mock(data=self.data, count=len(self.data))
+    
+    @pytest.mark.asyncio
+    async def test_concurrency_is_bounded(self):
+        """Test que le sémaphore borne les requêtes simultanées"""
+        try:
+            AsyncSupabaseDB = import_bot_module('async_supabase_client').AsyncSupabaseDB
+        except ImportError:
+            pytest.skip("async_supabase_client non disponible")
+        
+        db = AsyncSupabaseDB(max_concurrency=3)
+        tracker = {'current': 0, 'peak': 0}
+        
+        await asyncio.gather(*[
+            db._execute(self.FakeQuery(delay=0.01, tracker=tracker))
+            for _ in range(20)
+        ])
+        
+        assert tracker['peak'] == 3
+        assert db.get_stats()['total_requests'] == 20
+        assert db.get_stats()['in_flight'] == 0
+    
+    @pytest.mark.asyncio
+    async def test_get_or_create_user_returns_existing_row(self):
+        """Test que les méthodes sont awaitables et gardent la même sémantique"""
+        try:
+            AsyncSupabaseDB = import_bot_module('async_supabase_client').AsyncSupabaseDB
+        except ImportError:
+            pytest.skip("async_supabase_client non disponible")
+        
+        UserCache = import_bot_module('user_cache').UserCache
+        db = AsyncSupabaseDB(user_cache=UserCache())
+        row = {'user_id': 12345, 'username': 'TestUser', 'plan': 'pro'}
+        db.client = Mock()
+        db.client.table = Mock(return_value=self.FakeQuery(data=[row]))
+        
+        user = await db.get_or_create_user(12345, 'TestUser')
+        
+        assert user == row
+        db.client.table.assert_called_once_with('users')
+    
+    @pytest.mark.asyncio
+    async def test_requires_connect(self):
+        """Test qu'une requête sans connect() échoue clairement"""
+        try:
+            AsyncSupabaseDB = import_bot_module('async_supabase_client').AsyncSupabaseDB
+        except ImportError:
+            pytest.skip("async_supabase_client non disponible")
+        
+        db = AsyncSupabaseDB()
+        with pytest.raises(RuntimeError):
+            await db.get_user(12345)
+
+    @pytest.mark.asyncio
+    async def test_admit_message_single_round_trip(self):
+        """Test que l'admission passe en un seul appel RPC avec les règles de config"""
+        try:
+            AsyncSupabaseDB = import_bot_module('async_supabase_client').AsyncSupabaseDB
+        except ImportError:
+            pytest.skip("async_supabase_client non disponible")
+
+        db = AsyncSupabaseDB()
+        admission = {
+            'admitted': True,
+            'user': {'user_id': 12345, 'plan': 'free'},
+            'quota': {'messages_used': 3, 'messages_limit': 10, 'streak_bonus': 50},
+            'streak': {'current_streak': 7, 'longest_streak': 7, 'is_new_milestone': True, 'bonus': 50}
+        }
+        db.client = Mock()
+        db.client.rpc = Mock(return_value=self.FakeQuery(data=admission))
+
+        result = await db.admit_message(12345, 'TestUser')
+
+        assert result['admitted'] is True
+        assert 'badge' in result['streak']
+        assert db.client.rpc.call_count == 1
+        name, params = db.client.rpc.call_args[0]
+        assert name == 'admit_message'
+        assert params['p_plan_limits']['free'] == 10
+        assert params['p_bypass_quota'] is False
+        assert 7 in params['p_milestones']
+
+    @pytest.mark.asyncio
+    async def test_commit_usage_returns_quota(self):
+        """Test que commit_usage renvoie le quota à jour sans relecture"""
+        try:
+            AsyncSupabaseDB = import_bot_module('async_supabase_client').AsyncSupabaseDB
+        except ImportError:
+            pytest.skip("async_supabase_client non disponible")
+
+        UserCache = import_bot_module('user_cache').UserCache
+        cache = UserCache()
+        db = AsyncSupabaseDB(user_cache=cache)
+        quota = {'messages_used': 4, 'messages_limit': 10, 'streak_bonus': 0}
+        db.client = Mock()
+        db.client.rpc = Mock(return_value=self.FakeQuery(data=quota))
+        db.client.table = Mock()
+        cache.set(12345, {'plan': 'free', 'total_messages': 3})
+
+        result = await db.commit_usage(12345, tokens=120, cost=0.001)
+
+        assert result == quota
+        db.client.table.assert_not_called()
+        assert cache.get(12345) is None  # totaux du profil modifiés
+
+
+    @pytest.mark.asyncio
+    async def test_user_cache_and_invalidation(self):
+        """Test que les profils sont servis par le cache et invalidés à l'écriture"""
+        try:
+            module = import_bot_module('async_supabase_client')
+        except ImportError:
+            pytest.skip("async_supabase_client non disponible")
+
+        UserCache = import_bot_module('user_cache').UserCache
+        db = module.AsyncSupabaseDB(user_cache=UserCache())
+        row = {'user_id': 12345, 'plan': 'free', 'is_banned': False}
+        db.client = Mock()
+        db.client.table = Mock(return_value=self.FakeQuery(data=[row]))
+
+        assert (await db.get_user(12345))['plan'] == 'free'
+        assert await db.is_user_banned(12345) == (False, None)
+        assert db.client.table.call_count == 1  # 2e lecture servie par le cache
+
+        await db.update_user(12345, plan='pro')
+        await db.get_user(12345)
+        assert db.client.table.call_count == 3  # update + relecture après invalidation
+
+        stats = db.user_cache.get_stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 2
+        assert stats['invalidations'] == 1
+
+
+class TestUserCache:
+    """Tests du cache utilisateurs TTL + LRU"""
+
+    def test_lru_eviction_and_ttl(self):
+        """Test que le cache est borné et que les entrées expirent"""
+        try:
+            from bot.user_cache import UserCache
+        except ImportError:
+            pytest.skip("user_cache non disponible")
+
+        cache = UserCache(max_entries=2, ttl_seconds=60)
+        cache.set(1, {'plan': 'free'})
+        cache.set(2, {'plan': 'pro'})
+        cache.get(1)                    # 1 devient le plus récent
+        cache.set(3, {'plan': 'ultra'})  # évince 2
+
+        assert cache.get(2) is None
+        assert cache.get(1) == {'plan': 'free'}
+        assert cache.get_stats()['evictions'] == 1
+
+        expired = UserCache(ttl_seconds=0)
+        expired.set(1, {'plan': 'free'})
+        assert expired.get(1) is None
+
+    def test_returned_rows_are_copies(self):
+        """Test qu'un appelant ne peut pas corrompre le cache"""
+        try:
+            from bot.user_cache import UserCache
+        except ImportError:
+            pytest.skip("user_cache non disponible")
+
+        cache = UserCache()
+        cache.set(1, {'plan': 'free'})
+        cache.get(1)['plan'] = 'founder'
+        cache.patch(1, last_active_at='2026-01-01T00:00:00')
+
+        assert cache.get(1) == {'plan': 'free', 'last_active_at': '2026-01-01T00:00:00'}
+
+    def test_image_counter_write_invalidates_profile(self):
+        """Test que le compteur d'images passe par la RPC atomique et invalide le cache"""
+        try:
+            module = import_bot_module('supabase_client')
+        except ImportError:
+            pytest.skip("supabase_client non disponible")
+
+        UserCache = import_bot_module('user_cache').UserCache
+        cache = UserCache()
+        with patch.object(module, 'create_client'):
+            db = module.SupabaseDB(user_cache=cache)
+        db.client.rpc.return_value.execute.return_value = Mock(data=3)
+        cache.set(42, {'images_generated_today': 2})
+
+        assert db.increment_images_generated(42) == 3
+        db.client.rpc.assert_called_once_with('increment_images_generated', {'p_user_id': 42})
+        assert cache.get(42) is None
+
+
+class TestWriteBehindBuffer:
+    """Tests du buffer d'écriture différée"""
+
+    @staticmethod
+    def make_writer(calls, delay=0.0):
+        async def writer(table, rows):
+            await asyncio.sleep(delay)
+            calls.append((table, list(rows)))
+        return writer
+
+    @pytest.mark.asyncio
+    async def test_rows_are_batched_per_table(self):
+        """Test que les lignes sont écrites en lots par table"""
+        try:
+            from bot.write_behind import WriteBehindBuffer, WriteBehindConfig
+        except ImportError:
+            pytest.skip("write_behind non disponible")
+
+        calls = []
+        buffer = WriteBehindBuffer(self.make_writer(calls), WriteBehindConfig(max_batch_size=10))
+
+        for i in range(25):
+            await buffer.add('security_logs', {'user_id': i})
+        await buffer.add('webhook_logs', {'event_id': 'evt_1'})
+        await buffer.flush()
+
+        sizes = [(table, len(rows)) for table, rows in calls]
+        assert sizes == [('security_logs', 10), ('security_logs', 10), ('security_logs', 5), ('webhook_logs', 1)]
+        assert buffer.get_stats()['written'] == 26
+        assert buffer.get_stats()['pending'] == 0
+
+    @pytest.mark.asyncio
+    async def test_size_and_interval_trigger_flush(self):
+        """Test que la tâche de fond flush par taille et par intervalle"""
+        try:
+            from bot.write_behind import WriteBehindBuffer, WriteBehindConfig
+        except ImportError:
+            pytest.skip("write_behind non disponible")
+
+        calls = []
+        buffer = WriteBehindBuffer(
+            self.make_writer(calls),
+            WriteBehindConfig(max_batch_size=5, flush_interval=0.05)
+        )
+        buffer.start()
+
+        for i in range(5):
+            await buffer.add('security_logs', {'user_id': i})
+        await asyncio.sleep(0.01)
+        assert len(calls) == 1  # Taille atteinte
+
+        await buffer.add('security_logs', {'user_id': 99})
+        await asyncio.sleep(0.1)
+        assert len(calls) == 2  # Intervalle écoulé
+
+        await buffer.stop()
+
+    @pytest.mark.asyncio
+    async def test_backpressure_and_flush_on_stop(self):
+        """Test que le buffer est borné et tout écrit à l'arrêt"""
+        try:
+            from bot.write_behind import WriteBehindBuffer, WriteBehindConfig
+        except ImportError:
+            pytest.skip("write_behind non disponible")
+
+        calls = []
+        buffer = WriteBehindBuffer(
+            self.make_writer(calls, delay=0.01),
+            WriteBehindConfig(max_batch_size=4, flush_interval=10.0, max_pending=8)
+        )
+        buffer.start()
+
+        for i in range(30):
+            await buffer.add('security_logs', {'user_id': i})
+            assert buffer.get_stats()['pending'] <= 8
+
+        await buffer.stop()
+
+        written = sum(len(rows) for _, rows in calls)
+        assert written == buffer.get_stats()['enqueued']
+        assert buffer.get_stats()['backpressure_waits'] > 0
+        assert buffer.add_nowait('security_logs', {'user_id': -2}) is False
+
+        # Après l'arrêt, add() écrit directement au lieu de perdre la ligne
+        await buffer.add('security_logs', {'user_id': -3})
+        assert calls[-1] == ('security_logs', [{'user_id': -3}])
+        assert buffer.get_stats()['pending'] == 0
+        assert buffer.get_stats()['written'] == buffer.get_stats()['enqueued']
 
 
 class TestImageGeneration(TestIntegration):
@@ -268,6 +635,1281 @@ class TestConversationHistory(TestIntegration):
         assert len(context) == 3, "Le contexte devrait contenir 3 messages"
         assert context[0]['role'] == 'user'
         assert context[1]['role'] == 'model'
+    
+    @pytest.mark.asyncio
+    async def test_conversation_append_is_single_rpc(self, mock_db):
+        """Test qu'un message = un seul appel DB (ajout + élagage côté serveur)"""
+        try:
+            from bot.conversation_history import ConversationHistoryManager
+        except ImportError:
+            pytest.skip("conversation_history non disponible")
+        
+        history = ConversationHistoryManager(mock_db, max_history=3)
+        user_id = 12345
+        
+        await history.get_history(user_id)
+        mock_db.client.table.reset_mock()
+        
+        for i in range(5):
+            await history.add_message(user_id, 'user', f'Message {i}')
+        
+        assert mock_db.client.rpc.call_count == 5
+        name, params = mock_db.client.rpc.call_args[0]
+        assert name == 'append_conversation_message'
+        assert params['p_max_history'] == 3
+        assert not mock_db.client.table.called
+        
+        messages = await history.get_history(user_id, limit=10)
+        assert [m.content for m in messages] == ['Message 2', 'Message 3', 'Message 4']
+    
+    @pytest.mark.asyncio
+    async def test_conversation_db_calls_leave_event_loop(self, mock_db):
+        """Test que chargement (défaut de cache) et suppression ne bloquent pas la boucle"""
+        try:
+            from bot.conversation_history import ConversationHistoryManager
+        except ImportError:
+            pytest.skip("conversation_history non disponible")
+        
+        import threading
+        threads = []
+        
+        def execute():
+            threads.append(threading.current_thread())
+            return Mock(data=[])
+        
+        table = mock_db.client.table.return_value
+        table.select.return_value.eq.return_value.order.return_value.limit.return_value.execute.side_effect = execute
+        table.delete.return_value.eq.return_value.execute.side_effect = execute
+        
+        history = ConversationHistoryManager(mock_db, max_history=10)
+        await history.get_history(12345)
+        await history.clear_history(12345)
+        
+        assert len(threads) == 2
+        assert threading.main_thread() not in threads
+    
+    @pytest.mark.asyncio
+    async def test_conversation_cache_is_bounded(self, mock_db):
+        """Test que le cache LRU respecte le nombre d'utilisateurs et le budget mémoire"""
+        try:
+            from bot.conversation_history import ConversationHistoryManager
+        except ImportError:
+            pytest.skip("conversation_history non disponible")
+        
+        history = ConversationHistoryManager(mock_db, max_history=10, max_cached_users=2)
+        for user_id in (1, 2, 3):
+            await history.add_message(user_id, 'user', 'Hello')
+        
+        stats = history.get_cache_stats()
+        assert stats['users'] == 2
+        assert stats['evictions'] == 1
+        assert 1 not in history._cache
+        
+        history = ConversationHistoryManager(mock_db, max_history=10, cache_memory_budget=2000)
+        for user_id in range(10):
+            await history.add_message(user_id, 'user', 'x' * 500)
+        
+        stats = history.get_cache_stats()
+        assert 0 < stats['bytes'] <= 2000
+        assert stats['users'] < 10
+    
+    @pytest.mark.asyncio
+    async def test_conversation_context_window_is_incremental(self, mock_db):
+        """Test que la fenêtre de contexte suit le budget de tokens à chaque ajout"""
+        try:
+            from bot.conversation_history import ConversationHistoryManager
+        except ImportError:
+            pytest.skip("conversation_history non disponible")
+        
+        history = ConversationHistoryManager(mock_db, max_history=10, context_token_budget=10)
+        user_id = 12345
+        for i in range(6):
+            await history.add_message(user_id, 'user', f'{i}' * 16)  # 4 tokens chacun
+        
+        context = await history.get_conversation_context(user_id)
+        assert [c['content'][0] for c in context] == ['4', '5']
+        
+        # Autre budget: calcul à la demande, même résultat que l'ancien parcours
+        context = await history.get_conversation_context(user_id, max_tokens=12)
+        assert [c['content'][0] for c in context] == ['3', '4', '5']
+    
+    @pytest.mark.asyncio
+    async def test_ai_manager_uses_shared_history(self, mock_db):
+        """Test qu'AIManager lit et alimente l'historique partagé"""
+        try:
+            ai_engine = import_bot_module('ai_engine')
+        except ImportError:
+            pytest.skip("ai_engine non disponible")
+        
+        history = ai_engine.ConversationHistoryManager(mock_db, max_history=20)
+        ai = ai_engine.AIManager('test-key', mock_db, history=history)
+        assert ai.history is history
+        
+        chats = []
+        
+        class FakeChat:
+            def __init__(self, history):
+                chats.append(history)
+            
+            async def send_message_async(self, content):
+                return Mock(text=f'Réponse à {content}', usage_metadata=None)
+        
+        for model in ai.models.values():
+            model.start_chat = FakeChat
+        
+        await ai.process_message(12345, 'Bonjour')
+        response = await ai.process_message(12345, 'Encore')
+        
+        assert response.success
+        assert chats[0] == []
+        assert chats[1] == [
+            {'role': 'user', 'parts': ['Bonjour']},
+            {'role': 'model', 'parts': ['Réponse à Bonjour']},
+        ]
+        messages = await history.get_history(12345)
+        assert [m.role for m in messages] == ['user', 'model', 'user', 'model']
+
+
+class TestCostLedger(TestIntegration):
+    """Tests du registre des coûts IA"""
+    
+    def test_token_usage_from_response_metadata(self):
+        """Test que les tokens réels (entrée complète, cache, réflexion) sont lus"""
+        try:
+            from bot.cost_ledger import TokenUsage, compute_cost
+        except ImportError:
+            pytest.skip("cost_ledger non disponible")
+        
+        response = Mock(usage_metadata=Mock(
+            prompt_token_count=1200,
+            candidates_token_count=300,
+            thoughts_token_count=100,
+            cached_content_token_count=1000
+        ))
+        usage = TokenUsage.from_response(response, 'court', 'réponse')
+        
+        assert usage.prompt_tokens == 1200
+        assert usage.completion_tokens == 400
+        assert usage.cached_tokens == 1000
+        assert not usage.estimated
+        
+        costs = {'input': 1.0, 'output': 2.0, 'cached': 0.25}
+        assert compute_cost(costs, usage) == pytest.approx((200 * 1.0 + 1000 * 0.25 + 400 * 2.0) / 1_000_000)
+        
+        estimated = TokenUsage.from_response(Mock(usage_metadata=None), 'x' * 40, 'y' * 20)
+        assert estimated.estimated
+        assert (estimated.prompt_tokens, estimated.completion_tokens) == (10, 5)
+    
+    @pytest.mark.asyncio
+    async def test_ledger_aggregates_and_flushes_in_one_call(self):
+        """Test l'agrégation par (utilisateur, plan, modèle, jour) et l'écriture groupée"""
+        try:
+            from bot.cost_ledger import CostLedger, TokenUsage
+        except ImportError:
+            pytest.skip("cost_ledger non disponible")
+        
+        batches = []
+        fail = [True]
+        
+        async def writer(rows):
+            if fail[0]:
+                raise RuntimeError("Supabase indisponible")
+            batches.append(rows)
+        
+        ledger = CostLedger(writer)
+        usage = TokenUsage(prompt_tokens=100, completion_tokens=50, cached_tokens=20)
+        for _ in range(3):
+            ledger.record(1, 'pro', 'flash', usage, 0.001)
+        ledger.record(2, 'free', 'flash-lite', usage, 0.0005)
+        
+        # Échec: rien n'est perdu
+        assert await ledger.flush() == 0
+        ledger.record(1, 'pro', 'flash', usage, 0.001)
+        
+        fail[0] = False
+        assert await ledger.flush() == 2
+        assert len(batches) == 1
+        
+        rows = {row['user_id']: row for row in batches[0]}
+        assert rows[1]['calls'] == 4
+        assert rows[1]['prompt_tokens'] == 400
+        assert rows[1]['cached_tokens'] == 80
+        assert rows[1]['cost_usd'] == pytest.approx(0.004)
+        assert rows[2]['plan'] == 'free'
+        
+        assert await ledger.flush() == 0
+        assert len(batches) == 1
+
+
+class TestResponseCache(TestIntegration):
+    """Tests du cache de réponses"""
+    
+    def test_normalized_prompts_share_a_key(self):
+        """Test que des variantes d'une même question ont la même clé"""
+        try:
+            from bot.response_cache import ResponseCache, normalize_prompt
+        except ImportError:
+            pytest.skip("response_cache non disponible")
+        
+        assert normalize_prompt("C'est quoi le plan PRO ?!") == normalize_prompt("cest quoi  le plan pro")
+        assert normalize_prompt("Comment upgrader ?") == "comment upgrader"
+        assert ResponseCache.make_key('flash', 'Plan Pro ?') != ResponseCache.make_key('pro', 'plan pro')
+        
+        cache = ResponseCache()
+        assert cache.is_cacheable('comment upgrader ?', context_messages=0)
+        assert not cache.is_cacheable('comment upgrader ?', context_messages=10)
+        assert not cache.is_cacheable('x' * 1000, context_messages=0)
+        assert not cache.is_cacheable('?!', context_messages=0)
+    
+    @pytest.mark.asyncio
+    async def test_cache_ttl_budget_and_savings(self):
+        """Test TTL, budget mémoire et latence/coût économisés"""
+        try:
+            from bot.response_cache import ResponseCache, ResponseCacheConfig
+        except ImportError:
+            pytest.skip("response_cache non disponible")
+        
+        cache = ResponseCache(ResponseCacheConfig(max_bytes=1500))
+        await cache.set('flash', 'comment upgrader ?', 'Utilise /plans', latency=1.5, cost_usd=0.002)
+        
+        for prompt in ('Comment upgrader', 'comment upgrader ??'):
+            answer = await cache.get('flash', prompt)
+            assert answer.content == 'Utilise /plans'
+        assert await cache.get('pro', 'comment upgrader') is None
+        
+        stats = cache.get_stats()
+        assert stats['hits'] == 2
+        assert stats['saved_latency_seconds'] == pytest.approx(3.0)
+        assert stats['saved_cost_usd'] == pytest.approx(0.004)
+        assert cache.top_entries()[0]['hits'] == 2
+        
+        # Budget mémoire: les plus anciennes sont évincées
+        for i in range(5):
+            await cache.set('flash', f'question {i}', 'r' * 400, latency=1.0, cost_usd=0.001)
+        assert cache.get_stats()['bytes'] <= 1500
+        assert await cache.get('flash', 'question 0') is None
+        assert await cache.get('flash', 'question 4') is not None
+        
+        # TTL
+        cache.config.ttl_seconds = 0
+        await cache.set('flash', 'expire', 'vite', latency=1.0, cost_usd=0.0)
+        assert await cache.get('flash', 'expire') is None
+    
+    @pytest.mark.asyncio
+    async def test_cache_is_shared_through_redis(self):
+        """Test qu'une réponse mise en cache par une instance sert l'autre"""
+        try:
+            from bot.response_cache import ResponseCache
+            import fakeredis
+        except ImportError:
+            pytest.skip("response_cache ou fakeredis non disponible")
+        
+        redis_client = fakeredis.FakeRedis(decode_responses=True)
+        first = ResponseCache(redis_client=redis_client)
+        second = ResponseCache(redis_client=redis_client)
+        
+        await first.set('flash', 'plan pro ?', 'Le plan Pro coûte...', latency=2.0, cost_usd=0.001)
+        answer = await second.get('flash', 'Plan Pro')
+        assert answer is not None
+        assert answer.content == 'Le plan Pro coûte...'
+        assert second.get_stats()['saved_latency_seconds'] == pytest.approx(2.0)
+    
+    @pytest.mark.asyncio
+    async def test_ai_manager_serves_repeated_question_from_cache(self, mock_db):
+        """Test qu'une question répétée n'appelle le modèle qu'une fois"""
+        try:
+            ai_engine = import_bot_module('ai_engine')
+            ResponseCache = import_bot_module('response_cache').ResponseCache
+        except ImportError:
+            pytest.skip("ai_engine non disponible")
+        
+        calls = []
+        
+        class FakeChat:
+            def __init__(self, history):
+                pass
+            
+            async def send_message_async(self, content):
+                calls.append(content)
+                return Mock(text='Utilise /plans', usage_metadata=None)
+        
+        history = ai_engine.ConversationHistoryManager(mock_db)
+        ai = ai_engine.AIManager('test-key', mock_db, history=history, response_cache=ResponseCache())
+        for model in ai.models.values():
+            model.start_chat = FakeChat
+        
+        first = await ai.process_message(1, 'Comment upgrader ?')
+        second = await ai.process_message(2, 'comment upgrader')
+        
+        assert len(calls) == 1
+        assert not first.from_cache
+        assert second.from_cache and second.content == 'Utilise /plans'
+        assert second.cost_usd == 0.0
+        
+        # Avec un historique long, le tour n'est plus éligible
+        for _ in range(3):
+            await ai.process_message(2, 'autre chose')
+        await ai.process_message(2, 'comment upgrader')
+        assert calls[-1] == 'comment upgrader'
+
+
+class TestStreamingRenderer(TestIntegration):
+    """Tests du rendu progressif Discord"""
+    
+    def test_split_keeps_code_blocks_intact(self):
+        """Test que le découpage ne coupe pas un bloc de code qui tient dans un message"""
+        try:
+            from bot.discord_streaming import split_message
+        except ImportError:
+            pytest.skip("discord_streaming non disponible")
+        
+        code = "```python\n" + "\n".join(f"x = {i}" for i in range(20)) + "\n```"
+        text = "intro\n" + "a" * 60 + "\n" + code + "\nfin"
+        chunks = split_message(text, limit=len(code) + 20)
+        
+        assert all(len(c) <= len(code) + 20 for c in chunks)
+        assert any(code in c for c in chunks)
+        assert "\n".join(chunks) == text
+    
+    def test_split_reopens_oversized_code_block(self):
+        """Test qu'un bloc plus long qu'un message est fermé puis rouvert"""
+        try:
+            from bot.discord_streaming import split_message
+        except ImportError:
+            pytest.skip("discord_streaming non disponible")
+        
+        code = "```js\n" + "\n".join(f"let v{i} = {i};" for i in range(300)) + "\n```"
+        chunks = split_message(code)
+        
+        assert len(chunks) > 1
+        assert all(len(c) <= 2000 for c in chunks)
+        for chunk in chunks:
+            assert chunk.count("```") == 2
+        assert all(c.startswith("```js\n") for c in chunks)
+        
+        # Préfixe stable: les messages complets ne changent pas quand le texte grandit
+        assert split_message(code[:3000])[0] == chunks[0]
+    
+    @pytest.mark.asyncio
+    async def test_renderer_edits_at_safe_cadence_and_rolls_over(self):
+        """Test la cadence d'édition et le passage à un nouveau message"""
+        try:
+            from bot.discord_streaming import DiscordStreamRenderer
+        except ImportError:
+            pytest.skip("discord_streaming non disponible")
+        
+        class FakeMessage:
+            def __init__(self, content, channel):
+                self.content = content
+                self.channel = channel
+                self.edits = 0
+            
+            async def edit(self, content, delete_after=None):
+                self.content = content
+                self.edits += 1
+            
+            async def reply(self, content, delete_after=None):
+                return await self.channel.send(content)
+        
+        class FakeChannel:
+            def __init__(self):
+                self.sent = []
+            
+            async def send(self, content):
+                message = FakeMessage(content, self)
+                self.sent.append(message)
+                return message
+        
+        now = [0.0]
+        channel = FakeChannel()
+        renderer = DiscordStreamRenderer(
+            FakeMessage("question", channel), min_edit_interval=1.0, clock=lambda: now[0]
+        )
+        await renderer.start()
+        placeholder = channel.sent[0]
+        
+        text = ""
+        for _ in range(50):
+            text += "mot " * 5
+            now[0] += 0.1
+            await renderer.update(text)
+        
+        # 5 s de stream: premier fragment + au plus une édition par seconde
+        assert placeholder.edits <= 6
+        
+        long_text = text + "\n" + "b" * 2500
+        await renderer.finish(long_text)
+        assert len(channel.sent) >= 2
+        assert all(len(m.content) <= 2000 for m in channel.sent)
+        assert "".join(m.content for m in channel.sent).replace("\n", "") == long_text.replace("\n", "")
+    
+    @pytest.mark.asyncio
+    async def test_ai_manager_streams_partial_text(self, mock_db):
+        """Test que process_message transmet le texte partiel en streaming"""
+        try:
+            ai_engine = import_bot_module('ai_engine')
+        except ImportError:
+            pytest.skip("ai_engine non disponible")
+        
+        class FakeStream:
+            text = "Bonjour à toi"
+            usage_metadata = None
+            
+            def __aiter__(self):
+                async def chunks():
+                    for part in ("Bonjour", " à", " toi"):
+                        yield Mock(text=part)
+                return chunks()
+        
+        class FakeChat:
+            def __init__(self, history):
+                pass
+            
+            async def send_message_async(self, content, stream=False):
+                assert stream
+                return FakeStream()
+        
+        ai = ai_engine.AIManager('test-key', mock_db, history=ai_engine.ConversationHistoryManager(mock_db))
+        for model in ai.models.values():
+            model.start_chat = FakeChat
+        
+        partials = []
+        
+        async def on_text(text):
+            partials.append(text)
+        
+        response = await ai.process_message(1, 'Salut', on_text=on_text)
+        
+        assert response.success
+        assert partials == ["Bonjour", "Bonjour à", "Bonjour à toi"]
+        assert response.content == "Bonjour à toi"
+
+
+class TestAIScheduler(TestIntegration):
+    """Tests de l'ordonnanceur des appels IA"""
+    
+    @pytest.mark.asyncio
+    async def test_weighted_fair_order_by_support_priority(self):
+        """Test qu'en file, les plans prioritaires passent devant sans attendre leur tour d'arrivée"""
+        try:
+            from bot.ai_scheduler import AIScheduler, AISchedulerConfig
+        except ImportError:
+            pytest.skip("ai_scheduler non disponible")
+        
+        scheduler = AIScheduler(AISchedulerConfig(max_in_flight=1))
+        blocker = await scheduler.acquire('community')
+        
+        order = []
+        
+        async def request(priority):
+            async with scheduler.slot(priority):
+                order.append(priority)
+                await asyncio.sleep(0)
+        
+        tasks = [asyncio.create_task(request('community')) for _ in range(3)]
+        tasks += [asyncio.create_task(request('vip')) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert scheduler.get_stats()['queued'] == 6
+        
+        scheduler.release(blocker)
+        await asyncio.gather(*tasks)
+        
+        assert order[:3] == ['vip', 'vip', 'vip']
+        stats = scheduler.get_stats()
+        assert stats['in_flight'] == 0
+        assert stats['priorities']['vip']['dispatched'] == 3
+        assert stats['priorities']['community']['dispatched'] == 4
+    
+    @pytest.mark.asyncio
+    async def test_queue_deadline_sheds_load(self):
+        """Test qu'une requête trop longtemps en file est abandonnée avec un message convivial"""
+        try:
+            from bot.ai_scheduler import AIScheduler, AISchedulerConfig, AIQueueTimeoutError, OVERLOAD_MESSAGE
+        except ImportError:
+            pytest.skip("ai_scheduler non disponible")
+        
+        scheduler = AIScheduler(AISchedulerConfig(max_in_flight=1, queue_timeout=0.05, max_queue_depth=1))
+        blocker = await scheduler.acquire('vip')
+        
+        waiting = asyncio.create_task(scheduler.acquire('normal'))
+        await asyncio.sleep(0)
+        
+        # File pleine: refus immédiat
+        with pytest.raises(AIQueueTimeoutError):
+            await scheduler.acquire('normal')
+        
+        with pytest.raises(AIQueueTimeoutError) as exc:
+            await waiting
+        assert str(exc.value) == OVERLOAD_MESSAGE
+        
+        stats = scheduler.get_stats()
+        assert stats['priorities']['normal']['shed'] == 2
+        assert stats['queued'] == 0
+        
+        # La place libérée ne part pas vers une requête abandonnée
+        scheduler.release(blocker)
+        assert scheduler.in_flight == 0
+    
+    @pytest.mark.asyncio
+    async def test_model_token_budget_does_not_block_other_models(self):
+        """Test qu'un modèle à court de budget attend sans bloquer les autres"""
+        try:
+            from bot.ai_scheduler import AIScheduler
+        except ImportError:
+            pytest.skip("ai_scheduler non disponible")
+        
+        scheduler = AIScheduler(model_budgets={'pro': 600, 'flash': 600})
+        
+        first = await scheduler.acquire('vip', 'pro', estimated_tokens=600)
+        scheduler.release(first)
+        
+        starved = asyncio.create_task(scheduler.acquire('vip', 'pro', estimated_tokens=300))
+        other = await asyncio.wait_for(scheduler.acquire('community', 'flash', estimated_tokens=100), timeout=1)
+        assert other.model == 'flash'
+        assert not starved.done()
+        
+        starved.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await starved
+        scheduler.release(other)
+        assert scheduler.get_stats()['queued'] == 0
+
+
+class TestModelRouter(TestIntegration):
+    """Tests du routage des modèles (couverture, repli, décisions)"""
+    
+    @pytest.mark.asyncio
+    async def test_hedged_request_wins_when_primary_is_silent(self):
+        """Test qu'un modèle muet au-delà du délai est couvert par le modèle suivant"""
+        try:
+            from bot.model_router import ModelRouter, RoutingConfig
+        except ImportError:
+            pytest.skip("model_router non disponible")
+        
+        router = ModelRouter({'flash': 'flash-lite'}, RoutingConfig(hedge_delay=0.05))
+        cancelled = []
+        
+        async def call(attempt):
+            if attempt.model == 'flash':
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    cancelled.append(attempt.model)
+                    raise
+            return f"réponse {attempt.model}"
+        
+        result, attempt = await router.run('flash', call)
+        await asyncio.sleep(0)
+        
+        assert result == "réponse flash-lite"
+        assert attempt.kind == 'hedge'
+        assert cancelled == ['flash']
+        decision = router.decisions()[-1]
+        assert decision['reason'] == 'hedge'
+        assert decision['attempts'] == ['flash', 'flash-lite']
+        assert router.get_stats()['hedge_wins'] == 1
+    
+    @pytest.mark.asyncio
+    async def test_streaming_primary_is_not_hedged(self):
+        """Test qu'un modèle qui a commencé à répondre n'est pas couvert"""
+        try:
+            from bot.model_router import ModelRouter, RoutingConfig
+        except ImportError:
+            pytest.skip("model_router non disponible")
+        
+        router = ModelRouter({'flash': 'flash-lite'}, RoutingConfig(hedge_delay=0.02))
+        calls = []
+        
+        async def call(attempt):
+            calls.append(attempt.model)
+            attempt.mark_progress()
+            await asyncio.sleep(0.1)
+            return "ok"
+        
+        result, attempt = await router.run('flash', call)
+        
+        assert result == "ok"
+        assert calls == ['flash']
+        assert router.get_stats()['hedges'] == 0
+        assert router.get_stats()['models']['flash']['calls'] == 1
+    
+    @pytest.mark.asyncio
+    async def test_fallback_on_open_breaker_and_on_error(self):
+        """Test le repli le long de la chaîne: circuit ouvert puis erreur"""
+        try:
+            from bot.model_router import ModelRouter, RoutingConfig, NoModelAvailableError
+            from bot.circuit_breaker import CircuitBreaker, CircuitBreakerConfig, CircuitState
+        except ImportError:
+            pytest.skip("model_router non disponible")
+        
+        breakers = {
+            'pro': CircuitBreaker('pro', CircuitBreakerConfig(max_retries=0)),
+            'flash': CircuitBreaker('flash', CircuitBreakerConfig(max_retries=0)),
+        }
+        await breakers['pro']._transition_to(CircuitState.OPEN)
+        
+        router = ModelRouter({'pro': 'flash', 'flash': 'flash-lite'}, RoutingConfig(hedge_delay=None), breakers)
+        
+        async def call(attempt):
+            if attempt.model == 'flash':
+                raise RuntimeError("503")
+            return attempt.model
+        
+        result, attempt = await router.run('pro', call)
+        
+        assert result == 'flash-lite'
+        decision = router.decisions()[-1]
+        assert decision['skipped'] == ['pro']
+        assert decision['attempts'] == ['flash', 'flash-lite']
+        assert decision['reason'] == 'fallback'
+        assert router.get_stats()['models']['flash']['error_rate'] == 1.0
+        assert breakers['flash'].stats.failed_calls == 1
+        
+        # Plus aucun modèle disponible
+        router.breakers['flash-lite'] = breakers['pro']
+        await breakers['flash']._transition_to(CircuitState.OPEN)
+        with pytest.raises(NoModelAvailableError):
+            await router.run('pro', call)
+        assert router.decisions()[-1]['reason'] == 'unavailable'
+    
+    @pytest.mark.asyncio
+    async def test_queue_wait_is_outside_breaker_and_health(self):
+        """Test que l'attente en file ne déclenche pas de couverture et ne compte pas dans la latence"""
+        try:
+            from bot.model_router import ModelRouter, RoutingConfig
+            from bot.circuit_breaker import CircuitBreaker, CircuitBreakerConfig
+        except ImportError:
+            pytest.skip("model_router non disponible")
+        
+        from contextlib import asynccontextmanager
+        
+        breaker = CircuitBreaker('flash', CircuitBreakerConfig(max_retries=0, call_timeout=0.1))
+        router = ModelRouter({'flash': 'flash-lite'}, RoutingConfig(hedge_delay=0.05), {'flash': breaker})
+        calls = []
+        
+        @asynccontextmanager
+        async def admit(attempt):
+            await asyncio.sleep(0.2)  # File d'attente plus longue que hedge_delay et call_timeout
+            yield 'grant'
+        
+        async def call(attempt):
+            calls.append((attempt.model, attempt.slot))
+            await asyncio.sleep(0.01)
+            return "ok"
+        
+        result, attempt = await router.run('flash', call, admit)
+        
+        assert result == "ok"
+        assert calls == [('flash', 'grant')]
+        assert router.get_stats()['hedges'] == 0
+        assert router.get_stats()['models']['flash']['p50'] < 0.1
+        assert breaker.stats.successful_calls == 1
+    
+    @pytest.mark.asyncio
+    async def test_shed_or_expired_request_is_not_a_model_failure(self):
+        """Test qu'un délestage ou une échéance n'ouvre pas de circuit et ne part pas en repli"""
+        try:
+            deadline = import_bot_module('deadline')
+            circuit_breaker = import_bot_module('circuit_breaker')
+            model_router = import_bot_module('model_router')
+            AIQueueTimeoutError = import_bot_module('ai_scheduler').AIQueueTimeoutError
+        except ImportError:
+            pytest.skip("model_router non disponible")
+        
+        from contextlib import asynccontextmanager
+        
+        breaker = circuit_breaker.CircuitBreaker('flash', circuit_breaker.CircuitBreakerConfig(max_retries=0))
+        router = model_router.ModelRouter(
+            {'flash': 'flash-lite'}, model_router.RoutingConfig(hedge_delay=0.01), {'flash': breaker}
+        )
+        calls = []
+        
+        @asynccontextmanager
+        async def shed(attempt):
+            raise AIQueueTimeoutError("file pleine")
+            yield
+        
+        async def call(attempt):
+            calls.append(attempt.model)
+            raise deadline.DeadlineExceeded()
+        
+        with pytest.raises(AIQueueTimeoutError):
+            await router.run('flash', call, shed)
+        assert router.decisions()[-1]['reason'] == 'shed'
+        assert router.decisions()[-1]['attempts'] == ['flash']
+        
+        with pytest.raises(deadline.DeadlineExceeded):
+            await router.run('flash', call)
+        assert calls == ['flash']
+        assert router.decisions()[-1]['reason'] == 'shed'
+        
+        assert router.get_stats()['models']['flash']['calls'] == 0
+        assert breaker.stats.failed_calls == 0
+
+
+class TestDeadlines(TestIntegration):
+    """Tests de l'échéance par message et du budget de retries"""
+    
+    @pytest.mark.asyncio
+    async def test_with_deadline_distinguishes_cap_and_deadline(self):
+        """Test que le timeout propre d'une étape et l'échéance du message sont distingués"""
+        try:
+            deadline = import_bot_module('deadline')
+        except ImportError:
+            pytest.skip("deadline non disponible")
+        
+        # Hors requête: seul le cap s'applique
+        assert deadline.bounded_timeout(2.0) == 2.0
+        
+        with deadline.deadline_scope(deadline.Deadline(0.5)):
+            assert deadline.bounded_timeout(10.0) <= 0.5
+            
+            with pytest.raises(asyncio.TimeoutError) as exc:
+                await deadline.with_deadline(asyncio.sleep(1), cap=0.01)
+            assert not isinstance(exc.value, deadline.DeadlineExceeded)
+            
+            # Travail détaché de l'échéance
+            with deadline.deadline_scope(None):
+                assert deadline.current_deadline() is None
+            
+            with pytest.raises(deadline.DeadlineExceeded):
+                await deadline.with_deadline(asyncio.sleep(1))
+            
+            # Échéance passée: l'appel n'est même pas lancé
+            with pytest.raises(deadline.DeadlineExceeded):
+                await deadline.with_deadline(asyncio.sleep(0))
+        
+        assert deadline.current_deadline() is None
+    
+    @pytest.mark.asyncio
+    async def test_breaker_attempts_bounded_by_deadline(self):
+        """Test que le circuit borne ses tentatives par l'échéance sans compter d'échec"""
+        try:
+            deadline = import_bot_module('deadline')
+            circuit_breaker = import_bot_module('circuit_breaker')
+        except ImportError:
+            pytest.skip("circuit_breaker non disponible")
+        
+        breaker = circuit_breaker.CircuitBreaker(
+            "test_deadline",
+            config=circuit_breaker.CircuitBreakerConfig(call_timeout=5.0, max_retries=3, base_delay=0.5),
+            retry_budget=circuit_breaker.RetryBudget()
+        )
+        
+        async def hanging_func():
+            await asyncio.sleep(5)
+        
+        started = time.monotonic()
+        with deadline.deadline_scope(deadline.Deadline(0.2)):
+            with pytest.raises(deadline.DeadlineExceeded):
+                await breaker.call(hanging_func)
+        
+        assert time.monotonic() - started < 1.0
+        assert breaker.stats.failed_calls == 0
+        assert breaker.stats.retried_attempts == 0
+    
+    @pytest.mark.asyncio
+    async def test_half_open_slot_released_without_verdict(self):
+        """Test qu'une sonde half-open coupée par l'échéance ou annulée rend son créneau"""
+        try:
+            deadline = import_bot_module('deadline')
+            circuit_breaker = import_bot_module('circuit_breaker')
+        except ImportError:
+            pytest.skip("circuit_breaker non disponible")
+        
+        breaker = circuit_breaker.CircuitBreaker(
+            "test_half_open",
+            config=circuit_breaker.CircuitBreakerConfig(call_timeout=5.0, half_open_max_calls=1),
+            retry_budget=circuit_breaker.RetryBudget()
+        )
+        await breaker._transition_to(circuit_breaker.CircuitState.HALF_OPEN)
+        
+        async def hanging_func():
+            await asyncio.sleep(5)
+        
+        with deadline.deadline_scope(deadline.Deadline(0.05)):
+            with pytest.raises(deadline.DeadlineExceeded):
+                await breaker.call(hanging_func)
+        assert breaker.allows_request()
+        
+        # Tentative perdante du hedging: annulée en vol
+        task = asyncio.create_task(breaker.call(hanging_func))
+        await asyncio.sleep(0.05)
+        assert not breaker.allows_request()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert breaker.allows_request()
+        assert breaker.state == circuit_breaker.CircuitState.HALF_OPEN
+        
+        async def ok_func():
+            return "ok"
+        
+        assert await breaker.call(ok_func) == "ok"
+    
+    @pytest.mark.asyncio
+    async def test_process_message_reports_deadline_message(self, mock_db):
+        """Test qu'une échéance dépassée donne le message convivial, pas une erreur brute"""
+        try:
+            deadline = import_bot_module('deadline')
+            ai_engine = import_bot_module('ai_engine')
+        except ImportError:
+            pytest.skip("ai_engine non disponible")
+        
+        ai = ai_engine.AIManager('test-key', mock_db)
+        with deadline.deadline_scope(deadline.Deadline(0)):
+            response = await ai.process_message(12345, 'Bonjour')
+        
+        assert not response.success
+        assert response.error == deadline.DEADLINE_MESSAGE
+    
+    @pytest.mark.asyncio
+    async def test_retry_budget_caps_retries(self):
+        """Test que les retries sont plafonnés en proportion du trafic"""
+        try:
+            from bot.circuit_breaker import CircuitBreaker, CircuitBreakerConfig, RetryBudget
+        except ImportError:
+            pytest.skip("circuit_breaker non disponible")
+        
+        budget = RetryBudget(ratio=0.1, min_per_second=0)
+        for _ in range(20):
+            budget.record_request()
+        assert budget.try_spend()
+        assert budget.try_spend()
+        assert not budget.try_spend()
+        assert budget.get_stats()['denied'] == 1
+        
+        # Budget épuisé: l'appel échoue sans retry, compté une fois
+        breaker = CircuitBreaker(
+            "test_budget",
+            config=CircuitBreakerConfig(max_retries=3, base_delay=0.001),
+            retry_budget=RetryBudget(ratio=0.0, min_per_second=0)
+        )
+        
+        async def failing_func():
+            raise Exception("503")
+        
+        with pytest.raises(Exception):
+            await breaker.call(failing_func)
+        assert breaker.stats.retried_attempts == 0
+        assert breaker.stats.retries_denied == 1
+        assert breaker.stats.failed_calls == 1
+
+
+class TestComplexityClassifier(TestIntegration):
+    """Tests du classifieur de complexité et de l'évaluation hors ligne"""
+    
+    @staticmethod
+    def legacy_score(content):
+        """Ancien AIManager._analyze_complexity (référence)"""
+        score = 0.0
+        if len(content) > 500:
+            score += 0.2
+        if len(content) > 1000:
+            score += 0.1
+        if '```' in content or '`' in content:
+            score += 0.2
+        for indicator in ['explique', 'détaille', 'analyse', 'compare', 'différence',
+                          'pourquoi', 'comment', 'optimise', 'améliore', 'résous',
+                          'code', 'programme', 'script', 'fonction', 'algorithme']:
+            if indicator in content.lower():
+                score += 0.1
+                break
+        if any(ord(c) > 127 for c in content):
+            score += 0.1
+        if any(c in content for c in '+=*/^$%#'):
+            score += 0.1
+        return min(score, 1.0)
+    
+    def test_classifier_matches_legacy_scores(self):
+        """Test que le classifieur donne les mêmes scores que l'ancienne analyse"""
+        try:
+            from bot.complexity import ComplexityClassifier
+        except ImportError:
+            pytest.skip("complexity non disponible")
+        
+        samples = [
+            "", "salut", "Salut ça va ?", "EXPLIQUE moi", "DÉTAILLE ce point",
+            "`x`", "```py\nprint(1)\n```", "2+2=4", "Pourquoi ? " * 60,
+            "Compare ces deux algorithmes " * 40, "un codec audio", "Résous x^2 = 4",
+        ]
+        classifier = ComplexityClassifier()
+        for content in samples:
+            assert classifier.classify(content).score == pytest.approx(self.legacy_score(content)), content
+    
+    def test_classifier_feature_vector(self):
+        """Test le vecteur de features retourné avec le score"""
+        try:
+            from bot.complexity import ComplexityClassifier, select_tier
+        except ImportError:
+            pytest.skip("complexity non disponible")
+        
+        features = ComplexityClassifier().classify("Explique ce `code`: a = b * 2")
+        assert (features.code, features.indicator, features.non_ascii, features.math) == (True, True, False, True)
+        assert features.vector == (features.length / 1000, 1.0, 1.0, 0.0, 1.0)
+        assert features.score == pytest.approx(0.4)
+        
+        assert select_tier(0.9, 0.3, 0.1, 0.05) == 'pro'
+        assert select_tier(0.9, 0.3, 0.1, 0.2) == 'flash'
+        assert select_tier(0.5, 0.3, 0.0, 0.2) == 'flash'
+        assert select_tier(0.3, 1.0, 1.0, 0.0) == 'lite'
+    
+    def test_offline_routing_evaluation(self):
+        """Test le rejeu hors ligne: répartition, coût estimé et débit"""
+        try:
+            from bot.complexity import evaluate_routing
+        except ImportError:
+            pytest.skip("complexity non disponible")
+        
+        from types import SimpleNamespace
+        plans = {
+            'free': SimpleNamespace(flash_ratio=0.0, pro_ratio=0.0),
+            'ultra': SimpleNamespace(flash_ratio=1.0, pro_ratio=0.0),
+        }
+        tiers = {'lite': 'lite-model', 'flash': 'flash-model', 'pro': 'pro-model'}
+        costs = {
+            'lite-model': {'input': 0.1, 'output': 0.4},
+            'flash-model': {'input': 0.3, 'output': 2.5},
+            'pro-model': {'input': 0.6, 'output': 10.0},
+        }
+        complex_msg = "Explique pourquoi ce `code` échoue: x = 1 / 0"
+        messages = [("salut", 'free'), (complex_msg, 'free'), (complex_msg, 'ultra'), ("merci", 'inconnu')]
+        
+        report = evaluate_routing(messages, plans, tiers, costs, output_tokens=100, seed=1)
+        
+        assert report['messages'] == 4
+        assert report['mix']['lite-model']['count'] == 3
+        assert report['mix']['flash-model']['count'] == 1
+        expected_flash = (len(complex_msg) / 4 * 0.3 + 100 * 2.5) / 1_000_000
+        assert report['mix']['flash-model']['cost_usd'] == pytest.approx(expected_flash)
+        assert report['score']['above_0.4'] == pytest.approx(0.5)
+        assert report['classifier_per_second'] > 0
+
+
+class TestImageJobQueue(TestIntegration):
+    """Tests de la file de génération d'images"""
+    
+    @staticmethod
+    def _generator(calls, gate=None, data=b"png-bytes"):
+        async def generate(job):
+            calls.append(job.prompt)
+            if gate is not None:
+                await gate.wait()
+            return Mock(success=True, image_data=data + job.prompt.encode(), mime_type="image/png",
+                        model_used="image-model", error=None, cached=False)
+        return generate
+    
+    @pytest.mark.asyncio
+    async def test_retry_is_served_from_store_without_regenerating(self, tmp_path):
+        """Test qu'une demande déjà produite (même normalisée) ne rappelle pas le modèle"""
+        try:
+            from bot.image_jobs import ImageJobQueue, ImageStore, JobStatus
+        except ImportError:
+            pytest.skip("image_jobs non disponible")
+        
+        calls = []
+        queue = ImageJobQueue(self._generator(calls), ImageStore(str(tmp_path)))
+        queue.start()
+        try:
+            job = await queue.wait(await queue.submit(1, "Un chat  roux"), timeout=2)
+            assert job.status == JobStatus.DONE
+            assert not job.cached
+            assert queue.read_image(job) == b"png-bytesUn chat  roux"
+            
+            retry = await queue.submit(1, "un chat roux")
+            assert retry.status == JobStatus.DONE
+            assert retry.cached
+            assert retry.digest == job.digest
+            assert calls == ["Un chat  roux"]
+            
+            # Store persistant: une nouvelle file (redémarrage) le retrouve
+            restarted = ImageJobQueue(self._generator(calls), ImageStore(str(tmp_path)))
+            assert (await restarted.submit(2, "un chat roux")).cached
+            assert len(calls) == 1
+        finally:
+            await queue.stop()
+    
+    @pytest.mark.asyncio
+    async def test_caps_coalescing_and_worker_bound(self, tmp_path):
+        """Test des limites par utilisateur et globale, du regroupement et du nombre de workers"""
+        try:
+            from bot.image_jobs import ImageJobConfig, ImageJobQueue, ImageJobRejected, ImageStore, JobStatus
+        except ImportError:
+            pytest.skip("image_jobs non disponible")
+        
+        calls = []
+        gate = asyncio.Event()
+        queue = ImageJobQueue(
+            self._generator(calls, gate),
+            ImageStore(str(tmp_path)),
+            ImageJobConfig(workers=2, max_queue=1, per_user_limit=1)
+        )
+        queue.start()
+        try:
+            first = await queue.submit(1, "a")
+            second = await queue.submit(2, "b")
+            await asyncio.sleep(0.01)
+            assert first.status == second.status == JobStatus.RUNNING
+            
+            with pytest.raises(ImageJobRejected):
+                await queue.submit(1, "autre chose")
+            
+            # Même demande en cours: job propre à l'appelant, pas de nouvel appel
+            follower = await queue.submit(5, "a")
+            assert follower is not first
+            assert follower.user_id == 5 and follower.follows == first.job_id
+            assert follower.status == JobStatus.RUNNING
+            with pytest.raises(ImageJobRejected):
+                await queue.submit(5, "a")
+            
+            third = await queue.submit(3, "c")
+            assert third.status == JobStatus.QUEUED
+            assert queue.position(third) == 1
+            with pytest.raises(ImageJobRejected):
+                await queue.submit(4, "d")
+            
+            assert len(calls) == 2
+            assert queue.get_stats()['running'] == 2
+            
+            gate.set()
+            await queue.wait(third, timeout=2)
+            assert third.status == JobStatus.DONE
+            assert queue.get(first.job_id) is first
+            assert follower.status == JobStatus.DONE
+            assert follower.digest == first.digest
+            
+            stats = queue.get_stats()
+            assert stats['generated'] == 3
+            assert stats['coalesced'] == 1
+            assert stats['rejected'] == 3
+            assert stats['queued'] == stats['running'] == 0
+        finally:
+            await queue.stop()
+    
+    @pytest.mark.asyncio
+    async def test_shared_generation_charges_each_caller(self, tmp_path):
+        """Test qu'une génération partagée est décomptée à chaque appelant, pas au cache"""
+        try:
+            from bot.image_jobs import ImageJobQueue, ImageStore, JobStatus
+        except ImportError:
+            pytest.skip("image_jobs non disponible")
+        
+        calls, charged = [], []
+        gate = asyncio.Event()
+        
+        async def charge(job):
+            charged.append(job.user_id)
+        
+        queue = ImageJobQueue(self._generator(calls, gate), ImageStore(str(tmp_path)), charge=charge)
+        queue.start()
+        try:
+            first = await queue.submit(1, "un phare")
+            second = await queue.submit(2, "Un phare !")
+            assert queue.get(second.job_id) is second
+            assert queue.position(second) == queue.position(first)
+            
+            gate.set()
+            await queue.wait(second, timeout=2)
+            assert first.status == second.status == JobStatus.DONE
+            assert calls == ["un phare"]
+            assert sorted(charged) == [1, 2]
+            
+            # Servi depuis le store: rien à décompter
+            assert (await queue.submit(3, "un phare")).cached
+            assert sorted(charged) == [1, 2]
+        finally:
+            await queue.stop()
+    
+    @pytest.mark.asyncio
+    async def test_failure_releases_user_slot(self, tmp_path):
+        """Test qu'un échec (ou une réponse sans image) libère la place de l'utilisateur"""
+        try:
+            from bot.image_jobs import ImageJobQueue, ImageStore, JobStatus
+        except ImportError:
+            pytest.skip("image_jobs non disponible")
+        
+        async def generate(job):
+            if job.prompt == "boom":
+                raise RuntimeError("API down")
+            return Mock(success=True, image_data=None, mime_type="image/png", model_used="", error=None,
+                        description=None)
+        
+        queue = ImageJobQueue(generate, ImageStore(str(tmp_path)))
+        queue.start()
+        try:
+            failed = await queue.wait(await queue.submit(1, "boom"), timeout=2)
+            assert failed.status == JobStatus.FAILED
+            assert "API down" not in failed.error
+            
+            empty = await queue.wait(await queue.submit(1, "texte seulement"), timeout=2)
+            assert empty.status == JobStatus.FAILED
+            assert queue.read_image(empty) is None
+            assert queue.get_stats()['failed'] == 2
+        finally:
+            await queue.stop()
+
+
+class TestImageCache(TestIntegration):
+    """Tests du cache d'images et de descriptions"""
+    
+    def test_lru_bound_and_index_reload(self, tmp_path):
+        """Test que le cache reste sous sa taille max (LRU) et se reconstruit au redémarrage"""
+        try:
+            from bot.image_jobs import ImageStore
+        except ImportError:
+            pytest.skip("image_jobs non disponible")
+        
+        store = ImageStore(str(tmp_path), max_bytes=250)
+        store.put("a", b"a" * 100, "image/png")
+        store.put("b", b"b" * 100, "image/png")
+        store.put("shared", b"a" * 100, "image/png")   # Même contenu que "a": même blob
+        assert store.lookup("a") is not None           # "a" devient récent
+        
+        store.put("c", b"c" * 100, "image/png")
+        assert store.lookup("b") is None               # Le moins récent est évincé
+        assert store.total_bytes <= 250
+        assert store.read(store.lookup("a").digest) == b"a" * 100
+        
+        reloaded = ImageStore(str(tmp_path), max_bytes=250)
+        assert reloaded.total_bytes == store.total_bytes
+        assert reloaded.lookup("c") is not None
+        assert reloaded.lookup("b") is None
+        
+        stats = store.get_stats()
+        assert stats['evictions'] >= 1
+        assert stats['images']['hits'] == 2
+        assert stats['images']['misses'] == 1
+        assert stats['images']['hit_rate'] == pytest.approx(2 / 3)
+    
+    @pytest.mark.asyncio
+    async def test_description_fallback_is_cached(self, tmp_path):
+        """Test qu'une description de repli n'appelle le modèle texte qu'une fois"""
+        try:
+            from bot.image_generator import ImageGenerator
+            from bot.image_jobs import ImageStore
+        except ImportError:
+            pytest.skip("image_generator non disponible")
+        
+        generator = ImageGenerator("test_key")
+        generator.store = ImageStore(str(tmp_path))
+        generator.image_model_available = False
+        generator.text_model_available = True
+        generator.text_model = Mock()
+        generator.text_model.generate_content.return_value = Mock(text="Un chat roux au soleil")
+        
+        first = await generator.generate("Un chat roux", 1)
+        second = await generator.generate("un chat roux !", 2)
+        
+        assert first.description == second.description == "Un chat roux au soleil"
+        assert not first.cached and second.cached
+        assert generator.text_model.generate_content.call_count == 1
+        assert generator.store.get_stats()['descriptions']['hit_rate'] == 0.5
+        
+        # Clé d'image: prompt amélioré normalisé, style et taille
+        assert generator.cache_key("Un chat, roux") == generator.cache_key("un  chat roux")
+        assert generator.cache_key("Un chat roux") != generator.cache_key("Un chat roux", style="anime")
+
+
+class TestLoadHarness(TestIntegration):
+    """Tests du banc de charge hors ligne (load_test.py)"""
+    
+    @staticmethod
+    def _harness():
+        try:
+            import fakeredis  # noqa: F401
+        except ImportError:
+            pytest.skip("fakeredis non disponible")
+        path = os.path.join(BOT_DIR, '..', 'load_test.py')
+        spec = importlib.util.spec_from_file_location('load_test', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    
+    @pytest.mark.asyncio
+    async def test_messages_flow_through_real_handler(self):
+        """Test que les messages traversent le vrai handler avec les faux services"""
+        harness = self._harness()
+        
+        report = await harness.run_load_test(harness.LoadTestConfig(
+            bot='shellia',
+            users=4,
+            messages_per_user=3,
+            ramp_up=0,
+            db_latency=0,
+            gemini=harness.GeminiProfile(latency=0.01, sigma=0)
+        ))
+        
+        assert report['messages'] == 12
+        assert report['outcomes'] == {'answered': 12}
+        assert report['messages_per_sec'] > 0
+        assert 0 < report['latency']['p50'] <= report['latency']['p99']
+        
+        # Admission et usage: un appel chacun par message
+        db = report['db']
+        assert db['by_endpoint']['RPC admit_message'] == 12
+        assert db['by_endpoint']['RPC commit_usage'] == 12
+        assert db['round_trips_per_message'] >= 2
+        assert not db['errors']
+        assert report['gemini']['calls'] == 12
+        assert report['loop_lag']['max'] >= 0
+    
+    @pytest.mark.asyncio
+    async def test_gemini_errors_and_quota_are_reported(self):
+        """Test que les erreurs Gemini et les quotas épuisés apparaissent dans les issues"""
+        harness = self._harness()
+        
+        report = await harness.run_load_test(harness.LoadTestConfig(
+            bot='shellia',
+            users=2,
+            messages_per_user=12,
+            ramp_up=0,
+            plans=['free'],
+            db_latency=0,
+            gemini=harness.GeminiProfile(latency=0.005, sigma=0, error_rate=1.0)
+        ))
+        
+        # Plan free: 10 messages/jour; un échec IA ne consomme pas de quota
+        assert report['outcomes'].get('ai_error') == 20
+        assert report['outcomes'].get('rate_limited', 0) + report['outcomes'].get('quota_exhausted', 0) == 4
+        assert report['gemini']['errors'] >= 20
+        assert report['latency']['p50'] == 0.0
+
+    @pytest.mark.asyncio
+    async def test_maxis_target(self):
+        """Test que le bot Maxis (giveaways inclus) tourne dans le banc"""
+        harness = self._harness()
+
+        report = await harness.run_load_test(harness.LoadTestConfig(
+            bot='maxis',
+            users=3,
+            messages_per_user=2,
+            ramp_up=0,
+            db_latency=0,
+            gemini=harness.GeminiProfile(latency=0.01, sigma=0)
+        ))
+
+        assert report['outcomes'] == {'answered': 6}
+        assert report['db']['by_endpoint']['RPC admit_message'] == 6
+        assert not report['db']['errors']
+
+    @pytest.mark.asyncio
+    async def test_maxis_deadline_replaces_placeholder(self):
+        """Test qu'une échéance dépassée remplace le placeholder au lieu d'ajouter une réponse"""
+        harness = self._harness()
+        config = import_bot_module('config')
+
+        with patch.object(config.SecurityConfig, 'AI_REQUEST_DEADLINE', 0.3):
+            report = await harness.run_load_test(harness.LoadTestConfig(
+                bot='maxis',
+                users=2,
+                messages_per_user=1,
+                ramp_up=0,
+                db_latency=0,
+                gemini=harness.GeminiProfile(latency=2.0, sigma=0)
+            ))
+
+        assert report['outcomes'] == {'deadline': 2}
+        assert report['discord']['replies'] == 1.0
 
 
 class TestBotCommands(TestIntegration):
@@ -126,6 +126,99 @@ async def test_circuit_breaker_success():
     assert breaker.state == CircuitState.CLOSED
 
 
+@pytest.mark.asyncio
+async def test_circuit_breaker_retries_count_as_one_call():
+    """Test qu'un appel et ses retries comptent pour un seul échec"""
+    try:
+        from bot.circuit_breaker import CircuitBreaker, CircuitState, CircuitBreakerConfig, RetryBudget
+    except ImportError:
+        pytest.skip("circuit_breaker non disponible")
+    
+    breaker = CircuitBreaker(
+        "test_retries",
+        config=CircuitBreakerConfig(failure_threshold=2, max_retries=3, base_delay=0.01),
+        retry_budget=RetryBudget()  # Isolé du budget global partagé par les autres tests
+    )
+    
+    async def failing_func():
+        raise Exception("Test error")
+    
+    with pytest.raises(Exception):
+        await breaker.call(failing_func)
+    
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.stats.failed_calls == 1
+    assert breaker.stats.retried_attempts == 3
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_sliding_window():
+    """Test l'ouverture sur taux d'échecs / d'appels lents avec un minimum d'appels"""
+    try:
+        from bot.circuit_breaker import CircuitBreaker, CircuitState, CircuitBreakerConfig, CircuitMode
+    except ImportError:
+        pytest.skip("circuit_breaker non disponible")
+    
+    breaker = CircuitBreaker(
+        "test_window",
+        config=CircuitBreakerConfig(
+            mode=CircuitMode.SLIDING_WINDOW,
+            minimum_calls=4,
+            failure_rate_threshold=0.5,
+            max_retries=0,
+            max_state_changes=2
+        )
+    )
+    
+    async def success_func():
+        return "success"
+    
+    async def failing_func():
+        raise Exception("Test error")
+    
+    # Deux échecs d'affilée ne suffisent pas sous le minimum d'appels
+    for func in (failing_func, failing_func, success_func):
+        try:
+            await breaker.call(func)
+        except Exception:
+            pass
+    assert breaker.state == CircuitState.CLOSED
+    
+    # 4e appel: 2 échecs sur 4 = 50%
+    await breaker.call(success_func)
+    assert breaker.state == CircuitState.CLOSED
+    with pytest.raises(Exception):
+        await breaker.call(failing_func)
+    assert breaker.state == CircuitState.OPEN
+    assert breaker.get_stats()['window']['calls'] == 5
+    
+    # Historique borné
+    for _ in range(3):
+        breaker.state = CircuitState.CLOSED
+        await breaker._transition_to(CircuitState.OPEN)
+    assert len(breaker.stats.state_changes) == 2
+    
+    # Appels lents
+    slow = CircuitBreaker(
+        "test_slow",
+        config=CircuitBreakerConfig(
+            mode=CircuitMode.SLIDING_WINDOW,
+            minimum_calls=2,
+            slow_call_seconds=0.01,
+            slow_call_rate_threshold=1.0
+        )
+    )
+    
+    async def slow_func():
+        await asyncio.sleep(0.02)
+        return "slow"
+    
+    await slow.call(slow_func)
+    assert slow.state == CircuitState.CLOSED
+    await slow.call(slow_func)
+    assert slow.state == CircuitState.OPEN
+
+
 # ============== TESTS RATE LIMITER ==============
 
 @pytest.mark.asyncio
@@ -184,6 +277,302 @@ def test_rate_limiter_spam_detection():
     # Note: Le comportement exact dépend de SPAM_THRESHOLD
 
 
+def test_rate_limiter_redis_single_round_trip():
+    """Test que le check Redis passe par un seul appel au script Lua"""
+    try:
+        from bot.persistent_rate_limiter import PersistentRateLimiter
+        from bot.rate_limit_engine import RateLimitEngine, RedisGCRABackend
+    except ImportError:
+        pytest.skip("persistent_rate_limiter non disponible")
+
+    # Réponses du script: {accepté, index refusant, retry_after, restants cooldown/minute/heure}
+    replies = [[1, 0, b'0', 0, 9, 99], [0, 1, b'2.5', 0, 0, 0]]
+    calls = []
+
+    class MockRedis:
+        def register_script(self, script):
+            def run(keys, args):
+                calls.append((keys, args))
+                return replies[len(calls) - 1]
+            return run
+
+        def __getattr__(self, name):
+            raise AssertionError(f"Appel Redis inattendu: {name}")
+
+    class MockDB:
+        class client:
+            @staticmethod
+            def table(name):
+                raise AssertionError("Aucune écriture DB attendue sur le hot path")
+
+    redis = MockRedis()
+    engine = RateLimitEngine(RedisGCRABackend(redis), cooldown_seconds=3)
+    limiter = PersistentRateLimiter(MockDB(), redis, engine=engine)
+
+    status = limiter.check_rate_limit(12345, plan='free')
+    assert status.can_proceed is True
+    assert status.remaining_minute == 9
+    assert status.remaining_hour == 99
+
+    status = limiter.check_rate_limit(12345, plan='free')
+    assert status.can_proceed is False
+    assert status.cooldown_remaining == 2.5
+
+    assert len(calls) == 2
+    assert calls[0][0] == ["shellia:gcra:12345:cooldown", "shellia:gcra:12345:minute", "shellia:gcra:12345:hour"]
+
+
+# ============== TESTS MOTEUR GCRA ==============
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_gcra_allows_burst_then_spaces_requests():
+    """Test que GCRA autorise `limit` messages puis impose l'espacement"""
+    try:
+        from bot.rate_limit_engine import RateLimitEngine, MemoryGCRABackend
+    except ImportError:
+        pytest.skip("rate_limit_engine non disponible")
+
+    clock = FakeClock()
+    engine = RateLimitEngine(MemoryGCRABackend(), default_per_minute=3, default_per_hour=100, clock=clock)
+
+    results = [engine.check(1).allowed for _ in range(4)]
+    assert results == [True, True, True, False]
+
+    decision = engine.check(1)
+    assert decision.rule == 'minute'
+    assert decision.retry_after == pytest.approx(20.0)
+
+    clock.now += 20
+    assert engine.check(1).allowed is True
+    assert engine.check(1).allowed is False
+
+
+def test_gcra_no_double_burst_at_window_boundary():
+    """Test qu'il n'y a pas de rafale 2x à la frontière d'une fenêtre"""
+    try:
+        from bot.rate_limit_engine import RateLimitEngine, MemoryGCRABackend
+    except ImportError:
+        pytest.skip("rate_limit_engine non disponible")
+
+    clock = FakeClock(now=1_000_059.0)  # 1s avant une frontière de minute
+    engine = RateLimitEngine(MemoryGCRABackend(), default_per_minute=10, default_per_hour=1000, clock=clock)
+
+    allowed = sum(engine.check(1).allowed for _ in range(10))
+    clock.now += 2  # fenêtre fixe: compteur remis à zéro ici
+    allowed += sum(engine.check(1).allowed for _ in range(10))
+
+    assert allowed <= 11
+
+
+def test_gcra_limits_per_plan():
+    """Test que les limites viennent du plan"""
+    try:
+        from bot.rate_limit_engine import RateLimitEngine, MemoryGCRABackend
+    except ImportError:
+        pytest.skip("rate_limit_engine non disponible")
+
+    class Plan:
+        def __init__(self, per_minute, per_hour):
+            self.messages_per_minute = per_minute
+            self.messages_per_hour = per_hour
+
+    plans = {'free': Plan(2, 100), 'pro': Plan(5, 100)}
+    engine = RateLimitEngine(MemoryGCRABackend(), plans=plans, clock=FakeClock())
+
+    assert sum(engine.check(1, 'free').allowed for _ in range(10)) == 2
+    assert sum(engine.check(2, 'pro').allowed for _ in range(10)) == 5
+    assert sum(engine.check(3, 'inconnu').allowed for _ in range(10)) == 2
+
+
+def test_gcra_redis_backend_matches_memory_backend():
+    """Test que le script Lua et le backend mémoire donnent les mêmes décisions"""
+    try:
+        from bot.rate_limit_engine import RateLimitEngine, MemoryGCRABackend, RedisGCRABackend
+        import fakeredis
+        fakeredis.FakeRedis().register_script("return 1")(keys=[], args=[])
+    except Exception:
+        pytest.skip("fakeredis avec support Lua non disponible")
+
+    clock = FakeClock()
+    options = dict(cooldown_seconds=3, default_per_minute=3, default_per_hour=100, clock=clock)
+    redis_engine = RateLimitEngine(RedisGCRABackend(fakeredis.FakeRedis()), **options)
+    memory_engine = RateLimitEngine(MemoryGCRABackend(), **options)
+
+    for step in [0, 1, 3, 3, 3, 3, 20, 20, 1]:
+        clock.now += step
+        a, b = redis_engine.check(1), memory_engine.check(1)
+        assert (a.allowed, a.rule, a.remaining) == (b.allowed, b.rule, b.remaining)
+        assert a.retry_after == pytest.approx(b.retry_after, abs=1e-3)
+
+
+def test_gcra_memory_is_bounded():
+    """Test que l'état expiré est purgé (un float par utilisateur et règle)"""
+    try:
+        from bot.rate_limit_engine import RateLimitEngine, MemoryGCRABackend
+    except ImportError:
+        pytest.skip("rate_limit_engine non disponible")
+
+    clock = FakeClock()
+    backend = MemoryGCRABackend(sweep_every=1000)
+    engine = RateLimitEngine(backend, clock=clock)
+
+    for user_id in range(999):
+        engine.check(user_id)
+    assert len(backend.tats) == 999 * 2
+
+    clock.now += 3600
+    engine.check(5000)
+    assert len(backend.tats) == 2
+
+
+def test_rate_limiter_last_active_is_batched():
+    """Test que last_active_at est écrit par lots, hors du hot path"""
+    try:
+        from bot.persistent_rate_limiter import PersistentRateLimiter
+    except ImportError:
+        pytest.skip("persistent_rate_limiter non disponible")
+
+    rpc_calls = []
+
+    class MockQuery:
+        def execute(self):
+            return type('Result', (), {'data': []})()
+
+    class MockDB:
+        class client:
+            @staticmethod
+            def rpc(name, params):
+                rpc_calls.append((name, params))
+                return MockQuery()
+
+    limiter = PersistentRateLimiter(MockDB())
+    limiter._mark_active(1, datetime.now())
+    limiter._mark_active(2, datetime.now())
+    limiter._mark_active(1, datetime.now())
+    assert rpc_calls == []
+
+    assert limiter.flush_last_active() == 2
+    assert len(rpc_calls) == 1
+    name, params = rpc_calls[0]
+    assert name == 'touch_last_active'
+    assert sorted(params['p_user_ids']) == [1, 2]
+
+    assert limiter.flush_last_active() == 0
+
+
+def test_rate_limiter_plan_resolved_without_db():
+    """Test que le plan vient de la mémoire: aucun get_user sur le hot path"""
+    try:
+        from bot.persistent_rate_limiter import PersistentRateLimiter
+        from bot.rate_limit_engine import RateLimitEngine, MemoryGCRABackend
+        from bot.user_cache import UserCache
+    except ImportError:
+        pytest.skip("persistent_rate_limiter non disponible")
+
+    class Plan:
+        def __init__(self, per_minute):
+            self.messages_per_minute = per_minute
+            self.messages_per_hour = 100
+
+    class MockDB:
+        user_cache = UserCache()
+
+        def get_user(self, user_id):
+            raise AssertionError("Aucune lecture DB attendue sur le hot path")
+
+    engine = RateLimitEngine(
+        MemoryGCRABackend(), plans={'free': Plan(2), 'pro': Plan(5)}, clock=FakeClock()
+    )
+    db = MockDB()
+    limiter = PersistentRateLimiter(db, engine=engine)
+
+    # Profil vu à l'admission puis invalidé (usage enregistré): le plan reste connu
+    db.user_cache.set(1, {'user_id': 1, 'plan': 'pro'})
+    db.user_cache.invalidate(1)
+    assert sum(limiter.check_rate_limit(1).can_proceed for _ in range(10)) == 5
+
+    # Utilisateur jamais vu: 'free' par défaut, sauf si l'appelant connaît le plan
+    assert sum(limiter.check_rate_limit(2).can_proceed for _ in range(10)) == 2
+    assert sum(limiter.check_rate_limit(3, plan='pro').can_proceed for _ in range(10)) == 5
+
+
+def test_rate_limiter_memory_checkpoint_and_restore():
+    """Test le mode sans Redis: aucun appel DB par message, checkpoint puis reprise"""
+    try:
+        from bot.persistent_rate_limiter import PersistentRateLimiter
+        from bot.rate_limit_engine import RateLimitEngine, MemoryGCRABackend
+    except ImportError:
+        pytest.skip("rate_limit_engine non disponible")
+
+    rpc_calls = []
+    stored_rows = []
+
+    class MockQuery:
+        def __init__(self, data=None):
+            self.data = data or []
+
+        def select(self, *args):
+            return self
+
+        def gt(self, *args):
+            return self
+
+        def range(self, start, end):
+            return MockQuery(self.data[start:end + 1])
+
+        def execute(self):
+            return self
+
+    class MockDB:
+        class client:
+            @staticmethod
+            def rpc(name, params):
+                rpc_calls.append((name, params))
+                return MockQuery()
+
+            @staticmethod
+            def table(name):
+                assert name == 'rate_limits'
+                return MockQuery(stored_rows)
+
+    def make_limiter():
+        engine = RateLimitEngine(MemoryGCRABackend(), default_per_minute=3, default_per_hour=100)
+        return PersistentRateLimiter(MockDB(), engine=engine)
+
+    limiter = make_limiter()
+    for _ in range(3):
+        assert limiter.check_rate_limit(42, plan='free').can_proceed
+    assert not limiter.check_rate_limit(42, plan='free').can_proceed
+    assert rpc_calls == []
+
+    assert limiter.checkpoint_counters() == 2
+    assert len(rpc_calls) == 1
+    name, params = rpc_calls[0]
+    assert name == 'checkpoint_rate_limits'
+    rows = {row['period']: row for row in params['p_rows']}
+    assert set(rows) == {'minute', 'hour'}
+    assert rows['minute']['count'] == 3
+    assert rows['hour']['count'] == 3
+
+    # Rien de nouveau: pas de second RPC
+    assert limiter.checkpoint_counters() == 0
+    assert len(rpc_calls) == 1
+
+    # Redémarrage: l'état est reconstruit depuis rate_limits
+    stored_rows.extend(params['p_rows'])
+    restarted = make_limiter()
+    assert restarted.restore_counters() == 2
+    assert not restarted.check_rate_limit(42, plan='free').can_proceed
+    assert restarted.check_rate_limit(7, plan='free').can_proceed
+
+
 # ============== TESTS WEBHOOK VALIDATOR ==============
 
 def test_webhook_signature_parsing():